@@ -1,5 +1,5 @@
 import React from "react";
-import { stockAPI } from "../services/api";
+import { stockAPI, mergeHistoryDelta } from "../services/api";
 import { useEffect, useState } from "react";
 import Spinner from "./Spinner";
 import {
@@ -102,11 +102,15 @@ const Board = () => {
   };
 
   React.useEffect(() => {
+    let cursor = null;
+    let current = {};
     const fetchData = async () => {
       setIsLoading(true);
       try {
         const result = await stockAPI.getTop100History(30);
         const dataObj = result?.data || {};
+        cursor = result?.cursor || null;
+        current = dataObj;
         const rows = normalizeHistoryToRows(dataObj);
         setData(rows);
         setHistoryMap(dataObj);
@@ -116,7 +120,29 @@ const Board = () => {
         setIsLoading(false);
       }
     };
+
+    // Refresh: only symbols with new/changed bars are downloaded (304 when nothing changed)
+    const refresh = async () => {
+      if (!cursor) return;
+      try {
+        const result = await stockAPI.getTop100History(30, cursor);
+        if (result?.notModified) return;
+        cursor = result?.cursor || cursor;
+        const next = { ...current };
+        for (const [sym, series] of Object.entries(result?.data || {})) {
+          next[sym] = result.delta ? mergeHistoryDelta(current[sym], series, result.from?.[sym]) : series;
+        }
+        current = next;
+        setData(normalizeHistoryToRows(next));
+        setHistoryMap(next);
+      } catch (error) {
+        console.error("Error refreshing data:", error);
+      }
+    };
+
     fetchData();
+    const timer = setInterval(refresh, 60000);
+    return () => clearInterval(timer);
   }, []);
 
   const rows = Array.isArray(data) ? data : [];
@@ -98,6 +98,32 @@ const TopRecommendations = () => {
     fetchData();
   }, []);
 
+  // Live updates: server only pushes symbols that were rescored on a new bar
+  useEffect(() => {
+    const applyRows = (rows) => {
+      const updates = rows.filter((r) => r && r.status === "ok");
+      if (updates.length === 0) return;
+      setData((prev) => {
+        const bySymbol = new Map(prev.map((r) => [r.symbol, r]));
+        for (const r of updates) {
+          bySymbol.set(r.symbol, {
+            symbol: r.symbol,
+            date: r.date,
+            prediction: r.prediction,
+            prob_buy: r.prob_buy,
+            status: r.status,
+          });
+        }
+        return Array.from(bySymbol.values()).sort((a, b) => (b.prob_buy ?? -1) - (a.prob_buy ?? -1));
+      });
+    };
+    const close = stockAPI.subscribeLive(null, (msg) => {
+      if (msg.type === "snapshot") applyRows(msg.data || []);
+      else if (msg.type === "score") applyRows([msg]);
+    });
+    return close;
+  }, []);
+
   const groups = useMemo(() => {
     const g1 = [];
     const g2 = [];
@@ -2,6 +2,34 @@ import axios from "axios";
 
 const API_BASE_URL = "http://localhost:5000";
 
+// 304 = không có bar mới kể từ cursor; trả về { notModified: true } thay vì ném lỗi
+const allowNotModified = (status) => (status >= 200 && status < 300) || status === 304;
+
+const historyParams = (days, since, maxPoints, resolution, interval = "1D") => {
+  const params = { days };
+  if (since) params.since = since;
+  if (maxPoints) Object.assign(params, { max_points: maxPoints, resolution });
+  if (interval && interval !== "1D") params.interval = interval;
+  return params;
+};
+
+// Merge a delta series (bars from `from` onward) into an existing series keyed by time
+export const mergeHistoryDelta = (series, delta, from) => {
+  if (!Array.isArray(series) || !from) return delta;
+  return series.filter((bar) => String(bar.time) < String(from)).concat(delta);
+};
+
+// Heavy Top-100 runs are server-side jobs: a 202 response carries the job, poll it until done
+const waitForJob = async (jobId, { intervalMs = 1000, onProgress = null } = {}) => {
+  for (;;) {
+    const { data } = await axios.get(`${API_BASE_URL}/jobs/${jobId}`);
+    if (onProgress) onProgress(data.progress);
+    if (data.status === "done") return data;
+    if (data.status === "failed") throw new Error(data.error || "Job failed");
+    await new Promise((resolve) => setTimeout(resolve, intervalMs));
+  }
+};
+
 export const stockAPI = {
   // Get Top 100 list
   getTop100List: async () => {
@@ -9,20 +37,31 @@ export const stockAPI = {
     return response.data;
   },
 
-  // Get Top 100 history
-  getTop100History: async (days = 30) => {
-    const response = await axios.get(
-      `${API_BASE_URL}/top100-history?days=${days}`
-    );
-
+  // Get Top 100 history; pass `since` (cursor from the previous response) to get only changed symbols.
+  // `maxPoints` caps points per symbol for long windows (resolution: 'lttb' | 'W' | 'M' | 'auto')
+  // `interval`: '1D' (default) or intraday '1m' | '5m' | '15m' | '30m' | '1h' (no since/maxPoints)
+  getTop100History: async (days = 30, since = null, { maxPoints = null, resolution = 'lttb', interval = "1D", onProgress = null } = {}) => {
+    const request = () => axios.get(`${API_BASE_URL}/top100-history`, {
+      params: historyParams(days, since, maxPoints, resolution, interval),
+      validateStatus: allowNotModified,
+    });
+    let response = await request();
+    if (response.status === 202) {
+      // Refresh still running (e.g. days=1000): wait for the job, then read the refreshed cache
+      await waitForJob(response.data.id, { onProgress });
+      response = await request();
+    }
+    if (response.status === 304) return { notModified: true, cursor: since };
     return response.data;
   },
 
-  // Get single stock history
-  getStockHistory: async (symbol, days = 30) => {
-    const response = await axios.get(
-      `${API_BASE_URL}/stock/${symbol}?days=${days}`
-    );
+  // Get single stock history; pass `since` (cursor) to get only bars from `from` onward
+  getStockHistory: async (symbol, days = 30, since = null, { maxPoints = null, resolution = 'lttb', interval = "1D" } = {}) => {
+    const response = await axios.get(`${API_BASE_URL}/stock/${symbol}`, {
+      params: historyParams(days, since, maxPoints, resolution, interval),
+      validateStatus: allowNotModified,
+    });
+    if (response.status === 304) return { notModified: true, cursor: since };
     return response.data;
   },
 
@@ -36,10 +75,137 @@ export const stockAPI = {
 
   // Get top recommendations by computing on server now
   // source: 'VNStock' (live) or 'local'
-  getTopRecommendations: async ({ source = "VNStock", limit = 100, save_csv = false, days = 60 } = {}) => {
+  getTopRecommendations: async ({ source = "VNStock", limit = 100, save_csv = false, days = 60, onProgress = null } = {}) => {
     const response = await axios.get(`${API_BASE_URL}/predict-top100`, {
       params: { source, limit, save_csv, days },
     });
+    if (response.status === 202) {
+      await waitForJob(response.data.id, { onProgress });
+      return (await axios.get(`${API_BASE_URL}/jobs/${response.data.id}/result`)).data;
+    }
+    return response.data;
+  },
+
+  // Job status/progress ({ status, progress: { done, total, percent } }); see /jobs
+  getJob: async (jobId) => {
+    const response = await axios.get(`${API_BASE_URL}/jobs/${jobId}`);
+    return response.data;
+  },
+
+  // Predict a whole watchlist in one request; data[i].status is 'ok' | 'insufficient_input' | 'error: ...'
+  // models: extra model-set names to score on the same features, e.g. ["lr"] or ["all"]
+  predictBatch: async (symbols, { source = "VNStock", useCache = true, explain = false, models = [] } = {}) => {
+    const response = await axios.post(`${API_BASE_URL}/predict/batch`, {
+      symbols,
+      source,
+      use_cache: useCache,
+      explain,
+      models,
+    });
+    return response.data;
+  },
+
+  // Rolling 60-session volatility, beta and correlation to the equal-weight Top-100 index
+  getRisk: async ({ symbols = null, sort = "vol", order = "desc" } = {}) => {
+    const params = { sort, order };
+    if (symbols && symbols.length) params.symbols = symbols.join(",");
+    const response = await axios.get(`${API_BASE_URL}/risk`, { params });
+    return response.data;
+  },
+
+  // Correlation clusters (+ optional matrix in dendrogram order for a heatmap)
+  getRiskClusters: async ({ threshold = 0.5, k = null, matrix = false, symbols = null } = {}) => {
+    const params = { threshold, matrix };
+    if (k) params.k = k;
+    if (symbols && symbols.length) params.symbols = symbols.join(",");
+    const response = await axios.get(`${API_BASE_URL}/risk/clusters`, { params });
     return response.data;
   },
+
+  // Top-K by score, skipping names too correlated with those already picked
+  getDiversifiedTopK: async ({ k = 10, maxCorr = 0.7, perCluster = null, score = "prob_buy" } = {}) => {
+    const params = { k, max_corr: maxCorr, score };
+    if (perCluster) params.per_cluster = perCluster;
+    const response = await axios.get(`${API_BASE_URL}/risk/diversified`, { params });
+    return response.data;
+  },
+
+  // FA ranking sensitivity to the 7 component weights: per-ticker top-k inclusion and rank stability
+  getFaWeightSweep: async ({ n = 2000, k = 100, concentration = 50, seed = 0, limit = 150, symbols = null } = {}) => {
+    const params = { n, k, concentration, seed, limit };
+    if (symbols && symbols.length) params.symbols = symbols.join(",");
+    const response = await axios.get(`${API_BASE_URL}/fa/weights-sweep`, { params });
+    return response.data;
+  },
+
+  // Per-feature drift of served inputs vs. the training set (PSI / KS); window: "all" | "recent"
+  getDrift: async ({ window = "all", sort = "psi" } = {}) => {
+    const response = await axios.get(`${API_BASE_URL}/drift`, { params: { window, sort } });
+    return response.data;
+  },
+
+  // Reference vs. live histogram of one feature (bin edges + proportions)
+  getFeatureDrift: async (feature, { window = "all" } = {}) => {
+    const response = await axios.get(`${API_BASE_URL}/drift/${feature}`, { params: { window } });
+    return response.data;
+  },
+
+  // Registered models (primary / shadow / on_request) with latency and agreement metrics
+  getModels: async () => {
+    const response = await axios.get(`${API_BASE_URL}/models`);
+    return response.data;
+  },
+
+  // Per-feature contributions behind a symbol's prediction ({ base_value, contributions: [...] })
+  getExplanation: async (symbol, { top = 10, source = "VNStock" } = {}) => {
+    const response = await axios.get(`${API_BASE_URL}/explain/${symbol}`, { params: { top, source } });
+    return response.data;
+  },
+
+  // Top-N contributions for the whole universe (or a comma-separated symbol list)
+  explainUniverse: async ({ symbols = null, top = 5, source = "VNStock" } = {}) => {
+    const params = { top, source };
+    if (symbols && symbols.length) params.symbols = symbols.join(",");
+    const response = await axios.get(`${API_BASE_URL}/explain`, { params });
+    return response.data;
+  },
+
+  // Filter the universe, e.g. screenStocks("rsi_14<30 AND volume_ratio>2 AND final_score>50", { sort: "final_score" })
+  screenStocks: async (where, { sort = null, order = "desc", limit = 50, fields = null } = {}) => {
+    const params = { where, order, limit };
+    if (sort) params.sort = sort;
+    if (fields && fields.length) params.fields = fields.join(",");
+    const response = await axios.get(`${API_BASE_URL}/screen`, { params });
+    return response.data;
+  },
+
+  // Fields usable in screenStocks predicates ({ ta: [...], fa: [...] })
+  getScreenFields: async () => {
+    const response = await axios.get(`${API_BASE_URL}/screen/fields`);
+    return response.data;
+  },
+
+  // Find stocks / past periods whose 50-session price shape matches a symbol's
+  // scope: 'latest' (other stocks now) or 'history' (any past window, e.g. symbols: ['HPG'])
+  getSimilarPatterns: async (symbol, { k = 10, scope = "latest", end = null, symbols = null } = {}) => {
+    const params = { k, scope };
+    if (end) params.end = end;
+    if (symbols && symbols.length) params.symbols = symbols.join(",");
+    const response = await axios.get(`${API_BASE_URL}/similar/${symbol}`, { params });
+    return response.data;
+  },
+
+  // Subscribe to live score updates (WebSocket /ws/live); returns a function that closes the socket
+  subscribeLive: (symbols, onMessage) => {
+    const query = symbols && symbols.length ? `?symbols=${symbols.join(",")}` : "";
+    const ws = new WebSocket(`${API_BASE_URL.replace(/^http/, "ws")}/ws/live${query}`);
+    ws.onmessage = (event) => {
+      try {
+        onMessage(JSON.parse(event.data));
+      } catch (e) {
+        console.error(e);
+      }
+    };
+    return () => ws.close();
+  },
 };
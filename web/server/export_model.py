@@ -0,0 +1,108 @@
+import os
+import sys
+import time
+import argparse
+import tracemalloc
+import numpy as np
+import joblib
+
+# Ensure UTF-8 output on Windows
+if sys.platform == 'win32':
+    os.environ['PYTHONIOENCODING'] = 'utf-8'
+    if hasattr(sys.stdout, 'reconfigure'):
+        sys.stdout.reconfigure(encoding='utf-8')
+    if hasattr(sys.stderr, 'reconfigure'):
+        sys.stderr.reconfigure(encoding='utf-8')
+
+from service.compiled_model import CompiledModel, compiled_path_for, export_compiled
+from service.drift import build_reference, reference_path_for
+from service.indicators import compute_features, feature_matrix, model_feature_columns, FEATURE_COLUMNS
+from service.price_store import get_price_store
+
+
+def sample_features(limit_symbols: int = None) -> np.ndarray:
+    """Ma trận feature của toàn bộ lịch sử trong kho giá local (dùng để so khớp/benchmark)."""
+    store = get_price_store()
+    symbols = store.symbol_list()
+    if limit_symbols:
+        symbols = symbols[:limit_symbols]
+    mats = []
+    for sym in symbols:
+        bars = store.bars(sym).filled()
+        if len(bars) < 50:
+            continue
+        f = compute_features(bars.open, bars.high, bars.low, bars.close, bars.volume)
+        mats.append(feature_matrix(f, FEATURE_COLUMNS))
+    return np.concatenate(mats) if mats else np.empty((0, len(FEATURE_COLUMNS)))
+
+
+def _measure(fn, X):
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    out = fn(X)
+    elapsed = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return out, elapsed, peak
+
+
+def check(model, compiled: CompiledModel, X: np.ndarray, tol: float) -> bool:
+    import pandas as pd
+    names = list(compiled.feature_names_in_) if compiled.feature_names_in_ is not None else FEATURE_COLUMNS
+    df = pd.DataFrame(X, columns=names)
+
+    ref, t_ref, m_ref = _measure(model.predict_proba, df)
+    got, t_got, m_got = _measure(compiled.predict_proba, X)
+    diff = float(np.max(np.abs(ref - got))) if len(X) else 0.0
+    labels_equal = bool(np.array_equal(model.classes_[ref.argmax(1)], compiled.classes_[got.argmax(1)]))
+
+    one = df.iloc[:50]
+    t0 = time.perf_counter()
+    for _ in range(20):
+        model.predict_proba(one)
+    t_ref_50 = (time.perf_counter() - t0) / 20
+    t0 = time.perf_counter()
+    for _ in range(20):
+        compiled.predict_proba(X[:50])
+    t_got_50 = (time.perf_counter() - t0) / 20
+
+    print(f'Rows: {len(X):,}')
+    print(f'Max |Δprob|: {diff:.3e} (tol {tol:.0e}), labels equal: {labels_equal}')
+    print(f'Batch predict_proba: sklearn {t_ref * 1000:.1f} ms / {m_ref / 1e6:.1f} MB peak, '
+          f'compiled {t_got * 1000:.1f} ms / {m_got / 1e6:.1f} MB peak')
+    print(f'50-row predict_proba: sklearn {t_ref_50 * 1000:.2f} ms, compiled {t_got_50 * 1000:.2f} ms')
+    return diff <= tol and labels_equal
+
+
+def main():
+    here = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description='Compile best_model.pkl thành mảng NumPy (.npz) cho server')
+    parser.add_argument('--model', type=str, default=os.path.join(here, 'model', 'best_model.pkl'), help='File model sklearn')
+    parser.add_argument('--out', type=str, default=None, help='File .npz output (mặc định cạnh file model)')
+    parser.add_argument('--check', action='store_true', help='So khớp xác suất với model gốc trên dữ liệu local')
+    parser.add_argument('--tol', type=float, default=1e-9, help='Sai số tối đa cho phép khi --check')
+    parser.add_argument('--drift', action='store_true',
+                        help='Ghi sketch drift tham chiếu cạnh model từ kho giá local (model không do retrain.py tạo)')
+    parser.add_argument('--limit-symbols', type=int, default=None, help='Chỉ dùng N mã đầu khi --check')
+    args = parser.parse_args()
+
+    model = joblib.load(args.model)
+    out = args.out or compiled_path_for(args.model)
+    export_compiled(model, out, source_path=args.model)
+    print(f'✓ Đã ghi {out} ({os.path.getsize(out) / 1024:.0f} KB, pickle {os.path.getsize(args.model) / 1024:.0f} KB)')
+
+    if args.drift:
+        ref = build_reference(model_feature_columns(model))
+        print(f'✓ Sketch drift: {ref.save(reference_path_for(args.model))} ({ref.sketch.rows:,} dòng)')
+
+    if args.check:
+        compiled = CompiledModel.load(out)
+        X = sample_features(args.limit_symbols)
+        if not check(model, compiled, X, args.tol):
+            print('✗ Model compiled không khớp model gốc')
+            sys.exit(1)
+        print('✓ Khớp model gốc')
+
+
+if __name__ == '__main__':
+    main()
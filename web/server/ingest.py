@@ -0,0 +1,134 @@
+import os
+import sys
+import argparse
+import pandas as pd
+
+# Ensure UTF-8 output on Windows
+if sys.platform == 'win32':
+    os.environ['PYTHONIOENCODING'] = 'utf-8'
+    if hasattr(sys.stdout, 'reconfigure'):
+        sys.stdout.reconfigure(encoding='utf-8')
+    if hasattr(sys.stderr, 'reconfigure'):
+        sys.stderr.reconfigure(encoding='utf-8')
+
+from service.ingest import (
+    KINDS, FakeFinance, FakeQuote, Manifest, PartitionWriter, TokenBucket,
+    make_fetcher, read_partitions, run_ingest, vnstock_classes,
+)
+from service.fundamentals import FA_REFRESH_SECONDS, diff_reports, load_fa_reports
+from service.price_store import _find_repo_root
+from service.validation import validate_frame
+
+
+def load_symbols(args, repo_root: str):
+    if args.symbols:
+        symbols = [s.strip().upper() for s in args.symbols.split(',') if s.strip()]
+    else:
+        path = args.symbols_file or os.path.join(
+            repo_root, 'data', 'raw', 'top_100_stocks.csv' if args.kind == 'ta' else 'vietnam_stock_symbols.csv')
+        df = pd.read_csv(path)
+        symbols = df['symbol'].dropna().astype(str).str.strip().str.upper().tolist()
+        print(f"✓ Đọc {len(symbols)} mã từ {path}")
+    if args.kind != 'ta':
+        # Như notebook FA: bỏ các mã < 3 ký tự
+        symbols = [s for s in symbols if len(s) >= 3]
+    if args.limit:
+        symbols = symbols[:args.limit]
+    return list(dict.fromkeys(symbols))
+
+
+def main():
+    repo_root = _find_repo_root()
+    parser = argparse.ArgumentParser(description='Lấy dữ liệu TA/FA song song, có checkpoint để chạy tiếp khi bị dừng')
+    parser.add_argument('kind', choices=KINDS, help="'ta' = giá (Quote.history), income/balance/cashflow = báo cáo quý (Finance)")
+    parser.add_argument('--symbols', type=str, default=None, help='Danh sách mã, vd. FPT,HPG (mặc định đọc từ --symbols-file)')
+    parser.add_argument('--symbols-file', type=str, default=None,
+                        help='CSV có cột symbol (mặc định top_100_stocks.csv cho ta, vietnam_stock_symbols.csv cho FA)')
+    parser.add_argument('--limit', type=int, default=None, help='Chỉ lấy N mã đầu')
+    parser.add_argument('--start', type=str, default='2023-01-01', help='Ngày bắt đầu (ta)')
+    parser.add_argument('--end', type=str, default='2025-10-31', help='Ngày kết thúc (ta)')
+    parser.add_argument('--years', type=str, default='2023,2024,2025', help='Năm giữ lại (FA), rỗng = tất cả')
+    parser.add_argument('--out', type=str, default=None, help='Thư mục output (mặc định data/ingest/<kind>)')
+    parser.add_argument('--format', choices=['parquet', 'pickle'], default=None,
+                        help='Định dạng partition (mặc định parquet nếu có pyarrow)')
+    parser.add_argument('--workers', type=int, default=4, help='Số worker song song')
+    parser.add_argument('--rate', type=float, default=2.0, help='Tối đa request/giây cho cả pool (0 = không giới hạn)')
+    parser.add_argument('--burst', type=int, default=4, help='Số request được dồn tối đa')
+    parser.add_argument('--max-retries', type=int, default=8)
+    parser.add_argument('--backoff', type=float, default=60.0, help='Thời gian chờ cơ sở khi lỗi (giây, tăng theo số lần thử)')
+    parser.add_argument('--restart', action='store_true', help='Bỏ checkpoint cũ, lấy lại từ đầu')
+    parser.add_argument('--retry-failed', action='store_true', help='Thử lại cả các mã lỗi non-retriable')
+    parser.add_argument('--no-validate', action='store_true',
+                        help='Không kiểm tra bar (ta); mặc định bar sai được tách vào <out>/_quarantine kèm lý do')
+    parser.add_argument('--export-csv', type=str, default=None, help='Gộp các partition thành một CSV sau khi chạy')
+    parser.add_argument('--fake', action='store_true', help='Dùng nguồn giả (không gọi vnstock) để chạy offline')
+    parser.add_argument('--fake-latency-ms', type=float, default=50.0)
+    parser.add_argument('--fake-fail-rate', type=float, default=0.0, help='Xác suất lỗi rate limit giả lập mỗi request')
+    parser.add_argument('--fake-empty-vci', action='store_true', help='Nguồn VCI giả luôn rỗng (kiểm tra fallback TCBS)')
+    args = parser.parse_args()
+
+    if args.fake:
+        empty = ('VCI',) if args.fake_empty_vci else ()
+        quote_cls = FakeQuote.configure(args.fake_latency_ms, args.fake_fail_rate, empty)
+        finance_cls = FakeFinance.configure(args.fake_latency_ms, args.fake_fail_rate, empty)
+    else:
+        quote_cls, finance_cls = vnstock_classes()
+
+    out_dir = args.out or os.path.join(repo_root, 'data', 'ingest', args.kind)
+    years = [int(y) for y in args.years.split(',') if y.strip()] if args.kind != 'ta' else None
+    config = {'kind': args.kind, 'start': args.start, 'end': args.end, 'years': years, 'fake': args.fake}
+
+    writer = PartitionWriter(out_dir, args.format)
+    manifest_path = os.path.join(out_dir, '_manifest.json')
+    if args.restart and os.path.exists(manifest_path):
+        os.remove(manifest_path)
+    manifest = Manifest.load(manifest_path, config)
+
+    limiter = TokenBucket(args.rate, args.burst)
+    fetch = make_fetcher(args.kind, quote_cls, finance_cls, start=args.start, end=args.end,
+                         years=years, limiter=limiter)
+    symbols = load_symbols(args, repo_root)
+
+    validate, quarantine = None, None
+    if args.kind == 'ta' and not args.no_validate:
+        sessions = None
+        if not args.fake:
+            # Lịch phiên từ kho local -> báo các phiên bị thiếu của từng mã
+            from service.trading_calendar import get_trading_calendar
+            sessions = get_trading_calendar().days
+        validate = lambda df: validate_frame(df, sessions)
+        quarantine = PartitionWriter(os.path.join(out_dir, '_quarantine'), writer.fmt)
+
+    # FA: so các kỳ trước/sau khi lấy để báo kỳ mới (server tự nạp lại chỉ mục as-of khi nguồn đổi)
+    fa_before = load_fa_reports() if args.kind in ('income', 'balance') and args.out is None else None
+
+    try:
+        stats = run_ingest(symbols, fetch, writer, manifest, workers=args.workers, max_retries=args.max_retries,
+                           backoff_s=args.backoff, limiter=limiter, retry_failed=args.retry_failed,
+                           validate=validate, quarantine=quarantine)
+    except KeyboardInterrupt:
+        print(f"\n⚠ Đã dừng. Checkpoint: {manifest_path} {manifest.summary()} – chạy lại cùng lệnh để tiếp tục")
+        sys.exit(130)
+
+    print(f"\n{'=' * 60}")
+    print(f"Xong {len(symbols)} mã trong {stats['elapsed_s']}s "
+          f"(tổng thời gian worker chờ rate limit {limiter.waited:.1f}s)")
+    print(f"  Thành công: {stats['done']}  Rỗng: {stats['empty']}  Lỗi: {stats['failed']}")
+    if quarantine is not None:
+        print(f"  Bar bị loại: {stats['quarantined']} (chi tiết: {quarantine.out_dir})")
+    print(f"  Output: {out_dir} ({writer.fmt})")
+    print(f"  Checkpoint: {manifest_path}")
+    if fa_before is not None:
+        changed = diff_reports(fa_before, load_fa_reports())
+        print(f"  Kỳ FA mới/sửa: {len(changed)} ({changed['symbol'].nunique()} mã) – server nạp lại chỉ mục "
+              f"as-of trong vòng {FA_REFRESH_SECONDS:.0f}s")
+    print(f"{'=' * 60}")
+
+    if args.export_csv:
+        df = read_partitions(out_dir, symbols)
+        df.to_csv(args.export_csv, index=False, encoding='utf-8-sig' if args.kind != 'ta' else 'utf-8')
+        print(f"✓ Đã gộp {len(df)} dòng vào {args.export_csv}")
+
+
+if __name__ == '__main__':
+    main()
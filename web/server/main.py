@@ -10,18 +10,43 @@ if sys.platform == 'win32':
     if hasattr(sys.stderr, 'reconfigure'):
         sys.stderr.reconfigure(encoding='utf-8')
 
-from fastapi import FastAPI, HTTPException
+from fastapi import BackgroundTasks, FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
 from fastapi.encoders import jsonable_encoder
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from vnstock import Listing, Quote
+from pydantic import BaseModel
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 import pandas as pd
 import numpy as np
 from typing import Dict, Any, List
 import os
-import joblib
-from service.model_service_wrapper import run_model_on_top100
+import asyncio
+import json
+from service.bars import Bars, iso_to_day
+from service.price_store import get_price_store
+from service.providers import get_provider
+from service.history_export import build_history_table, iter_arrow_stream, to_parquet_bytes
+from service.compiled_model import compiled_path_for, load_model_versioned
+from service.indicators import compute_features, model_feature_columns
+from service.trading_calendar import get_trading_calendar
+from service.live_feed import LiveFeed, LiveHub, ProviderSource, ReplaySource
+from service.history_index import FULL, get_history_index, parse_since
+from service.downsample import DownsampleCache, RESOLUTIONS
+from service.similarity import SCOPES, get_pattern_index
+from service.screener import get_screen_table, latest_values
+from service.prediction_cache import PredictionMemo
+from service.explain import ExplanationMemo, explain_rows, get_explainer, top_contributions
+from service.profiling import ProfileStore, install_profiling
+from service.validation import clean_bars, get_quarantine_log, validate_bars
+from service.fundamentals import FA_FIELDS, get_fa_index, on_fa_update, wants_fa
+from service.intraday import get_intraday_store, iso_to_minute, normalize_interval
+from service.fa_ranking import BASELINE_WEIGHTS, COMPONENTS, get_fa_components, run_sweep
+from service.jobs import DONE, FAILED, JobQueueFull, get_job_manager, job_params
+from service.risk import INDEX_NAME, cluster_correlation, diversified_top_k, get_risk_model, window_label
+from service.model_set import get_model_metrics, get_model_set, get_shadow_runner, load_models, matrix_builder, score_all
+from service.drift import get_drift_monitor
 def _find_repo_root(start_path: str) -> str:
     cur = os.path.abspath(start_path)
     for _ in range(6):
@@ -54,15 +79,35 @@ app.add_middleware(
 # Simple in-memory caches to reduce provider calls and avoid rate limits
 CACHE = {
     "top100_list": {"ts": None, "data": []},
-    "top100_history": {},  # keyed by days: { days: {"ts": datetime, "data": {...}, "metadata": {...}} }
-    "symbol_history": {},  # keyed by f"{symbol}|{days}": {"ts": datetime, "df": pd.DataFrame}
-    "model_input": {},     # keyed by f"{symbol}|{source}|{days}": {"ts": datetime, "df": pd.DataFrame}
+    "top100_history": {},  # keyed by days: { days: {"ts": datetime, "bars": {symbol: Bars}, "metadata": {...}} }
+    "symbol_history": {},  # keyed by f"{symbol}|{days}": {"ts": datetime, "bars": Bars}
+    "model_input": {},     # keyed by f"{symbol}|{days}": {"ts": datetime, "bars": Bars}
+    "intraday_sync": {},   # keyed by symbol: datetime lần cuối lấy bar phút từ provider
+    "top100_intraday": {}, # keyed by days: {"ts": datetime, "symbols": [...]}
 }
 
+HISTORY_INDEX = get_history_index()
+DOWNSAMPLE_CACHE = DownsampleCache()
+PREDICTION_MEMO = PredictionMemo()
+# Kết quả các model so sánh (không phải primary) – LRU + hit/miss riêng để không đẩy dự báo primary ra
+OTHER_MODEL_MEMO = PredictionMemo()
+EXPLANATIONS = ExplanationMemo()
+
+
+def _drop_fa_cached(symbols: List[str]):
+    # Kỳ FA mới không đổi bar input nên khóa cache không tự đổi: xóa dự báo/giải thích của các mã đó
+    PREDICTION_MEMO.discard(symbols)
+    OTHER_MODEL_MEMO.discard(symbols)
+    EXPLANATIONS.discard(symbols)
+
+
+on_fa_update(_drop_fa_cached)
+
 CACHE_TTL_SYMBOLS_SECONDS = 600  # 10 minutes
 CACHE_TTL_HISTORY_SECONDS = 300   # 5 minutes
 CACHE_TTL_SYMBOL_HISTORY_SECONDS = 600  # 10 minutes for per-symbol history
 CACHE_TTL_MODEL_INPUT_SECONDS = 600     # 10 minutes for model input per symbol
+CACHE_TTL_INTRADAY_SECONDS = 60         # bar phút: hỏi provider tối đa 1 lần/phút mỗi mã
 
 def _now():
     return datetime.now()
@@ -127,103 +172,82 @@ def get_top100_symbols():
             return cached.get("data")
         return []
 
-def get_stock_history(symbol: str, start_date: str, end_date: str):
-    """Lấy dữ liệu lịch sử của một mã cụ thể"""
+def get_stock_history(symbol: str, start_date: str, end_date: str) -> Bars:
+    """Lấy dữ liệu lịch sử của một mã cụ thể (provider chọn theo cấu hình, xem service/providers.py)"""
     try:
-        # Khởi tạo đối tượng Quote như trong tài liệu
-        quote = Quote(symbol=symbol, source='VCI') 
-        # Hàm history thường dùng định dạng YYYY-MM-DD
-        try:
-            df = quote.history(start=start_date, end=end_date, interval='1D')
-        except SystemExit as se:
-            # Provider rate limit; surface as empty to trigger fallback
-            print(f"Rate limit while fetching history for {symbol}: {se}")
-            return pd.DataFrame()
-        return df
+        bars = get_provider().history(symbol, start_date, end_date, interval='1D')
+    except SystemExit as se:
+        # Provider rate limit; surface as empty to trigger fallback
+        print(f"Rate limit while fetching history for {symbol}: {se}")
+        return Bars.empty(symbol)
     except Exception as e:
         print(f"Lỗi khi lấy dữ liệu {symbol}: {e}")
-        return pd.DataFrame()
-
-def _normalize_history_df(df: pd.DataFrame, symbol: str) -> pd.DataFrame:
+        return Bars.empty(symbol)
+    # Bar sai (high<low, giá/volume âm, thiếu cột, bad tick...) -> quarantine, không vào model
+    calendar = get_trading_calendar()
+    checked = validate_bars(bars, calendar.days)
+    get_quarantine_log().record(checked, [bars.symbol])
+    if len(checked.quarantine):
+        print(f"{symbol}: loại {len(checked.quarantine)} bar từ provider ({checked.summary()})")
+        bars = clean_bars(checked, bars.symbol)
+    # Ngày phiên thật từ provider thay cho phần lịch ước lượng; bar cuối -> chỉ mục delta-sync
+    calendar.observe(bars.day)
+    HISTORY_INDEX.update(symbol, bars)
+    return bars
+
+def get_last_sessions(symbol: str, n: int) -> Bars:
     """
-    Chuẩn hóa schema dữ liệu lịch sử về các cột bắt buộc:
-    time, open, high, low, close, volume, symbol
+    n phiên gần nhất từ provider, khoảng ngày tính chính xác theo lịch phiên
+    (không lấy dư theo ngày lịch). Nếu phần lịch ước lượng gặp ngày nghỉ lễ và thiếu bar,
+    gọi lại một lần với cửa sổ nới đúng số phiên còn thiếu.
     """
-    if df is None or df.empty:
-        return pd.DataFrame()
-
-    # Rename time-like column to 'time'
-    time_candidates = ['time', 'date', 'datetime', 'tradingDate']
-    if 'time' not in df.columns:
-        for c in time_candidates:
-            if c in df.columns:
-                df = df.rename(columns={c: 'time'})
-                break
-
-    # Normalize price/volume columns if alternative names exist
-    rename_map: Dict[str, str] = {}
-    if 'open' not in df.columns:
-        for c in ['Open', 'o', 'open_price']:
-            if c in df.columns:
-                rename_map[c] = 'open'
-                break
-    if 'high' not in df.columns:
-        for c in ['High', 'h', 'high_price']:
-            if c in df.columns:
-                rename_map[c] = 'high'
-                break
-    if 'low' not in df.columns:
-        for c in ['Low', 'l', 'low_price']:
-            if c in df.columns:
-                rename_map[c] = 'low'
-                break
-    if 'close' not in df.columns:
-        for c in ['Close', 'c', 'close_price', 'adj_close', 'price']:
-            if c in df.columns:
-                rename_map[c] = 'close'
-                break
-    if 'volume' not in df.columns:
-        for c in ['Volume', 'vol', 'volume_match', 'total_volume']:
-            if c in df.columns:
-                rename_map[c] = 'volume'
-                break
-
-    if rename_map:
-        df = df.rename(columns=rename_map)
-
-    required = ['time', 'open', 'high', 'low', 'close', 'volume']
-    # If any required missing, try to fill minimally
-    for col in required:
-        if col not in df.columns:
-            df[col] = None
-
-    # Keep only required columns
-    df = df[required].copy()
-
-    # Ensure time is string ISO-like
+    calendar = get_trading_calendar()
+    start_date, end_date = calendar.window_iso(n)
+    bars = get_stock_history(symbol, start_date, end_date)
+    if 0 < len(bars) < n:
+        retry_start, _ = calendar.window_iso(2 * n - len(bars))
+        if retry_start < start_date:
+            more = get_stock_history(symbol, retry_start, end_date)
+            if len(more) > len(bars):
+                bars = more
+    return bars.tail(n)
+
+def _sync_intraday(symbol: str, start_date: str, end_date: str) -> None:
+    """
+    Lấy bar phút mới từ provider vào kho intraday (data/intraday): chỉ hỏi từ ngày của bar cuối
+    đã lưu (hoặc start_date), tối đa một lần mỗi CACHE_TTL_INTRADAY_SECONDS. Lỗi -> giữ dữ liệu đã lưu.
+    """
+    if _is_fresh(CACHE["intraday_sync"].get(symbol), CACHE_TTL_INTRADAY_SECONDS):
+        return
+    store = get_intraday_store()
+    last = store.last_ts(symbol)
+    fetch_start = start_date
+    if last is not None:
+        fetch_start = max(start_date, str(np.datetime64(last, 'm').astype('datetime64[D]')))
     try:
-        df['time'] = pd.to_datetime(df['time']).dt.strftime('%Y-%m-%d')
-    except Exception:
-        # leave as-is if cannot parse
-        pass
-
-    # Add symbol column
-    df['symbol'] = str(symbol).upper()
+        bars = get_provider().intraday(symbol, fetch_start, end_date, interval='1m')
+    except SystemExit as se:
+        print(f"Rate limit while fetching intraday for {symbol}: {se}")
+        return
+    except Exception as e:
+        print(f"Lỗi khi lấy dữ liệu trong ngày {symbol}: {e}")
+        return
+    store.write(bars)
+    CACHE["intraday_sync"][symbol] = _now()
 
-    # Sort ascending by time
+def _with_intraday_daily(bars: Bars) -> Bars:
+    """Ghép bar ngày gộp sẵn trong kho intraday cho các phiên sau bar ngày cuối (vd. phiên đang diễn ra)."""
     try:
-        df = df.sort_values('time')
-    except Exception:
-        pass
-
-    return df
+        extra = get_intraday_store().daily(bars.symbol, start_day=bars.last_day + 1 if len(bars) else None)
+    except Exception as e:
+        print(f"Không đọc được bar ngày từ kho intraday ({bars.symbol}): {e}")
+        return bars
+    return bars.merge(extra)
 
-def _slice_last_n(df: pd.DataFrame, n: int) -> pd.DataFrame:
-    if df is None or df.empty:
-        return pd.DataFrame()
-    if len(df) <= n:
-        return df.tail(n)
-    return df.iloc[-n:]
+def _load_local_bars(symbol: str, n: int = None) -> Bars:
+    """Lịch sử một mã từ kho CSV local (fallback khi provider thiếu dữ liệu); n -> chỉ n bar cuối."""
+    store = get_price_store()
+    return store.bars(symbol) if n is None else store.tail(symbol, n)
 
 # --- Endpoints ---
 
@@ -237,94 +261,280 @@ def get_top100_list():
     symbols = get_top100_symbols()
     return {"count": len(symbols), "symbols": symbols}
 
-@app.get("/top100-history")
-def get_top100_history_data(days: int = 30):
+def _refresh_bars(symbol: str, old: Bars, start_date: str, end_date: str) -> Bars:
     """
-    Lấy dữ liệu lịch sử của Top 100 mã.
-    - days: Số ngày quá khứ muốn lấy (mặc định 30 ngày).
+    Làm mới lịch sử đã cache: chỉ hỏi provider từ ngày bar cuối đã có (bar hôm nay có thể
+    còn thay đổi) rồi ghép vào; chưa có cache thì lấy cả cửa sổ. Lỗi/rỗng -> giữ dữ liệu cũ.
+    Kết quả giữ đúng số phiên của cửa sổ [start_date, end_date].
     """
-    # Tính toán ngày bắt đầu và kết thúc
+    if old is not None and len(old):
+        last_iso = str(old.times()[-1])
+        update = get_stock_history(symbol, max(last_iso, start_date), end_date)
+        bars = old.merge(update)
+    else:
+        bars = get_stock_history(symbol, start_date, end_date)
+    return bars.tail(get_trading_calendar().count(iso_to_day(start_date), iso_to_day(end_date)))
+
+
+def _delta_from(symbol: str, mode: str, value: int):
+    """Ngày đầu cần gửi lại cho client theo `since`; None = không có gì mới."""
+    if mode == 'date':
+        last = HISTORY_INDEX.last_day(symbol)
+        return value if last is not None and last >= value else None
+    return HISTORY_INDEX.changed_since(symbol, value)
+
+
+def _sync_cached(symbol: str, bars: Bars, seq: int, start_date: str, end_date: str):
+    """
+    (bars, seq) của một mục cache lịch sử, làm mới nếu chỉ mục delta-sync đã thấy bar mới hơn
+    cho mã này sau khi mục được lưu (vd. /predict hay live feed vừa hỏi provider).
+    """
+    if HISTORY_INDEX.changed_since(symbol, seq) is None:
+        return bars, seq
+    return _refresh_bars(symbol, bars, start_date, end_date), HISTORY_INDEX.seq
+
+
+def _check_resolution(max_points: int, resolution: str):
+    if max_points is not None and max_points < 2:
+        raise HTTPException(status_code=400, detail="max_points phải >= 2")
+    if resolution not in RESOLUTIONS:
+        raise HTTPException(status_code=400, detail=f"resolution phải là một trong {list(RESOLUTIONS)}")
+
+
+def _series(bars: Bars, max_points: int, resolution: str):
+    """(records, độ phân giải) – downsample (có cache) khi có max_points."""
+    if max_points is None:
+        return bars.to_records(), 'D'
+    small, res = DOWNSAMPLE_CACHE.get(bars, max_points, resolution)
+    return small.to_records(), res
+
+
+def _job_top100_history(params: Dict[str, Any], progress) -> Dict[str, Any]:
+    """Làm mới lịch sử `days` ngày của cả Top 100 vào CACHE (lỗi lấy danh sách -> giữ bản cũ nếu có)."""
+    days = int(params["days"])
     end_date = datetime.now().strftime('%Y-%m-%d')
     start_date = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d')
-    
-    # Serve cached history if fresh
     cached_days = CACHE["top100_history"].get(days)
-    if cached_days and _is_fresh(cached_days.get("ts"), CACHE_TTL_HISTORY_SECONDS):
-        return {
-            "metadata": cached_days.get("metadata"),
-            "data": cached_days.get("data"),
-        }
-
     symbols = get_top100_symbols()
     if not symbols:
         # Try serving stale cached history if available
-        if cached_days:
-            return {
-                "metadata": cached_days.get("metadata"),
-                "data": cached_days.get("data"),
-            }
-        raise HTTPException(status_code=500, detail="Không thể lấy danh sách Top 100")
+        if not cached_days:
+            raise RuntimeError("Không thể lấy danh sách Top 100")
+        return {"symbols": len(cached_days["bars"]), "stale": True}
+    prev = cached_days.get("bars", {}) if cached_days else {}
+    bars_map, seqs = {}, {}
+    for i, sym in enumerate(symbols, 1):
+        bars_map[sym] = _refresh_bars(sym, prev.get(sym), start_date, end_date)
+        # seq của chỉ mục ngay sau khi lấy: thay đổi sau đó (đường khác gọi provider) chưa có trong cache
+        seqs[sym] = HISTORY_INDEX.seq
+        progress(i, len(symbols), sym)
+    metadata = {
+        "source": "Local CSV + VNStock",
+        "start_date": start_date,
+        "end_date": end_date,
+        "group": "Top100",
+    }
+    # Update cache
+    CACHE["top100_history"][days] = {"ts": _now(), "bars": bars_map, "seqs": seqs, "metadata": metadata}
+    return {"symbols": len(bars_map), "stale": False, **metadata}
+
+
+def _check_interval(interval: str, since: str = None, max_points: int = None) -> str:
+    try:
+        interval = normalize_interval(interval)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if interval != '1D' and (since or max_points is not None):
+        raise HTTPException(status_code=400, detail="since / max_points chỉ dùng với interval=1D")
+    return interval
+
 
+def _job_top100_intraday(params: Dict[str, Any], progress) -> Dict[str, Any]:
+    """Đồng bộ bar phút `days` ngày gần nhất của cả Top 100 vào kho intraday."""
+    days = int(params["days"])
+    end_date = datetime.now().strftime('%Y-%m-%d')
+    start_date = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d')
+    symbols = get_top100_symbols()
+    if not symbols:
+        raise RuntimeError("Không thể lấy danh sách Top 100")
+    for i, sym in enumerate(symbols, 1):
+        _sync_intraday(sym, start_date, end_date)
+        progress(i, len(symbols), sym)
+    CACHE["top100_intraday"][days] = {"ts": _now(), "symbols": symbols}
+    return {"symbols": len(symbols), "start_date": start_date, "end_date": end_date}
+
+
+def _top100_intraday(days: int, interval: str):
+    """/top100-history với interval trong ngày: đồng bộ (job) rồi đọc + gộp khung từ kho intraday."""
+    synced = CACHE["top100_intraday"].get(days)
+    if not (synced and _is_fresh(synced.get("ts"), CACHE_TTL_INTRADAY_SECONDS)):
+        job = _submit_job("top100-intraday", {"days": int(days)})
+        if not job.wait(JOB_WAIT_SECONDS):
+            return _job_accepted(job)
+        if job.status == FAILED:
+            raise HTTPException(status_code=500, detail=job.error)
+        synced = CACHE["top100_intraday"][days]
+    start = iso_to_minute((datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d'))
+    store = get_intraday_store()
     result_data = {}
-    for sym in symbols:
-        df = get_stock_history(sym, start_date, end_date)
-        if not df.empty:
-            result_data[sym] = df.to_dict(orient='records')
-        else:
-            # On rate limit or no data, keep previous cached symbol data if present
-            if cached_days and cached_days.get("data", {}).get(sym):
-                result_data[sym] = cached_days["data"][sym]
-            else:
-                result_data[sym] = "No data found"
+    for sym in synced["symbols"]:
+        bars = store.read(sym, interval, start)
+        result_data[sym] = bars.to_records() if len(bars) else "No data found"
+    metadata = {"source": "Intraday store + VNStock", "interval": interval, "days": int(days), "group": "Top100"}
+    return {"metadata": metadata, "data": result_data, "delta": False}
 
-    payload = {
-        "metadata": {
-            "source": "Local CSV + VNStock",
-            "start_date": start_date,
-            "end_date": end_date,
-            "group": "Top100",
-        },
-        "data": result_data,
-    }
 
-    # Update cache
-    CACHE["top100_history"][days] = {"ts": _now(), "data": result_data, "metadata": payload["metadata"]}
-    return payload
+@app.get("/top100-history")
+def get_top100_history_data(days: int = 30, since: str = None, max_points: int = None, resolution: str = 'lttb',
+                            interval: str = '1D'):
+    """
+    Lấy dữ liệu lịch sử của Top 100 mã.
+    - days: Số ngày quá khứ muốn lấy (mặc định 30 ngày).
+    - since: cursor từ lần gọi trước (hoặc ngày YYYY-MM-DD) -> chỉ trả các mã có bar mới,
+      mỗi mã từ ngày `from[symbol]`; không có gì mới -> 304.
+    - max_points: tối đa số điểm mỗi mã (khung dài); resolution: 'lttb' (mặc định, giữ bar
+      ngày theo LTTB trên close) | 'W' | 'M' (gộp OHLC tuần/tháng, vẫn quá max_points thì
+      LTTB tiếp -> 'W+lttb' / 'M+lttb') | 'auto'.
+      Khi có max_points, chỉ các mã thay đổi có trong `data` nhưng mỗi mã là cả chuỗi đã
+      downsample: response có "delta": false và from[mã] = null – client thay chuỗi của mã đó,
+      không nối vào chuỗi đang có (mã không có trong `data` giữ nguyên).
+    - interval: 1D (mặc định) | 1m | 5m | 15m | 30m | 1h – khung trong ngày đọc từ kho bar phút
+      (data/intraday) và gộp khung có cache; không dùng cùng since / max_points.
+    """
+    _check_resolution(max_points, resolution)
+    interval = _check_interval(interval, since, max_points)
+    if interval != '1D':
+        return _top100_intraday(days, interval)
+    # Tính toán ngày bắt đầu và kết thúc
+    end_date = datetime.now().strftime('%Y-%m-%d')
+    start_date = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d')
+    mode, value = parse_since(since, HISTORY_INDEX)
+
+    cached_days = CACHE["top100_history"].get(days)
+    if not (cached_days and _is_fresh(cached_days.get("ts"), CACHE_TTL_HISTORY_SECONDS)):
+        # Làm mới cả Top 100 là việc nặng: chạy thành job, các request cùng `days` dùng chung một lượt
+        job = _submit_job("top100-history", {"days": int(days)})
+        if not job.wait(JOB_WAIT_SECONDS):
+            return _job_accepted(job)
+        if job.status == FAILED:
+            raise HTTPException(status_code=500, detail=job.error)
+        cached_days = CACHE["top100_history"].get(days)
+    metadata = cached_days["metadata"]
+    # Cursor = seq trước khi đối chiếu: mọi thay đổi tới seq này đều đã có trong cache sau vòng dưới
+    cursor = HISTORY_INDEX.cursor(HISTORY_INDEX.seq)
+    bars_map, seqs = dict(cached_days["bars"]), dict(cached_days.get("seqs") or {})
+    stale = False
+    for sym, bars in bars_map.items():
+        synced, seqs[sym] = _sync_cached(sym, bars, seqs.get(sym, -1), start_date, end_date)
+        if synced is not bars:
+            bars_map[sym], stale = synced, True
+    if stale:
+        CACHE["top100_history"][days] = {**cached_days, "bars": bars_map, "seqs": seqs}
+    if mode is None:
+        result_data, res_map = {}, {}
+        for sym, bars in bars_map.items():
+            if len(bars):
+                result_data[sym], res_map[sym] = _series(bars, max_points, resolution)
+            else:
+                result_data[sym] = "No data found"
+        payload = {"metadata": metadata, "data": result_data, "cursor": cursor, "delta": False}
+        if max_points is not None:
+            payload["resolution"] = res_map
+        return payload
+
+    result_data, from_map, res_map = {}, {}, {}
+    for sym, bars in bars_map.items():
+        start = _delta_from(sym, mode, value)
+        if start is None or not len(bars):
+            continue
+        if max_points is not None:
+            result_data[sym], res_map[sym] = _series(bars, max_points, resolution)
+            continue
+        part = bars if start == FULL else bars.since(start)
+        result_data[sym] = part.to_records()
+        from_map[sym] = str(part.times()[0]) if len(part) and start != FULL else None
+    if not result_data:
+        return Response(status_code=304, headers={"X-Cursor": cursor})
+    if max_points is not None:
+        # Chuỗi downsample không nối được vào chuỗi cũ: from = None -> client thay cả chuỗi của mã đó
+        return {"metadata": metadata, "data": result_data, "cursor": cursor, "delta": False,
+                "from": {sym: None for sym in result_data}, "resolution": res_map}
+    return {"metadata": metadata, "data": result_data, "cursor": cursor, "delta": True, "from": from_map}
 
 @app.get("/stock/{symbol}")
-def get_single_stock(symbol: str, days: int = 30):
-    """Lấy lịch sử của 1 mã bất kỳ"""
+def get_single_stock(symbol: str, days: int = 30, since: str = None, max_points: int = None, resolution: str = 'lttb',
+                     interval: str = '1D'):
+    """
+    Lấy lịch sử của 1 mã bất kỳ.
+    - since: cursor từ lần gọi trước (hoặc ngày YYYY-MM-DD) -> chỉ trả bar từ ngày `from`;
+      không có gì mới -> 304.
+    - max_points / resolution: downsample như /top100-history; cùng với since thì có bar mới là
+      gửi lại cả chuỗi downsample ("delta": false, "from": null – client thay, không nối).
+    - interval: 1D (mặc định) | 1m | 5m | 15m | 30m | 1h – bar trong ngày: lấy phần bar phút còn
+      thiếu từ provider vào kho intraday rồi gộp khung (có cache theo partition).
+    """
+    _check_resolution(max_points, resolution)
+    interval = _check_interval(interval, since, max_points)
     end_date = datetime.now().strftime('%Y-%m-%d')
     start_date = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d')
     symbol_u = symbol.upper()
+    if interval != '1D':
+        _sync_intraday(symbol_u, start_date, end_date)
+        bars = get_intraday_store().read(symbol_u, interval, iso_to_minute(start_date))
+        if not len(bars):
+            raise HTTPException(status_code=404, detail="Symbol not found or no intraday data")
+        return {"symbol": symbol_u, "interval": interval, "count": len(bars), "data": bars.to_records()}
+    mode, value = parse_since(since, HISTORY_INDEX)
 
     # Try cache first
     cache_key = f"{symbol_u}|{int(days)}"
     cached = CACHE["symbol_history"].get(cache_key)
-    if cached and _is_fresh(cached.get("ts"), CACHE_TTL_SYMBOL_HISTORY_SECONDS):
-        df_cached: pd.DataFrame = cached.get("df")
-        if df_cached is not None and not df_cached.empty:
-            return {
-                "symbol": symbol_u,
-                "data": df_cached.to_dict(orient='records')
-            }
-    
-    df = get_stock_history(symbol_u, start_date, end_date)
-    if df.empty:
-        raise HTTPException(status_code=404, detail="Symbol not found or no data")
-
-    # Normalize and cache + persist
-    df_norm = _normalize_history_df(df, symbol_u)
-    CACHE["symbol_history"][cache_key] = {"ts": _now(), "df": df_norm}
-    try:
-        out_path = os.path.join(_cache_dir(), f"history_{symbol_u}.csv")
-        _save_csv_safe(out_path, df_norm)
-    except Exception:
-        pass
+    bars = cached.get("bars") if cached else None
+    seen = HISTORY_INDEX.seq
+    if not (cached and _is_fresh(cached.get("ts"), CACHE_TTL_SYMBOL_HISTORY_SECONDS) and bars is not None and len(bars)):
+        bars = _refresh_bars(symbol_u, bars, start_date, end_date)
+        if not len(bars):
+            raise HTTPException(status_code=404, detail="Symbol not found or no data")
+        seq, changed = HISTORY_INDEX.seq, True
+    else:
+        # Cache còn hạn nhưng có thể cũ hơn chỉ mục (đường khác đã lấy bar mới của mã này)
+        bars, seq = _sync_cached(symbol_u, bars, cached.get("seq", -1), start_date, end_date)
+        changed = bars is not cached["bars"]
+    if changed:
+        # Cache + persist
+        CACHE["symbol_history"][cache_key] = {"ts": _now(), "bars": bars, "seq": seq}
+        try:
+            out_path = os.path.join(_cache_dir(), f"history_{symbol_u}.csv")
+            _save_csv_safe(out_path, bars.to_frame())
+        except Exception:
+            pass
+    # Cursor chỉ tới seq mà `bars` chắc chắn đã gồm mọi thay đổi của mã này (không phải seq toàn cục)
+    cursor = HISTORY_INDEX.cursor(max(seen, seq))
+
+    start = _delta_from(symbol_u, mode, value) if mode is not None else FULL
+    if start is None:
+        return Response(status_code=304, headers={"X-Cursor": cursor})
+    if mode is None or max_points is not None:
+        records, res = _series(bars, max_points, resolution)
+        payload = {
+            "symbol": symbol_u,
+            "data": records,
+            "cursor": cursor,
+            "delta": False,
+        }
+        if max_points is not None:
+            payload["resolution"] = res
+            if mode is not None:
+                payload["from"] = None          # cả chuỗi downsample: thay, không nối
+        return payload
 
+    part = bars if start == FULL else bars.since(start)
     return {
         "symbol": symbol_u,
-        "data": df_norm.to_dict(orient='records')
+        "data": part.to_records(),
+        "cursor": cursor,
+        "delta": start != FULL,
+        "from": str(part.times()[0]) if len(part) and start != FULL else None,
     }
 
 @app.get("/model-input/{symbol}")
@@ -333,228 +543,409 @@ def get_model_input(symbol: str, days: int = 50):
     Trả về input gồm đúng 50 dòng cho một mã cổ phiếu,
     với các cột: time, open, high, low, close, volume, symbol.
 
-    - days: số ngày quá khứ cần lấy tối thiểu để đảm bảo 50 dòng.
+    - days: giữ để tương thích (khóa cache); khoảng ngày lấy từ provider được tính
+      chính xác cho 50 phiên theo lịch giao dịch, không cần đoán số ngày dư.
     """
     symbol = symbol.upper()
 
-    # Tính khoảng thời gian lấy dữ liệu (lấy dư để đảm bảo đủ 50 bản ghi)
-    end_date = datetime.now().strftime('%Y-%m-%d')
-    start_date = (datetime.now() - timedelta(days=max(days, 60))).strftime('%Y-%m-%d')
-
-    df: pd.DataFrame = pd.DataFrame()
-
     # Try cache first (model_input cache stores last-50 normalized rows)
     cache_key_inp = f"{symbol}|{int(days)}"
     cached_inp = CACHE["model_input"].get(cache_key_inp)
     if cached_inp and _is_fresh(cached_inp.get("ts"), CACHE_TTL_MODEL_INPUT_SECONDS):
-        df_cached: pd.DataFrame = cached_inp.get("df")
-        if df_cached is not None and len(df_cached) >= 50:
-            df_50 = _slice_last_n(df_cached, 50)
+        bars_cached: Bars = cached_inp.get("bars")
+        if bars_cached is not None and len(bars_cached) >= 50:
+            bars_50 = bars_cached.tail(50)
             return {
                 "symbol": symbol,
-                "count": len(df_50),
-                "data": df_50.to_dict(orient='records')
+                "count": len(bars_50),
+                "data": bars_50.to_records()
             }
 
-    # Always try provider (vnstock)
-    df = get_stock_history(symbol, start_date, end_date)
-    df = _normalize_history_df(df, symbol)
+    # Always try provider (vnstock): đúng 50 phiên gần nhất
+    bars = get_last_sessions(symbol, 50)
 
     # Fallback to local CSV only if provider thiếu dữ liệu
-    if df.empty or len(df) < 50:
+    if len(bars) < 50:
         try:
-            # Build path to local CSV within repo
-            repo_root = _find_repo_root(os.path.dirname(__file__))
-            local_csv = os.path.join(repo_root, 'data', 'raw', 'ta', 'vietnam_stock_price_history_2022-10-31_2025-10-31.csv')
-            if os.path.exists(local_csv):
-                df_local = pd.read_csv(local_csv)
-                # Try common column names
-                # Ensure symbol filter
-                sym_col = 'symbol' if 'symbol' in df_local.columns else ('ticker' if 'ticker' in df_local.columns else None)
-                if sym_col is None:
-                    raise Exception('symbol column not found in local CSV')
-                df_local = df_local[df_local[sym_col].astype(str).str.upper() == symbol]
-
-                # Map columns to required
-                # time
-                time_col = None
-                for c in ['time', 'date', 'datetime', 'tradingDate']:
-                    if c in df_local.columns:
-                        time_col = c
-                        break
-                if time_col is None:
-                    # If no time column, cannot proceed
-                    raise Exception('time-like column not found in local CSV')
-
-                rename_map = {time_col: 'time'}
-                # price columns
-                for src, dst, alts in [
-                    ('open', 'open', ['Open','o','open_price']),
-                    ('high', 'high', ['High','h','high_price']),
-                    ('low', 'low', ['Low','l','low_price']),
-                    ('close', 'close', ['Close','c','close_price','adj_close','price']),
-                    ('volume', 'volume', ['Volume','vol','volume_match','total_volume']),
-                ]:
-                    if src in df_local.columns:
-                        rename_map[src] = dst
-                    else:
-                        for alt in alts:
-                            if alt in df_local.columns:
-                                rename_map[alt] = dst
-                                break
-
-                df_local = df_local.rename(columns=rename_map)
-                # Keep required columns; create missing if needed
-                required = ['time', 'open', 'high', 'low', 'close', 'volume']
-                for col in required:
-                    if col not in df_local.columns:
-                        df_local[col] = None
-                df_local = df_local[required].copy()
-                df_local['symbol'] = symbol
-                try:
-                    df_local['time'] = pd.to_datetime(df_local['time']).dt.strftime('%Y-%m-%d')
-                except Exception:
-                    pass
-                df_local = df_local.sort_values('time')
-                df = df_local
+            bars_local = _load_local_bars(symbol, 50)
+            if len(bars_local):
+                bars = bars_local
         except Exception as e:
             print(f"Local CSV fallback failed: {e}")
 
     # Slice last 50
-    df_50 = _slice_last_n(df, 50)
-    if df_50.empty or len(df_50) < 50:
+    bars_50 = bars.tail(50)
+    if len(bars_50) < 50:
         raise HTTPException(status_code=404, detail="Không đủ dữ liệu 50 dòng cho mã này")
 
     # Cache and persist model input
-    CACHE["model_input"][cache_key_inp] = {"ts": _now(), "df": df_50}
+    CACHE["model_input"][cache_key_inp] = {"ts": _now(), "bars": bars_50, "seq": HISTORY_INDEX.seq}
     try:
         out_path = os.path.join(_cache_dir(), f"model_input_{symbol}.csv")
-        _save_csv_safe(out_path, df_50)
+        _save_csv_safe(out_path, bars_50.to_frame())
     except Exception:
         pass
 
     return {
         "symbol": symbol,
-        "count": len(df_50),
-        "data": df_50.to_dict(orient='records')
+        "count": len(bars_50),
+        "data": bars_50.to_records()
     }
 
-@app.get("/predict/{symbol}")
-def predict_symbol(symbol: str, days: int = 70, source: str = 'VNStock'):
-    """
-    Dự báo cho ngày mới nhất sử dụng mô hình lưu tại server/model/best_model.pkl.
-    Trả về nhãn dự báo và xác suất mua (nếu có).
-    """
-    # Build input using same logic as /model-input
-    symbol_u = symbol.upper()
-    end_date = datetime.now().strftime('%Y-%m-%d')
-    start_date = (datetime.now() - timedelta(days=max(days, 70))).strftime('%Y-%m-%d')
-
-    # Chuẩn hóa source
+def _normalize_source(source: str) -> str:
     src_in = (source or '').strip().lower()
     if src_in in {'api', 'vnstock', 'provider', 'remote', 'live'}:
-        source_norm = 'VNStock'
-    elif src_in in {'local', 'csv', 'offline'}:
-        source_norm = 'local'
-    else:
-        source_norm = source
+        return 'VNStock'
+    if src_in in {'local', 'csv', 'offline'}:
+        return 'local'
+    return source
 
-    df: pd.DataFrame = pd.DataFrame()
+
+def _predict_bars(symbol_u: str, source_norm: str) -> Bars:
+    """50 bar input của model cho một mã (cache input -> provider -> CSV local), đã fill."""
+    bars = Bars.empty(symbol_u)
     if source_norm.lower() == 'vnstock':
-        df = get_stock_history(symbol_u, start_date, end_date)
-        df = _normalize_history_df(df, symbol_u)
+        # Dùng chung cache input với /model-input; bỏ qua nếu chỉ mục delta-sync đã thấy bar mới hơn
+        cache_key_inp = f"{symbol_u}|50"
+        cached_inp = CACHE["model_input"].get(cache_key_inp)
+        if (cached_inp and _is_fresh(cached_inp.get("ts"), CACHE_TTL_MODEL_INPUT_SECONDS)
+                and len(cached_inp.get("bars") or ()) >= 50
+                and HISTORY_INDEX.changed_since(symbol_u, cached_inp.get("seq", -1)) is None):
+            bars = cached_inp["bars"]
+        else:
+            bars = get_last_sessions(symbol_u, 50)
+            if len(bars) >= 50:
+                CACHE["model_input"][cache_key_inp] = {"ts": _now(), "bars": bars.tail(50), "seq": HISTORY_INDEX.seq}
 
-    if df.empty or len(df) < 50 or source_norm.lower() == 'local':
+    if len(bars) < 50 or source_norm.lower() == 'local':
         try:
-            repo_root = _find_repo_root(os.path.dirname(__file__))
-            local_csv = os.path.join(repo_root, 'data', 'raw', 'ta', 'vietnam_stock_price_history_2022-10-31_2025-10-31.csv')
-            if os.path.exists(local_csv):
-                df_local = pd.read_csv(local_csv)
-                sym_col = 'symbol' if 'symbol' in df_local.columns else ('ticker' if 'ticker' in df_local.columns else None)
-                if sym_col is None:
-                    raise Exception('symbol column not found in local CSV')
-                df_local = df_local[df_local[sym_col].astype(str).str.upper() == symbol_u]
-                time_col = None
-                for c in ['time', 'date', 'datetime', 'tradingDate']:
-                    if c in df_local.columns:
-                        time_col = c
-                        break
-                if time_col is None:
-                    raise Exception('time-like column not found in local CSV')
-                rename_map = {time_col: 'time'}
-                for src, dst, alts in [
-                    ('open', 'open', ['Open','o','open_price']),
-                    ('high', 'high', ['High','h','high_price']),
-                    ('low', 'low', ['Low','l','low_price']),
-                    ('close', 'close', ['Close','c','close_price','adj_close','price']),
-                    ('volume', 'volume', ['Volume','vol','volume_match','total_volume']),
-                ]:
-                    if src in df_local.columns:
-                        rename_map[src] = dst
-                    else:
-                        for alt in alts:
-                            if alt in df_local.columns:
-                                rename_map[alt] = dst
-                                break
-                df_local = df_local.rename(columns=rename_map)
-                required = ['time', 'open', 'high', 'low', 'close', 'volume']
-                for col in required:
-                    if col not in df_local.columns:
-                        df_local[col] = None
-                df_local = df_local[required].copy()
-                df_local['symbol'] = symbol_u
-                try:
-                    df_local['time'] = pd.to_datetime(df_local['time']).dt.strftime('%Y-%m-%d')
-                except Exception:
-                    pass
-                df_local = df_local.sort_values('time')
-                df = df_local
+            bars_local = _load_local_bars(symbol_u, 50)
+            if len(bars_local):
+                bars = bars_local
         except Exception as e:
             print(f"Local CSV fallback failed (predict): {e}")
+    return _with_intraday_daily(bars).tail(50).filled()
 
-    df_50 = _slice_last_n(df, 50)
-    if df_50.empty or len(df_50) < 50:
+
+def _model_path() -> str:
+    """File model primary của model set (mặc định server/model/best_model.pkl)."""
+    return get_model_set().primary_spec.path
+
+
+@app.get("/predict/{symbol}")
+def predict_symbol(symbol: str, background_tasks: BackgroundTasks, days: int = 70, source: str = 'VNStock',
+                   models: str = None):
+    """
+    Dự báo cho ngày mới nhất bằng model primary của model set (mặc định server/model/best_model.pkl).
+    Trả về nhãn dự báo và xác suất mua (nếu có), kèm tên model.
+    - `models`: thêm dự báo của các model khác trong model set để so sánh (vd. `lr,lgbm` hoặc `all`)
+    """
+    symbol_u = symbol.upper()
+    results, _, _ = _score_batch([symbol_u], _normalize_source(source), models=_split_param(models),
+                                 background=background_tasks)
+    result = dict(results[symbol_u])
+    status = result.pop("status")
+    if status == "insufficient_input":
         raise HTTPException(status_code=404, detail="Không đủ dữ liệu 50 dòng cho mã này")
+    if status != "ok":
+        raise HTTPException(status_code=500, detail=status)
+    return result
+
+
+class BatchPredictRequest(BaseModel):
+    symbols: List[str]
+    source: str = 'VNStock'
+    use_cache: bool = True
+    explain: bool = False
+    models: List[str] = []
+
+
+BATCH_PREDICT_MAX_SYMBOLS = 200
+BATCH_FETCH_WORKERS = int(os.environ.get('BATCH_FETCH_WORKERS', 8))
+
+
+def _feature_builder(panel: List[Bars], symbols: List[str]):
+    """
+    Tính chỉ báo một lần cho cả lô (panel 2-D), trả về build_X(columns) dùng chung cho mọi model
+    của model set: mỗi model chỉ lấy các cột nó cần (FA chỉ gắn khi có model cần tới).
+    """
+    stack = {f: np.vstack([getattr(b, f) for b in panel]) for f in ('open', 'high', 'low', 'close', 'volume')}
+    feats = compute_features(stack['open'], stack['high'], stack['low'], stack['close'], stack['volume'])
+    return matrix_builder(feats, symbols, np.vstack([b.day for b in panel]))
 
-    # Load model and predict
-    model_path = os.path.join(os.path.dirname(__file__), 'model', 'best_model.pkl')
-    if not os.path.exists(model_path):
-        raise HTTPException(status_code=500, detail="Model file not found")
-    pipeline = joblib.load(model_path)
 
-    y_pred = pipeline.predict(df_50)
+def _observe_drift(pipeline, model_version: str, build_X, rows: List[int]):
+    """Đưa feature của các input mới (không tính memo hit) vào sketch drift của model primary."""
     try:
-        y_prob = pipeline.predict_proba(df_50)
-        prob_buy = float(y_prob[0,1])
-    except Exception:
-        prob_buy = None
+        columns = model_feature_columns(pipeline)
+        monitor = get_drift_monitor(_model_path(), model_version, columns)
+        monitor.observe(build_X(columns).to_numpy()[rows])
+    except Exception as e:
+        print(f"Lỗi cập nhật drift: {e}")
+
+
+def _score_batch(symbols: List[str], source_norm: str, use_cache: bool = True, explain: bool = False,
+                 models: List[str] = None, background: BackgroundTasks = None):
+    """
+    Dự báo (và giải thích nếu explain=True) cho cả nhóm mã: lấy input các mã song song, tính
+    chỉ báo như một panel 2-D một lần rồi chấm bằng model primary + các model trong `models`
+    (tên trong model set hoặc 'all'). Model shadow được chấm nền sau khi response đã gửi
+    (`background`) nên không làm chậm primary.
+    Kết quả và giải thích được cache theo (mã, hash input, version model).
+    Trả về ({mã: kết quả}, version model primary, {mã: Bars input}).
+    """
+    model_set = get_model_set()
+    try:
+        specs = model_set.resolve(models)
+    except KeyError as e:
+        raise HTTPException(status_code=400, detail=f"Không có model {e} trong model set")
+    try:
+        loaded = load_models(specs)
+    except FileNotFoundError:
+        raise HTTPException(status_code=500, detail="Model file not found")
+    primary_name, pipeline, model_version = loaded[0][0].name, loaded[0][1], loaded[0][2]
+    if any(wants_fa(model_feature_columns(m)) for _, m, _ in loaded):
+        # Nạp lại chỉ mục FA nếu có kỳ mới trước khi tra cache (listener xóa dự báo cũ của các mã đó)
+        get_fa_index()
+
+    # Lấy input: provider là I/O nên chạy song song (limiter của provider vẫn áp dụng)
+    def _fetch(sym: str) -> Bars:
+        try:
+            return _predict_bars(sym, source_norm)
+        except Exception as e:
+            print(f"Batch predict: lỗi lấy dữ liệu {sym}: {e}")
+            return Bars.empty(sym)
+
+    workers = max(1, min(BATCH_FETCH_WORKERS, len(symbols)))
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            inputs = dict(zip(symbols, pool.map(_fetch, symbols)))
+    else:
+        inputs = {sym: _fetch(sym) for sym in symbols}
+
+    def _other_key(key, name: str, version: str):
+        return key[0], key[1], f"{name}@{version}"
 
+    results: Dict[str, Dict[str, Any]] = {}
+    pending = []
+    for sym in symbols:
+        bars = inputs[sym]
+        if len(bars) < 50:
+            results[sym] = {"symbol": sym, "date": None, "prediction": None, "prob_buy": None,
+                            "status": "insufficient_input"}
+            continue
+        key = PREDICTION_MEMO.key(sym, bars, model_version)
+        memo = PREDICTION_MEMO.get(key) if use_cache else None
+        # Dự báo đã có nhưng chưa có giải thích / kết quả model so sánh -> vẫn đưa vào lô
+        hit = memo is not None and (not explain or EXPLANATIONS.get(key) is not None)
+        others = {}
+        for spec, _, version in loaded[1:]:
+            if not hit:
+                break
+            others[spec.name] = OTHER_MODEL_MEMO.get(_other_key(key, spec.name, version))
+            hit = others[spec.name] is not None
+        if hit:
+            results[sym] = {**memo, **({"models": others} if others else {}), "status": "ok", "cached": True}
+        else:
+            pending.append((sym, bars, key, memo))
+
+    if pending:
+        syms = [p[0] for p in pending]
+        panel = [p[1] for p in pending]
+        try:
+            build_X = _feature_builder(panel, syms)
+            scored = score_all(loaded, build_X)
+            y_pred, prob = scored[primary_name]["prediction"], scored[primary_name]["prob"]
+            shadows = [spec for spec in model_set.shadows if spec.name not in scored]
+            if shadows:
+                if background is not None:
+                    background.add_task(get_shadow_runner().submit, shadows, build_X, y_pred, prob)
+                else:
+                    get_shadow_runner().submit(shadows, build_X, y_pred, prob)
+            fresh = [i for i, p in enumerate(pending) if p[3] is None]
+            if fresh:
+                if background is not None:
+                    background.add_task(_observe_drift, pipeline, model_version, build_X, fresh)
+                else:
+                    _observe_drift(pipeline, model_version, build_X, fresh)
+            explanations = None
+            if explain:
+                columns = model_feature_columns(pipeline)
+                explanations = explain_rows(get_explainer(pipeline, model_version, _model_path()),
+                                            build_X(columns), columns)
+            for i, (sym, bars, key, memo) in enumerate(pending):
+                result = memo or {
+                    "symbol": sym,
+                    "date": str(bars.times()[-1]),
+                    "prediction": int(y_pred[i]),
+                    "prob_buy": float(prob[i]) if prob is not None else None,
+                    "rows": len(bars),
+                    "model": primary_name,
+                    "model_version": model_version,
+                }
+                if memo is None:
+                    PREDICTION_MEMO.put(key, result)
+                if explanations is not None:
+                    EXPLANATIONS.put(key, {"symbol": sym, "date": result["date"], "prob_buy": result["prob_buy"],
+                                           "model_version": model_version, **explanations[i]})
+                others = {}
+                for name, r in scored.items():
+                    if name == primary_name:
+                        continue
+                    others[name] = {"prediction": int(r["prediction"][i]),
+                                    "prob_buy": float(r["prob"][i]) if r["prob"] is not None else None,
+                                    "model_version": r["version"]}
+                    OTHER_MODEL_MEMO.put(_other_key(key, name, r["version"]), others[name])
+                results[sym] = {**result, **({"models": others} if others else {}), "status": "ok",
+                                "cached": memo is not None}
+        except Exception as e:
+            for sym in syms:
+                results[sym] = {"symbol": sym, "date": None, "prediction": None, "prob_buy": None,
+                                "status": f"error: {e}"}
+    return results, model_version, inputs
+
+
+def _batch_symbols(symbols: List[str]) -> List[str]:
+    symbols = list(dict.fromkeys(s.strip().upper() for s in symbols if s and s.strip()))
+    if not symbols:
+        raise HTTPException(status_code=400, detail="symbols không được rỗng")
+    if len(symbols) > BATCH_PREDICT_MAX_SYMBOLS:
+        raise HTTPException(status_code=400, detail=f"Tối đa {BATCH_PREDICT_MAX_SYMBOLS} mã mỗi request")
+    return symbols
+
+
+@app.post("/predict/batch")
+def predict_batch(req: BatchPredictRequest, background_tasks: BackgroundTasks):
+    """
+    Dự báo cho một danh sách mã trong một request (vd. watchlist):
+    lấy input các mã còn thiếu song song, tính chỉ báo cả nhóm như một panel 2-D rồi gọi
+    predict_proba một lần. Mỗi mã có status như predict_for_symbol: 'ok' | 'insufficient_input' | 'error: ...'.
+    - `symbols`: danh sách mã (tối đa 200, trùng lặp bị bỏ)
+    - `source`: 'VNStock' (mặc định) hoặc 'local'
+    - `use_cache`: dùng lại kết quả đã tính cho cùng input + cùng model
+    - `explain`: tính luôn đóng góp feature cho cả lô (xem sau ở /explain/{symbol}, không tốn thêm)
+    - `models`: thêm dự báo của các model khác trong model set (tên hoặc ["all"]), cùng bộ chỉ báo
+    """
+    t0 = datetime.now()
+    symbols = _batch_symbols(req.symbols)
+    results, model_version, _ = _score_batch(symbols, _normalize_source(req.source), req.use_cache, req.explain,
+                                             models=req.models, background=background_tasks)
+    data = [results[s] for s in symbols]
     return {
-        "symbol": symbol_u,
-        "date": df_50.iloc[-1]['time'],
-        "prediction": y_pred[0] if len(y_pred) > 0 else None,
-        "prob_buy": prob_buy,
-        "rows": len(df_50),
+        "count": len(data),
+        "ok": sum(1 for r in data if r["status"] == "ok"),
+        "model": get_model_set().primary,
+        "model_version": model_version,
+        "took_ms": round((datetime.now() - t0).total_seconds() * 1000, 2),
+        "data": data,
     }
 
 
-@app.get("/predict-top100")
-def predict_top100(days: int = 60, limit: int = None, save_csv: bool = False):
+# --- Giải thích dự báo (đóng góp từng feature) ---
+
+@app.get("/explain")
+def explain_universe(symbols: str = None, top: int = 5, source: str = 'VNStock'):
     """
-    Chạy dự báo cho Top 100 mã và trả về list được sắp xếp theo xác suất mua giảm dần.
+    Dự báo + đóng góp feature cho cả universe (mặc định Top 100) trong một lượt; kết quả được cache
+    cùng snapshot dự báo nên /explain/{symbol} sau đó chỉ là tra cache.
+    - `top`: số feature đóng góp lớn nhất mỗi mã (0 = tất cả)
+    """
+    t0 = datetime.now()
+    syms = _batch_symbols(_split_param(symbols) or get_top100_symbols())
+    results, model_version, inputs = _score_batch(syms, _normalize_source(source), explain=True)
+    data = []
+    for sym in syms:
+        if results[sym]["status"] != "ok":
+            data.append({"symbol": sym, "status": results[sym]["status"]})
+            continue
+        exp = EXPLANATIONS.get(PREDICTION_MEMO.key(sym, inputs[sym], model_version))
+        data.append({**top_contributions(exp, top), "status": "ok"} if exp else {"symbol": sym, "status": "error: no explanation"})
+    return {
+        "count": len(data),
+        "model_version": model_version,
+        "took_ms": round((datetime.now() - t0).total_seconds() * 1000, 2),
+        "data": data,
+    }
 
-    - source: 'local' dùng dữ liệu đã tính sẵn (khuyến nghị nhanh/stable), 'VNStock' gọi provider.
-    - limit: giới hạn số mã đầu vào (ví dụ 20 để debug nhanh).
-    - save_csv: nếu True, ghi thêm file top100_predictions.csv tại thư mục server.
+
+@app.get("/explain/{symbol}")
+def explain_symbol(symbol: str, top: int = 10, source: str = 'VNStock'):
+    """
+    Vì sao model cho `prob_buy` này: base + đóng góp từng feature (cộng lại bằng đầu ra model;
+    `output` = probability với model cây, log_odds với LogisticRegression).
+    Lấy từ snapshot đã tính (cùng input + cùng model); chưa có thì tính cho riêng mã này.
     """
+    symbol_u = symbol.upper()
+    source_norm = _normalize_source(source)
     try:
-        # Use the running API port (5000) to fetch model inputs
-        df_res = run_model_on_top100(server_url='http://127.0.0.1:5000', days=days, source='VNStock', limit=limit)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Prediction failed: {e}")
+        _, model_version = load_model_versioned(_model_path())
+    except FileNotFoundError:
+        raise HTTPException(status_code=500, detail="Model file not found")
+    # Cùng input (cache input của /predict) + cùng model -> đúng khóa của snapshot đã giải thích
+    bars = _predict_bars(symbol_u, source_norm)
+    if len(bars) < 50:
+        raise HTTPException(status_code=404, detail="Không đủ dữ liệu 50 dòng cho mã này")
+    key = PREDICTION_MEMO.key(symbol_u, bars, model_version)
+    exp = EXPLANATIONS.get(key)
+    cached = exp is not None
+    if exp is None:
+        results, _, _ = _score_batch([symbol_u], source_norm, explain=True)
+        if results[symbol_u]["status"] != "ok":
+            raise HTTPException(status_code=500, detail=results[symbol_u]["status"])
+        exp = EXPLANATIONS.get(key)
+        if exp is None:
+            raise HTTPException(status_code=500, detail="Không tính được giải thích")
+    return {**top_contributions(exp, top), "cached": cached}
+
+
+@app.get("/models")
+def list_models():
+    """
+    Model set đang phục vụ (model/models.json) + số liệu từng model: độ trễ chấm, tỉ lệ đồng thuận
+    nhãn và |Δ prob_buy| trung bình so với primary trên cùng input, lỗi / lượt shadow bị bỏ.
+    """
+    model_set = get_model_set()
+    metrics = get_model_metrics().snapshot()
+    data = []
+    for name, spec in model_set.specs.items():
+        role = "primary" if name == model_set.primary else ("shadow" if spec.shadow else "on_request")
+        data.append({**spec.to_dict(), "role": role, "available": os.path.exists(spec.path)
+                     or os.path.exists(compiled_path_for(spec.path)), "metrics": metrics.get(name)})
+    return {"primary": model_set.primary, "count": len(data), "data": data}
+
+
+@app.get("/predict-cache")
+def predict_cache_stats():
+    """Thống kê cache kết quả /predict (số mục, hit/miss) của model primary; `other_models`: các model so sánh."""
+    return {**PREDICTION_MEMO.stats(), "other_models": OTHER_MODEL_MEMO.stats()}
 
-    if df_res is None or df_res.empty:
-        raise HTTPException(status_code=500, detail="Không có kết quả dự báo")
+
+# Số mã mỗi lượt chấm của job Top 100: mỗi lượt là một panel 2-D, tiến độ báo sau từng lượt
+JOB_PREDICT_CHUNK = int(os.environ.get('JOB_PREDICT_CHUNK', 20))
+
+
+def _job_predict_top100(params: Dict[str, Any], progress) -> Dict[str, Any]:
+    """
+    Chấm Top 100 ngay trong tiến trình qua _score_batch (cùng model set, cache và drift như
+    /predict/batch), theo từng lượt JOB_PREDICT_CHUNK mã. `days` chỉ giữ cho khóa job: input
+    model luôn là 50 phiên cuối.
+    """
+    symbols = _batch_symbols(get_top100_symbols())
+    if params.get("limit") is not None:
+        symbols = symbols[:int(params["limit"])]
+    rows = []
+    total = len(symbols)
+    for start in range(0, total, JOB_PREDICT_CHUNK):
+        chunk = symbols[start:start + JOB_PREDICT_CHUNK]
+        results, _, _ = _score_batch(chunk, 'VNStock')
+        rows.extend({k: results[s].get(k) for k in ('symbol', 'date', 'prediction', 'prob_buy', 'status')}
+                    for s in chunk)
+        progress(start + len(chunk), total, chunk[-1])
+    df_res = pd.DataFrame(rows, columns=['symbol', 'date', 'prediction', 'prob_buy', 'status'])
+    if df_res.empty:
+        raise RuntimeError("Không có kết quả dự báo")
+    df_res['prob_buy'] = pd.to_numeric(df_res['prob_buy'], errors='coerce')
+    df_res = df_res.sort_values(['prob_buy', 'status'], ascending=[False, True], na_position='last')
 
     # Clean NaN/inf to make JSON-safe
     try:
@@ -566,22 +957,170 @@ def predict_top100(days: int = 60, limit: int = None, save_csv: bool = False):
 
     records = df_res.to_dict(orient='records')
 
-    if save_csv:
+    if params.get("save_csv"):
         out_path = os.path.join(os.path.dirname(__file__), 'top100_predictions.csv')
         try:
             df_res.to_csv(out_path, index=False)
         except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Không ghi được CSV: {e}")
+            raise RuntimeError(f"Không ghi được CSV: {e}")
 
-    payload = {
+    # Ensure JSON-safe (convert NaN/Inf to null) using FastAPI encoder
+    return jsonable_encoder({
         "count": len(records),
         "source": "VNStock",
         "data": records,
-    }
+    })
+
+
+@app.get("/predict-top100")
+def predict_top100(days: int = 60, limit: int = None, save_csv: bool = False, wait: bool = True):
+    """
+    Chạy dự báo cho Top 100 mã và trả về list được sắp xếp theo xác suất mua giảm dần.
+
+    Chạy thành job nền (xem /jobs): nhiều request cùng tham số dùng chung một lượt chạy.
+    - limit: giới hạn số mã đầu vào (ví dụ 20 để debug nhanh).
+    - save_csv: nếu True, ghi thêm file top100_predictions.csv tại thư mục server.
+    - wait: đợi kết quả tối đa JOB_WAIT_S giây (mặc định 2); quá hạn hoặc wait=false -> 202 kèm job
+      để theo dõi ở /jobs/{id} (lấy kết quả ở /jobs/{id}/result).
+    """
+    job = _submit_job("predict-top100", {"days": int(days), "limit": limit, "save_csv": bool(save_csv)})
+    if not wait or not job.wait(JOB_WAIT_SECONDS):
+        return _job_accepted(job)
+    if job.status == FAILED:
+        raise HTTPException(status_code=500, detail=f"Prediction failed: {job.error}")
+    return JSONResponse(content=job.result)
+
+
+# --- Drift feature (input phục vụ so với tập train) ---
+
+DRIFT_WINDOWS = ('all', 'recent')
+DRIFT_SORTS = ('psi', 'ks', 'feature')
+
+
+def _primary_drift_monitor():
+    try:
+        model, version = get_model_set().primary_spec.load()
+    except FileNotFoundError:
+        raise HTTPException(status_code=500, detail="Model file not found")
+    try:
+        return get_drift_monitor(_model_path(), version, model_feature_columns(model))
+    except Exception as e:
+        print(f"Lỗi dựng sketch drift: {e}")
+        raise HTTPException(status_code=500, detail=f"Không dựng được sketch drift: {e}")
 
-    # Ensure JSON-safe (convert NaN/Inf to null) using FastAPI encoder
-    encoded = jsonable_encoder(payload)
-    return JSONResponse(content=encoded)
+
+def _check_drift_window(window: str):
+    if window not in DRIFT_WINDOWS:
+        raise HTTPException(status_code=400, detail=f"window phải là một trong {list(DRIFT_WINDOWS)}")
+
+
+@app.get("/drift")
+def feature_drift(window: str = 'all', sort: str = 'psi'):
+    """
+    Độ lệch phân phối từng feature của model primary giữa các input đã dự báo và tập train:
+    PSI và KS tính trên histogram cố định (cùng biên phân vị của tập train), nên tốn bộ nhớ và
+    thời gian như nhau dù đã phục vụ bao nhiêu lô. status theo PSI: stable < 0.1 <= moderate < 0.25 <= major
+    ('insufficient' khi cửa sổ còn ít hơn DRIFT_MIN_ROWS dòng).
+    - `window`: 'all' (từ lúc server chạy) | 'recent' (các khung giờ gần nhất)
+    - `sort`: 'psi' | 'ks' (giảm dần) | 'feature'
+    Chỉ input mới được đếm (kết quả lấy từ cache dự báo không cộng lại lần nữa).
+    """
+    _check_drift_window(window)
+    if sort not in DRIFT_SORTS:
+        raise HTTPException(status_code=400, detail=f"sort phải là một trong {list(DRIFT_SORTS)}")
+    report = _primary_drift_monitor().report(window)
+    if sort == 'feature':
+        report["features"].sort(key=lambda f: f["feature"])
+    else:
+        report["features"].sort(key=lambda f: -1.0 if f[sort] is None else f[sort], reverse=True)
+    return report
+
+
+@app.get("/drift/{feature}")
+def feature_drift_histogram(feature: str, window: str = 'all'):
+    """Histogram tham chiếu và live của một feature (biên bin + tỉ lệ mỗi bin) để vẽ so sánh."""
+    _check_drift_window(window)
+    monitor = _primary_drift_monitor()
+    if feature not in monitor.reference.columns:
+        raise HTTPException(status_code=404, detail=f"Model không dùng feature {feature}")
+    return monitor.histogram(feature, window)
+
+
+# --- Job nền (chạy nặng cho cả Top 100) ---
+
+JOBS = get_job_manager()
+JOBS.register("predict-top100", _job_predict_top100)
+JOBS.register("top100-history", _job_top100_history)
+JOBS.register("top100-intraday", _job_top100_intraday)
+# Route đồng bộ chỉ đợi ngắn (job nhỏ/đã xong trả luôn) rồi 202: không giữ worker threadpool suốt job
+JOB_WAIT_SECONDS = float(os.environ.get('JOB_WAIT_S', 2))
+JOB_RETRY_AFTER = "2"
+
+
+def _submit_job(kind: str, params: Dict[str, Any]):
+    try:
+        return JOBS.submit(kind, params)
+    except JobQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "30"})
+
+
+def _job_accepted(job) -> JSONResponse:
+    return JSONResponse(status_code=202, content=job.to_dict(),
+                        headers={"Location": f"/jobs/{job.id}", "Retry-After": JOB_RETRY_AFTER})
+
+
+class JobRequest(BaseModel):
+    kind: str
+    params: Dict[str, Any] = {}
+
+
+_JOB_DEFAULTS = {
+    "predict-top100": {"days": 60, "limit": None, "save_csv": False},
+    "top100-history": {"days": 30},
+    "top100-intraday": {"days": 5},
+}
+
+
+@app.post("/jobs")
+def submit_job(req: JobRequest):
+    """
+    Tạo job: {"kind": "predict-top100", "params": {"days": 60, "limit": null, "save_csv": false}}
+    hoặc {"kind": "top100-history", "params": {"days": 1000}}. Cùng kind + params với một job đang
+    chờ/chạy thì trả về chính job đó. Trả 202 + header Location: /jobs/{id}.
+    """
+    try:
+        params = job_params(_JOB_DEFAULTS, req.kind, req.params)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return _job_accepted(_submit_job(req.kind, params))
+
+
+@app.get("/jobs")
+def list_jobs(status: str = None):
+    """Các job còn giữ (đang chờ / đang chạy / đã xong trong TTL) + thống kê hàng đợi."""
+    return {**JOBS.snapshot(), "data": [j.to_dict() for j in JOBS.list(status)]}
+
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str, result: bool = False):
+    """Trạng thái + tiến độ (done/total/percent) của job; `result=true` kèm kết quả khi đã xong."""
+    job = JOBS.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Không có job này (hoặc đã hết hạn)")
+    return job.to_dict(result=result)
+
+
+@app.get("/jobs/{job_id}/result")
+def get_job_result(job_id: str):
+    """Kết quả của job đã xong; chưa xong -> 202 kèm trạng thái; lỗi -> 500."""
+    job = JOBS.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Không có job này (hoặc đã hết hạn)")
+    if job.status == FAILED:
+        raise HTTPException(status_code=500, detail=job.error)
+    if job.status != DONE:
+        return _job_accepted(job)
+    return JSONResponse(content=jsonable_encoder(job.result))
 
 
 @app.get("/predict-top100-csv")
@@ -636,4 +1175,419 @@ def predict_top100_csv(limit: int = None, sort: bool = True):
         "data": records,
     }
     encoded = jsonable_encoder(payload)
-    return JSONResponse(content=encoded)
\ No newline at end of file
+    return JSONResponse(content=encoded)
+
+
+def _split_param(value: str = None):
+    if not value:
+        return None
+    items = [v.strip() for v in value.split(',') if v.strip()]
+    return items or None
+
+
+@app.get("/export/history")
+def export_history(symbols: str = None, start: str = None, end: str = None,
+                   columns: str = None, format: str = 'arrow'):
+    """
+    Xuất lịch sử giá từ kho local dạng cột cho notebook/pipeline.
+    - `symbols`, `columns`: danh sách phân tách bằng dấu phẩy (mặc định tất cả)
+    - `start`, `end`: YYYY-MM-DD (bao gồm hai đầu)
+    - `format`: `arrow` (Arrow IPC stream, gửi dần từng record batch) | `parquet`
+    """
+    syms = _split_param(symbols)
+    if syms:
+        syms = [s.upper() for s in syms]
+    try:
+        table = build_history_table(symbols=syms, start=start, end=end, columns=_split_param(columns))
+    except RuntimeError as e:
+        raise HTTPException(status_code=501, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    fmt = (format or 'arrow').lower()
+    if fmt == 'arrow':
+        return StreamingResponse(iter_arrow_stream(table), media_type='application/vnd.apache.arrow.stream')
+    if fmt == 'parquet':
+        return Response(content=to_parquet_bytes(table), media_type='application/vnd.apache.parquet',
+                        headers={'Content-Disposition': 'attachment; filename="history.parquet"'})
+    raise HTTPException(status_code=400, detail="format phải là 'arrow' hoặc 'parquet'")
+
+
+# --- Chất lượng dữ liệu ---
+
+@app.get("/data-quality")
+def data_quality(symbols: str = None, limit: int = 200):
+    """
+    Các bar bị loại (kèm lý do) khi nạp kho CSV local và khi lấy từ provider, cùng các đoạn thiếu phiên.
+    - `symbols`: chỉ xem các mã này (phân tách bằng dấu phẩy)
+    - `limit`: số dòng tối đa mỗi danh sách
+    """
+    syms = _split_param(symbols)
+    wanted = {s.upper() for s in syms} if syms else None
+    store = get_price_store()
+
+    def _rows(df: pd.DataFrame):
+        if df is None or df.empty:
+            return 0, []
+        if wanted is not None:
+            df = df[df['symbol'].isin(wanted)]
+        df = df.drop(columns=['day'], errors='ignore')
+        return int(len(df)), jsonable_encoder(df.head(limit).replace({np.nan: None}).to_dict(orient='records'))
+
+    store_total, store_rows = _rows(store.quarantine)
+    provider_total, provider_rows = _rows(get_quarantine_log().frame(wanted))
+    gaps_total, gaps_rows = _rows(store.gaps)
+    return {
+        "store": {"quarantined": store_total, "rows": store_rows},
+        "provider": {"quarantined": provider_total, "rows": provider_rows},
+        "gaps": {"count": gaps_total, "rows": gaps_rows},
+    }
+
+
+# --- Chỉ số FA theo ngày (as-of) ---
+
+@app.get("/fundamentals/{symbol}")
+def fundamentals(symbol: str, date: str = None):
+    """
+    Chỉ số FA (ROA, ROE, D/E, biên lợi nhuận, tăng trưởng) mà thị trường đã biết tại `date`
+    (YYYY-MM-DD, mặc định hôm nay): kỳ gần nhất đã công bố, tính cả độ trễ công bố báo cáo.
+    Kèm danh sách các kỳ và ngày có hiệu lực của từng kỳ.
+    """
+    index = get_fa_index()
+    if symbol.upper() not in index:
+        raise HTTPException(status_code=404, detail=f"Không có dữ liệu FA cho {symbol.upper()}")
+    try:
+        day = iso_to_day(date) if date else int(np.datetime64(datetime.now().date(), 'D').astype(np.int64))
+    except Exception:
+        raise HTTPException(status_code=400, detail="date phải có dạng YYYY-MM-DD")
+    values, pos = index.join(np.array([symbol.upper()], dtype=object), np.array([day]))
+    as_of = None
+    if pos[0] >= 0:
+        as_of = {"period": index.period_label(int(pos[0])),
+                 **{f: (float(v) if np.isfinite(v) else None) for f, v in zip(FA_FIELDS, values[0])}}
+    return {"symbol": symbol.upper(), "date": date or datetime.now().strftime('%Y-%m-%d'),
+            "lag_days": index.lag_days, "as_of": as_of, "periods": index.history(symbol)}
+
+
+@app.get("/fa/weights-sweep")
+def fa_weights_sweep(n: int = 2000, k: int = 100, concentration: float = 50.0, seed: int = 0,
+                     limit: int = 150, symbols: str = None):
+    """
+    Độ nhạy của xếp hạng FA (fa_ranking.ipynb) với 7 trọng số thành phần: chấm cả universe FA
+    dưới `n` bộ trọng số ngẫu nhiên quanh trọng số gốc (Dirichlet, `concentration` càng lớn càng
+    sát; 0 = đều trên simplex), mỗi mã trả về tần suất vào top-`k` và độ ổn định hạng.
+    - `limit`: số dòng trả về (sắp theo tần suất vào top-k); `symbols`: chỉ trả các mã này
+    """
+    if not 1 <= n <= 50000:
+        raise HTTPException(status_code=400, detail="n phải trong khoảng 1..50000")
+    if k < 1:
+        raise HTTPException(status_code=400, detail="k phải >= 1")
+    if concentration < 0:
+        raise HTTPException(status_code=400, detail="concentration phải >= 0")
+    try:
+        components = get_fa_components()
+    except Exception as e:
+        print(f"Lỗi dựng điểm FA: {e}")
+        raise HTTPException(status_code=500, detail=f"Không dựng được điểm FA: {e}")
+    table, summary = run_sweep(components, n=n, k=k, concentration=concentration, seed=seed)
+    wanted = _split_param(symbols)
+    if wanted:
+        table = table[table['symbol'].isin([s.upper() for s in wanted])]
+    elif limit:
+        table = table.head(limit)
+    table = table.round(4).replace({np.nan: None})
+    return {"summary": summary, "weights": dict(zip(COMPONENTS, BASELINE_WEIGHTS.tolist())),
+            "count": len(table), "data": table.to_dict(orient='records')}
+
+
+# --- Bộ lọc cổ phiếu (screener) ---
+
+@app.get("/screen")
+def screen(where: str, sort: str = None, order: str = 'desc', limit: int = 50, fields: str = None):
+    """
+    Lọc universe theo điều kiện trên chỉ báo TA tại bar mới nhất và điểm FA (top_100_stocks.csv).
+    - `where`: vd. `rsi_14<30 AND volume_ratio>2 AND final_score>50` (AND/OR/NOT, ngoặc, + - * /)
+    - `sort`, `order` (asc|desc): sắp xếp theo một cột; `limit`: số dòng trả về (0 = tất cả)
+    - `fields`: thêm cột vào kết quả (phân tách bằng dấu phẩy); danh sách cột ở /screen/fields
+    """
+    if order not in ('asc', 'desc'):
+        raise HTTPException(status_code=400, detail="order phải là 'asc' hoặc 'desc'")
+    if limit < 0:
+        raise HTTPException(status_code=400, detail="limit phải >= 0")
+    table = get_screen_table()
+    t0 = datetime.now()
+    try:
+        result = table.screen(where, sort=sort, descending=order == 'desc', limit=limit or None,
+                              fields=_split_param(fields))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    result["took_ms"] = round((datetime.now() - t0).total_seconds() * 1000, 2)
+    return result
+
+
+@app.get("/screen/fields")
+def screen_fields():
+    """Các cột dùng được trong /screen: chỉ báo TA (bar mới nhất) và điểm FA."""
+    table = get_screen_table()
+    return {"ta": list(table.ta), "fa": list(table.fa), "universe": len(table)}
+
+
+# --- Rủi ro danh mục (hiệp phương sai / tương quan trượt của Top 100) ---
+
+def _round(x, nd: int = 6):
+    x = float(x)
+    return round(x, nd) if np.isfinite(x) else None
+
+
+@app.get("/risk")
+def risk_summary(symbols: str = None, sort: str = 'vol', order: str = 'desc'):
+    """
+    Độ biến động (năm hóa), beta và tương quan với chỉ số equal-weight Top 100 của từng mã, trên
+    cửa sổ trượt 60 phiên (cập nhật tăng dần khi có bar mới từ live feed).
+    - `sort`: vol | beta | corr_index | symbol; `order`: asc | desc
+    """
+    if sort not in ('vol', 'beta', 'corr_index', 'symbol'):
+        raise HTTPException(status_code=400, detail="sort phải là vol, beta, corr_index hoặc symbol")
+    risk = get_risk_model()
+    summary = risk.summary()
+    idx = risk.indices(_split_param(symbols))
+    rows = [{"symbol": risk.symbols[i], "vol": _round(summary["vol"][i]), "beta": _round(summary["beta"][i]),
+             "corr_index": _round(summary["corr_index"][i], 4), "sessions": int(summary["n_obs"][i])} for i in idx]
+    # None xuống cuối dù sắp tăng hay giảm
+    rows.sort(key=lambda r: (r[sort] is None, r[sort] if sort == 'symbol' or r[sort] is None
+                             else (-r[sort] if order == 'desc' else r[sort])))
+    return {"index": INDEX_NAME, "index_vol": _round(summary["index_vol"]), **window_label(risk),
+            "count": len(rows), "data": rows}
+
+
+@app.get("/risk/clusters")
+def risk_clusters(symbols: str = None, threshold: float = 0.5, k: int = None, matrix: bool = False):
+    """
+    Gom cụm các mã theo tương quan return (cụm = các mã tương quan trung bình >= `threshold`,
+    hoặc đúng `k` cụm). `order` là thứ tự để vẽ heatmap tương quan theo khối;
+    `matrix=true` trả kèm ma trận tương quan theo thứ tự đó.
+    """
+    if not -1 <= threshold <= 1:
+        raise HTTPException(status_code=400, detail="threshold phải trong [-1, 1]")
+    risk = get_risk_model()
+    t0 = datetime.now()
+    res = cluster_correlation(risk, _split_param(symbols), threshold=threshold, n_clusters=k)
+    pos = {s: i for i, s in enumerate(res["symbols"])}
+    corr = res["corr"]
+    clusters: Dict[int, List[str]] = {}
+    for sym in res["order"]:
+        clusters.setdefault(int(res["labels"][pos[sym]]), []).append(sym)
+    data = []
+    for label, members in sorted(clusters.items(), key=lambda kv: -len(kv[1])):
+        ii = [pos[m] for m in members]
+        sub = corr[np.ix_(ii, ii)][np.triu_indices(len(ii), 1)]
+        sub = sub[np.isfinite(sub)]
+        data.append({"cluster": label, "size": len(members), "symbols": members,
+                     "avg_corr": round(float(sub.mean()), 4) if len(sub) else None})
+    out = {**window_label(risk), "count": len(data), "order": res["order"], "clusters": data,
+           "took_ms": round((datetime.now() - t0).total_seconds() * 1000, 2)}
+    if matrix:
+        order = [pos[s] for s in res["order"]]
+        m = np.round(corr[np.ix_(order, order)], 4)
+        out["matrix"] = [[None if not np.isfinite(v) else float(v) for v in row] for row in m]
+    return out
+
+
+@app.get("/risk/diversified")
+def risk_diversified(k: int = 10, max_corr: float = 0.7, per_cluster: int = None, threshold: float = 0.5,
+                     score: str = 'prob_buy', symbols: str = None, source: str = 'VNStock'):
+    """
+    Top-K đa dạng hóa: lấy lần lượt các mã điểm cao nhất, bỏ mã có tương quan > `max_corr` với mã
+    đã chọn (và quá `per_cluster` mã mỗi cụm tương quan nếu đặt). So sánh vol / tương quan trung
+    bình của danh mục equal-weight với top-K thuần theo điểm.
+    - `score`: prob_buy (dự báo model) hoặc một cột của /screen (vd. final_score, rsi_14)
+    """
+    if k < 1:
+        raise HTTPException(status_code=400, detail="k phải >= 1")
+    risk = get_risk_model()
+    universe = _split_param(symbols) or risk.symbols
+    if score == 'prob_buy':
+        syms = _batch_symbols([s for s in universe if s.upper() in set(risk.symbols)][:BATCH_PREDICT_MAX_SYMBOLS])
+        results, _, _ = _score_batch(syms, _normalize_source(source))
+        scores = {s: r["prob_buy"] for s, r in results.items() if r["status"] == "ok"}
+    else:
+        table = get_screen_table()
+        values = table.ta.get(score, table.fa.get(score))
+        if values is None:
+            raise HTTPException(status_code=400, detail=f"Không có cột '{score}' (xem /screen/fields)")
+        wanted = {s.upper() for s in universe}
+        scores = {s: float(v) for s, v in zip(table.symbols.tolist(), values) if s in wanted}
+    labels = None
+    if per_cluster:
+        res = cluster_correlation(risk, list(scores), threshold=threshold)
+        labels = {s: int(l) for s, l in zip(res["symbols"], res["labels"])}
+    out = diversified_top_k(risk, scores, k=k, max_corr=max_corr, labels=labels, per_cluster=per_cluster)
+    return {"score": score, "k": k, "max_corr": max_corr, **window_label(risk), **out}
+
+
+# --- Tìm mẫu giá tương tự ---
+
+@app.get("/similar/{symbol}")
+def similar_patterns(symbol: str, k: int = 10, scope: str = 'latest', end: str = None, symbols: str = None):
+    """
+    Tìm các cửa sổ 50 phiên có hình dạng giá (close đã z-normalize) giống cửa sổ của `symbol` nhất.
+    - `scope=latest`: mã nào có 50 phiên gần nhất giống nhất (mỗi mã một kết quả)
+    - `scope=history`: các đoạn lịch sử giống nhất, vd. `?scope=history&symbols=HPG`
+    - `end`: YYYY-MM-DD, dùng cửa sổ kết thúc tại ngày này thay vì mới nhất
+    - `symbols`: chỉ tìm trong các mã này (phân tách bằng dấu phẩy)
+    """
+    if scope not in SCOPES:
+        raise HTTPException(status_code=400, detail=f"scope phải là một trong {list(SCOPES)}")
+    if not 1 <= k <= 200:
+        raise HTTPException(status_code=400, detail="k phải trong khoảng 1..200")
+    try:
+        end_day = iso_to_day(end) if end else None
+    except Exception:
+        raise HTTPException(status_code=400, detail="end phải có dạng YYYY-MM-DD")
+    index = get_pattern_index()
+    t0 = datetime.now()
+    try:
+        result = index.search(symbol, k=k, scope=scope, end_day=end_day, symbols=_split_param(symbols))
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e).strip("'\""))
+    result["took_ms"] = round((datetime.now() - t0).total_seconds() * 1000, 2)
+    result["indexed_windows"] = len(index)
+    return result
+
+
+@app.on_event("startup")
+async def _warm_pattern_index():
+    # Dựng chỉ mục (~1s) ở nền để truy vấn /similar đầu tiên không phải chờ
+    asyncio.get_running_loop().run_in_executor(None, get_pattern_index)
+
+
+# --- Live feed (WebSocket) ---
+
+LIVE_FEED = LiveFeed()
+LIVE_HUB = LiveHub(LIVE_FEED)
+# Bar mới từ live feed -> cập nhật đúng các dòng đó trong bảng /screen (chỉ báo đã tính sẵn)
+LIVE_FEED.listeners.append(
+    lambda syms, feats, panel: get_screen_table().apply(syms, latest_values(feats), np.array([int(b.day[-1]) for b in panel])))
+# ... và cập nhật hạng 1 ma trận hiệp phương sai / tương quan của /risk (O(n²) mỗi phiên mới)
+LIVE_FEED.listeners.append(lambda syms, feats, panel: get_risk_model().apply_bars(panel))
+
+
+def _build_live_source():
+    """
+    LIVE_FEED=off (mặc định) | replay | provider
+    LIVE_INTERVAL_S: chu kỳ lấy bar mới (mặc định 5s với replay, 60s với provider)
+    """
+    mode = os.environ.get('LIVE_FEED', 'off').strip().lower()
+    symbols = get_top100_symbols()
+    if mode == 'replay':
+        source = ReplaySource(symbols)
+        source.prime(LIVE_FEED)
+        return source, float(os.environ.get('LIVE_INTERVAL_S', 5))
+    if mode in {'provider', 'vnstock', 'live'}:
+        return ProviderSource(symbols, get_last_sessions), float(os.environ.get('LIVE_INTERVAL_S', 60))
+    return None, 0.0
+
+
+@app.on_event("startup")
+async def _start_live_feed():
+    source, interval = await run_in_threadpool(_build_live_source)
+    if source is not None:
+        LIVE_HUB.start(source, interval)
+
+
+@app.on_event("shutdown")
+async def _stop_live_feed():
+    await LIVE_HUB.stop()
+
+
+@app.get("/live/status")
+def live_status():
+    """Thống kê live feed: số client, số tick, số message đã gửi/bỏ."""
+    return {"clients": LIVE_HUB.clients, **LIVE_HUB.stats}
+
+
+@app.websocket("/ws/live")
+async def live_ws(websocket: WebSocket, symbols: str = None):
+    """
+    Kênh điểm số live. `?symbols=FPT,VNM` (mặc định: tất cả).
+    Khi kết nối nhận snapshot điểm hiện tại, sau đó chỉ nhận các mã vừa được chấm lại
+    khi có bar mới. Gửi {"subscribe": ["FPT", ...]} hoặc {"subscribe": "*"} để đổi danh sách.
+    """
+    await websocket.accept()
+    queue = LIVE_HUB.register()
+
+    async def _subscribe(syms):
+        LIVE_HUB.subscribe(queue, syms)
+        wanted = syms if syms is not None else get_top100_symbols()
+        snapshot = await run_in_threadpool(LIVE_FEED.snapshot, wanted)
+        await websocket.send_text(json.dumps({"type": "snapshot", "data": snapshot}, ensure_ascii=False))
+
+    async def _sender():
+        while True:
+            await websocket.send_text(await queue.get())
+
+    syms = _split_param(symbols)
+    sender = None
+    try:
+        await _subscribe([s.upper() for s in syms] if syms else None)
+        sender = asyncio.create_task(_sender())
+        while True:
+            msg = await websocket.receive_json()
+            sub = msg.get("subscribe") if isinstance(msg, dict) else None
+            if sub == "*":
+                await _subscribe(None)
+            elif isinstance(sub, list):
+                await _subscribe([str(s).upper() for s in sub])
+    except WebSocketDisconnect:
+        pass
+    finally:
+        LIVE_HUB.unsubscribe(queue)
+        if sender is not None:
+            sender.cancel()
+
+
+# --- Profile theo request (chỉ admin) ---
+# ADMIN_TOKEN chưa đặt -> không cài middleware/wrapper nào, không tốn gì cho request thường.
+# Đặt ADMIN_TOKEN rồi gọi bất kỳ route nào với ?profile=1 (hoặc header X-Profile: 1;
+# `cpu` = chỉ lấy mẫu CPU, bỏ tracemalloc) và header X-Admin-Token.
+
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN', '').strip()
+PROFILES = ProfileStore(keep=int(os.environ.get('PROFILE_KEEP', 20)),
+                        directory=os.path.join(_cache_dir(), 'profiles'))
+
+
+def _require_admin(request: Request):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Chưa bật chế độ admin (đặt biến môi trường ADMIN_TOKEN)")
+    if request.headers.get('x-admin-token') != ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Sai X-Admin-Token")
+
+
+@app.get("/admin/profiles")
+def list_profiles(request: Request):
+    """Các profile gần nhất (mới nhất trước)."""
+    _require_admin(request)
+    return {"profiles": PROFILES.list()}
+
+
+@app.get("/admin/profiles/{profile_id}")
+def get_profile(profile_id: str, request: Request, part: str = 'speedscope'):
+    """
+    `part=speedscope` (mặc định): file speedscope JSON, mở bằng https://www.speedscope.app
+    `part=allocations`: top dòng code cấp phát bộ nhớ (tracemalloc) và peak trong request
+    """
+    _require_admin(request)
+    record = PROFILES.get(profile_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="Không tìm thấy profile")
+    if part == 'allocations':
+        return {"id": profile_id, "name": record["name"], "allocations": record["allocations"]}
+    if part != 'speedscope':
+        raise HTTPException(status_code=400, detail="part phải là 'speedscope' hoặc 'allocations'")
+    return JSONResponse(content=record["speedscope"], headers={
+        'Content-Disposition': f'attachment; filename="{profile_id}.speedscope.json"'})
+
+
+if ADMIN_TOKEN:
+    install_profiling(app, ADMIN_TOKEN, PROFILES,
+                      interval=float(os.environ.get('PROFILE_INTERVAL_MS', 2)) / 1000)
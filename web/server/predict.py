@@ -1,7 +1,6 @@
 import os
 import argparse
 import sys
-import joblib
 import pandas as pd
 
 # Ensure UTF-8 output on Windows
@@ -13,7 +12,10 @@ if sys.platform == 'win32':
         sys.stderr.reconfigure(encoding='utf-8')
 
 # Import builder from service
-from service.model_service_wrapper import build_model_input
+from service.model_service_wrapper import build_model_input, features_frame
+from service.bars import Bars
+from service.compiled_model import load_model
+from service.indicators import model_feature_columns
 
 
 def main():
@@ -43,17 +45,20 @@ def main():
         print(f"Model file not found: {model_path}")
         sys.exit(1)
 
-    pipeline = joblib.load(model_path)
+    pipeline = load_model(model_path)
+
+    # Model nhận các cột chỉ báo (feature_names_in_) tính từ 50 dòng OHLCV
+    X = features_frame(Bars.from_frame(df_input, args.symbol), model_feature_columns(pipeline))
 
     # Predict and predict_proba
     try:
-        y_pred = pipeline.predict(df_input)
+        y_pred = pipeline.predict(X)
     except Exception as e:
         print(f"Error in predict: {e}")
         raise
 
     try:
-        y_prob = pipeline.predict_proba(df_input)
+        y_prob = pipeline.predict_proba(X)
     except Exception:
         y_prob = None
 
@@ -63,10 +68,10 @@ def main():
     lines.append("=== Prediction Result ===")
     lines.append(f"Symbol: {last_row['symbol']}")
     lines.append(f"Date: {last_row['time']}")
-    lines.append(f"Predicted label: {y_pred[0] if len(y_pred) > 0 else y_pred}")
+    lines.append(f"Predicted label: {y_pred[-1] if len(y_pred) > 0 else y_pred}")
     if y_prob is not None:
         try:
-            lines.append(f"Buy probability (class 1): {y_prob[0,1]:.4f}")
+            lines.append(f"Buy probability (class 1): {y_prob[-1, 1]:.4f}")
         except Exception:
             lines.append(f"Probabilities: {y_prob}")
 
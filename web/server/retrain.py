@@ -0,0 +1,176 @@
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+import pandas as pd
+import joblib
+
+# Ensure UTF-8 output on Windows
+if sys.platform == 'win32':
+    os.environ['PYTHONIOENCODING'] = 'utf-8'
+    if hasattr(sys.stdout, 'reconfigure'):
+        sys.stdout.reconfigure(encoding='utf-8')
+    if hasattr(sys.stderr, 'reconfigure'):
+        sys.stderr.reconfigure(encoding='utf-8')
+
+from service.compiled_model import compiled_path_for, export_compiled
+from service.drift import DriftReference, reference_path_for
+from service.feature_selection import load_selected_features
+from service.fundamentals import FA_FEATURE_COLUMNS
+from service.indicators import FEATURE_COLUMNS, model_feature_columns
+from service.price_store import get_price_store
+from service.training import (
+    FAMILIES, GAP_DAYS, FoldCache, available_families, build_dataset, expand_grid,
+    final_estimator, parse_bytes, split_by_time, successive_halving, time_folds,
+)
+
+
+def _auc(model, X: pd.DataFrame, y: np.ndarray) -> float:
+    from sklearn.metrics import roc_auc_score
+    if len(y) == 0 or y.min() == y.max():
+        return float('nan')
+    return float(roc_auc_score(y, model.predict_proba(X)[:, 1]))
+
+
+def main():
+    here = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description='Train lại model dự báo (successive halving trên các fold thời gian, có cache)')
+    parser.add_argument('--models', type=str, default=None,
+                        help=f"Các họ model, vd. lr,rf (mặc định mọi họ có sẵn: {','.join(available_families())})")
+    parser.add_argument('--folds', type=int, default=3, help='Số fold TimeSeriesSplit trên tập train')
+    parser.add_argument('--factor', type=int, default=3, help='Hệ số loại ứng viên mỗi vòng successive halving')
+    parser.add_argument('--min-rows', type=int, default=1000, help='Số dòng train tối thiểu ở vòng đầu')
+    parser.add_argument('--n-jobs', type=int, default=-1, help='Số worker song song (-1 = mọi core)')
+    parser.add_argument('--memory-cap', type=str, default='2G', help='Giới hạn bộ nhớ cho các worker, vd. 2G, 512M')
+    parser.add_argument('--limit-symbols', type=int, default=None, help='Chỉ dùng N mã đầu (chạy thử nhanh)')
+    parser.add_argument('--cache-dir', type=str, default=os.path.join(here, 'cache', 'folds'),
+                        help='Thư mục cache ma trận từng fold')
+    parser.add_argument('--features', type=str, default=None,
+                        help='selected_features.json (từ select_features.py) – chỉ train trên các feature này')
+    parser.add_argument('--with-fa', action='store_true',
+                        help='Thêm chỉ số FA as-of (ROA, ROE, D/E, tăng trưởng... đã công bố tới ngày của bar) vào feature')
+    parser.add_argument('--out', type=str, default=os.path.join(here, 'model', 'best_model.pkl'), help='File model output')
+    parser.add_argument('--no-export', action='store_true', help='Không export bản compiled .npz')
+    args = parser.parse_args()
+
+    families = [f.strip() for f in args.models.split(',')] if args.models else available_families()
+    unknown = [f for f in families if f not in FAMILIES]
+    missing = [f for f in families if f in FAMILIES and f not in available_families()]
+    if unknown or missing:
+        parser.error(f"Họ model không hỗ trợ: {unknown}; chưa cài: {missing}")
+
+    t_start = time.perf_counter()
+    store = get_price_store()
+    symbols = store.symbol_list()[:args.limit_symbols] if args.limit_symbols else None
+    columns = load_selected_features(args.features) if args.features else FEATURE_COLUMNS
+    if args.with_fa:
+        columns = list(columns) + [c for c in FA_FEATURE_COLUMNS if c not in columns]
+    data = build_dataset(store, symbols, columns=columns)
+    train, val, test = split_by_time(data.day)
+    print(f"Dữ liệu: {len(data):,} dòng, {len(data.symbols)} mã, tỉ lệ nhãn 1 = {data.y.mean():.2%} "
+          f"({time.perf_counter() - t_start:.1f}s)")
+    if args.features:
+        print(f"  {len(columns)}/{len(FEATURE_COLUMNS)} feature theo {args.features}")
+    if args.with_fa:
+        print(f"  + {len(FA_FEATURE_COLUMNS)} feature FA as-of")
+    print(f"  Train {int(train.sum()):,} | Val {int(val.sum()):,} | Test {int(test.sum()):,}")
+
+    # Fold trên tập train (đã sắp theo ngày để 'đuôi' của fold là dữ liệu gần nhất)
+    train_idx = np.flatnonzero(train)
+    train_idx = train_idx[np.argsort(data.day[train_idx], kind='stable')]
+    X_train, y_train, day_train = data.X[train_idx], data.y[train_idx], data.day[train_idx]
+    folds = time_folds(day_train, n_splits=args.folds, gap_days=GAP_DAYS)
+    cache = FoldCache(args.cache_dir, FoldCache.key_for(data, train, args.folds, GAP_DAYS))
+    if cache.exists(len(folds)):
+        print(f"✓ Dùng cache fold: {cache.dir}")
+    else:
+        t0 = time.perf_counter()
+        cache.build(X_train, y_train, folds)
+        print(f"✓ Đã cache {len(folds)} fold vào {cache.dir} ({time.perf_counter() - t0:.1f}s)")
+
+    candidates = expand_grid(families)
+    print(f"Tìm kiếm: {len(candidates)} ứng viên ({', '.join(FAMILIES[f]['label'] for f in families)}), "
+          f"{len(folds)} fold, factor {args.factor}")
+    history = successive_halving(cache, len(folds), candidates, factor=args.factor, min_rows=args.min_rows,
+                                 n_jobs=args.n_jobs, memory_cap=parse_bytes(args.memory_cap),
+                                 n_features=len(columns))
+    final_round = max(h['round'] for h in history)
+    best = max((h for h in history if h['round'] == final_round),
+               key=lambda h: np.nan_to_num(h['mean_auc'], nan=-1.0))
+    print(f"Tốt nhất: {FAMILIES[best['family']]['label']} {best['params']} – CV AUC {best['mean_auc']:.4f} ± {best['std_auc']:.4f}")
+
+    # Model cuối: fit trên train + val, đánh giá trên test (sau gap)
+    fit_mask = train | val
+    X_fit = pd.DataFrame(data.X[fit_mask], columns=columns)
+    y_fit = data.y[fit_mask]
+    X_test = pd.DataFrame(data.X[test], columns=columns)
+    y_test = data.y[test]
+    model = final_estimator(best['family'], best['params'], best['best_iter'])
+    if best['family'] == 'xgb':
+        pos = max(int(y_fit.sum()), 1)
+        model.set_params(scale_pos_weight=(len(y_fit) - pos) / pos)
+    t0 = time.perf_counter()
+    model.fit(X_fit, y_fit)
+    test_auc = _auc(model, X_test, y_test)
+    print(f"✓ Fit model cuối trên {len(y_fit):,} dòng ({time.perf_counter() - t0:.1f}s), Test AUC {test_auc:.4f}")
+
+    previous_auc = None
+    if os.path.exists(args.out):
+        try:
+            previous = joblib.load(args.out)
+            prev_columns = model_feature_columns(previous)
+            X_prev = X_test[prev_columns] if set(prev_columns) <= set(columns) else pd.DataFrame(
+                build_dataset(store, symbols, columns=prev_columns).X[test], columns=prev_columns)
+            previous_auc = _auc(previous, X_prev, y_test)
+            print(f"  Model hiện tại ({os.path.basename(args.out)}): Test AUC {previous_auc:.4f}")
+        except Exception as e:
+            print(f"  Không đánh giá được model hiện tại: {e}")
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+    joblib.dump(model, args.out)
+    print(f"✓ Đã ghi {args.out}")
+    npz = compiled_path_for(args.out)
+    if not args.no_export:
+        try:
+            export_compiled(model, npz, source_path=args.out)
+            print(f"✓ Đã export {npz}")
+        except Exception as e:
+            # Model không compile được (vd. LightGBM): xóa .npz cũ để server dùng pickle mới
+            if os.path.exists(npz):
+                os.remove(npz)
+            print(f"⚠ Không export được bản compiled ({e}); server sẽ dùng pickle")
+
+    # Sketch phân phối feature của tập fit cho /drift (server so input phục vụ với nó)
+    try:
+        reference = DriftReference.from_matrix(data.X[fit_mask], columns,
+                                               meta={'source': 'retrain', 'data_fingerprint': data.fingerprint()})
+        print(f"✓ Sketch drift: {reference.save(reference_path_for(args.out))}")
+    except Exception as e:
+        print(f"⚠ Không ghi được sketch drift ({e}); server sẽ tự dựng từ price store")
+
+    report = {
+        'model': FAMILIES[best['family']]['label'],
+        'family': best['family'],
+        'params': best['params'],
+        'features': list(columns),
+        'best_iter': best['best_iter'],
+        'cv_auc': best['mean_auc'],
+        'cv_auc_std': best['std_auc'],
+        'test_auc': test_auc,
+        'previous_test_auc': previous_auc,
+        'rows': {'train': int(train.sum()), 'val': int(val.sum()), 'test': int(test.sum())},
+        'folds': len(folds),
+        'data_fingerprint': data.fingerprint(),
+        'elapsed_s': round(time.perf_counter() - t_start, 1),
+        'search': [{k: v for k, v in h.items() if k != 'index'} for h in history],
+    }
+    report_path = os.path.splitext(args.out)[0] + '_report.json'
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=1, default=str)
+    print(f"✓ Báo cáo: {report_path} (tổng {report['elapsed_s']}s)")
+
+
+if __name__ == '__main__':
+    main()
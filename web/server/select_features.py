@@ -0,0 +1,62 @@
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+# Ensure UTF-8 output on Windows
+if sys.platform == 'win32':
+    os.environ['PYTHONIOENCODING'] = 'utf-8'
+    if hasattr(sys.stdout, 'reconfigure'):
+        sys.stdout.reconfigure(encoding='utf-8')
+    if hasattr(sys.stderr, 'reconfigure'):
+        sys.stderr.reconfigure(encoding='utf-8')
+
+from service.feature_selection import analyze, default_selection_path, save_selection
+from service.indicators import FEATURE_COLUMNS
+from service.price_store import get_price_store
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Phân tích feature dư thừa (tương quan, phương sai, độ lệch, thiếu) trong một lượt')
+    parser.add_argument('--threshold', type=float, default=0.85, help='|Tương quan| tối thiểu để coi hai feature là trùng lặp')
+    parser.add_argument('--min-variance', type=float, default=1e-10, help='Bỏ feature có phương sai <= ngưỡng này')
+    parser.add_argument('--max-missing', type=float, default=50.0, help='Bỏ feature thiếu quá %% này')
+    parser.add_argument('--keep', type=str, default='', help='Feature luôn được chọn làm đại diện cụm, vd. RSI,MACD')
+    parser.add_argument('--chunk-rows', type=int, default=250_000, help='Số dòng mỗi khúc khi cộng dồn thống kê')
+    parser.add_argument('--limit-symbols', type=int, default=None, help='Chỉ dùng N mã đầu (chạy thử nhanh)')
+    parser.add_argument('--out', type=str, default=default_selection_path(), help='File JSON danh sách feature đã chọn')
+    args = parser.parse_args()
+
+    keep = [c.strip() for c in args.keep.split(',') if c.strip()]
+    unknown = [c for c in keep if c not in FEATURE_COLUMNS]
+    if unknown:
+        parser.error(f'Feature không tồn tại: {unknown}')
+
+    t0 = time.perf_counter()
+    store = get_price_store()
+    symbols = store.symbol_list()[:args.limit_symbols] if args.limit_symbols else None
+    moments, result = analyze(store, symbols, chunk_rows=args.chunk_rows, threshold=args.threshold,
+                              min_variance=args.min_variance, max_missing_pct=args.max_missing, keep=keep)
+    print(f"✓ {result['rows']:,} dòng, {len(FEATURE_COLUMNS)} feature ({time.perf_counter() - t0:.1f}s)")
+
+    print(f"\nCác cặp |r| > {args.threshold}: {len(result['high_corr_pairs'])}")
+    for p in result['high_corr_pairs'][:15]:
+        print(f"  {p['feature_1']:>14} ~ {p['feature_2']:<14} {p['corr']:+.3f}")
+    print(f"\nCụm trùng lặp ({len(result['clusters'])}):")
+    target = result['target_corr'] or {}
+    for c in result['clusters']:
+        members = ', '.join(f"{m}({target.get(m, np.nan):+.3f})" for m in c['members'])
+        print(f"  giữ {c['keep']:<14} ← {members}")
+    other = {k: v for k, v in result['dropped'].items() if not v.startswith('redundant')}
+    if other:
+        print(f"\nBỏ vì phương sai/thiếu: {other}")
+
+    path = save_selection(result, args.out)
+    print(f"\n✓ Chọn {len(result['features'])}/{len(FEATURE_COLUMNS)} feature: {', '.join(result['features'])}")
+    print(f"✓ Đã ghi {path}")
+    print(f"  Train lại với: python retrain.py --features {path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,207 @@
+import numpy as np
+import pandas as pd
+from typing import Any, Dict, List, Optional
+
+# Tên cột thay thế mà các provider/CSV hay dùng, map về schema chuẩn
+TIME_ALIASES = ['time', 'date', 'datetime', 'tradingDate', 'Date']
+COLUMN_ALIASES = {
+    'open': ['open', 'Open', 'o', 'open_price'],
+    'high': ['high', 'High', 'h', 'high_price'],
+    'low': ['low', 'Low', 'l', 'low_price'],
+    'close': ['close', 'Close', 'c', 'close_price', 'adj_close', 'price'],
+    'volume': ['volume', 'Volume', 'vol', 'volume_match', 'total_volume'],
+}
+PRICE_FIELDS = ('open', 'high', 'low', 'close', 'volume')
+COLUMNS = ['time', 'open', 'high', 'low', 'close', 'volume', 'symbol']
+
+
+def _find_column(columns, candidates) -> Optional[str]:
+    for c in candidates:
+        if c in columns:
+            return c
+    return None
+
+
+def _parse_days(values) -> np.ndarray:
+    """Parse giá trị ngày bất kỳ -> datetime64[D] (NaT nếu không parse được)."""
+    ts = pd.to_datetime(pd.Series(values), errors='coerce')
+    return ts.values.astype('datetime64[D]')
+
+
+def days_to_iso(days: np.ndarray) -> np.ndarray:
+    """int32 epoch-days -> mảng chuỗi 'YYYY-MM-DD'."""
+    return np.datetime_as_string(np.asarray(days, dtype='int64').astype('datetime64[D]'), unit='D')
+
+
+def iso_to_day(value: str) -> int:
+    """'YYYY-MM-DD' (hoặc datetime) -> int epoch-day."""
+    return int(np.datetime64(pd.Timestamp(value).date(), 'D').astype('int64'))
+
+
+def _ffill_bfill(a: np.ndarray) -> np.ndarray:
+    """ffill rồi bfill theo trục cuối, phần còn trống -> 0 (giống df.ffill().bfill().fillna(0))."""
+    out = np.where(np.isfinite(a), a, np.nan)
+    n = out.shape[-1]
+    if n == 0:
+        return out
+    idx = np.arange(n)
+    valid = ~np.isnan(out)
+    # forward fill
+    last = np.where(valid, idx, 0)
+    np.maximum.accumulate(last, axis=-1, out=last)
+    out = np.take_along_axis(out, last, axis=-1)
+    # backward fill
+    valid = ~np.isnan(out)
+    first = np.where(valid, idx, n - 1)
+    first = np.minimum.accumulate(first[..., ::-1], axis=-1)[..., ::-1]
+    out = np.take_along_axis(out, first, axis=-1)
+    return np.nan_to_num(out, nan=0.0)
+
+
+def _json_values(a: np.ndarray, integral: bool = False) -> List[Any]:
+    if integral and a.size and np.all(np.isfinite(a)) and np.all(a == np.floor(a)):
+        return a.astype(np.int64).tolist()
+    vals = a.tolist()
+    if not np.all(np.isfinite(a)):
+        vals = [v if v == v and v not in (float('inf'), float('-inf')) else None for v in vals]
+    return vals
+
+
+class Bars:
+    """
+    Container OHLCV cố định schema cho một mã, lưu bằng các mảng NumPy liền kề.
+
+    - day: int32 số ngày kể từ 1970-01-01 (tăng dần)
+    - open/high/low/close/volume: float64 (NaN nếu provider thiếu cột)
+
+    Normalizer, cache, indicator và model input dùng chung đối tượng này;
+    DataFrame chỉ được tạo ở biên API (to_frame / to_records).
+    """
+    __slots__ = ('symbol', 'day', 'open', 'high', 'low', 'close', 'volume')
+
+    def __init__(self, symbol: str, day: np.ndarray, open: np.ndarray, high: np.ndarray,
+                 low: np.ndarray, close: np.ndarray, volume: np.ndarray):
+        self.symbol = str(symbol).upper()
+        self.day = np.ascontiguousarray(day, dtype=np.int32)
+        self.open = np.ascontiguousarray(open, dtype=np.float64)
+        self.high = np.ascontiguousarray(high, dtype=np.float64)
+        self.low = np.ascontiguousarray(low, dtype=np.float64)
+        self.close = np.ascontiguousarray(close, dtype=np.float64)
+        self.volume = np.ascontiguousarray(volume, dtype=np.float64)
+
+    @classmethod
+    def empty(cls, symbol: str) -> 'Bars':
+        z = np.empty(0, dtype=np.float64)
+        return cls(symbol, np.empty(0, dtype=np.int32), z, z, z, z, z)
+
+    @classmethod
+    def from_frame(cls, df: Optional[pd.DataFrame], symbol: str) -> 'Bars':
+        """
+        Chuẩn hóa DataFrame của provider/CSV (tên cột bất kỳ trong các alias) thành Bars.
+        Dòng không parse được ngày bị bỏ; cột giá thiếu -> NaN. Kết quả sắp xếp tăng dần theo ngày.
+        """
+        if df is None or df.empty:
+            return cls.empty(symbol)
+
+        time_col = _find_column(df.columns, TIME_ALIASES)
+        if time_col is None:
+            return cls.empty(symbol)
+        days = _parse_days(df[time_col].values)
+        ok = ~np.isnat(days)
+
+        n = len(df)
+        cols = {}
+        for field in PRICE_FIELDS:
+            src = _find_column(df.columns, COLUMN_ALIASES[field])
+            if src is None:
+                cols[field] = np.full(n, np.nan)
+            else:
+                cols[field] = pd.to_numeric(df[src], errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+
+        day_i = days[ok].astype(np.int64)
+        order = np.argsort(day_i, kind='stable')
+        return cls(
+            symbol,
+            day_i[order],
+            *(cols[f][ok][order] for f in PRICE_FIELDS),
+        )
+
+    @classmethod
+    def from_records(cls, records: List[Dict[str, Any]], symbol: str) -> 'Bars':
+        if not records:
+            return cls.empty(symbol)
+        return cls.from_frame(pd.DataFrame(records), symbol)
+
+    def __len__(self) -> int:
+        return int(self.day.shape[0])
+
+    def __getitem__(self, key) -> 'Bars':
+        if not isinstance(key, slice):
+            raise TypeError('Bars chỉ hỗ trợ slice')
+        return Bars(self.symbol, self.day[key], self.open[key], self.high[key],
+                    self.low[key], self.close[key], self.volume[key])
+
+    @property
+    def last_day(self) -> Optional[int]:
+        return int(self.day[-1]) if len(self) else None
+
+    def tail(self, n: int) -> 'Bars':
+        if n <= 0:
+            return self[0:0]
+        return self[-n:]
+
+    def merge(self, update: 'Bars') -> 'Bars':
+        """Ghép bar mới: từ ngày đầu của update trở đi lấy theo update (bar cùng ngày bị thay)."""
+        if len(update) == 0:
+            return self
+        if len(self) == 0:
+            return update
+        keep = self.day < update.day[0]
+        return Bars(self.symbol, np.concatenate([self.day[keep], update.day]),
+                    *(np.concatenate([getattr(self, f)[keep], getattr(update, f)]) for f in PRICE_FIELDS))
+
+    def since(self, day: int) -> 'Bars':
+        """Các bar từ ngày `day` (bao gồm) trở đi."""
+        return self[int(np.searchsorted(self.day, day, side='left')):]
+
+    def filled(self) -> 'Bars':
+        """inf -> NaN, rồi ffill/bfill/fillna(0) cho từng cột giá (như build_model_input cũ)."""
+        stacked = np.vstack([self.open, self.high, self.low, self.close, self.volume])
+        f = _ffill_bfill(stacked)
+        return Bars(self.symbol, self.day, f[0], f[1], f[2], f[3], f[4])
+
+    def times(self) -> np.ndarray:
+        return days_to_iso(self.day)
+
+    def to_frame(self) -> pd.DataFrame:
+        """Tạo DataFrame schema chuẩn (time, open, high, low, close, volume, symbol) – chỉ dùng ở biên API/model."""
+        volume = self.volume
+        if volume.size and np.all(np.isfinite(volume)) and np.all(volume == np.floor(volume)):
+            volume = volume.astype(np.int64)
+        return pd.DataFrame({
+            'time': self.times(),
+            'open': self.open,
+            'high': self.high,
+            'low': self.low,
+            'close': self.close,
+            'volume': volume,
+            'symbol': self.symbol,
+        }, columns=COLUMNS)
+
+    def to_records(self) -> List[Dict[str, Any]]:
+        """List dict JSON-safe (NaN -> None) mà không cần tạo DataFrame."""
+        if not len(self):
+            return []
+        cols = (
+            self.times().tolist(),
+            _json_values(self.open),
+            _json_values(self.high),
+            _json_values(self.low),
+            _json_values(self.close),
+            _json_values(self.volume, integral=True),
+        )
+        sym = self.symbol
+        return [
+            {'time': t, 'open': o, 'high': h, 'low': l, 'close': c, 'volume': v, 'symbol': sym}
+            for t, o, h, l, c, v in zip(*cols)
+        ]
@@ -0,0 +1,379 @@
+import hashlib
+import json
+import os
+import threading
+import numpy as np
+from typing import Any, Dict, List, Optional, Tuple
+
+# Định dạng file .npz do export_model.py sinh ra; tăng khi đổi layout mảng
+FORMAT_VERSION = 1
+
+_ROW_CHUNK = 512
+# Từ cỡ lô này kernel NumPy không còn nhanh hơn sklearn (đo trên RF 100 cây sâu 8, 1 core: hòa
+# khoảng 2000 dòng, 5000 dòng chậm hơn ~35%) -> lô forest lớn chấm bằng pickle gốc nếu có
+COMPILED_MAX_ROWS = int(os.environ.get('COMPILED_MAX_ROWS', 2000))
+
+
+def _feature_names(model) -> Optional[List[str]]:
+    names = getattr(model, 'feature_names_in_', None)
+    if names is None:
+        for _, step in getattr(model, 'steps', []):
+            names = getattr(step, 'feature_names_in_', None)
+            if names is not None:
+                break
+    return [str(n) for n in names] if names is not None else None
+
+
+def _affine_of(step, n_features: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Biểu diễn scaler dưới dạng x' = x * a + b (theo từng feature)."""
+    name = type(step).__name__
+    a = np.ones(n_features)
+    b = np.zeros(n_features)
+    if name == 'StandardScaler':
+        scale = getattr(step, 'scale_', None)
+        mean = getattr(step, 'mean_', None)
+        if scale is not None:
+            a = 1.0 / np.asarray(scale, dtype=np.float64)
+        if mean is not None:
+            b = -np.asarray(mean, dtype=np.float64) * a
+        return a, b
+    if name == 'MinMaxScaler':
+        return np.asarray(step.scale_, dtype=np.float64), np.asarray(step.min_, dtype=np.float64)
+    if name == 'MaxAbsScaler':
+        return 1.0 / np.asarray(step.scale_, dtype=np.float64), b
+    if name == 'RobustScaler':
+        if step.scale_ is not None:
+            a = 1.0 / np.asarray(step.scale_, dtype=np.float64)
+        if step.center_ is not None:
+            b = -np.asarray(step.center_, dtype=np.float64) * a
+        return a, b
+    raise ValueError(f'Không gộp được bước tiền xử lý {name} vào model compiled')
+
+
+def _split_pipeline(model) -> Tuple[Any, Optional[np.ndarray], Optional[np.ndarray]]:
+    """Tách Pipeline thành (estimator cuối, a, b) với các scaler phía trước gộp thành một phép affine."""
+    steps = getattr(model, 'steps', None)
+    if not steps:
+        return model, None, None
+    est = steps[-1][1]
+    n = int(getattr(est, 'n_features_in_', 0))
+    a = np.ones(n)
+    b = np.zeros(n)
+    for _, step in steps[:-1]:
+        if step is None or step == 'passthrough':
+            continue
+        sa, sb = _affine_of(step, n)
+        # (x*a + b)*sa + sb
+        a, b = a * sa, b * sa + sb
+    return est, a, b
+
+
+def _compile_trees(est, a: Optional[np.ndarray], b: Optional[np.ndarray]) -> Dict[str, np.ndarray]:
+    """Làm phẳng mọi cây của forest thành mảng node liền kề (chỉ số toàn cục)."""
+    trees = getattr(est, 'estimators_', None)
+    if trees is None:
+        trees = [est]
+    feature, threshold, left, right, miss_left, value, roots = [], [], [], [], [], [], []
+    depth = 0
+    base = 0
+    for t in trees:
+        tr = t.tree_
+        n = tr.node_count
+        is_leaf = tr.children_left < 0
+        f = np.where(is_leaf, 0, tr.feature).astype(np.int32)
+        thr = np.where(is_leaf, 0.0, tr.threshold).astype(np.float64)
+        if a is not None:
+            # x*a + b <= t  <=>  x <= (t - b) / a  (cần a > 0)
+            fa = a[f]
+            if np.any(fa[~is_leaf] <= 0):
+                raise ValueError('Scaler có hệ số <= 0, không gộp được vào ngưỡng của cây')
+            thr = np.where(is_leaf, 0.0, (thr - b[f]) / fa)
+        own = np.arange(base, base + n, dtype=np.int32)
+        # Lá trỏ về chính nó nên duyệt cây không cần rẽ nhánh
+        left.append(np.where(is_leaf, own, tr.children_left + base).astype(np.int32))
+        right.append(np.where(is_leaf, own, tr.children_right + base).astype(np.int32))
+        mgl = getattr(tr, 'missing_go_to_left', None)
+        miss_left.append(np.zeros(n, dtype=bool) if mgl is None else np.asarray(mgl, dtype=bool) & ~is_leaf)
+        feature.append(f)
+        threshold.append(thr)
+        v = tr.value[:, 0, :].astype(np.float64)
+        s = v.sum(axis=1, keepdims=True)
+        value.append(np.divide(v, s, out=np.zeros_like(v), where=s > 0))
+        roots.append(base)
+        depth = max(depth, int(tr.max_depth))
+        base += n
+    return {
+        'feature': np.concatenate(feature),
+        'threshold': np.concatenate(threshold),
+        'left': np.concatenate(left),
+        'right': np.concatenate(right),
+        'missing_left': np.concatenate(miss_left),
+        'value': np.concatenate(value),
+        'roots': np.asarray(roots, dtype=np.int32),
+        'depth': np.asarray(depth, dtype=np.int32),
+    }
+
+
+def _compile_linear(est, a: Optional[np.ndarray], b: Optional[np.ndarray]) -> Dict[str, np.ndarray]:
+    coef = np.asarray(est.coef_, dtype=np.float64)
+    intercept = np.asarray(est.intercept_, dtype=np.float64)
+    if a is not None:
+        # w·(x*a + b) + c = (w*a)·x + (w·b + c)
+        intercept = intercept + coef @ b
+        coef = coef * a
+    multi = getattr(est, 'multi_class', 'auto')
+    softmax = coef.shape[0] > 1 and multi != 'ovr'
+    # Điểm gốc của scaler (x' = 0, vd. mean của StandardScaler) để phân rã đóng góp từng feature
+    center = np.zeros(coef.shape[1]) if a is None else np.divide(-b, a, out=np.zeros_like(b), where=a != 0)
+    return {'coef': coef, 'intercept': intercept, 'softmax': np.asarray(softmax), 'center': center}
+
+
+def compile_model(model) -> Dict[str, np.ndarray]:
+    """
+    Chuyển model sklearn (RandomForest/ExtraTrees/DecisionTree hoặc LogisticRegression,
+    có thể nằm sau các scaler trong Pipeline) thành dict mảng NumPy để lưu .npz.
+    Scaler được gộp vào ngưỡng của cây / hệ số tuyến tính nên lúc chạy không còn bước tiền xử lý.
+    """
+    est, a, b = _split_pipeline(model)
+    kind_name = type(est).__name__
+    if hasattr(est, 'tree_') or (hasattr(est, 'estimators_') and hasattr(est.estimators_[0], 'tree_')):
+        if getattr(est, 'n_outputs_', 1) != 1:
+            raise ValueError('Chỉ hỗ trợ cây một output')
+        arrays = _compile_trees(est, a, b)
+        kind = 'forest'
+    elif hasattr(est, 'coef_') and hasattr(est, 'intercept_') and hasattr(est, 'predict_proba'):
+        arrays = _compile_linear(est, a, b)
+        kind = 'linear'
+    else:
+        raise ValueError(f'Chưa hỗ trợ compile {kind_name}')
+
+    names = _feature_names(model)
+    meta = {
+        'format': FORMAT_VERSION,
+        'kind': kind,
+        'estimator': kind_name,
+        'feature_names': names,
+        'classes': np.asarray(est.classes_).tolist(),
+    }
+    arrays['meta'] = np.asarray(json.dumps(meta))
+    return arrays
+
+
+class CompiledModel:
+    """
+    Model đã compile về mảng NumPy, có giao diện giống sklearn (predict / predict_proba /
+    feature_names_in_ / classes_) để thay thế trực tiếp pipeline unpickle.
+    """
+
+    def __init__(self, arrays: Dict[str, np.ndarray], version: str = ''):
+        meta = json.loads(str(arrays['meta']))
+        self.kind = meta['kind']
+        self.estimator = meta.get('estimator')
+        self.classes_ = np.asarray(meta['classes'])
+        names = meta.get('feature_names')
+        self.feature_names_in_ = np.asarray(names, dtype=object) if names else None
+        self.version = version
+        self.source_sha256 = meta.get('source_sha256')
+        # File .pkl gốc (đã khớp hash) cho lô lớn; None -> luôn dùng kernel compiled
+        self.source_path: Optional[str] = None
+        self._sklearn = None
+        self._sklearn_lock = threading.Lock()
+        self._a = {k: np.asarray(v) for k, v in arrays.items() if k != 'meta'}
+        if self.kind == 'forest':
+            self._roots = self._a['roots'].astype(np.intp)
+            self._depth = int(self._a['depth'])
+            self._feature = self._a['feature'].astype(np.intp)
+            # children[2*i] = nhánh trái, children[2*i + 1] = nhánh phải -> một lần gather mỗi tầng
+            self._children = np.column_stack([self._a['left'], self._a['right']]).ravel().astype(np.intp)
+            # Ngưỡng float32 làm tròn xuống: x32 <= t64  <=>  x32 <= t32
+            thr = self._a['threshold']
+            t32 = thr.astype(np.float32)
+            up = t32.astype(np.float64) > thr
+            t32[up] = np.nextafter(t32[up], np.float32(-np.inf))
+            self._threshold32 = t32
+            self._value_t = np.ascontiguousarray(self._a['value'].T)
+
+    @classmethod
+    def load(cls, path: str) -> 'CompiledModel':
+        with open(path, 'rb') as fh:
+            version = hashlib.sha256(fh.read()).hexdigest()[:12]
+        with np.load(path, allow_pickle=False) as data:
+            arrays = {k: data[k] for k in data.files}
+        return cls(arrays, version=version)
+
+    def _matrix(self, X) -> np.ndarray:
+        cols = getattr(X, 'columns', None)
+        if cols is not None and self.feature_names_in_ is not None:
+            X = X[list(self.feature_names_in_)]
+        return np.asarray(X, dtype=np.float64)
+
+    def _descend(self, X: np.ndarray, on_level=None):
+        """
+        Duyệt mọi cây cho từng chunk dòng; yield (start, n, idx lá (n, n_trees)). on_level(start,
+        idx_trước, idx_sau, feature) được gọi ở mỗi tầng (dùng cho phân rã đóng góp feature).
+        """
+        feature, threshold, children = self._feature, self._threshold32, self._children
+        miss_left = self._a['missing_left'] if self._a['missing_left'].any() and np.isnan(X).any() else None
+        n_features = X.shape[1]
+        for s in range(0, X.shape[0], _ROW_CHUNK):
+            # sklearn so sánh trên float32; ép từng chunk để không nhân bản cả ma trận
+            Xc = np.ascontiguousarray(X[s:s + _ROW_CHUNK], dtype=np.float32).ravel()
+            n = Xc.shape[0] // n_features
+            base = (np.arange(n, dtype=np.intp) * n_features)[:, None]
+            idx = np.repeat(self._roots[None, :], n, axis=0)
+            fi = np.empty_like(idx)
+            x = np.empty(idx.shape, dtype=np.float32)
+            t = np.empty(idx.shape, dtype=np.float32)
+            go_right = np.empty(idx.shape, dtype=bool)
+            for _ in range(self._depth):
+                prev = idx.copy() if on_level is not None else None
+                np.take(feature, idx, out=fi)
+                fi += base
+                np.take(Xc, fi, out=x)
+                np.take(threshold, idx, out=t)
+                # NaN không thỏa x <= t nên sang phải, trừ node học được nhánh cho missing
+                np.less_equal(x, t, out=go_right)
+                np.logical_not(go_right, out=go_right)
+                if miss_left is not None:
+                    go_right &= ~(np.isnan(x) & np.take(miss_left, idx))
+                idx *= 2
+                idx += go_right
+                np.take(children, idx, out=idx)
+                if on_level is not None:
+                    on_level(s, prev, idx, fi - base)
+            yield s, n, idx
+
+    def _forest_proba(self, X: np.ndarray) -> np.ndarray:
+        value = self._value_t
+        n_trees = len(self._roots)
+        out = np.empty((X.shape[0], value.shape[0]))
+        for s, n, idx in self._descend(X):
+            for k in range(value.shape[0]):
+                out[s:s + n, k] = np.take(value[k], idx).sum(axis=1) / n_trees
+        return out
+
+    def _linear_proba(self, X: np.ndarray) -> np.ndarray:
+        z = X @ self._a['coef'].T + self._a['intercept']
+        if z.shape[1] == 1:
+            p = 1.0 / (1.0 + np.exp(-z[:, 0]))
+            return np.column_stack([1.0 - p, p])
+        if bool(self._a['softmax']):
+            z = z - z.max(axis=1, keepdims=True)
+            e = np.exp(z)
+            return e / e.sum(axis=1, keepdims=True)
+        p = 1.0 / (1.0 + np.exp(-z))
+        return p / p.sum(axis=1, keepdims=True)
+
+    def _source_model(self):
+        if self._sklearn is None:
+            with self._sklearn_lock:
+                if self._sklearn is None:
+                    import joblib
+                    self._sklearn = joblib.load(self.source_path)
+        return self._sklearn
+
+    def predict_proba(self, X) -> np.ndarray:
+        X = self._matrix(X)
+        if X.ndim == 1:
+            X = X[None, :]
+        if self.kind == 'forest':
+            if self.source_path is not None and X.shape[0] >= COMPILED_MAX_ROWS:
+                return self._source_proba(X)
+            return self._forest_proba(X)
+        return self._linear_proba(X)
+
+    def _source_proba(self, X: np.ndarray) -> np.ndarray:
+        model = self._source_model()
+        if self.feature_names_in_ is not None:
+            import pandas as pd
+            X = pd.DataFrame(X, columns=list(self.feature_names_in_))
+        return np.asarray(model.predict_proba(X), dtype=np.float64)
+
+    def predict(self, X) -> np.ndarray:
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
+
+
+def compiled_path_for(model_path: str) -> str:
+    return os.path.splitext(model_path)[0] + '.npz'
+
+
+def file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as fh:
+        for block in iter(lambda: fh.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def export_compiled(model, out_path: str, source_path: Optional[str] = None) -> str:
+    """Ghi model compiled ra .npz; source_path (file .pkl gốc) được ghi hash để phát hiện bản cũ."""
+    arrays = compile_model(model)
+    if source_path is not None:
+        meta = json.loads(str(arrays['meta']))
+        meta['source_sha256'] = file_sha256(source_path)
+        arrays['meta'] = np.asarray(json.dumps(meta))
+    np.savez_compressed(out_path, **arrays)
+    return out_path
+
+
+_MODELS: Dict[str, Dict[str, Any]] = {}
+_MODELS_LOCK = threading.Lock()
+
+
+def _mtime(path: str) -> Optional[float]:
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+
+def _load_uncached(model_path: str, npz: str, prefer_compiled: bool):
+    if prefer_compiled and os.path.exists(npz):
+        compiled = CompiledModel.load(npz)
+        if not os.path.exists(model_path):
+            return compiled
+        if compiled.source_sha256 in (None, file_sha256(model_path)):
+            compiled.source_path = model_path if compiled.source_sha256 is not None else None
+            return compiled
+        print(f'{npz} không khớp {model_path}, dùng pickle (chạy lại export_model.py)')
+    import joblib
+    return joblib.load(model_path)
+
+
+def _model_version(model, model_path: str) -> str:
+    version = getattr(model, 'version', None)
+    return version or file_sha256(model_path)[:12]
+
+
+def load_model_versioned(model_path: str, prefer_compiled: bool = True):
+    """
+    (model, version) – version là sha256 (12 ký tự) của file model đang dùng (.npz hoặc .pkl),
+    tính một lần mỗi khi file đổi; dùng làm khóa cache kết quả dự báo.
+    """
+    npz = compiled_path_for(model_path)
+    stamp = (_mtime(model_path), _mtime(npz) if prefer_compiled else None)
+    if stamp == (None, None):
+        raise FileNotFoundError(model_path)
+
+    key = f'{model_path}|{prefer_compiled}'
+    entry = _MODELS.get(key)
+    if entry is not None and entry['stamp'] == stamp:
+        return entry['model'], entry['version']
+    with _MODELS_LOCK:
+        entry = _MODELS.get(key)
+        if entry is not None and entry['stamp'] == stamp:
+            return entry['model'], entry['version']
+        model = _load_uncached(model_path, npz, prefer_compiled)
+        version = _model_version(model, model_path)
+        _MODELS[key] = {'stamp': stamp, 'model': model, 'version': version}
+        return model, version
+
+
+def load_model(model_path: str, prefer_compiled: bool = True):
+    """
+    Nạp model cho inference, cache theo mtime (file đổi thì nạp lại).
+
+    Ưu tiên bản compiled (.npz cạnh file .pkl). Nếu .npz không có hoặc được export từ
+    một .pkl khác (chưa chạy lại export_model.py) thì dùng pickle như trước.
+    """
+    return load_model_versioned(model_path, prefer_compiled)[0]
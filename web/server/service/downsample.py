@@ -0,0 +1,135 @@
+import threading
+from collections import OrderedDict
+import numpy as np
+from typing import Optional, Tuple
+
+from service.bars import Bars
+
+RESOLUTIONS = ('lttb', 'W', 'M', 'auto')
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets: chọn n_out điểm giữ hình dạng đường (x, y).
+    Luôn giữ điểm đầu và cuối; mỗi bucket ở giữa chọn điểm tạo tam giác lớn nhất với
+    điểm đã chọn trước đó và trung bình bucket kế tiếp.
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n) if n_out >= n else np.array([0, n - 1])[:max(n_out, 0)]
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    # Biên các bucket (bỏ điểm đầu/cuối)
+    edges = np.floor(np.linspace(1, n - 1, n_out - 1)).astype(np.int64)
+    out = np.empty(n_out, dtype=np.int64)
+    out[0], out[-1] = 0, n - 1
+    # Trung bình của từng bucket tính một lần (dùng làm điểm "kế tiếp")
+    cx = np.add.reduceat(x[1:n - 1], edges[:-1] - 1) / np.diff(edges)
+    cy = np.add.reduceat(y[1:n - 1], edges[:-1] - 1) / np.diff(edges)
+    cx = np.append(cx, x[-1])
+    cy = np.append(cy, y[-1])
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        bx, by = x[lo:hi], y[lo:hi]
+        area = np.abs((x[a] - cx[i + 1]) * (by - y[a]) - (x[a] - bx) * (cy[i + 1] - y[a]))
+        a = lo + int(np.argmax(area))
+        out[i + 1] = a
+    return out
+
+
+def _period_keys(day: np.ndarray, resolution: str) -> np.ndarray:
+    if resolution == 'W':
+        # 1970-01-01 là thứ Năm -> +3 để tuần bắt đầu từ thứ Hai
+        return (day.astype(np.int64) + 3) // 7
+    if resolution == 'M':
+        return day.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+    raise ValueError(f'resolution không hỗ trợ: {resolution}')
+
+
+def resample_ohlc(bars: Bars, resolution: str) -> Bars:
+    """
+    Gộp bar ngày thành tuần ('W') hoặc tháng ('M') giữ đúng OHLC:
+    open = bar đầu, high = max, low = min, close = bar cuối, volume = tổng.
+    time của mỗi bar gộp là phiên đầu tiên trong kỳ.
+    """
+    if len(bars) == 0:
+        return bars
+    keys = _period_keys(bars.day, resolution)
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    ends = np.r_[starts[1:], len(bars)] - 1
+    return Bars(
+        bars.symbol,
+        bars.day[starts],
+        bars.open[starts],
+        np.fmax.reduceat(bars.high, starts),
+        np.fmin.reduceat(bars.low, starts),
+        bars.close[ends],
+        np.add.reduceat(np.nan_to_num(bars.volume), starts),
+    )
+
+
+def downsample(bars: Bars, max_points: int, resolution: str = 'lttb') -> Tuple[Bars, str]:
+    """
+    Giảm số bar xuống tối đa max_points.
+    - 'lttb': giữ các bar ngày thật, chọn theo LTTB trên giá close
+    - 'W' / 'M': gộp OHLC theo tuần / tháng; khung quá dài vẫn > max_points thì LTTB tiếp trên bar gộp
+    - 'auto': ngày -> tuần -> tháng, lấy độ phân giải mịn nhất vừa max_points, nếu không thì LTTB trên tháng
+    Trả về (bars, độ phân giải thực dùng, vd 'W', 'M+lttb').
+    """
+    if resolution not in RESOLUTIONS:
+        raise ValueError(f"resolution phải là một trong {RESOLUTIONS}")
+    if max_points is None or len(bars) <= max_points:
+        return bars, 'D'
+    if resolution == 'lttb':
+        return _lttb_bars(bars, max_points), 'lttb'
+    for res in (('W', 'M') if resolution == 'auto' else (resolution,)):
+        agg = resample_ohlc(bars, res)
+        if len(agg) <= max_points:
+            return agg, res
+    return _lttb_bars(agg, max_points), f'{res}+lttb'
+
+
+def _lttb_bars(bars: Bars, max_points: int) -> Bars:
+    close = np.where(np.isfinite(bars.close), bars.close, np.nan)
+    close = np.where(np.isnan(close), np.nanmean(close) if np.isfinite(close).any() else 0.0, close)
+    idx = lttb_indices(bars.day.astype(np.float64), close, max_points)
+    return Bars(bars.symbol, bars.day[idx], bars.open[idx], bars.high[idx], bars.low[idx],
+                bars.close[idx], bars.volume[idx])
+
+
+class DownsampleCache:
+    """
+    LRU cache kết quả downsample theo (mã, độ phân giải, max_points, cửa sổ, bar cuối),
+    nên biểu đồ dài hạn gọi lại chỉ tốn một lần tra dict; bar mới làm đổi khóa.
+    Tính lười theo request thay vì dựng sẵn W/M cho mọi mã khi refresh lịch sử: chỉ mã và
+    khung mà client thật sự xem mới tốn bộ nhớ, và khóa theo bar cuối tự bỏ kết quả cũ.
+    """
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._data: 'OrderedDict[tuple, Tuple[Bars, str]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(bars: Bars, max_points: int, resolution: str) -> Optional[tuple]:
+        if len(bars) == 0:
+            return None
+        return (bars.symbol, resolution, int(max_points), len(bars), int(bars.day[0]), int(bars.day[-1]),
+                float(bars.close[-1]), float(bars.volume[-1]))
+
+    def get(self, bars: Bars, max_points: int, resolution: str = 'lttb') -> Tuple[Bars, str]:
+        key = self._key(bars, max_points, resolution)
+        if key is None:
+            return bars, 'D'
+        with self._lock:
+            hit = self._data.get(key)
+            if hit is not None:
+                self._data.move_to_end(key)
+                return hit
+        result = downsample(bars, max_points, resolution)
+        with self._lock:
+            self._data[key] = result
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+        return result
@@ -0,0 +1,395 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence
+
+import numpy as np
+
+from service.price_store import PriceStore, get_price_store
+
+DRIFT_BINS = int(os.environ.get('DRIFT_BINS', 32))
+EDGE_SAMPLE_ROWS = 100_000
+BUCKET_SECONDS = int(os.environ.get('DRIFT_BUCKET_SECONDS', 3600))
+WINDOW_BUCKETS = int(os.environ.get('DRIFT_WINDOW_BUCKETS', 24))
+PSI_MODERATE = 0.1
+PSI_MAJOR = 0.25
+DRIFT_MIN_ROWS = int(os.environ.get('DRIFT_MIN_ROWS', 200))
+_PSI_FLOOR = 1e-4
+# Sketch server tự dựng lúc chạy nằm ở đây; model/ chỉ chứa artefact do retrain/export ghi
+DRIFT_CACHE_DIR = os.environ.get('DRIFT_CACHE_DIR', os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'cache', 'drift'))
+
+
+class HistogramSketch:
+    """
+    Histogram kích thước cố định cho p feature trên cùng một bộ biên (p, B-1):
+    counts (p, B) + số giá trị thiếu/không hữu hạn mỗi cột + số dòng đã thấy.
+
+    Bộ nhớ và thời gian đọc chỉ phụ thuộc p×B, không phụ thuộc số dòng; hai sketch cùng biên
+    cộng được với nhau (merge) nên có thể cập nhật theo lô, theo giờ rồi gộp lại.
+    Biên của feature rời rạc (0/1...) có ít giá trị phân biệt nên được đệm +inf tới đủ B-1.
+    """
+
+    def __init__(self, edges: np.ndarray):
+        self.edges = np.asarray(edges, dtype=np.float64)
+        p, b = self.edges.shape[0], self.edges.shape[1] + 1
+        self.counts = np.zeros((p, b), dtype=np.int64)
+        self.nan = np.zeros(p, dtype=np.int64)
+        self.rows = 0
+
+    @property
+    def bins(self) -> int:
+        return self.counts.shape[1]
+
+    def update(self, X: np.ndarray) -> 'HistogramSketch':
+        X = np.asarray(X, dtype=np.float64)
+        if X.ndim != 2 or X.shape[0] == 0:
+            return self
+        b = self.bins
+        ok = np.isfinite(X)
+        idx = np.empty(X.shape, dtype=np.int64)
+        for j in range(X.shape[1]):
+            idx[:, j] = np.searchsorted(self.edges[j], X[:, j], side='right') + j * b
+        # Một bincount cho cả ma trận thay vì mỗi cột một lần
+        self.counts += np.bincount(idx[ok], minlength=self.counts.size).reshape(self.counts.shape)
+        self.nan += (~ok).sum(axis=0)
+        self.rows += X.shape[0]
+        return self
+
+    def merge(self, other: 'HistogramSketch') -> 'HistogramSketch':
+        if other.edges.shape != self.edges.shape or not np.array_equal(other.edges, self.edges):
+            raise ValueError('Chỉ merge được HistogramSketch có cùng biên')
+        self.counts += other.counts
+        self.nan += other.nan
+        self.rows += other.rows
+        return self
+
+    def empty_like(self) -> 'HistogramSketch':
+        return HistogramSketch(self.edges)
+
+    def proportions(self) -> np.ndarray:
+        """Tỉ lệ mỗi bin trên các giá trị hữu hạn (dòng toàn 0 nếu feature chưa có giá trị nào)."""
+        total = self.counts.sum(axis=1, keepdims=True)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(total > 0, self.counts / np.maximum(total, 1), 0.0)
+
+    def nan_rate(self) -> np.ndarray:
+        return self.nan / max(self.rows, 1)
+
+
+def quantile_edges(sample: np.ndarray, bins: int = DRIFT_BINS) -> np.ndarray:
+    """Biên (p, bins-1) theo phân vị của mẫu; biên trùng (feature rời rạc) được gộp và đệm +inf."""
+    sample = np.asarray(sample, dtype=np.float64)
+    qs = np.linspace(0.0, 1.0, bins + 1)[1:-1]
+    edges = np.full((sample.shape[1], bins - 1), np.inf)
+    for j in range(sample.shape[1]):
+        col = sample[:, j]
+        col = col[np.isfinite(col)]
+        if len(col) == 0:
+            continue
+        e = np.unique(np.quantile(col, qs))
+        edges[j, :len(e)] = e
+    return edges
+
+
+class Reservoir:
+    """Mẫu ngẫu nhiên đều kích thước cố định trên một luồng dòng (thuật toán R, vector hóa theo khúc)."""
+
+    def __init__(self, size: int = EDGE_SAMPLE_ROWS, seed: int = 0):
+        self.size = size
+        self.seen = 0
+        self.sample: Optional[np.ndarray] = None
+        self._rng = np.random.default_rng(seed)
+
+    def update(self, X: np.ndarray) -> 'Reservoir':
+        X = np.asarray(X, dtype=np.float64)
+        m = X.shape[0]
+        if m == 0:
+            return self
+        if self.sample is None:
+            self.sample = np.empty((self.size, X.shape[1]))
+        t = self.seen + np.arange(m)
+        # Chưa đầy: dòng t vào vị trí t; đầy rồi: thay vị trí ngẫu nhiên với xác suất size/(t+1)
+        j = np.where(t < self.size, t, self._rng.integers(0, t + 1))
+        keep = j < self.size
+        self.sample[j[keep]] = X[keep]      # trùng vị trí -> dòng sau thắng, như chạy tuần tự
+        self.seen += m
+        return self
+
+    def values(self) -> np.ndarray:
+        if self.sample is None:
+            return np.empty((0, 0))
+        return self.sample[:min(self.seen, self.size)]
+
+
+def psi(expected: np.ndarray, actual: np.ndarray) -> np.ndarray:
+    """Population Stability Index theo từng dòng (feature) từ hai ma trận tỉ lệ bin."""
+    e = np.maximum(expected, _PSI_FLOOR)
+    a = np.maximum(actual, _PSI_FLOOR)
+    return ((a - e) * np.log(a / e)).sum(axis=1)
+
+
+def ks(expected: np.ndarray, actual: np.ndarray) -> np.ndarray:
+    """Thống kê Kolmogorov–Smirnov trên histogram: max |CDF thực tế - CDF tham chiếu| theo bin."""
+    return np.abs(np.cumsum(actual, axis=1) - np.cumsum(expected, axis=1)).max(axis=1)
+
+
+def drift_status(value: float) -> str:
+    if value >= PSI_MAJOR:
+        return 'major'
+    if value >= PSI_MODERATE:
+        return 'moderate'
+    return 'stable'
+
+
+class DriftReference:
+    """Sketch của tập train cho một bộ feature, lưu thành .npz (cạnh file model hoặc trong cache)."""
+
+    def __init__(self, columns: Sequence[str], sketch: HistogramSketch, meta: Optional[Dict[str, Any]] = None):
+        self.columns = list(columns)
+        self.sketch = sketch
+        self.meta = meta or {}
+
+    @classmethod
+    def from_chunks(cls, chunks: Callable[[], Iterable[np.ndarray]], columns: Sequence[str],
+                    bins: int = DRIFT_BINS, meta: Optional[Dict[str, Any]] = None) -> 'DriftReference':
+        """
+        Hai lượt qua `chunks()` (hàm trả về iterator các khúc ma trận feature): lượt 1 giữ một
+        reservoir cố định để lấy biên phân vị, lượt 2 đếm histogram – bộ nhớ không tăng theo số dòng.
+        """
+        reservoir = Reservoir()
+        for X in chunks():
+            reservoir.update(X)
+        if reservoir.seen == 0:
+            raise ValueError('Không có dữ liệu để dựng sketch tham chiếu')
+        sketch = HistogramSketch(quantile_edges(reservoir.values(), bins))
+        for X in chunks():
+            sketch.update(X)
+        return cls(columns, sketch, {'created': time.strftime('%Y-%m-%dT%H:%M:%S'), **(meta or {})})
+
+    @classmethod
+    def from_matrix(cls, X: np.ndarray, columns: Sequence[str], bins: int = DRIFT_BINS,
+                    meta: Optional[Dict[str, Any]] = None, chunk_rows: int = 250_000) -> 'DriftReference':
+        def chunks():
+            for i in range(0, len(X), chunk_rows):
+                yield X[i:i + chunk_rows]
+        return cls.from_chunks(chunks, columns, bins, meta)
+
+    def save(self, path: str) -> str:
+        os.makedirs(os.path.dirname(os.path.abspath(path)) or '.', exist_ok=True)
+        tmp = path + '.tmp.npz'
+        np.savez_compressed(tmp, edges=self.sketch.edges, counts=self.sketch.counts, nan=self.sketch.nan,
+                            rows=np.int64(self.sketch.rows), columns=np.array(self.columns),
+                            meta=np.array(json.dumps(self.meta, ensure_ascii=False)))
+        os.replace(tmp, path)
+        return path
+
+    @classmethod
+    def load(cls, path: str) -> 'DriftReference':
+        with np.load(path, allow_pickle=False) as z:
+            sketch = HistogramSketch(z['edges'])
+            sketch.counts = z['counts'].astype(np.int64)
+            sketch.nan = z['nan'].astype(np.int64)
+            sketch.rows = int(z['rows'])
+            return cls([str(c) for c in z['columns']], sketch, json.loads(str(z['meta'])))
+
+
+def reference_path_for(model_path: str) -> str:
+    """model/best_model.pkl -> model/best_model_drift.npz (retrain.py / export_model.py ghi)"""
+    return os.path.splitext(model_path)[0] + '_drift.npz'
+
+
+def cache_path_for(model_path: str, columns: Sequence[str]) -> str:
+    """Sketch dựng lúc chạy: cache/drift/<tên model>_<hash bộ feature>.npz"""
+    digest = hashlib.sha1('\n'.join(columns).encode('utf-8')).hexdigest()[:12]
+    name = os.path.splitext(os.path.basename(model_path))[0]
+    return os.path.join(DRIFT_CACHE_DIR, f'{name}_{digest}.npz')
+
+
+def iter_feature_chunks(columns: Sequence[str], store: Optional[PriceStore] = None,
+                        symbols: Optional[Sequence[str]] = None, chunk_rows: int = 250_000) -> Iterator[np.ndarray]:
+    """
+    Feature (đúng các cột của model) của các dòng train trong price store, theo khúc. Mỗi dòng là
+    bar cuối của một cửa sổ MODEL_WINDOW bar (symbol_features) – cùng dòng server chấm, nên
+    sketch live so được trực tiếp với sketch này.
+    """
+    from service.training import symbol_features
+    if store is None:
+        store = get_price_store()
+    if symbols is None:
+        symbols = store.symbol_list()
+    buf, size = [], 0
+    for sym in symbols:
+        part = symbol_features(store.bars(sym), columns)
+        if part is None:
+            continue
+        buf.append(part[0])
+        size += len(part[0])
+        if size >= chunk_rows:
+            yield np.concatenate(buf)
+            buf, size = [], 0
+    if buf:
+        yield np.concatenate(buf)
+
+
+def build_reference(columns: Sequence[str], store: Optional[PriceStore] = None,
+                    symbols: Optional[Sequence[str]] = None) -> DriftReference:
+    """Sketch tham chiếu dựng từ price store (cùng dòng như build_dataset)."""
+    return DriftReference.from_chunks(lambda: iter_feature_chunks(columns, store, symbols), columns,
+                                      meta={'source': 'price_store'})
+
+
+def _load_matching(path: str, columns: Sequence[str]) -> Optional[DriftReference]:
+    if not os.path.exists(path):
+        return None
+    try:
+        ref = DriftReference.load(path)
+    except Exception as e:
+        print(f"Không đọc được sketch drift {path}: {e}")
+        return None
+    if ref.columns != list(columns):
+        print(f"Sketch drift {path} khác bộ feature của model, bỏ qua")
+        return None
+    return ref
+
+
+def load_or_build_reference(model_path: str, columns: Sequence[str]) -> DriftReference:
+    """
+    Sketch tham chiếu của model: file retrain.py / export_model.py ghi cạnh model, rồi tới bản
+    server đã dựng trong DRIFT_CACHE_DIR; không có thì dựng từ price store và ghi vào cache
+    (không bao giờ ghi vào thư mục model lúc phục vụ request).
+    """
+    ref = _load_matching(reference_path_for(model_path), columns)
+    if ref is None:
+        ref = _load_matching(cache_path_for(model_path, columns), columns)
+    if ref is not None:
+        return ref
+    ref = build_reference(columns)
+    path = cache_path_for(model_path, columns)
+    try:
+        ref.save(path)
+    except OSError as e:
+        print(f"Không ghi được sketch drift {path}: {e}")
+    return ref
+
+
+class DriftMonitor:
+    """
+    So phân phối feature của các lô đã phục vụ với tập train của một version model.
+
+    Sketch live dùng chung biên với tham chiếu: một sketch cộng dồn từ lúc khởi động/reset và
+    một vòng WINDOW_BUCKETS sketch theo khung BUCKET_SECONDS cho cửa sổ gần đây, nên bộ nhớ
+    và thời gian /drift cố định dù lưu lượng lớn tới đâu.
+    """
+
+    def __init__(self, reference: DriftReference, version: Optional[str] = None):
+        self.reference = reference
+        self.version = version
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.total = self.reference.sketch.empty_like()
+            self._buckets: List[Optional[HistogramSketch]] = [None] * WINDOW_BUCKETS
+            self._bucket_ids = [-1] * WINDOW_BUCKETS
+            self.started = time.time()
+            self.batches = 0
+
+    def observe(self, X: np.ndarray, now: Optional[float] = None) -> None:
+        X = np.asarray(X, dtype=np.float64)
+        if X.ndim != 2 or X.shape[0] == 0:
+            return
+        if X.shape[1] != len(self.reference.columns):
+            raise ValueError(f'Cần {len(self.reference.columns)} cột feature, nhận {X.shape[1]}')
+        part = self.reference.sketch.empty_like().update(X)
+        bucket = int((time.time() if now is None else now) // BUCKET_SECONDS)
+        slot = bucket % WINDOW_BUCKETS
+        with self._lock:
+            self.total.merge(part)
+            if self._bucket_ids[slot] != bucket:
+                self._buckets[slot], self._bucket_ids[slot] = part, bucket
+            else:
+                self._buckets[slot].merge(part)
+            self.batches += 1
+
+    def window(self, name: str = 'all', now: Optional[float] = None) -> HistogramSketch:
+        """'all' = từ lúc khởi động/reset; 'recent' = WINDOW_BUCKETS khung gần nhất."""
+        with self._lock:
+            if name == 'all':
+                return self.reference.sketch.empty_like().merge(self.total)
+            current = int((time.time() if now is None else now) // BUCKET_SECONDS)
+            out = self.reference.sketch.empty_like()
+            for sketch, bucket in zip(self._buckets, self._bucket_ids):
+                if sketch is not None and current - bucket < WINDOW_BUCKETS:
+                    out.merge(sketch)
+            return out
+
+    def report(self, window: str = 'all') -> Dict[str, Any]:
+        live = self.window(window)
+        ref = self.reference.sketch
+        expected, actual = ref.proportions(), live.proportions()
+        has_live = live.counts.sum(axis=1) > 0
+        psi_v, ks_v = psi(expected, actual), ks(expected, actual)
+        ref_nan, live_nan = ref.nan_rate(), live.nan_rate()
+        features = []
+        for j, col in enumerate(self.reference.columns):
+            row = {'feature': col, 'psi': None, 'ks': None, 'status': 'no_data',
+                   'nan_rate_ref': round(float(ref_nan[j]), 6),
+                   'nan_rate_live': round(float(live_nan[j]), 6) if live.rows else None}
+            if has_live[j]:
+                # Ít dòng thì histogram live thưa, PSI cao giả -> chưa kết luận
+                row.update(psi=round(float(psi_v[j]), 6), ks=round(float(ks_v[j]), 6),
+                           status=drift_status(float(psi_v[j])) if live.rows >= DRIFT_MIN_ROWS else 'insufficient')
+            features.append(row)
+        scored = [f for f in features if f['psi'] is not None]
+        return {
+            'model_version': self.version,
+            'window': window,
+            'bins': ref.bins,
+            'reference_rows': ref.rows,
+            'reference': self.reference.meta,
+            'live_rows': live.rows,
+            'batches': self.batches,
+            'since': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started)),
+            'min_rows': DRIFT_MIN_ROWS,
+            'summary': {s: sum(1 for f in scored if f['status'] == s) for s in ('stable', 'moderate', 'major')},
+            'max_psi': max((f['psi'] for f in scored), default=None),
+            'features': features,
+        }
+
+    def histogram(self, feature: str, window: str = 'all') -> Dict[str, Any]:
+        j = self.reference.columns.index(feature)
+        live = self.window(window)
+        ref = self.reference.sketch
+        edges = ref.edges[j]
+        n = int(np.isfinite(edges).sum())           # bin thực của feature (bỏ phần đệm +inf)
+        return {
+            'feature': feature,
+            'window': window,
+            'edges': edges[:n].tolist(),
+            'reference': ref.proportions()[j, :n + 1].round(6).tolist(),
+            'live': live.proportions()[j, :n + 1].round(6).tolist(),
+            'reference_rows': ref.rows,
+            'live_rows': live.rows,
+        }
+
+
+_MONITORS: Dict[str, DriftMonitor] = {}
+_MONITORS_LOCK = threading.Lock()
+
+
+def get_drift_monitor(model_path: str, version: str, columns: Sequence[str]) -> DriftMonitor:
+    """Monitor cho version model hiện tại (model đổi -> dựng lại tham chiếu, sketch live làm mới)."""
+    monitor = _MONITORS.get(version)
+    if monitor is not None:
+        return monitor
+    with _MONITORS_LOCK:
+        monitor = _MONITORS.get(version)
+        if monitor is None:
+            monitor = DriftMonitor(load_or_build_reference(model_path, columns), version)
+            _MONITORS.clear()
+            _MONITORS[version] = monitor
+        return monitor
@@ -0,0 +1,201 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from service.compiled_model import CompiledModel, compile_model
+
+
+def _has_shap() -> bool:
+    try:
+        import shap  # noqa: F401
+        return True
+    except Exception:
+        return False
+
+
+def _positive_index(classes) -> int:
+    """Cột của lớp 'mua' (1) trong predict_proba; mặc định cột cuối."""
+    classes = list(np.asarray(classes).tolist())
+    return classes.index(1) if 1 in classes else len(classes) - 1
+
+
+class Explainer:
+    """
+    Phân rã dự báo của cả lô thành base + đóng góp từng feature (cộng lại đúng bằng đầu ra):
+
+    - cây (RandomForest/ExtraTrees/DecisionTree): TreeSHAP qua thư viện shap nếu đã cài và có
+      model sklearn; không thì phân rã theo đường đi (Saabas) trên cây compiled – mỗi lần rẽ
+      nhánh cộng chênh lệch xác suất node con - node cha cho feature của node đó. Một lượt duyệt
+      như predict_proba, vector hóa theo (dòng × cây). Đầu ra: xác suất mua.
+    - LogisticRegression: đóng góp chính xác w_j * x'_j (x' = feature sau scaler), base = intercept.
+      Đầu ra: log-odds.
+    """
+
+    def __init__(self, model, sklearn_model=None):
+        self.model = model if isinstance(model, CompiledModel) else CompiledModel(compile_model(model))
+        self.kind = self.model.kind
+        self.pos = _positive_index(self.model.classes_)
+        self.feature_names = [str(c) for c in self.model.feature_names_in_] \
+            if self.model.feature_names_in_ is not None else None
+        self._shap = None
+        if self.kind == 'forest' and sklearn_model is not None and _has_shap():
+            try:
+                import shap
+                steps = getattr(sklearn_model, 'steps', None)
+                est = steps[-1][1] if steps else sklearn_model
+                self._pre = (lambda X: sklearn_model[:-1].transform(X)) if steps and len(steps) > 1 else (lambda X: X)
+                self._shap = shap.TreeExplainer(est)
+            except Exception as e:
+                print(f"Không dùng được shap, chuyển sang phân rã theo đường đi: {e}")
+                self._shap = None
+
+    @property
+    def method(self) -> str:
+        if self.kind == 'linear':
+            return 'linear'
+        return 'treeshap' if self._shap is not None else 'saabas'
+
+    @property
+    def output(self) -> str:
+        return 'log_odds' if self.kind == 'linear' else 'probability'
+
+    def explain(self, X) -> Tuple[np.ndarray, np.ndarray]:
+        """(base (n,), đóng góp (n, n_feature)); base + đóng góp.sum(1) = đầu ra của model."""
+        X = self.model._matrix(X)
+        if X.ndim == 1:
+            X = X[None, :]
+        if self.kind == 'linear':
+            return self._linear(X)
+        if self._shap is not None:
+            return self._treeshap(X)
+        return self._saabas(X)
+
+    def _linear(self, X: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        a = self.model._a
+        coef = a['coef'][self.pos if a['coef'].shape[0] > 1 else 0]
+        intercept = float(a['intercept'][self.pos if a['intercept'].shape[0] > 1 else 0])
+        center = a.get('center', np.zeros(X.shape[1]))
+        contrib = (X - center) * coef
+        base = np.full(X.shape[0], intercept + float(coef @ center))
+        if a['coef'].shape[0] == 1 and self.pos == 0:
+            return -base, -contrib
+        return base, contrib
+
+    def _saabas(self, X: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        m = self.model
+        value = m._value_t[self.pos]
+        n_trees = len(m._roots)
+        n_features = X.shape[1]
+        contrib = np.zeros(X.shape[0] * n_features)
+
+        def on_level(start, prev, idx, feat):
+            # Lá trỏ về chính nó nên chênh lệch bằng 0 sau khi đã tới lá
+            delta = np.take(value, idx) - np.take(value, prev)
+            rows = np.arange(start, start + idx.shape[0], dtype=np.intp)[:, None]
+            flat = (rows * n_features + feat).ravel()
+            contrib[:] += np.bincount(flat, weights=delta.ravel(), minlength=contrib.shape[0])
+
+        for _ in m._descend(X, on_level):
+            pass
+        base = np.full(X.shape[0], float(np.take(value, m._roots).mean()))
+        return base, contrib.reshape(X.shape[0], n_features) / n_trees
+
+    def _treeshap(self, X: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        values = self._shap.shap_values(self._pre(X), check_additivity=False)
+        if isinstance(values, list):
+            values = values[self.pos]
+        elif values.ndim == 3:
+            values = values[:, :, self.pos]
+        expected = np.atleast_1d(self._shap.expected_value)
+        base = float(expected[self.pos] if len(expected) > 1 else expected[0])
+        return np.full(X.shape[0], base), np.asarray(values, dtype=np.float64)
+
+
+_EXPLAINERS: Dict[str, Explainer] = {}
+_EXPLAINERS_LOCK = threading.Lock()
+
+
+def get_explainer(model, version: str, model_path: Optional[str] = None) -> Explainer:
+    """Explainer cho một version model (dựng một lần; model đổi thì version đổi)."""
+    explainer = _EXPLAINERS.get(version)
+    if explainer is not None:
+        return explainer
+    with _EXPLAINERS_LOCK:
+        explainer = _EXPLAINERS.get(version)
+        if explainer is None:
+            sklearn_model = None if isinstance(model, CompiledModel) else model
+            if sklearn_model is None and model_path and _has_shap():
+                try:
+                    import joblib
+                    sklearn_model = joblib.load(model_path)
+                except Exception as e:
+                    print(f"Không nạp được {model_path} cho shap: {e}")
+            explainer = Explainer(model, sklearn_model)
+            _EXPLAINERS.clear()
+            _EXPLAINERS[version] = explainer
+        return explainer
+
+
+def summarize(explainer: Explainer, base: float, contrib: np.ndarray, x: np.ndarray,
+              names: Sequence[str]) -> Dict[str, Any]:
+    """Một dòng giải thích: mọi feature sắp theo |đóng góp| giảm dần."""
+    order = np.argsort(-np.abs(contrib), kind='stable')
+    return {
+        'method': explainer.method,
+        'output': explainer.output,
+        'base_value': float(base),
+        'contributions': [{'feature': str(names[j]), 'value': float(x[j]), 'contribution': float(contrib[j])}
+                          for j in order],
+    }
+
+
+class ExplanationMemo:
+    """
+    Giải thích đã tính, khóa giống PredictionMemo (mã, hash input, version model) nên đi cùng
+    snapshot dự báo: input hay model đổi thì khóa đổi, mục cũ tự rơi khỏi LRU.
+    """
+
+    def __init__(self, maxsize: int = 2048):
+        self.maxsize = maxsize
+        self._data: 'OrderedDict[Tuple[str, str, str], Dict[str, Any]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple[str, str, str]) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def put(self, key: Tuple[str, str, str], value: Dict[str, Any]) -> None:
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def discard(self, symbols) -> int:
+        wanted = {s.upper() for s in symbols}
+        with self._lock:
+            stale = [k for k in self._data if k[0] in wanted]
+            for k in stale:
+                del self._data[k]
+            return len(stale)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+def top_contributions(explanation: Dict[str, Any], top: Optional[int]) -> Dict[str, Any]:
+    if not top:
+        return explanation
+    return {**explanation, 'contributions': explanation['contributions'][:top]}
+
+
+def explain_rows(explainer: Explainer, X, names: List[str]) -> List[Dict[str, Any]]:
+    """Giải thích cả lô trong một lượt (X: DataFrame/ma trận theo thứ tự `names`)."""
+    base, contrib = explainer.explain(X)
+    Xm = np.asarray(X, dtype=np.float64)
+    return [summarize(explainer, base[i], contrib[i], Xm[i], names) for i in range(len(base))]
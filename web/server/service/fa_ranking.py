@@ -0,0 +1,312 @@
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from service.fundamentals import compute_ratios
+from service.price_store import _find_repo_root
+
+# 7 nhóm điểm và trọng số gốc của notebooks/fa_ranking.ipynb
+COMPONENTS = ['profitability', 'growth', 'scale', 'stability', 'financial_health', 'cash_quality',
+              'asset_efficiency']
+BASELINE_WEIGHTS = np.array([0.25, 0.20, 0.15, 0.10, 0.15, 0.10, 0.05])
+RECENT_PERIODS = 11
+
+# Bộ nhớ tạm cho một khúc trọng số (điểm + thứ tự + hạng, mỗi mã ~32 byte / vector trọng số)
+SWEEP_MEMORY_MB = int(os.environ.get('FA_SWEEP_MEMORY_MB', 64))
+# Phân vị hạng lấy từ histogram (mã × bin); universe lớn hơn số bin thì gộp hạng liền nhau
+RANK_BINS = 2048
+
+_OCF = 'Dòng tiền thuần từ hoạt động kinh doanh'
+_CAPEX = 'Tiền chi để mua sắm XDCB và tài sản dài hạn khác'
+_RAW = {
+    'revenue': 'Doanh thu (đồng)',
+    'net_profit': 'Lợi nhuận sau thuế của Cổ đông công ty mẹ (đồng)',
+    'revenue_growth_pct': 'Tăng trưởng doanh thu (%)',
+    'profit_growth_pct': 'Tăng trưởng lợi nhuận (%)',
+    'gross_profit': 'Lãi gộp',
+    'net_revenue': 'Doanh thu thuần',
+    'total_assets': 'TỔNG CỘNG TÀI SẢN (đồng)',
+}
+
+
+def default_ranking_source() -> str:
+    """Input của fa_ranking.ipynb (non_financial_data.csv của fa_eda); chưa có thì dùng BCTC thô."""
+    root = _find_repo_root()
+    processed = os.path.join(root, 'data', 'processed', 'fa', 'non_financial_data.csv')
+    if os.path.exists(processed):
+        return processed
+    return os.path.join(root, 'data', 'raw', 'fa', 'baocaotaichinh.csv')
+
+
+def _num(df: pd.DataFrame, col: str) -> pd.Series:
+    if col not in df.columns:
+        return pd.Series(np.nan, index=df.index)
+    return pd.to_numeric(df[col], errors='coerce').replace([np.inf, -np.inf], np.nan)
+
+
+def _div(a: pd.Series, b: pd.Series) -> pd.Series:
+    return (a / b.replace(0, np.nan)).replace([np.inf, -np.inf], np.nan)
+
+
+def _scale(s: pd.Series, reverse: bool = False) -> np.ndarray:
+    """scale_score của notebook: min-max về 0-100 (reverse: nhỏ hơn = tốt hơn), hằng số -> 50."""
+    x = s.to_numpy(dtype=np.float64)
+    if not np.isfinite(x).any():
+        return np.full(len(x), 50.0)
+    lo, hi = np.nanmin(x), np.nanmax(x)
+    if hi == lo:
+        return np.full(len(x), 50.0)
+    scaled = (x - lo) / (hi - lo) * 100
+    return 100 - scaled if reverse else scaled
+
+
+def stock_metrics(df: pd.DataFrame, periods: int = RECENT_PERIODS) -> Tuple[pd.DataFrame, List[str]]:
+    """
+    Bước "CALCULATING FINANCIAL METRICS" của notebook: trung bình / độ lệch chuẩn theo mã trên
+    `periods` kỳ gần nhất. Trả về (bảng theo mã, các chỉ số nguồn không có).
+
+    Khác notebook ở một điểm: chỉ số mà nguồn hoàn toàn không có (vd. BCTC thô không có bảng cân
+    đối -> ROA, D/E) không làm rơi mọi mã khi dropna mà được coi là trung tính (điểm 50), giống
+    cách notebook xử lý khi thiếu dòng tiền.
+    """
+    df = df[pd.to_numeric(df['Năm'], errors='coerce').notna()
+            & pd.to_numeric(df['Kỳ'], errors='coerce').isin([1, 2, 3, 4])].reset_index(drop=True)
+    ratios = compute_ratios(df)
+    d = pd.DataFrame({'symbol': ratios['symbol'],
+                      'year_quarter': df['Năm'].astype(int).astype(str) + '_Q' + df['Kỳ'].astype(int).astype(str)})
+    for name, col in _RAW.items():
+        d[name] = _num(df, col)
+    d['roa'], d['roe'] = ratios['roa'], ratios['roe']
+    d['current_ratio'], d['de_ratio'] = ratios['current_ratio'], ratios['de_ratio']
+
+    latest = sorted(d['year_quarter'].unique(), reverse=True)[:periods]
+    d = d[d['year_quarter'].isin(latest)].copy()
+
+    d['gross_margin'] = _div(d['gross_profit'], d['net_revenue']) * 100
+    d['net_margin'] = _div(d['net_profit'], d['revenue']) * 100
+    if _OCF in df.columns and _CAPEX in df.columns:
+        ocf = _num(df, _OCF).loc[d.index]
+        d['ocf_quality'] = _div(ocf, d['net_profit'])
+        d['free_cash_flow'] = ocf - _num(df, _CAPEX).loc[d.index]
+    else:
+        d['ocf_quality'] = 1.0
+        d['free_cash_flow'] = d['net_profit']
+    d['asset_turnover'] = _div(d['revenue'], d['total_assets'])
+
+    g = d.groupby('symbol')
+    m = pd.DataFrame({
+        'avg_net_profit': g['net_profit'].mean(), 'avg_gross_margin': g['gross_margin'].mean(),
+        'avg_net_margin': g['net_margin'].mean(), 'avg_roa': g['roa'].mean(), 'avg_roe': g['roe'].mean(),
+        'avg_revenue_growth': g['revenue_growth_pct'].mean(), 'avg_profit_growth': g['profit_growth_pct'].mean(),
+        'avg_revenue': g['revenue'].mean(), 'avg_current_ratio': g['current_ratio'].mean(),
+        'avg_de_ratio': g['de_ratio'].mean(), 'avg_ocf_quality': g['ocf_quality'].mean(),
+        'avg_fcf': g['free_cash_flow'].mean(), 'avg_asset_turnover': g['asset_turnover'].mean(),
+        'std_net_margin': g['net_margin'].std(), 'std_revenue_growth': g['revenue_growth_pct'].std(),
+        'std_roa': g['roa'].std(),
+    })
+    missing = [c for c in m.columns if m[c].isna().all()]
+    m = m.dropna(subset=[c for c in m.columns if c not in missing])
+    return m, missing
+
+
+def component_scores(metrics: pd.DataFrame) -> pd.DataFrame:
+    """Bước "CALCULATING 7 COMPONENT SCORES": mỗi mã một dòng, cột = COMPONENTS (thang 0-100)."""
+    s = {c: _scale(metrics[c]) for c in metrics.columns if c.startswith('avg_')}
+    stab = {c: _scale(metrics[c], reverse=True) for c in ('std_net_margin', 'std_revenue_growth', 'std_roa')}
+    de = _scale(metrics['avg_de_ratio'], reverse=True)
+    return pd.DataFrame({
+        'profitability': .3 * s['avg_roa'] + .3 * s['avg_roe'] + .2 * s['avg_gross_margin'] + .2 * s['avg_net_margin'],
+        'growth': .5 * s['avg_revenue_growth'] + .5 * s['avg_profit_growth'],
+        'scale': .6 * s['avg_revenue'] + .4 * s['avg_net_profit'],
+        'stability': .4 * stab['std_net_margin'] + .3 * stab['std_revenue_growth'] + .3 * stab['std_roa'],
+        'financial_health': .6 * s['avg_current_ratio'] + .4 * de,
+        'cash_quality': .6 * s['avg_ocf_quality'] + .4 * s['avg_fcf'],
+        'asset_efficiency': .5 * s['avg_asset_turnover'] + .5 * s['avg_roa'],
+    }, index=metrics.index)
+
+
+class FAComponents:
+    """Ma trận điểm thành phần của cả universe FA (mã × 7), dựng một lần từ file nguồn."""
+
+    def __init__(self, symbols: np.ndarray, scores: np.ndarray, source: str, missing: List[str]):
+        self.symbols = symbols
+        self.scores = scores
+        self.source = source
+        self.missing = missing
+
+    @classmethod
+    def load(cls, path: Optional[str] = None, periods: int = RECENT_PERIODS) -> 'FAComponents':
+        path = path or default_ranking_source()
+        df = pd.read_csv(path, encoding='utf-8-sig', low_memory=False)
+        metrics, missing = stock_metrics(df, periods)
+        comp = component_scores(metrics)
+        return cls(comp.index.to_numpy(dtype=object), comp[COMPONENTS].to_numpy(dtype=np.float64), path, missing)
+
+    def __len__(self) -> int:
+        return len(self.symbols)
+
+    def ranking(self, weights: np.ndarray = BASELINE_WEIGHTS) -> pd.DataFrame:
+        """Xếp hạng theo một bộ trọng số (như bước FINAL SCORE của notebook)."""
+        score = self.scores @ np.asarray(weights, dtype=np.float64)
+        order = np.argsort(-score, kind='stable')
+        out = pd.DataFrame(self.scores[order], columns=[f'{c}_score' for c in COMPONENTS])
+        out.insert(0, 'final_score', score[order])
+        out.insert(0, 'rank', np.arange(1, len(order) + 1))
+        out.insert(0, 'symbol', self.symbols[order])
+        return out
+
+
+def sample_weights(n: int, baseline: np.ndarray = BASELINE_WEIGHTS, concentration: float = 50.0,
+                   seed: Optional[int] = None, include_baseline: bool = True) -> np.ndarray:
+    """
+    n vector trọng số (tổng = 1) ~ Dirichlet(concentration * baseline): concentration càng lớn càng
+    sát trọng số gốc (50 -> mỗi trọng số lệch cỡ ±30% giá trị của nó); 0 = đều trên cả simplex.
+    Dòng đầu là chính trọng số gốc nếu include_baseline.
+    """
+    rng = np.random.default_rng(seed)
+    baseline = np.asarray(baseline, dtype=np.float64)
+    baseline = baseline / baseline.sum()
+    alpha = concentration * baseline if concentration > 0 else np.ones_like(baseline)
+    W = rng.dirichlet(alpha, size=n)
+    if include_baseline and n:
+        W[0] = baseline
+    return W
+
+
+def chunk_size(n_symbols: int, memory_mb: int = SWEEP_MEMORY_MB) -> int:
+    return int(max(1, (memory_mb << 20) // (32 * max(1, n_symbols))))
+
+
+def sweep(C: np.ndarray, W: np.ndarray, k: int = 100, baseline: np.ndarray = BASELINE_WEIGHTS,
+          chunk: Optional[int] = None, progress=None) -> Dict[str, Any]:
+    """
+    Chấm cả universe (C: mã × thành phần) dưới mọi vector trọng số W (m × thành phần), mỗi khúc
+    là một phép nhân ma trận C @ W_khúc.T rồi argsort theo cột. Chỉ giữ số cộng dồn theo mã (số lần
+    vào top-k, tổng hạng, tổng bình phương, min/max, histogram hạng) và theo vector trọng số (độ
+    trùng top-k và tương quan hạng Spearman với xếp hạng gốc) -> bộ nhớ không tăng theo m.
+    Hạng tính từ 0 bên trong, trả ra từ 1.
+    """
+    C = np.ascontiguousarray(C, dtype=np.float64)
+    W = np.asarray(W, dtype=np.float64)
+    n, m = C.shape[0], W.shape[0]
+    k = int(min(max(1, k), n))
+    chunk = int(chunk or chunk_size(n))
+    bins = min(n, RANK_BINS)
+
+    base_score = C @ np.asarray(baseline, dtype=np.float64)
+    base_rank = np.empty(n, dtype=np.int64)
+    base_rank[np.argsort(-base_score, kind='stable')] = np.arange(n)
+    base_top = (base_rank < k).astype(np.float64)
+
+    inclusion = np.zeros(n, dtype=np.int64)
+    rank_sum = np.zeros(n)
+    rank_sq = np.zeros(n)
+    best = np.full(n, n, dtype=np.int64)
+    worst = np.zeros(n, dtype=np.int64)
+    hist = np.zeros(n * bins, dtype=np.int64)
+    overlap = np.empty(m)
+    spearman = np.empty(m)
+    row_base = (np.arange(n, dtype=np.int64) * bins)[:, None]
+    denom = n * (n * n - 1.0) if n > 1 else 1.0
+
+    for start in range(0, m, chunk):
+        Wc = W[start:start + chunk]
+        S = C @ Wc.T                                           # (n, c)
+        order = np.argsort(-S, axis=0, kind='stable')
+        ranks = np.empty_like(order)
+        np.put_along_axis(ranks, order, np.arange(n, dtype=np.int64)[:, None], axis=0)
+        top = ranks < k
+        inclusion += top.sum(axis=1)
+        rank_sum += ranks.sum(axis=1)
+        rank_sq += np.square(ranks, dtype=np.float64).sum(axis=1)
+        np.minimum(best, ranks.min(axis=1), out=best)
+        np.maximum(worst, ranks.max(axis=1), out=worst)
+        hist += np.bincount((row_base + ranks * bins // n).ravel(), minlength=n * bins)
+        end = start + Wc.shape[0]
+        overlap[start:end] = base_top @ top
+        d = (ranks - base_rank[:, None]).astype(np.float64)
+        spearman[start:end] = 1 - 6 * np.einsum('ij,ij->j', d, d) / denom
+        if progress is not None:
+            progress(end, m, None)
+
+    mean = rank_sum / m
+    std = np.sqrt(np.maximum(rank_sq / m - mean * mean, 0.0))
+    cdf = np.cumsum(hist.reshape(n, bins), axis=1)
+    pct = {}
+    for q in (5, 50, 95):
+        # bin đầu tiên có cdf >= q% số vector trọng số -> hạng đại diện (đầu bin)
+        b = np.argmax(cdf >= np.ceil(q / 100 * m), axis=1)
+        pct[q] = (b * n + bins - 1) // bins
+    return {
+        'k': k, 'n_weights': m, 'chunk': chunk,
+        'baseline_rank': base_rank + 1, 'baseline_score': base_score,
+        'inclusion': inclusion / m, 'mean_rank': mean + 1, 'std_rank': std,
+        'p05_rank': pct[5] + 1, 'p50_rank': pct[50] + 1, 'p95_rank': pct[95] + 1,
+        'best_rank': best + 1, 'worst_rank': worst + 1,
+        'topk_overlap': overlap / k, 'spearman': spearman,
+    }
+
+
+def sweep_table(components: FAComponents, result: Dict[str, Any]) -> pd.DataFrame:
+    """Mỗi mã một dòng, sắp theo tần suất vào top-k giảm dần rồi hạng trung bình."""
+    cols = ['baseline_rank', 'baseline_score', 'inclusion', 'mean_rank', 'std_rank', 'p05_rank', 'p50_rank',
+            'p95_rank', 'best_rank', 'worst_rank']
+    table = pd.DataFrame({'symbol': components.symbols, **{c: result[c] for c in cols}})
+    for j, c in enumerate(COMPONENTS):
+        table[f'{c}_score'] = components.scores[:, j]
+    return table.sort_values(['inclusion', 'mean_rank'], ascending=[False, True], kind='stable').reset_index(drop=True)
+
+
+def sweep_summary(W: np.ndarray, result: Dict[str, Any]) -> Dict[str, Any]:
+    """Tổng hợp độ ổn định của top-k: độ trùng với top-k gốc, số mã luôn/không chắc có mặt."""
+    inc, base_in = result['inclusion'], result['baseline_rank'] <= result['k']
+    overlap, rho = result['topk_overlap'], result['spearman']
+    # Trọng số nào làm top-k đổi nhiều nhất: tương quan giữa từng trọng số và độ trùng top-k
+    with np.errstate(invalid='ignore', divide='ignore'):
+        corr = [float(np.corrcoef(W[:, j], overlap)[0, 1]) if W.shape[0] > 2 else float('nan')
+                for j in range(W.shape[1])]
+    q = lambda a, p: float(np.percentile(a, p))
+    return {
+        'k': result['k'],
+        'n_weights': result['n_weights'],
+        'n_symbols': int(len(inc)),
+        'chunk': result['chunk'],
+        'topk_overlap': {'mean': float(overlap.mean()), 'p05': q(overlap, 5), 'min': float(overlap.min())},
+        'spearman': {'mean': float(rho.mean()), 'p05': q(rho, 5), 'min': float(rho.min())},
+        'always_in': int(np.count_nonzero(inc >= 0.99)),
+        'borderline': int(np.count_nonzero((inc > 0.05) & (inc < 0.95))),
+        'baseline_at_risk': int(np.count_nonzero(base_in & (inc < 0.5))),
+        'outside_often_in': int(np.count_nonzero(~base_in & (inc >= 0.5))),
+        'weight_overlap_corr': {c: (round(v, 4) if np.isfinite(v) else None) for c, v in zip(COMPONENTS, corr)},
+    }
+
+
+def run_sweep(components: FAComponents, n: int = 2000, k: int = 100, concentration: float = 50.0,
+              seed: Optional[int] = None, chunk: Optional[int] = None, progress=None
+              ) -> Tuple[pd.DataFrame, Dict[str, Any]]:
+    t0 = time.perf_counter()
+    W = sample_weights(n, concentration=concentration, seed=seed)
+    result = sweep(components.scores, W, k=k, chunk=chunk, progress=progress)
+    summary = sweep_summary(W, result)
+    summary.update(concentration=concentration, seed=seed, source=components.source,
+                   neutral_metrics=components.missing, took_s=round(time.perf_counter() - t0, 3))
+    return sweep_table(components, result), summary
+
+
+_COMPONENTS: Dict[str, Any] = {'stamp': None, 'value': None}
+_COMPONENTS_LOCK = threading.Lock()
+
+
+def get_fa_components(path: Optional[str] = None) -> FAComponents:
+    """Điểm thành phần của universe FA; dựng lại khi file nguồn đổi (mtime)."""
+    path = path or default_ranking_source()
+    stamp = (path, os.path.getmtime(path))
+    with _COMPONENTS_LOCK:
+        if _COMPONENTS['stamp'] != stamp:
+            _COMPONENTS['value'] = FAComponents.load(path)
+            _COMPONENTS['stamp'] = stamp
+        return _COMPONENTS['value']
@@ -0,0 +1,269 @@
+import json
+import os
+import numpy as np
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from service.indicators import FEATURE_COLUMNS
+from service.price_store import PriceStore, get_price_store
+
+
+class FeatureMoments:
+    """
+    Thống kê một lượt (có thể theo từng khúc) cho p cột: số giá trị hợp lệ, tổng lũy thừa
+    bậc 1–3 và ma trận tích chéo theo cặp quan sát đầy đủ (như DataFrame.corr()).
+
+    Mỗi khúc chỉ tốn vài phép nhân ma trận p×p thay vì vòng lặp Python theo cặp cột, và hai
+    FeatureMoments (cùng shift) cộng được với nhau nên có thể tính song song rồi merge().
+    Giá trị được trừ `shift` (trung bình khúc đầu) trước khi cộng dồn để tránh mất chính xác.
+    """
+
+    def __init__(self, columns: Sequence[str], shift: Optional[np.ndarray] = None):
+        self.columns = list(columns)
+        p = len(self.columns)
+        self.shift = shift
+        self.rows = 0
+        self.n = np.zeros(p)
+        self.s1 = np.zeros(p)
+        self.s2 = np.zeros(p)
+        self.s3 = np.zeros(p)
+        self.pair_n = np.zeros((p, p))
+        self.pair_s1 = np.zeros((p, p))      # [i, j] = tổng x_i trên các dòng cả i và j hợp lệ
+        self.pair_s2 = np.zeros((p, p))
+        self.cross = np.zeros((p, p))
+
+    def update(self, X: np.ndarray) -> 'FeatureMoments':
+        X = np.asarray(X, dtype=np.float64)
+        if X.size == 0:
+            return self
+        valid = np.isfinite(X)
+        if self.shift is None:
+            with np.errstate(invalid='ignore'):
+                shift = np.nanmean(np.where(valid, X, np.nan), axis=0)
+            self.shift = np.nan_to_num(shift)
+        Z = np.where(valid, X - self.shift, 0.0)
+        Z2 = Z * Z
+        M = valid.astype(np.float64)
+        self.rows += X.shape[0]
+        self.n += M.sum(axis=0)
+        self.s1 += Z.sum(axis=0)
+        self.s2 += Z2.sum(axis=0)
+        self.s3 += (Z2 * Z).sum(axis=0)
+        if valid.all():
+            # Không có giá trị thiếu: mọi cặp dùng chung tất cả các dòng
+            self.pair_n += X.shape[0]
+            self.pair_s1 += Z.sum(axis=0)[:, None]
+            self.pair_s2 += Z2.sum(axis=0)[:, None]
+        else:
+            self.pair_n += M.T @ M
+            self.pair_s1 += Z.T @ M
+            self.pair_s2 += Z2.T @ M
+        self.cross += Z.T @ Z
+        return self
+
+    def merge(self, other: 'FeatureMoments') -> 'FeatureMoments':
+        if other.rows == 0:
+            return self
+        if self.rows == 0:
+            self.__dict__.update({k: (v.copy() if isinstance(v, np.ndarray) else v) for k, v in other.__dict__.items()})
+            return self
+        if not np.array_equal(self.shift, other.shift):
+            raise ValueError('Chỉ merge được FeatureMoments có cùng shift')
+        for name in ('n', 's1', 's2', 's3', 'pair_n', 'pair_s1', 'pair_s2', 'cross'):
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        self.rows += other.rows
+        return self
+
+    def mean(self) -> np.ndarray:
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self.s1 / self.n + (self.shift if self.shift is not None else 0.0)
+
+    def var(self, ddof: int = 1) -> np.ndarray:
+        with np.errstate(invalid='ignore', divide='ignore'):
+            m2 = self.s2 - self.s1 ** 2 / self.n
+            return np.maximum(m2, 0.0) / (self.n - ddof)
+
+    def skew(self) -> np.ndarray:
+        """Độ lệch (Fisher-Pearson, không hiệu chỉnh – như scipy.stats.skew mặc định)."""
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mu = self.s1 / self.n
+            m2 = self.s2 / self.n - mu ** 2
+            m3 = self.s3 / self.n - 3 * mu * self.s2 / self.n + 2 * mu ** 3
+            out = m3 / m2 ** 1.5
+        return np.where(m2 > 1e-12 * np.maximum(1.0, (self.s2 / np.maximum(self.n, 1))), out, 0.0)
+
+    def missing_pct(self) -> np.ndarray:
+        return 100.0 * (1.0 - self.n / max(self.rows, 1))
+
+    def corr(self) -> np.ndarray:
+        """Ma trận tương quan Pearson theo cặp quan sát đầy đủ."""
+        N, Sx, Sxx, C = self.pair_n, self.pair_s1, self.pair_s2, self.cross
+        Sy, Syy = Sx.T, Sxx.T
+        with np.errstate(invalid='ignore', divide='ignore'):
+            num = N * C - Sx * Sy
+            den = np.sqrt(np.maximum(N * Sxx - Sx ** 2, 0.0) * np.maximum(N * Syy - Sy ** 2, 0.0))
+            r = num / den
+        r = np.clip(np.where(den > 0, r, np.nan), -1.0, 1.0)
+        np.fill_diagonal(r, 1.0)
+        return r
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        mean, var, skew, miss = self.mean(), self.var(), self.skew(), self.missing_pct()
+        std = np.sqrt(var)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            cv = np.where(np.abs(mean) > 0, std / np.abs(mean), np.nan)
+        return {c: {'mean': float(mean[i]), 'std': float(std[i]), 'variance': float(var[i]),
+                    'cv': float(cv[i]), 'skew': float(skew[i]), 'missing_pct': float(miss[i])}
+                for i, c in enumerate(self.columns)}
+
+
+TARGET = '__target__'
+
+
+def iter_panel_chunks(store: Optional[PriceStore] = None, symbols: Optional[Sequence[str]] = None,
+                      chunk_rows: int = 250_000, with_target: bool = True) -> Iterator[np.ndarray]:
+    """
+    Ma trận feature (kèm cột nhãn 7 phiên nếu with_target) theo từng khúc ~chunk_rows dòng,
+    nên bộ nhớ không tăng theo số mã khi mở rộng ra toàn thị trường.
+    """
+    from service.training import symbol_features
+    if store is None:
+        store = get_price_store()
+    if symbols is None:
+        symbols = store.symbol_list()
+    buf, size = [], 0
+    for sym in symbols:
+        part = symbol_features(store.bars(sym), FEATURE_COLUMNS)
+        if part is None:
+            continue
+        X, y, _ = part
+        block = np.column_stack([X, y.astype(np.float32)]) if with_target else X
+        buf.append(block)
+        size += len(block)
+        if size >= chunk_rows:
+            yield np.concatenate(buf)
+            buf, size = [], 0
+    if buf:
+        yield np.concatenate(buf)
+
+
+def compute_moments(chunks: Iterable[np.ndarray], columns: Sequence[str]) -> FeatureMoments:
+    acc = FeatureMoments(columns)
+    for X in chunks:
+        acc.update(X)
+    return acc
+
+
+def cluster_redundant(corr: np.ndarray, threshold: float = 0.85) -> List[List[int]]:
+    """
+    Gom các feature có |tương quan| > threshold thành cụm (hierarchical, complete linkage trên
+    khoảng cách 1 - |r|): mọi cặp trong một cụm đều tương quan cao, không bị nối chuỗi như
+    khi chỉ lấy thành phần liên thông.
+    """
+    from scipy.cluster.hierarchy import fcluster, linkage
+    from scipy.spatial.distance import squareform
+    p = corr.shape[0]
+    if p < 2:
+        return [[i] for i in range(p)]
+    dist = 1.0 - np.abs(np.nan_to_num(corr, nan=0.0))
+    dist = (dist + dist.T) / 2
+    np.fill_diagonal(dist, 0.0)
+    labels = fcluster(linkage(squareform(np.clip(dist, 0.0, 2.0), checks=False), method='complete'),
+                      t=1.0 - threshold, criterion='distance')
+    clusters: Dict[int, List[int]] = {}
+    for i, lab in enumerate(labels):
+        clusters.setdefault(int(lab), []).append(i)
+    return sorted(clusters.values(), key=lambda c: c[0])
+
+
+def select_features(moments: FeatureMoments, threshold: float = 0.85, min_variance: float = 1e-10,
+                    max_missing_pct: float = 50.0, keep: Sequence[str] = ()) -> Dict[str, object]:
+    """
+    Bỏ feature gần như hằng số / thiếu quá nhiều, gom cụm phần còn lại theo tương quan và giữ
+    một đại diện mỗi cụm: feature trong `keep` nếu có, nếu không thì feature tương quan mạnh
+    nhất với nhãn (khi moments có cột TARGET), hòa thì theo thứ tự FEATURE_COLUMNS.
+    """
+    cols = moments.columns
+    feat_idx = [i for i, c in enumerate(cols) if c != TARGET]
+    stats = moments.stats()
+    corr_all = moments.corr()
+    target_corr = None
+    if TARGET in cols:
+        t = cols.index(TARGET)
+        target_corr = {cols[i]: float(np.nan_to_num(corr_all[i, t])) for i in feat_idx}
+
+    dropped: Dict[str, str] = {}
+    candidates = []
+    for i in feat_idx:
+        c, st = cols[i], stats[cols[i]]
+        if not np.isfinite(st['variance']) or st['variance'] <= min_variance:
+            dropped[c] = 'low_variance'
+        elif st['missing_pct'] > max_missing_pct:
+            dropped[c] = 'missing'
+        else:
+            candidates.append(i)
+
+    sub = corr_all[np.ix_(candidates, candidates)]
+    order = {c: k for k, c in enumerate(FEATURE_COLUMNS)}
+    selected, clusters = [], []
+    for group in cluster_redundant(sub, threshold):
+        names = [cols[candidates[g]] for g in group]
+        preferred = [n for n in names if n in keep]
+        if preferred:
+            rep = preferred[0]
+        else:
+            rep = min(names, key=lambda n: (-abs(target_corr[n]) if target_corr else 0.0, order.get(n, len(order))))
+        selected.append(rep)
+        if len(names) > 1:
+            clusters.append({'keep': rep, 'members': names})
+            for n in names:
+                if n != rep:
+                    dropped[n] = f'redundant:{rep}'
+    selected.sort(key=lambda n: order.get(n, len(order)))
+
+    p = len(candidates)
+    iu = np.triu_indices(p, 1)
+    high = np.abs(np.nan_to_num(sub[iu])) > threshold
+    pairs = sorted(
+        ({'feature_1': cols[candidates[a]], 'feature_2': cols[candidates[b]], 'corr': float(sub[a, b])}
+         for a, b in zip(iu[0][high], iu[1][high])),
+        key=lambda r: -abs(r['corr']))
+    return {
+        'features': selected,
+        'dropped': dropped,
+        'clusters': clusters,
+        'high_corr_pairs': pairs,
+        'threshold': threshold,
+        'rows': int(moments.rows),
+        'target_corr': target_corr,
+        'stats': stats,
+    }
+
+
+def default_selection_path() -> str:
+    return os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'model', 'selected_features.json')
+
+
+def save_selection(result: Dict[str, object], path: Optional[str] = None) -> str:
+    path = path or default_selection_path()
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=1)
+    return path
+
+
+def load_selected_features(path: Optional[str] = None) -> List[str]:
+    """Danh sách feature đã chọn (theo thứ tự FEATURE_COLUMNS) – dùng làm cột train của model."""
+    with open(path or default_selection_path(), 'r', encoding='utf-8') as f:
+        features = json.load(f)['features']
+    unknown = [c for c in features if c not in FEATURE_COLUMNS]
+    if unknown:
+        raise ValueError(f'Feature không có trong compute_features: {unknown}')
+    return list(features)
+
+
+def analyze(store: Optional[PriceStore] = None, symbols: Optional[Sequence[str]] = None,
+            chunk_rows: int = 250_000, threshold: float = 0.85, with_target: bool = True,
+            **kwargs) -> Tuple[FeatureMoments, Dict[str, object]]:
+    columns = list(FEATURE_COLUMNS) + ([TARGET] if with_target else [])
+    moments = compute_moments(iter_panel_chunks(store, symbols, chunk_rows, with_target), columns)
+    return moments, select_features(moments, threshold=threshold, **kwargs)
@@ -0,0 +1,354 @@
+import os
+import threading
+import time
+import numpy as np
+import pandas as pd
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from service.bars import days_to_iso
+from service.price_store import _find_repo_root
+
+# Chỉ số FA gắn vào từng bar ngày (tên cột feature = 'fa_' + tên)
+FA_FIELDS = ['roa', 'roe', 'de_ratio', 'current_ratio', 'gross_margin', 'net_margin',
+             'revenue_growth', 'profit_growth']
+FA_PREFIX = 'fa_'
+FA_FEATURE_COLUMNS = [FA_PREFIX + f for f in FA_FIELDS]
+
+# Độ trễ công bố: BCTC quý hợp nhất công bố trong 30 ngày sau kỳ, bán niên soát xét 45 ngày
+# (TT 96/2020) -> mặc định 45 ngày sau ngày kết thúc quý cho mọi kỳ, trừ khi có cột ngày công bố.
+REPORT_LAG_DAYS = 45
+
+# Cột gốc (như notebooks/fa_eda.ipynb) -> cách tính từng chỉ số
+_COL = {
+    'assets': 'TỔNG CỘNG TÀI SẢN (đồng)',
+    'equity': 'VỐN CHỦ SỞ HỮU (đồng)',
+    'liabilities': 'NỢ PHẢI TRẢ (đồng)',
+    'current_assets': 'TÀI SẢN NGẮN HẠN (đồng)',
+    'current_liabilities': 'Nợ ngắn hạn (đồng)',
+    'profit': 'Lợi nhuận thuần',
+    'revenue': 'Doanh thu (đồng)',
+    'net_revenue': 'Doanh thu thuần',
+    'gross_profit': 'Lãi gộp',
+    'parent_profit': 'Lợi nhuận sau thuế của Cổ đông công ty mẹ (đồng)',
+    'revenue_growth': 'Tăng trưởng doanh thu (%)',
+    'profit_growth': 'Tăng trưởng lợi nhuận (%)',
+}
+# Chỉ số đã tính sẵn trong data/processed/fa/*.csv
+_READY = {'ROA': 'roa', 'ROE': 'roe', 'D_E_Ratio': 'de_ratio', 'Current_Ratio': 'current_ratio'}
+
+_KEY_BITS = 21          # khóa gộp (mã, ngày) = mã << 21 | ngày; epoch-day < 2^21 (năm 7700)
+
+
+def _ratio(df: pd.DataFrame, num: str, den: str) -> Optional[np.ndarray]:
+    if _COL[num] not in df.columns or _COL[den] not in df.columns:
+        return None
+    a = pd.to_numeric(df[_COL[num]], errors='coerce').to_numpy(dtype=np.float64)
+    b = pd.to_numeric(df[_COL[den]], errors='coerce').to_numpy(dtype=np.float64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(b != 0, a / b, np.nan)
+
+
+def compute_ratios(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Báo cáo quý dạng rộng (cột CP, Năm, Kỳ + các khoản mục tiếng Việt) -> symbol, year, quarter
+    + FA_FIELDS. Chỉ số nào thiếu cột gốc thì để NaN; mẫu số 0 -> NaN (không bịa giá trị 0).
+    """
+    out = pd.DataFrame({'symbol': df['CP'].astype(str).str.strip().str.upper().to_numpy(),
+                        'year': pd.to_numeric(df['Năm'], errors='coerce').to_numpy(),
+                        'quarter': pd.to_numeric(df['Kỳ'], errors='coerce').to_numpy()})
+    profit = 'profit' if _COL['profit'] in df.columns else 'parent_profit'
+    computed = {
+        'roa': _ratio(df, profit, 'assets'),
+        'roe': _ratio(df, profit, 'equity'),
+        'de_ratio': _ratio(df, 'liabilities', 'equity'),
+        'current_ratio': _ratio(df, 'current_assets', 'current_liabilities'),
+        'gross_margin': _ratio(df, 'gross_profit', 'net_revenue'),
+        'net_margin': _ratio(df, 'parent_profit', 'revenue'),
+    }
+    for src, field in _READY.items():
+        if src in df.columns:
+            computed[field] = pd.to_numeric(df[src], errors='coerce').to_numpy(dtype=np.float64)
+    for field in ('revenue_growth', 'profit_growth'):
+        if _COL[field] in df.columns:
+            computed[field] = pd.to_numeric(df[_COL[field]], errors='coerce').to_numpy(dtype=np.float64)
+    for field in FA_FIELDS:
+        arr = computed.get(field)
+        out[field] = arr if arr is not None else np.nan
+    if 'published' in df.columns:
+        out['published'] = pd.to_datetime(df['published'], errors='coerce')
+    out = out[np.isfinite(out['year']) & out['quarter'].isin([1, 2, 3, 4])]
+    return out.astype({'year': np.int64, 'quarter': np.int64}).reset_index(drop=True)
+
+
+def default_fa_sources() -> List[str]:
+    """
+    Nguồn FA theo thứ tự ưu tiên tăng dần (nguồn sau ghi đè chỉ số khác NaN của nguồn trước):
+    báo cáo KQKD thô, các bảng chỉ số đã xử lý của fa_eda.ipynb, rồi partition ingest.py.
+    """
+    root = _find_repo_root()
+    return [os.path.join(root, 'data', 'raw', 'fa', 'baocaotaichinh.csv'),
+            os.path.join(root, 'data', 'processed', 'fa', 'non_financial_data.csv'),
+            os.path.join(root, 'data', 'processed', 'fa', 'financial_data.csv'),
+            os.path.join(root, 'data', 'ingest', 'income'),
+            os.path.join(root, 'data', 'ingest', 'balance')]
+
+
+def _read_source(path: str) -> Optional[pd.DataFrame]:
+    if not os.path.exists(path):
+        return None
+    try:
+        if os.path.isdir(path):
+            from service.ingest import read_partitions
+            df = read_partitions(path)
+        else:
+            df = pd.read_csv(path, encoding='utf-8-sig', low_memory=False)
+    except Exception as e:
+        print(f"Không đọc được {path}: {e}")
+        return None
+    if df.empty or not {'CP', 'Năm', 'Kỳ'} <= set(df.columns):
+        return None
+    return df
+
+
+def load_fa_reports(paths: Optional[Sequence[str]] = None) -> pd.DataFrame:
+    """Gộp các nguồn FA thành một dòng/kỳ: symbol, year, quarter, FA_FIELDS (+ published nếu có)."""
+    if paths is None:
+        paths = default_fa_sources()
+    merged: Optional[pd.DataFrame] = None
+    statements = []
+    for p in paths:
+        df = _read_source(p)
+        if df is None:
+            continue
+        if os.path.isdir(p):
+            statements.append(df)
+            continue
+        merged = _merge(merged, compute_ratios(df))
+    if statements:
+        # income/balance của ingest là các phần của cùng kỳ: ghép theo (CP, Năm, Kỳ) rồi mới tính ROA/ROE/D/E
+        wide = pd.concat(statements, ignore_index=True).groupby(['CP', 'Năm', 'Kỳ'], as_index=False).first()
+        merged = _merge(merged, compute_ratios(wide))
+    if merged is None:
+        return pd.DataFrame(columns=['symbol', 'year', 'quarter', *FA_FIELDS])
+    return merged.reset_index().sort_values(['symbol', 'year', 'quarter'], kind='stable').reset_index(drop=True)
+
+
+def _merge(merged: Optional[pd.DataFrame], part: pd.DataFrame) -> pd.DataFrame:
+    part = part.drop_duplicates(['symbol', 'year', 'quarter'], keep='last').set_index(['symbol', 'year', 'quarter'])
+    return part if merged is None else part.combine_first(merged)
+
+
+def period_end_day(year: np.ndarray, quarter: np.ndarray) -> np.ndarray:
+    """Ngày cuối quý (epoch-day) – vector hóa."""
+    months = (np.asarray(year, dtype=np.int64) - 1970) * 12 + np.asarray(quarter, dtype=np.int64) * 3
+    return months.astype('datetime64[M]').astype('datetime64[D]').astype(np.int64) - 1
+
+
+class FAIndex:
+    """
+    Chỉ mục as-of của báo cáo quý: các kỳ sắp theo (mã, ngày có hiệu lực) trong mảng liền kề,
+    mỗi mã một đoạn [start, end) như PriceStore. Ngày có hiệu lực = ngày công bố nếu biết, không
+    thì cuối quý + lag, nên bar ngày d chỉ thấy số liệu đã công bố tới d (không nhìn trước).
+
+    Join cả panel ngày là một searchsorted trên khóa gộp (mã, ngày): O(n log m), không vòng lặp
+    theo mã. Kỳ công bố muộn hơn nhưng cũ hơn kỳ đã có (sửa số liệu kỳ trước) không che kỳ mới.
+    """
+
+    def __init__(self, reports: pd.DataFrame, lag_days: int = REPORT_LAG_DAYS):
+        self.lag_days = lag_days
+        self.reports = reports.reset_index(drop=True)
+        df = self.reports
+        available = period_end_day(df['year'].to_numpy(), df['quarter'].to_numpy()) + lag_days
+        if 'published' in df.columns:
+            pub = df['published'].to_numpy(dtype='datetime64[D]')
+            known = ~np.isnat(pub)
+            available = np.where(known, pub.astype(np.int64), available)
+        period = df['year'].to_numpy(dtype=np.int64) * 4 + df['quarter'].to_numpy(dtype=np.int64) - 1
+        symbols, codes = np.unique(df['symbol'].to_numpy(dtype=object), return_inverse=True) if len(df) \
+            else (np.array([], dtype=object), np.empty(0, dtype=np.int64))
+        order = np.lexsort((period, available, codes))
+        codes, available, period = codes[order], available[order], period[order]
+        values = df[FA_FIELDS].to_numpy(dtype=np.float64)[order]
+        # Bỏ kỳ cũ hơn kỳ mới nhất đã công bố trước đó của cùng mã
+        if len(codes):
+            gkey = codes.astype(np.int64) * (1 << 20) + period
+            keep = gkey >= np.maximum.accumulate(gkey)
+            codes, available, period, values = codes[keep], available[keep], period[keep], values[keep]
+        self.symbols = symbols
+        self._index = {s: i for i, s in enumerate(symbols.tolist())}
+        self.codes = codes.astype(np.int64)
+        self.available = available.astype(np.int64)
+        self.period = period
+        self.values = np.ascontiguousarray(values)
+        self._keys = (self.codes << _KEY_BITS) | self.available
+        self.offsets = np.searchsorted(self.codes, np.arange(len(symbols) + 1))
+
+    @classmethod
+    def load(cls, paths: Optional[Sequence[str]] = None, lag_days: int = REPORT_LAG_DAYS) -> 'FAIndex':
+        return cls(load_fa_reports(paths), lag_days)
+
+    def __len__(self) -> int:
+        return int(self.codes.shape[0])
+
+    def __contains__(self, symbol: str) -> bool:
+        return str(symbol).upper() in self._index
+
+    def lookup(self, codes: np.ndarray, day: np.ndarray) -> np.ndarray:
+        """Vị trí kỳ mới nhất có hiệu lực tới ngày `day` cho từng (mã FA, ngày); -1 nếu chưa có."""
+        codes = np.asarray(codes, dtype=np.int64)
+        keys = (np.maximum(codes, 0) << _KEY_BITS) | np.asarray(day, dtype=np.int64)
+        pos = np.searchsorted(self._keys, keys, side='right') - 1
+        ok = (codes >= 0) & (pos >= 0)
+        ok[ok] = self.codes[pos[ok]] == codes[ok]
+        return np.where(ok, pos, -1)
+
+    def codes_for(self, symbols: np.ndarray) -> np.ndarray:
+        """Mã FA (vị trí trong self.symbols) cho mảng tên mã; -1 nếu mã không có báo cáo."""
+        uniq, inv = np.unique(np.asarray(symbols, dtype=object), return_inverse=True)
+        table = np.array([self._index.get(str(s).upper(), -1) for s in uniq], dtype=np.int64)
+        return table[inv] if len(uniq) else np.empty(0, dtype=np.int64)
+
+    def join(self, symbols: np.ndarray, day: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """(giá trị (n, len(FA_FIELDS)) NaN khi chưa có kỳ nào, vị trí kỳ) cho cả panel một lượt."""
+        pos = self.lookup(self.codes_for(symbols), day)
+        out = np.full((len(pos), len(FA_FIELDS)), np.nan)
+        hit = pos >= 0
+        out[hit] = self.values[pos[hit]]
+        return out, pos
+
+    def join_frame(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Thêm cột fa_* (+ fa_period) vào DataFrame có cột symbol, day (epoch-day)."""
+        values, pos = self.join(df['symbol'].to_numpy(), df['day'].to_numpy(dtype=np.int64))
+        out = df.copy()
+        for j, field in enumerate(FA_FIELDS):
+            out[FA_PREFIX + field] = values[:, j]
+        out['fa_period'] = np.where(pos >= 0, [self.period_label(p) for p in pos], None)
+        return out
+
+    def features(self, symbols, day: np.ndarray) -> Dict[str, np.ndarray]:
+        """
+        Feature fa_* (NaN -> 0 như compute_features) cho một mã trên dãy ngày 1-D, hoặc cho
+        panel 2-D (n_mã, n_ngày) với `symbols` là danh sách mã theo hàng.
+        """
+        day = np.asarray(day, dtype=np.int64)
+        if isinstance(symbols, str):
+            sym = np.full(day.shape, symbols.upper(), dtype=object)
+        else:
+            sym = np.repeat(np.asarray([str(s).upper() for s in symbols], dtype=object), day.shape[-1]).reshape(day.shape)
+        values, _ = self.join(sym.ravel(), day.ravel())
+        values = np.nan_to_num(values, nan=0.0, posinf=0.0, neginf=0.0).reshape(*day.shape, len(FA_FIELDS))
+        return {FA_PREFIX + f: values[..., j] for j, f in enumerate(FA_FIELDS)}
+
+    def period_label(self, pos: int) -> str:
+        p = int(self.period[pos])
+        return f"{p // 4}Q{p % 4 + 1}"
+
+    def history(self, symbol: str) -> List[Dict[str, object]]:
+        """Các kỳ của một mã kèm ngày có hiệu lực (cho API)."""
+        i = self._index.get(str(symbol).upper())
+        if i is None:
+            return []
+        s, e = int(self.offsets[i]), int(self.offsets[i + 1])
+        out = []
+        for pos in range(s, e):
+            row = {'period': self.period_label(pos), 'available': str(days_to_iso(self.available[pos:pos + 1])[0])}
+            row.update({f: (None if not np.isfinite(v) else float(v)) for f, v in zip(FA_FIELDS, self.values[pos])})
+            out.append(row)
+        return out
+
+
+def diff_reports(old: pd.DataFrame, new: pd.DataFrame) -> pd.DataFrame:
+    """Các kỳ mới hoặc có số liệu đổi trong `new` so với `old`."""
+    key = ['symbol', 'year', 'quarter']
+    if old is None or old.empty:
+        return new
+    merged = new.merge(old, on=key, how='left', suffixes=('', '_old'), indicator=True)
+    changed = merged['_merge'] == 'left_only'
+    for f in FA_FIELDS:
+        a, b = merged[f].to_numpy(dtype=np.float64), merged[f + '_old'].to_numpy(dtype=np.float64)
+        changed |= ~((a == b) | (np.isnan(a) & np.isnan(b)))
+    return new[changed.to_numpy()]
+
+
+# Nguồn FA được kiểm tra lại tối đa mỗi FA_REFRESH_SECONDS giây (kỳ mới từ ingest.py / CSV cập nhật)
+FA_REFRESH_SECONDS = float(os.environ.get('FA_REFRESH_SECONDS', 60))
+
+_INDEX: Optional[FAIndex] = None
+_INDEX_STAMP: Optional[Tuple] = None
+_INDEX_CHECKED = 0.0
+_INDEX_LOCK = threading.Lock()
+_LISTENERS: List[Callable[[List[str]], None]] = []
+
+
+def _sources_stamp(paths: Sequence[str]) -> Tuple:
+    """(file, mtime, size) của mọi nguồn FA, kể cả từng partition trong thư mục ingest."""
+    out = []
+    for p in paths:
+        if os.path.isdir(p):
+            for root, _, files in os.walk(p):
+                for name in files:
+                    full = os.path.join(root, name)
+                    st = os.stat(full)
+                    out.append((full, st.st_mtime_ns, st.st_size))
+        elif os.path.exists(p):
+            st = os.stat(p)
+            out.append((p, st.st_mtime_ns, st.st_size))
+    return tuple(sorted(out))
+
+
+def on_fa_update(listener: Callable[[List[str]], None]) -> None:
+    """Đăng ký hàm được gọi với danh sách mã có kỳ FA mới/sửa mỗi khi chỉ mục được nạp lại."""
+    _LISTENERS.append(listener)
+
+
+def refresh_fa_index(index: Optional[FAIndex], reports: pd.DataFrame) -> Tuple[FAIndex, List[str]]:
+    """
+    Chỉ mục mới từ `reports` (như load_fa_reports) + các mã có kỳ mới hoặc số liệu đổi so với
+    `index`. Không có gì đổi thì giữ nguyên `index`.
+    """
+    if index is None:
+        return FAIndex(reports), []
+    changed = diff_reports(index.reports, reports)
+    if changed.empty and len(reports) == len(index.reports):
+        return index, []
+    return FAIndex(reports, index.lag_days), sorted(changed['symbol'].astype(str).unique().tolist())
+
+
+def get_fa_index() -> FAIndex:
+    """
+    FAIndex dùng chung của process (nạp lười lần đầu gọi). Nguồn FA đổi trên đĩa thì nạp lại và
+    báo các mã bị ảnh hưởng cho on_fa_update (vd. xóa dự báo đã cache của các mã đó).
+    """
+    global _INDEX, _INDEX_STAMP, _INDEX_CHECKED
+    if _INDEX is not None and time.monotonic() - _INDEX_CHECKED < FA_REFRESH_SECONDS:
+        return _INDEX
+    with _INDEX_LOCK:
+        if _INDEX is not None and time.monotonic() - _INDEX_CHECKED < FA_REFRESH_SECONDS:
+            return _INDEX
+        paths = default_fa_sources()
+        stamp = _sources_stamp(paths)
+        changed: List[str] = []
+        if _INDEX is None or stamp != _INDEX_STAMP:
+            _INDEX, changed = refresh_fa_index(_INDEX, load_fa_reports(paths))
+            _INDEX_STAMP = stamp
+        _INDEX_CHECKED = time.monotonic()
+    if changed:
+        print(f"FA: nạp lại chỉ mục, {len(changed)} mã có kỳ mới/sửa")
+        for listener in _LISTENERS:
+            try:
+                listener(changed)
+            except Exception as e:
+                print(f"Lỗi listener FA: {e}")
+    return _INDEX
+
+
+def wants_fa(columns: Sequence[str]) -> bool:
+    return any(str(c).startswith(FA_PREFIX) for c in columns)
+
+
+def attach_fa_features(features: Dict[str, np.ndarray], symbols, day: np.ndarray, columns: Sequence[str],
+                       index: Optional[FAIndex] = None) -> Dict[str, np.ndarray]:
+    """Thêm fa_* vào dict của compute_features khi model cần (không cần thì không đụng tới FA)."""
+    if wants_fa(columns):
+        features.update((index or get_fa_index()).features(symbols, day))
+    return features
@@ -0,0 +1,141 @@
+import io
+import numpy as np
+from typing import Iterator, Optional, Sequence
+
+from service.bars import PRICE_FIELDS, iso_to_day
+from service.price_store import PriceStore, get_price_store
+
+EXPORT_COLUMNS = ['time', 'symbol'] + list(PRICE_FIELDS)
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow as pa
+        return pa
+    except ImportError:
+        raise RuntimeError("Cần cài 'pyarrow' để export Arrow/Parquet (pip install pyarrow)")
+
+
+def select_rows(store: PriceStore, symbols: Optional[Sequence[str]] = None,
+                start: Optional[str] = None, end: Optional[str] = None):
+    """
+    Trả về danh sách đoạn (lo, hi) trong các mảng cột của store thỏa predicate mã + khoảng ngày.
+    Mỗi mã chỉ tốn một searchsorted vì store đã sort theo (symbol, day).
+    """
+    start_day = iso_to_day(start) if start else None
+    end_day = iso_to_day(end) if end else None
+    if symbols is None:
+        symbols = store.symbol_list()
+    ranges = []
+    for sym in symbols:
+        s, e = store.span(sym)
+        if s == e:
+            continue
+        days = store.day[s:e]
+        lo = s + (int(np.searchsorted(days, start_day, side='left')) if start_day is not None else 0)
+        hi = s + (int(np.searchsorted(days, end_day, side='right')) if end_day is not None else e - s)
+        if hi > lo:
+            ranges.append((lo, hi))
+    return ranges
+
+
+def _gather(arr: np.ndarray, ranges) -> np.ndarray:
+    # Một đoạn liền kề -> view (không copy); nhiều đoạn -> ghép một lần
+    if len(ranges) == 1:
+        lo, hi = ranges[0]
+        return arr[lo:hi]
+    if not ranges:
+        return arr[0:0]
+    return np.concatenate([arr[lo:hi] for lo, hi in ranges])
+
+
+def build_history_table(store: Optional[PriceStore] = None, symbols: Optional[Sequence[str]] = None,
+                        start: Optional[str] = None, end: Optional[str] = None,
+                        columns: Optional[Sequence[str]] = None):
+    """
+    Dựng pyarrow.Table từ kho giá dạng cột.
+
+    - time: date32 (chính là int32 epoch-day của store, không cần chuyển đổi)
+    - symbol: dictionary-encoded
+    - columns: chiếu cột (mặc định tất cả EXPORT_COLUMNS)
+    """
+    pa = _require_pyarrow()
+    if store is None:
+        store = get_price_store()
+    if columns is None:
+        columns = EXPORT_COLUMNS
+    unknown = [c for c in columns if c not in EXPORT_COLUMNS]
+    if unknown:
+        raise ValueError(f"Cột không hỗ trợ: {unknown}")
+
+    ranges = select_rows(store, symbols, start, end)
+    arrays, names = [], []
+    for col in columns:
+        if col == 'time':
+            arrays.append(pa.array(_gather(store.day, ranges), type=pa.int32()).view(pa.date32()))
+        elif col == 'symbol':
+            # mã số của symbol trong store.symbols -> DictionaryArray
+            codes = _gather(store.codes, ranges)
+            arrays.append(pa.DictionaryArray.from_arrays(pa.array(codes, type=pa.int32()),
+                                                         pa.array(store.symbol_list(), type=pa.string())))
+        else:
+            arrays.append(pa.array(_gather(store.columns[col], ranges)))
+        names.append(col)
+    return pa.Table.from_arrays(arrays, names=names)
+
+
+def iter_arrow_stream(table, max_chunksize: int = 65536) -> Iterator[bytes]:
+    """Ghi table theo Arrow IPC stream format, yield từng record batch để StreamingResponse gửi dần."""
+    pa = _require_pyarrow()
+    sink = io.BytesIO()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        for batch in table.to_batches(max_chunksize=max_chunksize):
+            writer.write_batch(batch)
+            yield sink.getvalue()
+            sink.seek(0)
+            sink.truncate()
+    yield sink.getvalue()
+
+
+def to_parquet_bytes(table) -> bytes:
+    _require_pyarrow()
+    import pyarrow.parquet as pq
+    buf = io.BytesIO()
+    pq.write_table(table, buf, compression='zstd')
+    return buf.getvalue()
+
+
+def load_panel(symbols: Optional[Sequence[str]] = None, start: Optional[str] = None, end: Optional[str] = None,
+               columns: Optional[Sequence[str]] = None, server_url: Optional[str] = None):
+    """
+    Helper cho notebook: trả về DataFrame panel lịch sử (time, symbol, open..volume).
+
+    - server_url=None: đọc thẳng kho CSV local (không cần chạy server)
+    - server_url='http://127.0.0.1:5000': tải qua /export/history dạng Arrow IPC
+
+    Ví dụ (từ thư mục notebooks/):
+        import sys; sys.path.append('../web/server')
+        from service.history_export import load_panel
+        df = load_panel(start='2023-01-01', end='2025-10-31')
+    """
+    pa = _require_pyarrow()
+    if server_url:
+        import requests
+        params = {'format': 'arrow'}
+        if symbols:
+            params['symbols'] = ','.join(symbols)
+        if start:
+            params['start'] = start
+        if end:
+            params['end'] = end
+        if columns:
+            params['columns'] = ','.join(columns)
+        resp = requests.get(f"{server_url}/export/history", params=params, timeout=300)
+        resp.raise_for_status()
+        table = pa.ipc.open_stream(resp.content).read_all()
+    else:
+        table = build_history_table(symbols=symbols, start=start, end=end, columns=columns)
+    df = table.to_pandas(date_as_object=False)
+    if 'symbol' in df.columns:
+        df['symbol'] = df['symbol'].astype(str)
+    return df
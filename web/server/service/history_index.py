@@ -0,0 +1,109 @@
+import os
+import threading
+import time
+from collections import deque
+from typing import Dict, Optional, Tuple
+
+from service.bars import Bars, iso_to_day
+
+# changed_since() trả về FULL khi không xác định được phần thay đổi -> client tải lại cả cửa sổ
+FULL = -1
+
+
+class HistoryIndex:
+    """
+    Chỉ mục bar cuối theo mã cho delta-sync.
+
+    Mỗi lần provider trả dữ liệu cho một mã, update() so bar cuối với lần trước; nếu khác
+    (có bar mới hoặc bar hôm nay đổi giá) thì tăng số thứ tự toàn cục `seq` và ghi lại
+    (seq, ngày bắt đầu thay đổi). Cursor gửi cho client chỉ là seq tại thời điểm trả lời,
+    nên kiểm tra "có gì mới cho 100 mã" chỉ là so vài số nguyên, không cần đọc lại bar.
+    """
+
+    def __init__(self, keep: int = 64):
+        self.keep = keep
+        # Cursor của process khác (server đã restart) không dùng được -> tải lại toàn bộ
+        self.epoch = f'{int(time.time()):x}{os.getpid():x}'
+        self.seq = 0
+        self._last: Dict[str, Tuple[int, tuple]] = {}
+        self._changes: Dict[str, deque] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _signature(bars: Bars) -> tuple:
+        return (float(bars.open[-1]), float(bars.high[-1]), float(bars.low[-1]),
+                float(bars.close[-1]), float(bars.volume[-1]))
+
+    def update(self, symbol: str, bars: Bars) -> None:
+        """Ghi nhận dữ liệu mới nhất của mã (bars phải kết thúc ở bar mới nhất provider có)."""
+        if len(bars) == 0:
+            return
+        symbol = symbol.upper()
+        day, sig = int(bars.day[-1]), self._signature(bars)
+        with self._lock:
+            prev = self._last.get(symbol)
+            if prev is not None and prev[0] == day and prev[1] == sig:
+                return
+            if prev is None:
+                from_day = int(bars.day[0])
+            elif day > prev[0]:
+                # Bar cuối cũ còn nguyên thì chỉ gửi các bar sau nó
+                old = bars.since(prev[0])
+                unchanged = len(old) and int(old.day[0]) == prev[0] and self._signature(old[:1]) == prev[1]
+                from_day = prev[0] + 1 if unchanged else prev[0]
+            else:
+                from_day = min(day, prev[0])
+            self.seq += 1
+            self._last[symbol] = (day, sig)
+            changes = self._changes.setdefault(symbol, deque(maxlen=self.keep))
+            changes.append((self.seq, from_day))
+
+    def last_day(self, symbol: str) -> Optional[int]:
+        entry = self._last.get(symbol.upper())
+        return entry[0] if entry else None
+
+    def cursor(self, seq: Optional[int] = None) -> str:
+        """Cursor tại `seq` (mặc định seq hiện tại) – dữ liệu trả kèm phải gồm mọi thay đổi tới seq đó."""
+        return f'{self.epoch}.{self.seq if seq is None else int(seq)}'
+
+    def parse_cursor(self, value: str) -> Optional[int]:
+        """seq từ cursor của chính process này; None nếu cursor lạ/hết hạn."""
+        epoch, _, seq = str(value).partition('.')
+        if epoch != self.epoch or not seq.isdigit() or int(seq) > self.seq:
+            return None
+        return int(seq)
+
+    def changed_since(self, symbol: str, seq: int) -> Optional[int]:
+        """
+        Ngày đầu tiên client (đang ở seq) cần tải lại cho mã này; None nếu không đổi,
+        FULL nếu lịch sử thay đổi đã bị cắt bớt (client cũ quá).
+        """
+        changes = self._changes.get(symbol.upper())
+        if not changes or changes[-1][0] <= seq:
+            return None
+        if changes[0][0] > seq + 1 and len(changes) == changes.maxlen:
+            return FULL
+        return min(d for s, d in changes if s > seq)
+
+
+def parse_since(value: Optional[str], index: HistoryIndex):
+    """
+    `since` của client: cursor do server cấp ('<epoch>.<seq>') hoặc ngày 'YYYY-MM-DD'.
+    Trả về ('cursor', seq) | ('date', day) | (None, None) nếu không dùng được.
+    """
+    if not value:
+        return None, None
+    seq = index.parse_cursor(value)
+    if seq is not None:
+        return 'cursor', seq
+    try:
+        return 'date', iso_to_day(value) + 1
+    except Exception:
+        return None, None
+
+
+_INDEX = HistoryIndex()
+
+
+def get_history_index() -> HistoryIndex:
+    return _INDEX
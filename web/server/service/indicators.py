@@ -0,0 +1,265 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from typing import Dict, List
+
+# Thứ tự cột feature khớp với feature_names_in_ của best_model.pkl
+FEATURE_COLUMNS: List[str] = [
+    'open', 'high', 'low', 'close', 'volume',
+    'price_range', 'price_range_pct', 'body_size_pct',
+    'ma_5_divergence', 'ma_20_divergence', 'ma_50_divergence',
+    'rsi_14', 'macd', 'macd_histogram', 'stochastic_k',
+    'volatility_20', 'atr_14', 'bb_width', 'bb_position',
+    'volume_ma_20', 'volume_ratio', 'obv',
+    'plus_di', 'minus_di', 'adx',
+    'Volume_Spike', 'RSI_Oversold', 'RSI_Overbought',
+    'Price_Above_MA20', 'Price_Above_MA50',
+]
+
+# Số bar mỗi input của model: dự báo chấm bar cuối của cửa sổ MODEL_WINDOW bar gần nhất,
+# và tập train dựng mỗi dòng từ đúng cửa sổ như vậy (window_features)
+MODEL_WINDOW = 50
+
+BINARY_FEATURES: List[str] = [
+    'Volume_Spike', 'RSI_Oversold', 'RSI_Overbought', 'Price_Above_MA20', 'Price_Above_MA50',
+]
+
+_EPS = 1e-10
+
+
+def _windows(x: np.ndarray, w: int) -> np.ndarray:
+    """Cửa sổ trượt độ dài w theo trục cuối, phần đầu pad NaN (tương đương rolling(min_periods=1))."""
+    pad = np.full(x.shape[:-1] + (w - 1,), np.nan)
+    return sliding_window_view(np.concatenate([pad, x], axis=-1), w, axis=-1)
+
+
+def _window_mean(win: np.ndarray, cnt: np.ndarray) -> np.ndarray:
+    # Cửa sổ toàn giá trị bằng nhau trả đúng giá trị đó (pandas cũng làm vậy),
+    # tránh sai số làm tròn lật các so sánh kiểu close > ma_20
+    lo = np.fmin.reduce(win, axis=-1)
+    hi = np.fmax.reduce(win, axis=-1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.nansum(win, axis=-1) / cnt
+    return np.where(lo == hi, lo, mean)
+
+
+def rolling_mean(x: np.ndarray, w: int) -> np.ndarray:
+    win = _windows(x, w)
+    cnt = np.sum(~np.isnan(win), axis=-1)
+    return np.where(cnt > 0, _window_mean(win, cnt), np.nan)
+
+
+def rolling_std(x: np.ndarray, w: int) -> np.ndarray:
+    """Độ lệch chuẩn mẫu (ddof=1); cửa sổ có < 2 quan sát -> NaN như pandas."""
+    win = _windows(x, w)
+    valid = ~np.isnan(win)
+    cnt = valid.sum(axis=-1)
+    mean = _window_mean(win, cnt)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        dev = np.where(valid, win - mean[..., None], 0.0)
+        var = (dev * dev).sum(axis=-1) / (cnt - 1)
+    return np.where(cnt > 1, np.sqrt(var), np.nan)
+
+
+def rolling_min(x: np.ndarray, w: int) -> np.ndarray:
+    return np.fmin.reduce(_windows(x, w), axis=-1)
+
+
+def rolling_max(x: np.ndarray, w: int) -> np.ndarray:
+    return np.fmax.reduce(_windows(x, w), axis=-1)
+
+
+def ewm_mean(x: np.ndarray, span: int) -> np.ndarray:
+    """EMA với adjust=False (y0 = x0, y_t = (1-a)·y_{t-1} + a·x_t), vector hóa theo các trục đầu."""
+    alpha = 2.0 / (span + 1.0)
+    out = np.empty_like(x)
+    if x.shape[-1] == 0:
+        return out
+    out[..., 0] = x[..., 0]
+    for t in range(1, x.shape[-1]):
+        out[..., t] = (1.0 - alpha) * out[..., t - 1] + alpha * x[..., t]
+    return out
+
+
+def _diff(x: np.ndarray) -> np.ndarray:
+    out = np.empty_like(x)
+    out[..., :1] = np.nan
+    out[..., 1:] = x[..., 1:] - x[..., :-1]
+    return out
+
+
+def _shift(x: np.ndarray) -> np.ndarray:
+    out = np.empty_like(x)
+    out[..., :1] = np.nan
+    out[..., 1:] = x[..., :-1]
+    return out
+
+
+def _nz(x: np.ndarray) -> np.ndarray:
+    """Thay 0 bằng 1e-10 (như .replace(0, 1e-10)) để tránh chia cho 0."""
+    return np.where(x == 0, _EPS, x)
+
+
+def _macd(c: np.ndarray):
+    macd = ewm_mean(c, 12) - ewm_mean(c, 26)
+    return macd, macd - ewm_mean(macd, 9)
+
+
+def _obv(delta: np.ndarray, v: np.ndarray) -> np.ndarray:
+    step = np.sign(np.nan_to_num(delta)) * v
+    step[..., 0] = 0.0
+    return np.cumsum(step, axis=-1)
+
+
+# Chỉ báo phụ thuộc điểm bắt đầu của input (EMA, tổng tích lũy): giá trị tại một bar khác nhau
+# giữa cửa sổ MODEL_WINDOW bar và toàn bộ lịch sử. Các chỉ báo còn lại chỉ nhìn tối đa 50 bar.
+PATH_DEPENDENT_FEATURES: List[str] = ['macd', 'macd_histogram', 'obv']
+
+
+def compute_features(open_: np.ndarray, high: np.ndarray, low: np.ndarray,
+                     close: np.ndarray, volume: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    Tính các chỉ báo kỹ thuật mà model cần từ mảng OHLCV đã làm sạch.
+
+    Mảng có thể 1-D (một mã) hoặc 2-D (n_mã x n_ngày); mọi phép tính đi theo trục cuối,
+    nên cả panel được tính trong một lượt. Kết quả khớp build_model_features_input bản
+    pandas tới sai số làm tròn (inf/NaN -> 0).
+    """
+    o = np.asarray(open_, dtype=np.float64)
+    h = np.asarray(high, dtype=np.float64)
+    l = np.asarray(low, dtype=np.float64)
+    c = np.asarray(close, dtype=np.float64)
+    v = np.asarray(volume, dtype=np.float64)
+
+    f: Dict[str, np.ndarray] = {'open': o, 'high': h, 'low': l, 'close': c, 'volume': v}
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # 1. Price-based
+        price_range = h - l
+        f['price_range'] = price_range
+        f['price_range_pct'] = (price_range / l) * 100
+        f['body_size_pct'] = np.abs((c - o) / o) * 100
+
+        # 2. Moving averages
+        ma_5 = rolling_mean(c, 5)
+        ma_20 = rolling_mean(c, 20)
+        ma_50 = rolling_mean(c, 50)
+        f['ma_5_divergence'] = ((c - ma_5) / ma_5) * 100
+        f['ma_20_divergence'] = ((c - ma_20) / ma_20) * 100
+        f['ma_50_divergence'] = ((c - ma_50) / ma_50) * 100
+
+        # 3. RSI
+        delta = _diff(c)
+        gain = rolling_mean(np.where(delta > 0, delta, 0.0), 14)
+        loss = rolling_mean(np.where(delta < 0, -delta, 0.0), 14)
+        rs = gain / _nz(loss)
+        rsi = 100 - (100 / (1 + rs))
+        f['rsi_14'] = rsi
+
+        # 4. MACD
+        f['macd'], f['macd_histogram'] = _macd(c)
+
+        # 5. Stochastic
+        low_14 = rolling_min(l, 14)
+        high_14 = rolling_max(h, 14)
+        f['stochastic_k'] = ((c - low_14) / _nz(high_14 - low_14)) * 100
+
+        # 6. Volatility
+        f['volatility_20'] = rolling_std(c, 20)
+
+        # 7. ATR
+        prev_close = _shift(c)
+        true_range = np.fmax(np.fmax(h - l, np.abs(h - prev_close)), np.abs(l - prev_close))
+        atr = rolling_mean(true_range, 14)
+        f['atr_14'] = atr
+
+        # 8. Bollinger Bands
+        bb_ma = ma_20
+        bb_std = f['volatility_20']
+        bb_upper = bb_ma + 2 * bb_std
+        bb_lower = bb_ma - 2 * bb_std
+        f['bb_width'] = ((bb_upper - bb_lower) / bb_ma) * 100
+        f['bb_position'] = ((c - bb_lower) / _nz(bb_upper - bb_lower)) * 100
+
+        # 9. Volume
+        volume_ma_20 = rolling_mean(v, 20)
+        f['volume_ma_20'] = volume_ma_20
+        volume_ratio = v / _nz(volume_ma_20)
+        f['volume_ratio'] = volume_ratio
+
+        # 10. OBV
+        f['obv'] = _obv(delta, v)
+
+        # 11. ADX
+        plus_dm = _diff(h)
+        minus_dm = -_diff(l)
+        plus_dm = np.where(plus_dm < 0, 0.0, plus_dm)
+        minus_dm = np.where(minus_dm < 0, 0.0, minus_dm)
+        atr_nz = _nz(atr)
+        plus_di = 100 * (rolling_mean(plus_dm, 14) / atr_nz)
+        minus_di = 100 * (rolling_mean(minus_dm, 14) / atr_nz)
+        f['plus_di'] = plus_di
+        f['minus_di'] = minus_di
+        dx = 100 * np.abs(plus_di - minus_di) / _nz(plus_di + minus_di)
+        f['adx'] = rolling_mean(dx, 14)
+
+        # 12. Binary
+        f['Volume_Spike'] = (volume_ratio > 2).astype(np.float64)
+        f['RSI_Oversold'] = (rsi < 30).astype(np.float64)
+        f['RSI_Overbought'] = (rsi > 70).astype(np.float64)
+        f['Price_Above_MA20'] = (c > ma_20).astype(np.float64)
+        f['Price_Above_MA50'] = (c > ma_50).astype(np.float64)
+
+    for k, arr in f.items():
+        f[k] = np.nan_to_num(arr, nan=0.0, posinf=0.0, neginf=0.0)
+    return f
+
+
+def window_features(open_: np.ndarray, high: np.ndarray, low: np.ndarray, close: np.ndarray,
+                    volume: np.ndarray, window: int = MODEL_WINDOW, chunk: int = 4096) -> Dict[str, np.ndarray]:
+    """
+    Feature tại bar cuối của mọi cửa sổ `window` bar liên tiếp (1-D, độ dài n - window + 1;
+    phần tử i ứng với bar i + window - 1) – đúng giá trị server tính khi chấm input `window` bar
+    kết thúc ở bar đó.
+
+    Chỉ báo cửa sổ trượt (<= 50 bar) tại bar cuối không phụ thuộc điểm bắt đầu nên lấy từ một
+    lượt compute_features trên cả lịch sử; riêng PATH_DEPENDENT_FEATURES được tính lại trên từng
+    cửa sổ (panel 2-D theo khúc `chunk` dòng), thay vì tính mọi chỉ báo cho từng cửa sổ.
+    """
+    arrays = [np.asarray(a, dtype=np.float64) for a in (open_, high, low, close, volume)]
+    m = len(arrays[3]) - window + 1
+    if m <= 0:
+        return {}
+    f = {k: v[window - 1:] for k, v in compute_features(*arrays).items()}
+    c_win, v_win = sliding_window_view(arrays[3], window), sliding_window_view(arrays[4], window)
+    parts: Dict[str, List[np.ndarray]] = {k: [] for k in PATH_DEPENDENT_FEATURES}
+    for s in range(0, m, chunk):
+        c, v = c_win[s:s + chunk], v_win[s:s + chunk]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            macd, hist = _macd(c)
+            obv = _obv(_diff(c), v)
+        for k, arr in (('macd', macd), ('macd_histogram', hist), ('obv', obv)):
+            parts[k].append(np.nan_to_num(arr[..., -1], nan=0.0, posinf=0.0, neginf=0.0))
+    f.update((k, np.concatenate(v)) for k, v in parts.items())
+    return f
+
+
+def feature_matrix(features: Dict[str, np.ndarray], columns: List[str] = FEATURE_COLUMNS) -> np.ndarray:
+    """Ghép dict feature thành ma trận (..., n_ngày, n_feature) theo thứ tự columns (cột thiếu -> 0)."""
+    ref = features['close']
+    cols = [features.get(c, np.zeros_like(ref)) for c in columns]
+    return np.stack(cols, axis=-1)
+
+
+def model_feature_columns(model) -> List[str]:
+    """
+    Cột feature mà model cần theo đúng thứ tự: feature_names_in_ của model (hoặc của bước cuối
+    trong Pipeline), mặc định FEATURE_COLUMNS. Model train trên tập feature đã chọn lọc
+    (selected_features.json) vì vậy vẫn dùng chung được compute_features.
+    """
+    names = getattr(model, 'feature_names_in_', None)
+    if names is None:
+        for _, step in reversed(getattr(model, 'steps', [])):
+            names = getattr(step, 'feature_names_in_', None)
+            if names is not None:
+                break
+    return [str(c) for c in names] if names is not None else list(FEATURE_COLUMNS)
@@ -0,0 +1,515 @@
+import json
+import os
+import random
+import threading
+import time
+import zlib
+import numpy as np
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from service.validation import clean_ta_frame
+
+# Loại dữ liệu ingest: giá (Quote.history) và 3 báo cáo tài chính (Finance.*)
+FA_REPORTS = {
+    'income': 'income_statement',
+    'balance': 'balance_sheet',
+    'cashflow': 'cash_flow',
+}
+KINDS = ('ta',) + tuple(FA_REPORTS)
+
+SOURCES = ('VCI', 'TCBS')
+
+# Phân loại lỗi giống notebooks/ta_scaping.ipynb
+RETRIABLE_KEYWORDS = (
+    "429", "too many requests", "timeout", "timed out", "temporarily blocked",
+    "max retries", "failed to establish a new connection", "connection aborted",
+    "connection reset", "read timed out", "temporarily unavailable",
+    "try again later", "rate limit", "retryerror", "systemexit",
+)
+
+NON_RETRIABLE_KEYWORDS = (
+    "invalid symbol", "khong ton tai", "does not exist", "not found",
+    "no data", "valueerror", "không tìm thấy dữ liệu", "khong tim thay du lieu",
+)
+
+RATE_LIMIT_KEYWORDS = ("429", "too many requests", "rate limit", "systemexit", "temporarily blocked")
+
+
+def classify_error(error_msg: str) -> Tuple[bool, bool]:
+    """(retriable, non_retriable) theo nội dung thông báo lỗi."""
+    error_lower = error_msg.lower()
+    is_non_retriable = any(kw in error_lower for kw in NON_RETRIABLE_KEYWORDS)
+    is_retriable = (
+        not is_non_retriable and
+        (any(kw in error_lower for kw in RETRIABLE_KEYWORDS) or
+         "http" in error_lower or "connection" in error_lower)
+    )
+    return is_retriable, is_non_retriable
+
+
+def describe_error(err: BaseException) -> str:
+    """Thông báo lỗi kèm lỗi lồng bên trong (tenacity RetryError.last_attempt)."""
+    if isinstance(err, SystemExit):
+        return f"SystemExit: {err}"
+    parts = [f"{type(err).__name__}: {err}"]
+    last_attempt = getattr(err, "last_attempt", None)
+    if last_attempt:
+        try:
+            last_exc = last_attempt.exception()
+            if last_exc:
+                parts.append(f"last_attempt: {last_exc}")
+        except Exception:
+            pass
+    return " | ".join(parts)
+
+
+class TokenBucket:
+    """
+    Rate limiter dùng chung cho mọi worker: tối đa `rate` request/giây, cho phép dồn `burst`.
+
+    Khi một worker bị provider chặn (429 / SystemExit), cooldown() tạm dừng cả pool
+    thay vì để các worker khác tiếp tục bắn request vào provider đang chặn.
+    """
+
+    def __init__(self, rate: float, burst: int = 1, clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep):
+        self.rate = float(rate)
+        self.burst = max(int(burst), 1)
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = float(self.burst)
+        self._updated = clock()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+        self.waited = 0.0
+
+    def acquire(self) -> None:
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = self._clock()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if now >= self._blocked_until and self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    return
+                wait = max(self._blocked_until - now, (1.0 - self._tokens) / self.rate)
+                self.waited += wait
+            self._sleep(wait)
+
+    def cooldown(self, seconds: float) -> None:
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, self._clock() + seconds)
+            self._tokens = 0.0
+
+
+# ---------------------------------------------------------------------------
+# Nguồn dữ liệu: lớp vnstock thật hoặc bản giả cùng interface để chạy offline
+# ---------------------------------------------------------------------------
+
+def _symbol_seed(symbol: str, salt: int = 0) -> int:
+    return zlib.crc32(f'{symbol}:{salt}'.encode('utf-8'))
+
+
+class FakeQuote:
+    """
+    Thay cho vnstock.Quote: history() trả về giá từ kho local nếu có, nếu không thì
+    random walk tất định theo mã. Có thể giả lập độ trễ, lỗi rate limit và nguồn rỗng.
+    """
+
+    latency_ms = 0.0
+    fail_rate = 0.0
+    empty_sources: Sequence[str] = ()
+    _rng = random.Random(0)
+    _lock = threading.Lock()
+
+    def __init__(self, symbol: str, source: str = 'VCI'):
+        self.symbol = symbol.upper()
+        self.source = source
+
+    @classmethod
+    def configure(cls, latency_ms: float = 0.0, fail_rate: float = 0.0,
+                  empty_sources: Sequence[str] = (), seed: Optional[int] = 0) -> type:
+        """Tạo lớp con với cấu hình riêng (để các lần chạy song song không dùng chung trạng thái)."""
+        return type(cls.__name__, (cls,), {
+            'latency_ms': latency_ms, 'fail_rate': fail_rate, 'empty_sources': tuple(empty_sources),
+            '_rng': random.Random(seed), '_lock': threading.Lock(),
+        })
+
+    def _simulate(self) -> bool:
+        """Độ trễ + lỗi giả lập; True nếu nguồn này 'không có dữ liệu'."""
+        with self._lock:
+            roll = self._rng.random()
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000.0)
+        if len(self.symbol) < 3 or not self.symbol.isalnum():
+            raise ValueError(f"Invalid symbol {self.symbol}")
+        if roll < self.fail_rate / 2:
+            raise SystemExit(f"Rate limit exceeded (simulated) for {self.symbol}")
+        if roll < self.fail_rate:
+            raise ConnectionError(f"429 Too Many Requests (simulated) for {self.symbol}")
+        return self.source in self.empty_sources
+
+    def history(self, start: str, end: str, interval: str = '1D') -> pd.DataFrame:
+        if self._simulate():
+            return pd.DataFrame(columns=['time', 'open', 'high', 'low', 'close', 'volume'])
+        from service.price_store import get_price_store
+        start_day = int(np.datetime64(start, 'D').astype(np.int64))
+        end_day = int(np.datetime64(end, 'D').astype(np.int64))
+        store = get_price_store()
+        if self.symbol in store:
+            bars = store.bars(self.symbol, start_day, end_day)
+            days, close = bars.day, bars.close
+            df = pd.DataFrame({'open': bars.open, 'high': bars.high, 'low': bars.low,
+                               'close': close, 'volume': np.nan_to_num(bars.volume).astype(np.int64)})
+        else:
+            days = np.arange(start_day, end_day + 1, dtype=np.int64)
+            days = days[np.is_busday(days.astype('datetime64[D]'))]
+            rng = np.random.default_rng(_symbol_seed(self.symbol))
+            close = np.round(20.0 * np.exp(np.cumsum(rng.normal(0, 0.015, len(days)))), 2)
+            spread = np.abs(rng.normal(0, 0.01, len(days))) * close
+            df = pd.DataFrame({'open': np.round(close + rng.normal(0, 0.3, len(days)) * spread, 2),
+                               'high': np.round(close + spread, 2), 'low': np.round(close - spread, 2),
+                               'close': close, 'volume': rng.integers(1e4, 5e6, len(days))})
+        df.insert(0, 'time', pd.to_datetime(np.asarray(days, dtype=np.int64).astype('datetime64[D]')))
+        return df
+
+
+FAKE_FA_COLUMNS = {
+    'income': ['Doanh thu (đồng)', 'Lợi nhuận sau thuế của Cổ đông công ty mẹ (đồng)', 'Lãi gộp'],
+    'balance': ['TỔNG CỘNG TÀI SẢN (đồng)', 'NỢ PHẢI TRẢ (đồng)', 'VỐN CHỦ SỞ HỮU (đồng)'],
+    'cashflow': ['Lưu chuyển tiền thuần từ hoạt động kinh doanh', 'Lưu chuyển tiền thuần từ hoạt động đầu tư',
+                 'Tiền và tương đương tiền cuối kỳ'],
+}
+
+
+class FakeFinance(FakeQuote):
+    """Thay cho vnstock.Finance: báo cáo quý tổng hợp (cột CP, Năm, Kỳ, ...) tất định theo mã."""
+
+    def _report(self, kind: str, period: str = 'quarter', lang: str = 'vi') -> pd.DataFrame:
+        cols = ['CP', 'Năm', 'Kỳ'] + FAKE_FA_COLUMNS[kind]
+        if self._simulate():
+            return pd.DataFrame(columns=cols)
+        rng = np.random.default_rng(_symbol_seed(self.symbol, len(kind)))
+        years = np.repeat(np.arange(2025, 2021, -1), 4)
+        quarters = np.tile(np.arange(4, 0, -1), 4)
+        values = np.round(rng.lognormal(26, 1.0, (len(years), 3)), 0)
+        df = pd.DataFrame(values, columns=FAKE_FA_COLUMNS[kind])
+        df.insert(0, 'Kỳ', quarters)
+        df.insert(0, 'Năm', years)
+        df.insert(0, 'CP', self.symbol)
+        return df
+
+    def income_statement(self, period: str = 'quarter', lang: str = 'vi') -> pd.DataFrame:
+        return self._report('income', period, lang)
+
+    def balance_sheet(self, period: str = 'quarter', lang: str = 'vi') -> pd.DataFrame:
+        return self._report('balance', period, lang)
+
+    def cash_flow(self, period: str = 'quarter', lang: str = 'vi') -> pd.DataFrame:
+        return self._report('cashflow', period, lang)
+
+
+def vnstock_classes():
+    from vnstock import Finance, Quote
+    return Quote, Finance
+
+
+def make_fetcher(kind: str, quote_cls=None, finance_cls=None, start: str = '2023-01-01',
+                 end: str = '2025-10-31', years: Optional[Sequence[int]] = None,
+                 limiter: Optional[TokenBucket] = None) -> Callable[[str], pd.DataFrame]:
+    """
+    fetch(symbol) -> DataFrame cho một loại dữ liệu, thử lần lượt VCI rồi TCBS khi nguồn
+    trước trả rỗng (giống notebook). Mỗi lần gọi provider đều lấy token từ limiter.
+    """
+    if kind not in KINDS:
+        raise ValueError(f"kind phải là một trong {KINDS}")
+
+    def call(fn):
+        if limiter is not None:
+            limiter.acquire()
+        return fn()
+
+    if kind == 'ta':
+        def fetch(symbol: str) -> pd.DataFrame:
+            df = pd.DataFrame()
+            for source in SOURCES:
+                df = call(lambda: quote_cls(symbol=symbol, source=source).history(start=start, end=end))
+                if df is not None and not df.empty:
+                    break
+            if df is None or df.empty:
+                return pd.DataFrame()
+            df = df.assign(symbol=symbol)
+            df['time'] = pd.to_datetime(df['time'])
+            return df[(df['time'] >= start) & (df['time'] <= end)].reset_index(drop=True)
+        return fetch
+
+    method = FA_REPORTS[kind]
+
+    def fetch(symbol: str) -> pd.DataFrame:
+        df = pd.DataFrame()
+        for source in SOURCES:
+            df = call(lambda: getattr(finance_cls(symbol=symbol, source=source), method)(period='quarter', lang='vi'))
+            if df is not None and not df.empty:
+                break
+        if df is None or df.empty:
+            return pd.DataFrame()
+        if years:
+            # Cột thứ 2 là năm (như filter_data_by_years trong notebook)
+            df = df[df[df.columns[1]].isin(list(years))]
+        return df.reset_index(drop=True)
+    return fetch
+
+
+# ---------------------------------------------------------------------------
+# Lưu trữ: mỗi mã một file nhị phân (parquet, hoặc pickle nếu thiếu pyarrow)
+# ---------------------------------------------------------------------------
+
+def _parquet_available() -> bool:
+    try:
+        import pyarrow  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+class PartitionWriter:
+    """
+    Ghi `<out_dir>/symbol=<MÃ>.<ext>`; ghi vào file tạm rồi os.replace nên một partition
+    hoặc đầy đủ hoặc không tồn tại, kể cả khi tiến trình bị dừng giữa chừng.
+    """
+
+    def __init__(self, out_dir: str, fmt: Optional[str] = None):
+        self.out_dir = out_dir
+        self.fmt = fmt or ('parquet' if _parquet_available() else 'pickle')
+        self.ext = 'parquet' if self.fmt == 'parquet' else 'pkl'
+        os.makedirs(out_dir, exist_ok=True)
+
+    def path_for(self, symbol: str) -> str:
+        return os.path.join(self.out_dir, f'symbol={symbol}.{self.ext}')
+
+    def write(self, symbol: str, df: pd.DataFrame) -> str:
+        path = self.path_for(symbol)
+        tmp = f'{path}.tmp{threading.get_ident()}'
+        if self.fmt == 'parquet':
+            # Cột object lẫn kiểu (số/chuỗi) từ báo cáo tài chính -> chuỗi để parquet chấp nhận
+            df = df.copy()
+            for col in df.columns:
+                if df[col].dtype == object and not df[col].map(lambda v: isinstance(v, str) or v is None).all():
+                    df[col] = df[col].astype(str)
+            df.to_parquet(tmp, index=False)
+        else:
+            df.to_pickle(tmp)
+        os.replace(tmp, path)
+        return path
+
+
+def read_partitions(out_dir: str, symbols: Optional[Sequence[str]] = None) -> pd.DataFrame:
+    """Gộp các partition đã ghi (parquet và/hoặc pickle) thành một DataFrame."""
+    frames = []
+    if not os.path.isdir(out_dir):
+        return pd.DataFrame()
+    wanted = {s.upper() for s in symbols} if symbols else None
+    for name in sorted(os.listdir(out_dir)):
+        if not name.startswith('symbol=') or name.endswith('.json') or '.tmp' in name:
+            continue
+        sym, _, ext = name[len('symbol='):].rpartition('.')
+        if wanted is not None and sym not in wanted:
+            continue
+        path = os.path.join(out_dir, name)
+        frames.append(pd.read_parquet(path) if ext == 'parquet' else pd.read_pickle(path))
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+
+# ---------------------------------------------------------------------------
+# Checkpoint manifest
+# ---------------------------------------------------------------------------
+
+DONE, EMPTY, FAILED = 'done', 'empty', 'failed'
+
+
+class Manifest:
+    """
+    Trạng thái từng mã của một lần ingest (JSON): status, rows, file, attempts, error.
+
+    Khi chạy lại với cùng out_dir, các mã đã 'done' (file còn tồn tại) hoặc 'empty' được bỏ
+    qua nên không phải đọc lại CSV cộng dồn như trước. Mã lỗi retriable được thử lại;
+    lỗi non-retriable chỉ thử lại khi có retry_failed.
+    """
+
+    def __init__(self, path: str, config: Optional[dict] = None):
+        self.path = path
+        self.config = config or {}
+        self.symbols: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+        self._dirty = 0
+        self._saved_at = 0.0
+
+    @classmethod
+    def load(cls, path: str, config: Optional[dict] = None) -> 'Manifest':
+        manifest = cls(path, config)
+        if os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                manifest.symbols = data.get('symbols', {})
+                if config is not None and data.get('config') not in (None, config):
+                    print(f"⚠ Cấu hình khác lần chạy trước ({data.get('config')}); vẫn tiếp tục từ checkpoint")
+            except Exception as e:
+                print(f"⚠ Không đọc được manifest {path}: {e}. Bắt đầu lại từ đầu")
+        return manifest
+
+    def pending(self, symbols: Sequence[str], retry_failed: bool = False) -> List[str]:
+        out = []
+        for sym in symbols:
+            entry = self.symbols.get(sym)
+            if entry is None:
+                out.append(sym)
+            elif entry['status'] == DONE:
+                if not entry.get('file') or not os.path.exists(entry['file']):
+                    out.append(sym)
+            elif entry['status'] == FAILED and (retry_failed or entry.get('retriable', True)):
+                out.append(sym)
+        return out
+
+    def record(self, symbol: str, **entry) -> None:
+        with self._lock:
+            prev = self.symbols.get(symbol, {})
+            entry['attempts'] = prev.get('attempts', 0) + entry.pop('attempts', 1)
+            entry['updated'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+            self.symbols[symbol] = entry
+            self._dirty += 1
+
+    def save(self, force: bool = True, every: int = 20, interval: float = 2.0) -> None:
+        """Ghi nguyên tử; khi force=False chỉ ghi nếu đã đủ `every` thay đổi hoặc `interval` giây."""
+        with self._lock:
+            if not self._dirty:
+                return
+            if not force and self._dirty < every and time.monotonic() - self._saved_at < interval:
+                return
+            data = {'config': self.config, 'symbols': self.symbols}
+            tmp = f'{self.path}.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=1)
+            os.replace(tmp, self.path)
+            self._dirty = 0
+            self._saved_at = time.monotonic()
+
+    def summary(self) -> Dict[str, int]:
+        counts = {DONE: 0, EMPTY: 0, FAILED: 0}
+        for entry in self.symbols.values():
+            counts[entry['status']] = counts.get(entry['status'], 0) + 1
+        counts['quarantined'] = sum(int(entry.get('quarantined') or 0) for entry in self.symbols.values())
+        return counts
+
+
+# ---------------------------------------------------------------------------
+# Worker pool
+# ---------------------------------------------------------------------------
+
+def fetch_with_retry(fetch: Callable[[str], pd.DataFrame], symbol: str, max_retries: int = 8,
+                     backoff_s: float = 60.0, max_backoff_s: float = 300.0,
+                     limiter: Optional[TokenBucket] = None):
+    """
+    (df, error, retriable, attempts). Lỗi rate limit làm cả pool nghỉ (limiter.cooldown),
+    lỗi khác chỉ làm worker hiện tại chờ; lỗi non-retriable dừng ngay.
+    """
+    error_msg = None
+    for attempt in range(1, max_retries + 1):
+        try:
+            return fetch(symbol), None, False, attempt
+        except KeyboardInterrupt:
+            raise
+        except (SystemExit, Exception) as exc:
+            error_msg = describe_error(exc)
+        retriable, non_retriable = classify_error(error_msg)
+        if non_retriable or not retriable or attempt == max_retries:
+            return None, error_msg, retriable and not non_retriable, attempt
+        wait = min(backoff_s * attempt, max_backoff_s)
+        if limiter is not None and any(kw in error_msg.lower() for kw in RATE_LIMIT_KEYWORDS):
+            limiter.cooldown(wait)
+        else:
+            time.sleep(wait)
+    return None, error_msg or "Max retries exceeded", True, max_retries
+
+
+def run_ingest(symbols: Sequence[str], fetch: Callable[[str], pd.DataFrame], writer: PartitionWriter,
+               manifest: Manifest, workers: int = 4, max_retries: int = 8, backoff_s: float = 60.0,
+               limiter: Optional[TokenBucket] = None, retry_failed: bool = False,
+               progress: bool = True, validate: Optional[Callable[[pd.DataFrame], Any]] = None,
+               quarantine: Optional[PartitionWriter] = None) -> Dict[str, int]:
+    """
+    Lấy dữ liệu các mã chưa xong trong manifest bằng `workers` thread, ghi partition + checkpoint.
+
+    validate (vd. service.validation.validate_frame, chỉ cho TA): bar sai được ghi vào
+    `quarantine` (cùng layout symbol=<MÃ>) kèm lý do, partition chính chỉ chứa bar hợp lệ,
+    nên dữ liệu đã ghi dùng được ngay, không phải làm sạch lại sau.
+    """
+    symbols = list(dict.fromkeys(symbols))
+    # Partition đã ghi nhưng chưa kịp vào manifest (bị dừng giữa hai lần lưu) -> coi là xong
+    for sym in symbols:
+        path = writer.path_for(sym)
+        if sym not in manifest.symbols and os.path.exists(path):
+            manifest.record(sym, status=DONE, rows=None, file=path, attempts=0)
+    todo = manifest.pending(symbols, retry_failed=retry_failed)
+    total = len(todo)
+    skipped = len(symbols) - total
+    if progress:
+        print(f"Cần lấy {total} mã ({skipped} mã đã có trong checkpoint), {workers} worker")
+
+    def work(sym: str):
+        df, err, retriable, attempts = fetch_with_retry(fetch, sym, max_retries, backoff_s, limiter=limiter)
+        if err is not None:
+            manifest.record(sym, status=FAILED, error=err[:500], retriable=retriable, attempts=attempts)
+            return sym, FAILED, err
+        if df is None or df.empty:
+            manifest.record(sym, status=EMPTY, rows=0, attempts=attempts)
+            return sym, EMPTY, None
+        extra = {}
+        if validate is not None:
+            checked = validate(df)
+            extra = {'quarantined': int(len(checked.quarantine)),
+                     'missing_sessions': int(checked.gaps['missing_sessions'].sum()) if len(checked.gaps) else 0}
+            if quarantine is not None:
+                if len(checked.quarantine):
+                    quarantine.write(sym, checked.quarantine)
+                elif os.path.exists(quarantine.path_for(sym)):
+                    os.remove(quarantine.path_for(sym))
+            df = clean_ta_frame(checked)
+            if df.empty:
+                manifest.record(sym, status=EMPTY, rows=0, attempts=attempts, **extra)
+                return sym, EMPTY, None
+        path = writer.write(sym, df)
+        manifest.record(sym, status=DONE, rows=int(len(df)), file=path, attempts=attempts, **extra)
+        return sym, DONE, len(df)
+
+    t0 = time.perf_counter()
+    pool = ThreadPoolExecutor(max_workers=max(int(workers), 1))
+    futures = []
+    try:
+        futures = [pool.submit(work, sym) for sym in todo]
+        for i, fut in enumerate(as_completed(futures), 1):
+            sym, status, info = fut.result()
+            manifest.save(force=False)
+            if progress:
+                if status == DONE:
+                    print(f"[{i}/{total}] {sym}: ✓ {info} dòng")
+                elif status == EMPTY:
+                    print(f"[{i}/{total}] {sym}: ⚠ Không có dữ liệu")
+                else:
+                    print(f"[{i}/{total}] {sym}: ✗ {str(info)[:100]}")
+    finally:
+        # Ctrl+C: lưu ngay checkpoint, bỏ các mã chưa bắt đầu, chờ mã đang chạy xong rồi lưu lần nữa
+        manifest.save()
+        for fut in futures:
+            fut.cancel()
+        try:
+            pool.shutdown(wait=True)
+        finally:
+            manifest.save()
+    stats = manifest.summary()
+    stats['elapsed_s'] = round(time.perf_counter() - t0, 2)
+    return stats
@@ -0,0 +1,346 @@
+import glob
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from service.bars import PRICE_FIELDS, TIME_ALIASES, COLUMN_ALIASES, Bars, _find_column, _json_values
+from service.price_store import _find_repo_root
+
+# Độ dài mỗi khung (phút); '1D' = cả phiên. Bucket không vượt quá một ngày nên gộp được theo
+# từng partition tháng rồi nối lại.
+INTERVALS = {'1m': 1, '5m': 5, '15m': 15, '30m': 30, '1h': 60, '1D': 1440}
+_ALIASES = {'1': '1m', '1min': '1m', '5min': '5m', '15min': '15m', '30min': '30m', '60m': '1h', '1H': '1h',
+            'H': '1h', 'D': '1D', '1d': '1D'}
+MINUTES_PER_DAY = 1440
+EXCHANGE_TZ = 'Asia/Ho_Chi_Minh'
+
+_DAILY = ['d_day', 'd_open', 'd_high', 'd_low', 'd_close', 'd_volume']
+
+
+def normalize_interval(value: str) -> str:
+    """'5m' / '5min' / '1H' / 'D' ... -> tên chuẩn trong INTERVALS; sai -> ValueError."""
+    v = str(value or '').strip()
+    v = _ALIASES.get(v, v)
+    if v not in INTERVALS:
+        raise ValueError(f"interval phải là một trong {list(INTERVALS)}")
+    return v
+
+
+def _parse_minutes(values) -> np.ndarray:
+    """Thời điểm bất kỳ -> int64 phút kể từ epoch theo giờ sàn (NaT -> -1)."""
+    ts = pd.to_datetime(pd.Series(values), errors='coerce')
+    if getattr(ts.dt, 'tz', None) is not None:
+        ts = ts.dt.tz_convert(EXCHANGE_TZ).dt.tz_localize(None)
+    m = ts.values.astype('datetime64[m]')
+    out = m.astype(np.int64)
+    out[np.isnat(m)] = -1
+    return out
+
+
+class MinuteBars:
+    """
+    OHLCV trong ngày của một mã, như Bars nhưng mốc thời gian là phút (int64 phút kể từ epoch,
+    giờ sàn, tăng dần, không trùng). Bar đã gộp (5m, 1h...) mang mốc đầu khung.
+    """
+    __slots__ = ('symbol', 'ts', 'open', 'high', 'low', 'close', 'volume')
+
+    def __init__(self, symbol: str, ts: np.ndarray, open: np.ndarray, high: np.ndarray,
+                 low: np.ndarray, close: np.ndarray, volume: np.ndarray):
+        self.symbol = str(symbol).upper()
+        self.ts = np.ascontiguousarray(ts, dtype=np.int64)
+        self.open = np.ascontiguousarray(open, dtype=np.float64)
+        self.high = np.ascontiguousarray(high, dtype=np.float64)
+        self.low = np.ascontiguousarray(low, dtype=np.float64)
+        self.close = np.ascontiguousarray(close, dtype=np.float64)
+        self.volume = np.ascontiguousarray(volume, dtype=np.float64)
+
+    @classmethod
+    def empty(cls, symbol: str) -> 'MinuteBars':
+        z = np.empty(0, dtype=np.float64)
+        return cls(symbol, np.empty(0, dtype=np.int64), z, z, z, z, z)
+
+    @classmethod
+    def from_frame(cls, df: Optional[pd.DataFrame], symbol: str) -> 'MinuteBars':
+        """DataFrame của provider (tên cột theo alias như Bars) -> MinuteBars; trùng mốc giữ dòng sau."""
+        if df is None or df.empty:
+            return cls.empty(symbol)
+        time_col = _find_column(df.columns, TIME_ALIASES)
+        if time_col is None:
+            return cls.empty(symbol)
+        ts = _parse_minutes(df[time_col].values)
+        ok = ts >= 0
+        cols = {}
+        for field in PRICE_FIELDS:
+            src = _find_column(df.columns, COLUMN_ALIASES[field])
+            cols[field] = (np.full(len(df), np.nan) if src is None else
+                           pd.to_numeric(df[src], errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan))
+        return cls(symbol, ts[ok], *(cols[f][ok] for f in PRICE_FIELDS)).dedup()
+
+    @classmethod
+    def concat(cls, symbol: str, parts: List['MinuteBars']) -> 'MinuteBars':
+        parts = [p for p in parts if len(p)]
+        if not parts:
+            return cls.empty(symbol)
+        if len(parts) == 1:
+            return parts[0]
+        return cls(symbol, np.concatenate([p.ts for p in parts]),
+                   *(np.concatenate([getattr(p, f) for p in parts]) for f in PRICE_FIELDS))
+
+    def __len__(self) -> int:
+        return int(self.ts.shape[0])
+
+    def __getitem__(self, key) -> 'MinuteBars':
+        if isinstance(key, slice) or (isinstance(key, np.ndarray) and key.dtype != object):
+            return MinuteBars(self.symbol, self.ts[key], *(getattr(self, f)[key] for f in PRICE_FIELDS))
+        raise TypeError('MinuteBars chỉ hỗ trợ slice / mảng chỉ số')
+
+    def dedup(self) -> 'MinuteBars':
+        """Sắp theo thời gian; cùng phút thì giữ bar xuất hiện sau cùng."""
+        if len(self) < 2 or (np.all(np.diff(self.ts) > 0)):
+            return self
+        order = np.argsort(self.ts, kind='stable')
+        ts = self.ts[order]
+        last = np.r_[ts[1:] != ts[:-1], True]
+        return self[order[last]]
+
+    def between(self, start: Optional[int] = None, end: Optional[int] = None) -> 'MinuteBars':
+        """Bar có start <= ts <= end (phút)."""
+        lo = 0 if start is None else int(np.searchsorted(self.ts, start, side='left'))
+        hi = len(self) if end is None else int(np.searchsorted(self.ts, end, side='right'))
+        return self[lo:hi]
+
+    def merge(self, update: 'MinuteBars') -> 'MinuteBars':
+        """Ghép bar mới: bar cùng mốc lấy theo update (bar đang hình thành được ghi đè)."""
+        if not len(update):
+            return self
+        if not len(self):
+            return update
+        return MinuteBars.concat(self.symbol, [self, update]).dedup()
+
+    @property
+    def last_ts(self) -> Optional[int]:
+        return int(self.ts[-1]) if len(self) else None
+
+    def times(self) -> np.ndarray:
+        return np.datetime_as_string(self.ts.astype('datetime64[m]'), unit='m')
+
+    def to_daily(self) -> Bars:
+        """Gộp thành bar ngày (open đầu phiên, high/low cực trị, close cuối phiên, volume tổng)."""
+        agg = resample(self, '1D')
+        return Bars(self.symbol, agg.ts // MINUTES_PER_DAY, agg.open, agg.high, agg.low, agg.close, agg.volume)
+
+    def to_records(self) -> List[Dict[str, Any]]:
+        if not len(self):
+            return []
+        cols = (self.times().tolist(), _json_values(self.open), _json_values(self.high), _json_values(self.low),
+                _json_values(self.close), _json_values(self.volume, integral=True))
+        sym = self.symbol
+        return [{'time': t, 'open': o, 'high': h, 'low': l, 'close': c, 'volume': v, 'symbol': sym}
+                for t, o, h, l, c, v in zip(*cols)]
+
+
+def resample(bars: MinuteBars, interval: str) -> MinuteBars:
+    """
+    Gộp bar phút thành khung `interval` trong một lượt reduceat: open = bar đầu, high = max,
+    low = min (bỏ NaN), close = bar cuối, volume = tổng. Mốc của bar gộp là đầu khung.
+    """
+    width = INTERVALS[normalize_interval(interval)]
+    if width == 1 or not len(bars):
+        return bars
+    keys = bars.ts // width
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    ends = np.r_[starts[1:], len(bars)] - 1
+    return MinuteBars(bars.symbol, keys[starts] * width, bars.open[starts],
+                      np.fmax.reduceat(bars.high, starts), np.fmin.reduceat(bars.low, starts),
+                      bars.close[ends], np.add.reduceat(np.nan_to_num(bars.volume), starts))
+
+
+def _month_of(ts: np.ndarray) -> np.ndarray:
+    return ts.astype('datetime64[m]').astype('datetime64[M]').astype(np.int64)
+
+
+def _month_label(month: int) -> str:
+    return str(np.datetime64(int(month), 'M'))
+
+
+class IntradayStore:
+    """
+    Kho bar phút trên đĩa, chia theo mã và tháng: <root>/symbol=<MÃ>/<YYYY-MM>.npz (nén, mỗi
+    cột một mảng). Mỗi file chứa thêm bar ngày gộp sẵn (d_*) để pipeline ngày đọc bar ngày mà
+    không giải nén bar phút (npz chỉ giải nén mảng được truy cập). Khung 5m/15m/1h gộp theo
+    từng partition và cache LRU theo (mã, tháng, khung, mtime).
+    """
+
+    def __init__(self, root: str, cache_entries: int = 512):
+        self.root = root
+        self.cache_entries = cache_entries
+        self._cache: 'OrderedDict[Tuple, Any]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'writes': 0}
+
+    def _dir(self, symbol: str) -> str:
+        return os.path.join(self.root, f'symbol={symbol.upper()}')
+
+    def _path(self, symbol: str, month: int) -> str:
+        return os.path.join(self._dir(symbol), f'{_month_label(month)}.npz')
+
+    def symbols(self) -> List[str]:
+        return sorted(os.path.basename(d)[len('symbol='):] for d in glob.glob(os.path.join(self.root, 'symbol=*'))
+                      if os.path.isdir(d))
+
+    def months(self, symbol: str) -> List[int]:
+        files = glob.glob(os.path.join(self._dir(symbol), '*.npz'))
+        return sorted(int(np.datetime64(os.path.basename(f)[:-4], 'M').astype(np.int64)) for f in files)
+
+    def __contains__(self, symbol: str) -> bool:
+        return bool(self.months(symbol))
+
+    # --- ghi ---
+
+    def write(self, bars: MinuteBars) -> int:
+        """Ghép `bars` vào các partition tháng tương ứng (ghi nguyên tử); trả về số partition đã đổi."""
+        if not len(bars):
+            return 0
+        bars = bars.dedup()
+        months = _month_of(bars.ts)
+        bounds = np.flatnonzero(np.r_[True, months[1:] != months[:-1], True])
+        os.makedirs(self._dir(bars.symbol), exist_ok=True)
+        written = 0
+        with self._write_lock:
+            for lo, hi in zip(bounds[:-1], bounds[1:]):
+                month = int(months[lo])
+                old = self._load(bars.symbol, month)
+                part = old.merge(bars[lo:hi])
+                if len(part) == len(old) and all(np.array_equal(getattr(part, f), getattr(old, f), equal_nan=True)
+                                                 for f in ('ts', *PRICE_FIELDS)):
+                    continue                    # không có gì mới -> giữ file (và cache theo mtime)
+                self._save(part, month)
+                written += 1
+        self.stats['writes'] += written
+        return written
+
+    def _save(self, bars: MinuteBars, month: int) -> None:
+        daily = bars.to_daily()
+        path = self._path(bars.symbol, month)
+        tmp = path + '.tmp.npz'
+        # phút kể từ epoch vừa int32 (tới năm 6053)
+        np.savez_compressed(tmp, ts=bars.ts.astype(np.int32), **{f: getattr(bars, f) for f in PRICE_FIELDS},
+                            d_day=daily.day, **{f'd_{f}': getattr(daily, f) for f in PRICE_FIELDS})
+        os.replace(tmp, path)
+
+    # --- đọc ---
+
+    def _load(self, symbol: str, month: int, fields: Optional[List[str]] = None) -> Any:
+        path = self._path(symbol, month)
+        if not os.path.exists(path):
+            return MinuteBars.empty(symbol) if fields is None else None
+        with np.load(path) as z:
+            if fields is not None:
+                return {f: z[f] for f in fields}
+            return MinuteBars(symbol, z['ts'], *(z[f] for f in PRICE_FIELDS))
+
+    def _cached(self, symbol: str, month: int, kind: str, build):
+        path = self._path(symbol, month)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return None
+        key = (symbol, month, kind, mtime)
+        with self._lock:
+            hit = self._cache.get(key)
+            if hit is not None:
+                self._cache.move_to_end(key)
+                self.stats['hits'] += 1
+                return hit
+        value = build()
+        with self._lock:
+            self.stats['misses'] += 1
+            self._cache[key] = value
+            while len(self._cache) > self.cache_entries:
+                self._cache.popitem(last=False)
+        return value
+
+    def _month_range(self, symbol: str, start: Optional[int], end: Optional[int]) -> List[int]:
+        lo = None if start is None else int(_month_of(np.array([start]))[0])
+        hi = None if end is None else int(_month_of(np.array([end]))[0])
+        return [m for m in self.months(symbol) if (lo is None or m >= lo) and (hi is None or m <= hi)]
+
+    def read(self, symbol: str, interval: str = '1m', start: Optional[int] = None,
+             end: Optional[int] = None) -> MinuteBars:
+        """Bar khung `interval` trong [start, end] (phút); chỉ mở các partition giao với khoảng."""
+        symbol = symbol.upper()
+        interval = normalize_interval(interval)
+        if interval == '1D':
+            daily = self.daily(symbol, None if start is None else start // MINUTES_PER_DAY,
+                               None if end is None else end // MINUTES_PER_DAY)
+            return MinuteBars(symbol, daily.day.astype(np.int64) * MINUTES_PER_DAY, daily.open, daily.high,
+                              daily.low, daily.close, daily.volume)
+        parts = []
+        for month in self._month_range(symbol, start, end):
+            if interval == '1m':
+                parts.append(self._load(symbol, month))
+            else:
+                parts.append(self._cached(symbol, month, interval,
+                                          lambda m=month: resample(self._load(symbol, m), interval)))
+        bars = MinuteBars.concat(symbol, [p for p in parts if p is not None])
+        if start is not None:
+            # Khung gộp chứa `start` tính từ đầu khung
+            start -= start % INTERVALS[interval]
+        return bars.between(start, end)
+
+    def daily(self, symbol: str, start_day: Optional[int] = None, end_day: Optional[int] = None) -> Bars:
+        """Bar ngày gộp sẵn (đọc mảng d_* của từng partition, không giải nén bar phút)."""
+        symbol = symbol.upper()
+        start = None if start_day is None else int(start_day) * MINUTES_PER_DAY
+        end = None if end_day is None else int(end_day) * MINUTES_PER_DAY
+        parts = []
+        for month in self._month_range(symbol, start, end):
+            d = self._cached(symbol, month, '1D', lambda m=month: self._load(symbol, m, _DAILY))
+            if d is not None:
+                parts.append(d)
+        if not parts:
+            return Bars.empty(symbol)
+        bars = Bars(symbol, np.concatenate([p['d_day'] for p in parts]),
+                    *(np.concatenate([p[f'd_{f}'] for p in parts]) for f in PRICE_FIELDS))
+        lo = 0 if start_day is None else int(np.searchsorted(bars.day, start_day, side='left'))
+        hi = len(bars) if end_day is None else int(np.searchsorted(bars.day, end_day, side='right'))
+        return bars[lo:hi]
+
+    def last_ts(self, symbol: str) -> Optional[int]:
+        months = self.months(symbol)
+        if not months:
+            return None
+        d = self._load(symbol.upper(), months[-1], ['ts'])
+        return int(d['ts'][-1]) if d is not None and len(d['ts']) else None
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            entries = len(self._cache)
+        return {'root': self.root, 'cache_entries': entries, **self.stats}
+
+
+def default_intraday_dir() -> str:
+    return os.environ.get('INTRADAY_DIR') or os.path.join(_find_repo_root(), 'data', 'intraday')
+
+
+_STORE: Optional[IntradayStore] = None
+_STORE_LOCK = threading.Lock()
+
+
+def get_intraday_store() -> IntradayStore:
+    global _STORE
+    if _STORE is None:
+        with _STORE_LOCK:
+            if _STORE is None:
+                _STORE = IntradayStore(default_intraday_dir())
+    return _STORE
+
+
+def iso_to_minute(value: str) -> int:
+    """'YYYY-MM-DD' hoặc 'YYYY-MM-DD HH:MM' -> phút kể từ epoch."""
+    return int(np.datetime64(pd.Timestamp(value).to_datetime64(), 'm').astype(np.int64))
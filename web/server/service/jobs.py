@@ -0,0 +1,284 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+JOB_MAX_QUEUE = int(os.environ.get('JOB_MAX_QUEUE', 16))
+JOB_TTL_SECONDS = int(os.environ.get('JOB_TTL_S', 3600))
+# Đặt JOBS_DB=đường/dẫn.sqlite để giữ kết quả job qua lần khởi động lại (mặc định chỉ trong bộ nhớ)
+JOBS_DB = os.environ.get('JOBS_DB') or None
+
+QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+FINISHED = (DONE, FAILED)
+
+# fn(params, progress) -> kết quả (JSON được nếu dùng SQLite); progress(done, total, message)
+Progress = Callable[[int, int, Optional[str]], None]
+JobFn = Callable[[Dict[str, Any], Progress], Any]
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+def job_key(kind: str, params: Dict[str, Any]) -> str:
+    """Khóa dedup: cùng loại + cùng tham số (không phụ thuộc thứ tự key) -> cùng khóa."""
+    raw = json.dumps({'kind': kind, 'params': params}, sort_keys=True, default=str)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()[:16]
+
+
+def job_params(defaults: Dict[str, Dict[str, Any]], kind: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    """Tham số đầy đủ của job (mặc định + params); kind / tham số lạ / days không phải số -> ValueError."""
+    base = defaults.get(kind)
+    if base is None:
+        raise ValueError(f"kind phải là một trong {list(defaults)}")
+    unknown = set(params) - set(base)
+    if unknown:
+        raise ValueError(f"Tham số không hỗ trợ: {sorted(unknown)}")
+    out = {**base, **params}
+    if 'days' in out:
+        try:
+            out['days'] = int(out['days'])
+        except (TypeError, ValueError):
+            raise ValueError("days phải là số nguyên")
+    return out
+
+
+class Job:
+    def __init__(self, kind: str, params: Dict[str, Any]):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.params = params
+        self.key = job_key(kind, params)
+        self.status = QUEUED
+        self.done = 0
+        self.total = 0
+        self.message: Optional[str] = None
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.created = time.time()
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.subscribers = 1                        # số lần submit được gộp vào job này
+        self._event = threading.Event()
+
+    def to_dict(self, result: bool = False) -> Dict[str, Any]:
+        now = time.time()
+        out = {
+            'id': self.id,
+            'kind': self.kind,
+            'params': self.params,
+            'status': self.status,
+            'progress': {'done': self.done, 'total': self.total,
+                         'percent': round(100.0 * self.done / self.total, 1) if self.total else None,
+                         'message': self.message},
+            'subscribers': self.subscribers,
+            'created': _iso(self.created),
+            'started': _iso(self.started),
+            'finished': _iso(self.finished),
+            'elapsed_s': round((self.finished or now) - self.started, 3) if self.started else None,
+            'error': self.error,
+        }
+        if result and self.status == DONE:
+            out['result'] = self.result
+        return out
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self._event.wait(timeout)
+
+
+def _iso(ts: Optional[float]) -> Optional[str]:
+    return time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(ts)) if ts else None
+
+
+class SQLiteJobStore:
+    """
+    Lưu job đã xong (và trạng thái job đang chạy) vào SQLite để đọc lại kết quả sau khi
+    server khởi động lại. Job đang chạy dở lúc tắt server được đánh dấu failed khi mở lại.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as db:
+            db.execute('CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, kind TEXT, params TEXT, '
+                       'key TEXT, status TEXT, done INTEGER, total INTEGER, message TEXT, result TEXT, '
+                       'error TEXT, created REAL, started REAL, finished REAL)')
+            db.execute("UPDATE jobs SET status = ?, error = 'interrupted (server restart)', finished = ? "
+                       "WHERE status IN (?, ?)", (FAILED, time.time(), QUEUED, RUNNING))
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=10)
+
+    def save(self, job: Job) -> None:
+        try:
+            result = json.dumps(job.result, default=str) if job.status == DONE else None
+        except Exception as e:
+            result, job.error = None, f'kết quả không lưu được: {e}'
+        row = (job.id, job.kind, json.dumps(job.params, default=str), job.key, job.status, job.done, job.total,
+               job.message, result, job.error, job.created, job.started, job.finished)
+        with self._lock, self._connect() as db:
+            db.execute('INSERT OR REPLACE INTO jobs VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)', row)
+
+    def load(self, job_id: str) -> Optional[Job]:
+        with self._lock, self._connect() as db:
+            row = db.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = Job(row[1], json.loads(row[2]))
+        (job.id, job.key, job.status, job.done, job.total, job.message) = (row[0], row[3], row[4], row[5], row[6], row[7])
+        job.result = json.loads(row[8]) if row[8] is not None else None
+        job.error, job.created, job.started, job.finished = row[9], row[10], row[11], row[12]
+        job._event.set()
+        return job
+
+    def prune(self, before: float) -> None:
+        with self._lock, self._connect() as db:
+            db.execute('DELETE FROM jobs WHERE finished IS NOT NULL AND finished < ?', (before,))
+
+
+class JobManager:
+    """
+    Hàng đợi job trong process cho các tác vụ nặng (chạy dự báo / làm mới lịch sử cả Top 100):
+
+    - submit(kind, params): tạo job; cùng tham số với một job đang chờ/chạy thì dùng chung job đó
+    - tối đa `workers` job chạy đồng thời, còn lại xếp hàng (quá `max_queue` -> JobQueueFull)
+    - tiến độ cập nhật qua callback progress(done, total, message) mà hàm của job nhận được
+    - job đã xong giữ kết quả `ttl` giây (trong bộ nhớ, hoặc SQLite nếu có `db_path`)
+    """
+
+    def __init__(self, workers: int = JOB_WORKERS, max_queue: int = JOB_MAX_QUEUE,
+                 ttl: int = JOB_TTL_SECONDS, db_path: Optional[str] = JOBS_DB):
+        self.workers = max(1, workers)
+        self.max_queue = max_queue
+        self.ttl = ttl
+        self._kinds: Dict[str, JobFn] = {}
+        self._jobs: Dict[str, Job] = {}
+        self._inflight: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='job')
+        self.store = SQLiteJobStore(db_path) if db_path else None
+        self._store_pruned = 0.0
+        self.stats = {'submitted': 0, 'deduplicated': 0, 'rejected': 0, 'done': 0, 'failed': 0}
+
+    def register(self, kind: str, fn: JobFn) -> None:
+        self._kinds[kind] = fn
+
+    @property
+    def kinds(self) -> List[str]:
+        return list(self._kinds)
+
+    def submit(self, kind: str, params: Dict[str, Any]) -> Job:
+        if kind not in self._kinds:
+            raise KeyError(kind)
+        key = job_key(kind, params)
+        with self._lock:
+            self._prune()
+            job = self._inflight.get(key)
+            if job is not None:
+                job.subscribers += 1
+                self.stats['deduplicated'] += 1
+                return job
+            queued = sum(1 for j in self._inflight.values() if j.status == QUEUED)
+            if queued >= self.max_queue:
+                self.stats['rejected'] += 1
+                raise JobQueueFull(f'Hàng đợi đầy ({queued} job đang chờ)')
+            job = Job(kind, params)
+            self._jobs[job.id] = job
+            self._inflight[key] = job
+            self.stats['submitted'] += 1
+        self._save(job)
+        self._pool.submit(self._run, job)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            self._prune()
+            job = self._jobs.get(job_id)
+        if job is None and self.store is not None:
+            job = self.store.load(job_id)
+            if job is not None and job.finished and job.finished < time.time() - self.ttl:
+                job = None
+        return job
+
+    def list(self, status: Optional[str] = None) -> List[Job]:
+        with self._lock:
+            self._prune()
+            jobs = list(self._jobs.values())
+        jobs = [j for j in jobs if status is None or j.status == status]
+        return sorted(jobs, key=lambda j: j.created, reverse=True)
+
+    def _run(self, job: Job) -> None:
+        fn = self._kinds[job.kind]
+        job.status, job.started = RUNNING, time.time()
+        self._save(job)
+        last_save = [0.0]
+
+        def progress(done: int, total: int, message: Optional[str] = None) -> None:
+            job.done, job.total, job.message = int(done), int(total), message
+            # SQLite: ghi tiến độ tối đa 1 lần/giây
+            if self.store is not None and time.time() - last_save[0] > 1.0:
+                last_save[0] = time.time()
+                self._save(job)
+
+        try:
+            job.result = fn(dict(job.params), progress)
+            job.status = DONE
+            if job.total and job.done < job.total:
+                job.done = job.total
+        except Exception as e:
+            print(f"Job {job.kind} {job.id} lỗi: {e}")
+            job.status, job.error = FAILED, str(e)
+        job.finished = time.time()
+        with self._lock:
+            if self._inflight.get(job.key) is job:
+                del self._inflight[job.key]
+            self.stats[job.status] += 1
+        self._save(job)
+        job._event.set()
+
+    def _save(self, job: Job) -> None:
+        if self.store is not None:
+            try:
+                self.store.save(job)
+            except Exception as e:
+                print(f"Không lưu được job {job.id}: {e}")
+
+    def _prune(self) -> None:
+        """Bỏ job đã xong quá ttl (gọi khi đang giữ _lock)."""
+        cutoff = time.time() - self.ttl
+        for job_id in [i for i, j in self._jobs.items() if j.finished and j.finished < cutoff]:
+            del self._jobs[job_id]
+        if self.store is not None and time.time() - self._store_pruned > 60:
+            self._store_pruned = time.time()
+            try:
+                self.store.prune(cutoff)
+            except Exception as e:
+                print(f"Không dọn được job cũ: {e}")
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            counts: Dict[str, int] = {}
+            for j in self._jobs.values():
+                counts[j.status] = counts.get(j.status, 0) + 1
+        return {'workers': self.workers, 'max_queue': self.max_queue, 'ttl_s': self.ttl,
+                'persistent': self.store is not None, 'kinds': self.kinds, 'jobs': counts, **self.stats}
+
+
+_MANAGER: Optional[JobManager] = None
+_MANAGER_LOCK = threading.Lock()
+
+
+def get_job_manager() -> JobManager:
+    global _MANAGER
+    if _MANAGER is None:
+        with _MANAGER_LOCK:
+            if _MANAGER is None:
+                _MANAGER = JobManager()
+    return _MANAGER
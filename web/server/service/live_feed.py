@@ -0,0 +1,290 @@
+import asyncio
+import json
+import threading
+import time
+import numpy as np
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set
+
+from service.bars import Bars, days_to_iso
+from service.indicators import MODEL_WINDOW, compute_features
+from service.model_set import ModelSpec, get_model_set, get_shadow_runner, load_models, matrix_builder, score_all
+from service.price_store import PriceStore, get_price_store
+
+WINDOW = MODEL_WINDOW
+
+# Chỉ báo của bar mới nhất gửi kèm điểm số (để client hiển thị, không phải toàn bộ feature)
+LIVE_INDICATORS = ['rsi_14', 'macd_histogram', 'stochastic_k', 'volume_ratio', 'ma_20_divergence', 'adx']
+
+
+def merge_bars(state: Bars, update: Bars, window: int = WINDOW) -> Bars:
+    """Ghép bar mới vào cửa sổ hiện tại (bar cùng ngày bị thay), giữ `window` bar cuối."""
+    return state.merge(update).tail(window)
+
+
+def _same_bars(a: Bars, b: Bars) -> bool:
+    if len(a) != len(b):
+        return False
+    return bool(np.array_equal(a.day, b.day) and np.array_equal(a.close, b.close)
+                and np.array_equal(a.volume, b.volume) and np.array_equal(a.high, b.high)
+                and np.array_equal(a.low, b.low) and np.array_equal(a.open, b.open))
+
+
+class LiveFeed:
+    """
+    Trạng thái live của từng mã: cửa sổ WINDOW bar cuối + điểm số gần nhất.
+
+    ingest() nhận bar mới cho nhiều mã, chỉ tính lại những mã có bar thay đổi – cả nhóm
+    được tính chỉ báo trong một lượt (panel 2-D) và chấm điểm bằng một lần predict_proba.
+    Điểm số dùng cùng input với predict_for_symbol (50 bar cuối, đã làm sạch) và cùng model
+    primary của model set như /predict (đổi models.json là feed đổi theo); model shadow được
+    chấm nền và ghi vào /models/metrics như các request khác.
+    `model_path` chỉ dùng để cố định một file model (test/benchmark).
+    """
+
+    def __init__(self, model_path: Optional[str] = None, store: Optional[PriceStore] = None,
+                 window: int = WINDOW):
+        self.model_path = model_path
+        self.window = window
+        self._store = store
+        self._bars: Dict[str, Bars] = {}
+        self._scores: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        # Gọi listener(symbols, feats, panel) mỗi khi tính lại chỉ báo (vd. cập nhật bảng /screen)
+        self.listeners: List[Callable[[List[str], Dict[str, np.ndarray], List[Bars]], None]] = []
+
+    @property
+    def store(self) -> PriceStore:
+        return self._store if self._store is not None else get_price_store()
+
+    def bars(self, symbol: str) -> Bars:
+        symbol = symbol.upper()
+        state = self._bars.get(symbol)
+        if state is None:
+            # Khởi tạo từ kho local; bar từ provider sau đó ghi đè/nối tiếp
+            state = self.store.tail(symbol, self.window)
+            self._bars[symbol] = state
+        return state
+
+    def reset(self, symbol: str, bars: Bars) -> None:
+        """Đặt lại cửa sổ của một mã (vd. khi bắt đầu phát lại) và xóa điểm số cũ."""
+        with self._lock:
+            self._bars[symbol.upper()] = bars.tail(self.window)
+            self._scores.pop(symbol.upper(), None)
+
+    def ingest(self, updates: Dict[str, Bars]) -> List[Dict[str, Any]]:
+        """Cập nhật trạng thái; trả về message cho các mã vừa được chấm lại điểm."""
+        changed: List[str] = []
+        with self._lock:
+            for sym, upd in updates.items():
+                sym = sym.upper()
+                old = self.bars(sym)
+                new = merge_bars(old, upd, self.window)
+                if _same_bars(old, new):
+                    continue
+                self._bars[sym] = new
+                changed.append(sym)
+            if not changed:
+                return []
+            return self._rescore(changed)
+
+    def _rescore(self, symbols: List[str]) -> List[Dict[str, Any]]:
+        full = [s for s in symbols if len(self._bars[s]) >= self.window]
+        messages = []
+        if full:
+            panel = [self._bars[s].filled() for s in full]
+            stack = {f: np.vstack([getattr(b, f) for b in panel]) for f in ('open', 'high', 'low', 'close', 'volume')}
+            feats = compute_features(stack['open'], stack['high'], stack['low'], stack['close'], stack['volume'])
+            for listener in self.listeners:
+                try:
+                    listener(full, feats, panel)
+                except Exception as e:
+                    print(f"Live feed listener lỗi: {e}")
+            model_set = get_model_set()
+            primary = model_set.primary_spec if self.model_path is None else ModelSpec('live', self.model_path)
+            loaded = load_models([primary])
+            # Cùng builder (có khóa) như đường request: shadow chạy nền gọi lại build_X này
+            build_X = matrix_builder(feats, full, np.vstack([b.day for b in panel]))
+
+            scored = score_all(loaded, build_X)[primary.name]
+            y_pred, prob = scored['prediction'], scored['prob']
+            if self.model_path is None:
+                get_shadow_runner().submit(model_set.shadows, build_X, y_pred, prob)
+            for i, (sym, b) in enumerate(zip(full, panel)):
+                msg = {
+                    'type': 'score',
+                    'symbol': sym,
+                    'date': str(days_to_iso(b.day[-1:])[0]),
+                    'prediction': int(y_pred[i]),
+                    'prob_buy': float(prob[i]) if prob is not None else None,
+                    'model_version': scored['version'],
+                    'status': 'ok',
+                    'bar': b.tail(1).to_records()[0],
+                    'indicators': {k: float(feats[k][i, -1]) for k in LIVE_INDICATORS},
+                }
+                self._scores[sym] = msg
+                messages.append(msg)
+        for sym in symbols:
+            if sym not in full:
+                msg = {'type': 'score', 'symbol': sym, 'date': None, 'prediction': None,
+                       'prob_buy': None, 'status': 'insufficient_input'}
+                self._scores[sym] = msg
+                messages.append(msg)
+        return messages
+
+    def snapshot(self, symbols: Optional[Iterable[str]] = None) -> List[Dict[str, Any]]:
+        """Điểm số hiện tại (tính nếu chưa có) – gửi cho client khi vừa subscribe."""
+        with self._lock:
+            wanted = [s.upper() for s in symbols] if symbols is not None else list(self._scores)
+            missing = [s for s in wanted if s not in self._scores]
+            for s in missing:
+                self.bars(s)
+            if missing:
+                self._rescore(missing)
+            return [self._scores[s] for s in wanted if s in self._scores]
+
+
+class ReplaySource:
+    """
+    Nguồn bar giả lập từ kho local: mỗi lần step() phát bar kế tiếp của từng mã,
+    bắt đầu từ `start_offset` phiên trước cuối dữ liệu (quay vòng khi hết).
+    """
+
+    def __init__(self, symbols: List[str], store: Optional[PriceStore] = None, start_offset: int = 60):
+        self.symbols = [s.upper() for s in symbols]
+        self._store = store
+        self.start_offset = start_offset
+        self.window = WINDOW
+        self._cursor: Dict[str, int] = {}
+
+    @property
+    def store(self) -> PriceStore:
+        return self._store if self._store is not None else get_price_store()
+
+    def prime(self, feed: LiveFeed) -> None:
+        """Đặt trạng thái feed về cửa sổ ngay trước điểm bắt đầu phát lại."""
+        self.window = feed.window
+        for sym in self.symbols:
+            s, e = self.store.span(sym)
+            pos = max(s + feed.window, e - self.start_offset)
+            self._cursor[sym] = pos
+            feed.reset(sym, self.store.bars(sym)[pos - s - feed.window:pos - s] if e > s else Bars.empty(sym))
+
+    def step(self) -> Dict[str, Bars]:
+        out = {}
+        for sym in self.symbols:
+            s, e = self.store.span(sym)
+            if e <= s:
+                continue
+            pos = self._cursor.get(sym, e - 1)
+            lo = pos
+            if pos >= e:
+                # Hết dữ liệu: quay lại điểm bắt đầu, gửi cả cửa sổ để thay trạng thái cũ
+                pos = max(s + self.window, e - self.start_offset)
+                lo = max(s, pos - self.window + 1)
+            self._cursor[sym] = pos + 1
+            out[sym] = self.store.bars(sym)[lo - s:pos - s + 1]
+        return out
+
+
+class ProviderSource:
+    """Nguồn bar thật: mỗi lần step() hỏi provider vài phiên cuối của từng mã (bar hôm nay được cập nhật dần)."""
+
+    def __init__(self, symbols: List[str], fetch, sessions: int = 2):
+        self.symbols = [s.upper() for s in symbols]
+        self.fetch = fetch              # fetch(symbol, n) -> Bars, vd main.get_last_sessions
+        self.sessions = sessions
+
+    def step(self) -> Dict[str, Bars]:
+        out = {}
+        for sym in self.symbols:
+            bars = self.fetch(sym, self.sessions)
+            if len(bars):
+                out[sym] = bars
+        return out
+
+
+class LiveHub:
+    """
+    Phân phát message tới các WebSocket đã subscribe.
+
+    Mỗi message được serialize một lần rồi đưa vào hàng đợi của từng client quan tâm,
+    nên chi phí tính toán là một lần cho mỗi bar mới, không phụ thuộc số client.
+    Client chậm bị bỏ message cũ nhất thay vì làm nghẽn cả hub.
+    """
+
+    def __init__(self, feed: LiveFeed, queue_size: int = 256):
+        self.feed = feed
+        self.queue_size = queue_size
+        self._by_symbol: Dict[str, Set[asyncio.Queue]] = {}
+        self._all: Set[asyncio.Queue] = set()
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {'ticks': 0, 'scored': 0, 'sent': 0, 'dropped': 0, 'last_tick_ms': 0.0}
+
+    @property
+    def clients(self) -> int:
+        qs = set(self._all)
+        for s in self._by_symbol.values():
+            qs |= s
+        return len(qs)
+
+    def register(self) -> asyncio.Queue:
+        return asyncio.Queue(maxsize=self.queue_size)
+
+    def subscribe(self, queue: asyncio.Queue, symbols: Optional[List[str]]) -> None:
+        self.unsubscribe(queue)
+        if symbols is None:
+            self._all.add(queue)
+            return
+        for s in symbols:
+            self._by_symbol.setdefault(s.upper(), set()).add(queue)
+
+    def unsubscribe(self, queue: asyncio.Queue) -> None:
+        self._all.discard(queue)
+        for subs in self._by_symbol.values():
+            subs.discard(queue)
+
+    def _put(self, queue: asyncio.Queue, text: str) -> None:
+        if queue.full():
+            try:
+                queue.get_nowait()
+                self.stats['dropped'] += 1
+            except asyncio.QueueEmpty:
+                pass
+        queue.put_nowait(text)
+        self.stats['sent'] += 1
+
+    def publish(self, messages: List[Dict[str, Any]]) -> None:
+        for msg in messages:
+            text = json.dumps(msg, ensure_ascii=False)
+            targets = self._all | self._by_symbol.get(msg['symbol'], set())
+            for q in targets:
+                self._put(q, text)
+
+    async def run(self, source, interval: float) -> None:
+        """Vòng lặp nền: lấy bar mới từ source, cập nhật feed (trong thread), phát message."""
+        loop = asyncio.get_running_loop()
+        while True:
+            t0 = time.perf_counter()
+            try:
+                updates = await loop.run_in_executor(None, source.step)
+                messages = await loop.run_in_executor(None, self.feed.ingest, updates)
+                self.publish(messages)
+                self.stats['ticks'] += 1
+                self.stats['scored'] += len(messages)
+            except Exception as e:
+                print(f"Live feed tick lỗi: {e}")
+            self.stats['last_tick_ms'] = (time.perf_counter() - t0) * 1000
+            await asyncio.sleep(interval)
+
+    def start(self, source, interval: float) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self.run(source, interval))
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -3,9 +3,24 @@ from typing import List, Optional
 import pandas as pd
 import numpy as np
 import requests
-import joblib
+import sys
 from datetime import datetime
 
+# Cho phép import service.* cả khi chạy trực tiếp `python model.service.py`
+_server_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _server_dir not in sys.path:
+    sys.path.insert(0, _server_dir)
+
+from service.bars import Bars
+from service.price_store import get_price_store
+from service.indicators import compute_features, model_feature_columns, FEATURE_COLUMNS, BINARY_FEATURES
+from service.compiled_model import load_model
+from service.fundamentals import attach_fa_features
+from service.model_set import get_model_set
+
+# Cột của input thô (build_model_input)
+RAW_INPUT_COLUMNS = ['time', 'open', 'high', 'low', 'close', 'volume', 'symbol']
+
 def _find_repo_root(start_path: Optional[str] = None) -> str:
     """Ascend directories to locate repo root containing 'data' folder."""
     if start_path is None:
@@ -36,6 +51,53 @@ def get_top100_symbols(csv_path: Optional[str] = None) -> List[str]:
             return df[alt].dropna().astype(str).str.upper().tolist()
     return []
 
+def _fetch_input_bars(server_url: str, symbol: str, days: int, source: Optional[str] = None) -> Bars:
+    """Gọi /model-input của API server và trả về 50 bar cuối (đã làm sạch)."""
+    params = {'days': days}
+    if source is not None:
+        params['source'] = source
+    resp = requests.get(f"{server_url}/model-input/{symbol}", params=params, timeout=30)
+    resp.raise_for_status()
+    data = resp.json().get('data', [])
+    return Bars.from_records(data, symbol).tail(50).filled()
+
+def build_model_bars(symbol: str, server_url: str = 'http://127.0.0.1:5000', days: int = 50, source: str = 'VNStock') -> Bars:
+    """
+    Giống build_model_input nhưng trả về Bars (mảng NumPy) thay vì DataFrame,
+    để indicator/model dùng trực tiếp mà không phải copy qua nhiều DataFrame.
+    """
+    symbol = symbol.upper()
+    
+    # Cố gắng lấy từ API trước
+    try:
+        bars = _fetch_input_bars(server_url, symbol, days)
+        if len(bars) < 50:
+            raise ValueError(f"Không đủ 50 dòng (chỉ có {len(bars)} dòng)")
+        return bars
+        
+    except Exception as api_error:
+        print(f"API lỗi cho {symbol}: {api_error}, chuyển sang CSV local")
+        
+        # Fallback sang kho CSV local (data/raw/ta + cache): lấy thẳng 50 dòng cuối
+        bars_local = get_price_store().tail(symbol, 50)
+        if len(bars_local) == 0:
+            raise RuntimeError(f'Không tìm thấy mã {symbol} trong CSV local')
+        
+        # Làm sạch
+        bars_local = bars_local.filled()
+        
+        if len(bars_local) < 50:
+            # Thử gọi provider để bổ sung nếu local không đủ
+            try:
+                bars2 = _fetch_input_bars(server_url, symbol, days, source='VNStock')
+                if len(bars2) >= 50:
+                    return bars2
+            except Exception:
+                pass
+            raise RuntimeError(f'Không đủ 50 dòng cho {symbol} (chỉ có {len(bars_local)} dòng)')
+        
+        return bars_local
+
 def build_model_input(symbol: str, server_url: str = 'http://127.0.0.1:5000', days: int = 50, source: str = 'VNStock') -> pd.DataFrame:
     """
     Tạo input chuẩn cho model từ API hoặc CSV local.
@@ -59,291 +121,45 @@ def build_model_input(symbol: str, server_url: str = 'http://127.0.0.1:5000', da
     Raises:
         RuntimeError: Nếu không đủ dữ liệu hoặc không tìm thấy mã trong CSV
     """
-    symbol = symbol.upper()
-    
-    # Cố gắng lấy từ API trước
-    try:
-        resp = requests.get(
-            f"{server_url}/model-input/{symbol}", 
-            params={'days': days}, 
-            timeout=30
-        )
-        resp.raise_for_status()
-        payload = resp.json()
-        data = payload.get('data', [])
-        df = pd.DataFrame(data)
-        
-        # Đảm bảo có đủ các cột bắt buộc
-        required = ['time', 'open', 'high', 'low', 'close', 'volume', 'symbol']
-        for col in required:
-            if col not in df.columns:
-                df[col] = None
-        
-        df = df[required].copy()
-        
-        # Chuyển đổi kiểu dữ liệu
-        for col in ['open', 'high', 'low', 'close', 'volume']:
-            df[col] = pd.to_numeric(df[col], errors='coerce')
-        
-        # Sắp xếp theo thời gian
-        try:
-            df['time'] = pd.to_datetime(df['time'])
-            df = df.sort_values('time')
-            df['time'] = df['time'].dt.strftime('%Y-%m-%d')
-        except Exception:
-            df = df.sort_values('time')
-        
-        # Lấy đúng 50 dòng cuối
-        df = df.iloc[-50:].copy()
-        
-        # Làm sạch dữ liệu
-        df = df.replace([np.inf, -np.inf], np.nan)
-        df = df.ffill().bfill().fillna(0)
-        
-        # Đảm bảo symbol đồng nhất
-        df['symbol'] = symbol
-        
-        if len(df) < 50:
-            raise ValueError(f"Không đủ 50 dòng (chỉ có {len(df)} dòng)")
-        
-        return df[required]
-        
-    except Exception as api_error:
-        print(f"API lỗi cho {symbol}: {api_error}, chuyển sang CSV local")
-        
-        # Fallback sang CSV local
-        repo_root = _find_repo_root()
-        local_csv = os.path.join(repo_root, 'data', 'raw', 'ta', 'vietnam_stock_price_history_2022-10-31_2025-10-31.csv')
-        
-        if not os.path.exists(local_csv):
-            raise RuntimeError(f'Không tìm thấy CSV local: {local_csv}')
-        
-        df_local = pd.read_csv(local_csv)
-        
-        # Tìm cột symbol
-        sym_col = None
-        for col_name in ['symbol', 'ticker', 'Symbol', 'Ticker']:
-            if col_name in df_local.columns:
-                sym_col = col_name
-                break
-        if sym_col is None:
-            raise RuntimeError('Không tìm thấy cột symbol/ticker trong CSV local')
-        
-        # Lọc theo mã
-        df_local = df_local[df_local[sym_col].astype(str).str.upper() == symbol].copy()
-        
-        if len(df_local) == 0:
-            raise RuntimeError(f'Không tìm thấy mã {symbol} trong CSV local')
-        
-        # Tìm cột thời gian
-        time_col = None
-        for col_name in ['time', 'date', 'datetime', 'tradingDate', 'Date']:
-            if col_name in df_local.columns:
-                time_col = col_name
-                break
-        if time_col is None:
-            raise RuntimeError('Không tìm thấy cột thời gian trong CSV local')
-        
-        # Chuẩn hóa tên cột
-        rename_map = {time_col: 'time'}
-        for src, dst, alts in [
-            ('open', 'open', ['Open', 'o', 'open_price']),
-            ('high', 'high', ['High', 'h', 'high_price']),
-            ('low', 'low', ['Low', 'l', 'low_price']),
-            ('close', 'close', ['Close', 'c', 'close_price', 'adj_close', 'price']),
-            ('volume', 'volume', ['Volume', 'vol', 'volume_match', 'total_volume']),
-        ]:
-            if src in df_local.columns:
-                rename_map[src] = dst
-            else:
-                for alt in alts:
-                    if alt in df_local.columns:
-                        rename_map[alt] = dst
-                        break
-        
-        df_local = df_local.rename(columns=rename_map)
-        
-        # Đảm bảo có đủ cột bắt buộc
-        required = ['time', 'open', 'high', 'low', 'close', 'volume']
-        for col in required:
-            if col not in df_local.columns:
-                df_local[col] = 0
-        
-        df_local = df_local[required].copy()
-        df_local['symbol'] = symbol
-        
-        # Chuyển đổi kiểu dữ liệu
-        for col in ['open', 'high', 'low', 'close', 'volume']:
-            df_local[col] = pd.to_numeric(df_local[col], errors='coerce')
-        
-        # Sắp xếp và chuẩn hóa thời gian
-        try:
-            df_local['time'] = pd.to_datetime(df_local['time'])
-            df_local = df_local.sort_values('time')
-            df_local['time'] = df_local['time'].dt.strftime('%Y-%m-%d')
-        except Exception:
-            df_local = df_local.sort_values('time')
-        
-        # Lấy đúng 50 dòng cuối
-        df_local = df_local.iloc[-50:].copy()
-        
-        # Làm sạch dữ liệu
-        df_local = df_local.replace([np.inf, -np.inf], np.nan)
-        df_local = df_local.ffill().bfill().fillna(0)
-        
-        if len(df_local) < 50:
-            # Thử gọi provider để bổ sung nếu local không đủ
-            try:
-                resp2 = requests.get(
-                    f"{server_url}/model-input/{symbol}",
-                    params={'days': max(days, 70), 'source': 'VNStock'},
-                    timeout=30,
-                )
-                resp2.raise_for_status()
-                data2 = resp2.json().get('data', [])
-                df2 = pd.DataFrame(data2)
-                req2 = ['time','open','high','low','close','volume','symbol']
-                for col in req2:
-                    if col not in df2.columns:
-                        df2[col] = None
-                for col in ['open','high','low','close','volume']:
-                    df2[col] = pd.to_numeric(df2[col], errors='coerce')
-                try:
-                    df2['time'] = pd.to_datetime(df2['time'])
-                    df2 = df2.sort_values('time')
-                    df2['time'] = df2['time'].dt.strftime('%Y-%m-%d')
-                except Exception:
-                    df2 = df2.sort_values('time')
-                df2['symbol'] = symbol
-                df2 = df2.iloc[-50:].copy()
-                df2 = df2.replace([np.inf, -np.inf], np.nan).ffill().bfill().fillna(0)
-                if len(df2) >= 50:
-                    return df2[['time','open','high','low','close','volume','symbol']]
-            except Exception:
-                pass
-            raise RuntimeError(f'Không đủ 50 dòng cho {symbol} (chỉ có {len(df_local)} dòng)')
-        
-        return df_local[['time', 'open', 'high', 'low', 'close', 'volume', 'symbol']]
+    return build_model_bars(symbol, server_url=server_url, days=days, source=source).to_frame()
+
+def features_frame(bars: Bars, columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """Tính chỉ báo kỹ thuật cho Bars và trả về DataFrame feature (biên model), theo thứ tự `columns`."""
+    if columns is None:
+        columns = FEATURE_COLUMNS
+    f = compute_features(bars.open, bars.high, bars.low, bars.close, bars.volume)
+    attach_fa_features(f, bars.symbol, bars.day, columns)
+    df = pd.DataFrame({c: f[c] if c in f else np.zeros(len(bars)) for c in columns}, columns=columns)
+    for c in BINARY_FEATURES:
+        if c in df.columns:
+            df[c] = df[c].astype(int)
+    return df
 
-def build_model_features_input(symbol: str, server_url: str = 'http://127.0.0.1:5000', days: int = 60, source: str = 'VNStock') -> pd.DataFrame:
+def build_model_features_input(symbol: str, server_url: str = 'http://127.0.0.1:5000', days: int = 60, source: str = 'VNStock',
+                               columns: Optional[List[str]] = None) -> pd.DataFrame:
     """
     Build input feature DataFrame by computing technical indicators from raw data.
     Fetches raw OHLCV data via API or local fallback, then calculates indicators.
-    Returns last 50 rows with all features needed for model prediction.
+    Returns last 50 rows with the model's `columns` (model_feature_columns; fa_* as-of
+    values are attached when requested, like the batch path), default FEATURE_COLUMNS.
+    The index holds each row's bar day ('YYYY-MM-DD'), so callers keep the date after
+    the frame is reduced to the model columns.
     """
     # Get raw OHLCV data
-    df = build_model_input(symbol, server_url=server_url, days=days, source=source)
+    bars = build_model_bars(symbol, server_url=server_url, days=days, source=source)
     
-    if df is None or len(df) < 20:  # Need at least 20 rows for indicators
+    if bars is None or len(bars) < 20:  # Need at least 20 rows for indicators
         return None
     
-    # Ensure numeric types
-    for col in ['open', 'high', 'low', 'close', 'volume']:
-        df[col] = pd.to_numeric(df[col], errors='coerce')
-    
-    # Fill any missing values
-    df = df.ffill().bfill().fillna(0)
-    
-    # Calculate technical indicators
-    # 1. Price-based features
-    df['price_range'] = df['high'] - df['low']
-    df['price_range_pct'] = (df['price_range'] / df['low']) * 100
-    df['body_size_pct'] = abs((df['close'] - df['open']) / df['open']) * 100
-    
-    # 2. Moving Averages
-    df['ma_5'] = df['close'].rolling(window=5, min_periods=1).mean()
-    df['ma_20'] = df['close'].rolling(window=20, min_periods=1).mean()
-    df['ma_50'] = df['close'].rolling(window=50, min_periods=1).mean()
-    df['ma_5_divergence'] = ((df['close'] - df['ma_5']) / df['ma_5']) * 100
-    df['ma_20_divergence'] = ((df['close'] - df['ma_20']) / df['ma_20']) * 100
-    df['ma_50_divergence'] = ((df['close'] - df['ma_50']) / df['ma_50']) * 100
-    
-    # 3. RSI (Relative Strength Index)
-    delta = df['close'].diff()
-    gain = (delta.where(delta > 0, 0)).rolling(window=14, min_periods=1).mean()
-    loss = (-delta.where(delta < 0, 0)).rolling(window=14, min_periods=1).mean()
-    rs = gain / loss.replace(0, 1e-10)
-    df['rsi_14'] = 100 - (100 / (1 + rs))
-    
-    # 4. MACD
-    ema_12 = df['close'].ewm(span=12, adjust=False, min_periods=1).mean()
-    ema_26 = df['close'].ewm(span=26, adjust=False, min_periods=1).mean()
-    df['macd'] = ema_12 - ema_26
-    df['macd_signal'] = df['macd'].ewm(span=9, adjust=False, min_periods=1).mean()
-    df['macd_histogram'] = df['macd'] - df['macd_signal']
-    
-    # 5. Stochastic Oscillator
-    low_14 = df['low'].rolling(window=14, min_periods=1).min()
-    high_14 = df['high'].rolling(window=14, min_periods=1).max()
-    df['stochastic_k'] = ((df['close'] - low_14) / (high_14 - low_14).replace(0, 1e-10)) * 100
-    
-    # 6. Volatility
-    df['volatility_20'] = df['close'].rolling(window=20, min_periods=1).std()
-    
-    # 7. ATR (Average True Range)
-    high_low = df['high'] - df['low']
-    high_close = abs(df['high'] - df['close'].shift())
-    low_close = abs(df['low'] - df['close'].shift())
-    true_range = pd.concat([high_low, high_close, low_close], axis=1).max(axis=1)
-    df['atr_14'] = true_range.rolling(window=14, min_periods=1).mean()
-    
-    # 8. Bollinger Bands
-    bb_ma = df['close'].rolling(window=20, min_periods=1).mean()
-    bb_std = df['close'].rolling(window=20, min_periods=1).std()
-    df['bb_upper'] = bb_ma + (2 * bb_std)
-    df['bb_lower'] = bb_ma - (2 * bb_std)
-    df['bb_width'] = ((df['bb_upper'] - df['bb_lower']) / bb_ma) * 100
-    df['bb_position'] = ((df['close'] - df['bb_lower']) / (df['bb_upper'] - df['bb_lower']).replace(0, 1e-10)) * 100
-    
-    # 9. Volume indicators
-    df['volume_ma_20'] = df['volume'].rolling(window=20, min_periods=1).mean()
-    df['volume_ratio'] = df['volume'] / df['volume_ma_20'].replace(0, 1e-10)
-    
-    # 10. OBV (On Balance Volume)
-    obv = [0]
-    for i in range(1, len(df)):
-        if df['close'].iloc[i] > df['close'].iloc[i-1]:
-            obv.append(obv[-1] + df['volume'].iloc[i])
-        elif df['close'].iloc[i] < df['close'].iloc[i-1]:
-            obv.append(obv[-1] - df['volume'].iloc[i])
-        else:
-            obv.append(obv[-1])
-    df['obv'] = obv
-    
-    # 11. ADX (Average Directional Index)
-    plus_dm = df['high'].diff()
-    minus_dm = -df['low'].diff()
-    plus_dm[plus_dm < 0] = 0
-    minus_dm[minus_dm < 0] = 0
-    atr = true_range.rolling(window=14, min_periods=1).mean()
-    df['plus_di'] = 100 * (plus_dm.rolling(window=14, min_periods=1).mean() / atr.replace(0, 1e-10))
-    df['minus_di'] = 100 * (minus_dm.rolling(window=14, min_periods=1).mean() / atr.replace(0, 1e-10))
-    dx = 100 * abs(df['plus_di'] - df['minus_di']) / (df['plus_di'] + df['minus_di']).replace(0, 1e-10)
-    df['adx'] = dx.rolling(window=14, min_periods=1).mean()
-    
-    # 12. Binary indicators
-    df['Volume_Spike'] = (df['volume_ratio'] > 2).astype(int)
-    df['RSI_Oversold'] = (df['rsi_14'] < 30).astype(int)
-    df['RSI_Overbought'] = (df['rsi_14'] > 70).astype(int)
-    df['Price_Above_MA20'] = (df['close'] > df['ma_20']).astype(int)
-    df['Price_Above_MA50'] = (df['close'] > df['ma_50']).astype(int)
-    
-    # Replace inf/nan values
-    df = df.replace([np.inf, -np.inf], 0).fillna(0)
-    
-    # Return last 50 rows with feature columns
-    df = df.iloc[-50:]
-    
-    # Select feature columns (exclude time, symbol, intermediate calculations)
-    exclude = {'time', 'symbol', 'ma_5', 'ma_20', 'ma_50', 'macd_signal', 'bb_upper', 'bb_lower'}
-    feature_cols = [c for c in df.columns if c not in exclude]
-    
-    return df[feature_cols]
+    # Indicators are computed on the NumPy arrays directly (see service/indicators.py)
+    tail = bars.tail(50)
+    df = features_frame(tail, columns)
+    df.index = pd.Index(tail.times(), name='time')
+    return df
     
 def _model_path_default() -> str:
-    here = os.path.dirname(__file__)
-    server_dir = os.path.dirname(here)
-    return os.path.join(server_dir, 'model', 'best_model.pkl')
+    # Model primary của model set (model/models.json), mặc định server/model/best_model.pkl
+    return get_model_set().primary_spec.path
 
 def predict_for_symbol(symbol: str, model_path: Optional[str] = None, server_url: str = 'http://127.0.0.1:5000', days: int = 60, source: str = 'local') -> dict:
     """
@@ -371,42 +187,28 @@ def predict_for_symbol(symbol: str, model_path: Optional[str] = None, server_url
         model_path = _model_path_default()
     
     try:
-        # Bước 1: Load model pipeline trước để nhận biết kỳ vọng feature
-        pipeline = joblib.load(model_path)
+        # Bước 1: Load model (bản compiled .npz nếu có, cache theo mtime) để nhận biết kỳ vọng feature
+        pipeline = load_model(model_path)
+        expected = model_feature_columns(pipeline)
+        # Model nhận thẳng OHLCV thô (tự tính chỉ báo bên trong) chỉ khi mọi cột nó cần đều là cột thô;
+        # còn lại – kể cả model train trên tập feature đã chọn lọc – cần feature tính sẵn
+        needs_features = not set(expected) <= set(RAW_INPUT_COLUMNS)
 
-        expected = None
-        if hasattr(pipeline, 'feature_names_in_'):
-            expected = list(pipeline.feature_names_in_)
-        else:
-            # Thử lấy từ estimator cuối cùng trong sklearn Pipeline
-            try:
-                final_est = getattr(pipeline, 'steps', [])[ -1 ][1]
-                if hasattr(final_est, 'feature_names_in_'):
-                    expected = list(final_est.feature_names_in_)
-            except Exception:
-                expected = None
-
-        needs_features = False
-        if expected is not None:
-            expected_set = set([str(x) for x in expected])
-            markers = {'Price_Above_MA20','Price_Above_MA50','RSI_Overbought','RSI_Oversold','Volume_Spike','macd','rsi_14'}
-            needs_features = len(expected_set & markers) > 0
-
-        # Bước 2: Chuẩn bị input phù hợp với mô hình
+        # Bước 2: Chuẩn bị input phù hợp với mô hình (ngày dự báo = ngày cuối cùng trong input)
+        last_time = None
         if needs_features:
-            df_input = build_model_features_input(symbol, server_url=server_url, days=max(days,60), source=source)
+            # Cùng cột (kể cả fa_* as-of) và thứ tự như model cần, giống _feature_builder của server
+            df_input = build_model_features_input(symbol, server_url=server_url, days=days, source=source,
+                                                  columns=expected)
             if df_input is None or len(df_input) < 50:
                 return {"symbol": symbol.upper(), "status": "insufficient_input", "date": None, "prediction": None, "prob_buy": None}
-            # Căn chỉnh cột theo expected
-            if expected is not None:
-                for col in expected:
-                    if col not in df_input.columns:
-                        df_input[col] = 0
-                df_input = df_input[[c for c in expected if c in df_input.columns]]
+            last_time = str(df_input.index[-1])
         else:
             df_input = build_model_input(symbol, server_url=server_url, days=days, source=source)
             if df_input is None or len(df_input) < 50:
                 return {"symbol": symbol.upper(), "status": "insufficient_input", "date": None, "prediction": None, "prob_buy": None}
+            last_time = df_input.iloc[-1]['time']
+            df_input = df_input[expected]
 
         # Bước 3: Chạy dự báo
         y_pred = pipeline.predict(df_input)
@@ -414,20 +216,14 @@ def predict_for_symbol(symbol: str, model_path: Optional[str] = None, server_url
         # Bước 4: Lấy xác suất (probability) nếu có
         try:
             y_prob = pipeline.predict_proba(df_input)
-            prob_buy = float(y_prob[0, 1])  # Xác suất class 1 (mua)
+            prob_buy = float(y_prob[-1, 1])  # Xác suất class 1 (mua) tại bar mới nhất
         except Exception:
             prob_buy = None
         
-        # Bước 5: Lấy ngày dự báo (ngày cuối cùng trong input)
-        try:
-            last_time = df_input.iloc[-1]['time'] if 'time' in df_input.columns else None
-        except Exception:
-            last_time = None
-        
         return {
             "symbol": symbol.upper(),
             "date": last_time,
-            "prediction": int(y_pred[0]) if len(y_pred) > 0 else None,
+            "prediction": int(y_pred[-1]) if len(y_pred) > 0 else None,
             "prob_buy": prob_buy,
             "status": "ok",
         }
@@ -8,7 +8,9 @@ _model = SourceFileLoader('model_service', _module_path).load_module()
 
 # Re-export selected functions
 build_model_input = getattr(_model, 'build_model_input')
+build_model_bars = getattr(_model, 'build_model_bars')
 get_top100_symbols = getattr(_model, 'get_top100_symbols')
+features_frame = getattr(_model, 'features_frame')
 
 # Optional exports used by API layer
 run_model_on_top100 = getattr(_model, 'run_model_on_top100', None)
@@ -0,0 +1,299 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from service.compiled_model import load_model_versioned
+from service.fundamentals import attach_fa_features
+from service.indicators import feature_matrix, model_feature_columns
+
+_MODEL_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'model')
+DEFAULT_CONFIG = os.environ.get('MODEL_SET_CONFIG', os.path.join(_MODEL_DIR, 'models.json'))
+DEFAULT_PRIMARY = 'best'
+
+# Shadow chạy nền: hàng đợi đầy thì bỏ lượt (đếm vào 'dropped') thay vì dồn việc làm chậm primary
+SHADOW_MAX_PENDING = int(os.environ.get('SHADOW_MAX_PENDING', 4))
+LATENCY_WINDOW = 500
+
+
+class ModelSpec:
+    """Một model trong model set: tên, file .pkl (bản .npz cạnh nó được ưu tiên), shadow hay không."""
+
+    def __init__(self, name: str, path: str, shadow: bool = False):
+        self.name = name
+        self.path = path if os.path.isabs(path) else os.path.join(_MODEL_DIR, path)
+        self.shadow = shadow
+
+    def load(self):
+        """(model, version) – cache theo mtime như load_model_versioned."""
+        return load_model_versioned(self.path)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'name': self.name, 'path': self.path, 'shadow': self.shadow}
+
+
+class ModelSet:
+    """
+    Các model đăng ký trong model/models.json (không có file -> chỉ best_model.pkl tên 'best'):
+
+        {"primary": "best",
+         "models": [{"name": "best", "path": "best_model.pkl"},
+                    {"name": "lgbm", "path": "candidates/lgbm.pkl", "shadow": true},
+                    {"name": "lr", "path": "candidates/lr.pkl"}]}
+
+    - primary: model trả lời request
+    - shadow: chấm nền trên cùng ma trận feature sau khi primary đã trả lời (không thêm độ trễ)
+    - còn lại: chỉ chấm khi request yêu cầu (`models=lr,...` hoặc `models=all`) để so sánh live
+    """
+
+    def __init__(self, specs: Sequence[ModelSpec], primary: str):
+        self.specs: Dict[str, ModelSpec] = {s.name: s for s in specs}
+        if primary not in self.specs:
+            raise ValueError(f"primary '{primary}' không có trong danh sách model")
+        self.primary = primary
+
+    @classmethod
+    def default(cls) -> 'ModelSet':
+        return cls([ModelSpec(DEFAULT_PRIMARY, 'best_model.pkl')], DEFAULT_PRIMARY)
+
+    @classmethod
+    def from_file(cls, path: str) -> 'ModelSet':
+        with open(path, 'r', encoding='utf-8') as f:
+            cfg = json.load(f)
+        specs = [ModelSpec(str(m['name']), str(m['path']), bool(m.get('shadow', False))) for m in cfg.get('models', [])]
+        if not specs:
+            raise ValueError('models rỗng')
+        return cls(specs, str(cfg.get('primary') or specs[0].name))
+
+    @property
+    def primary_spec(self) -> ModelSpec:
+        return self.specs[self.primary]
+
+    @property
+    def shadows(self) -> List[ModelSpec]:
+        return [s for s in self.specs.values() if s.shadow and s.name != self.primary]
+
+    def resolve(self, names: Optional[Sequence[str]]) -> List[ModelSpec]:
+        """Model cần chấm đồng bộ cho request: primary + các tên yêu cầu ('all' = mọi model)."""
+        out = [self.primary_spec]
+        if not names:
+            return out
+        wanted = list(self.specs) if 'all' in names else list(names)
+        unknown = [n for n in wanted if n not in self.specs]
+        if unknown:
+            raise KeyError(', '.join(unknown))
+        return out + [self.specs[n] for n in dict.fromkeys(wanted) if n != self.primary]
+
+
+_SET_LOCK = threading.Lock()
+_SET_CACHE: Dict[str, Any] = {'stamp': None, 'set': None}
+
+
+def get_model_set(config_path: Optional[str] = None) -> ModelSet:
+    """Model set hiện tại; đọc lại models.json khi file đổi (lỗi cấu hình -> giữ bản cũ/mặc định)."""
+    path = config_path or DEFAULT_CONFIG
+    try:
+        stamp = os.path.getmtime(path)
+    except OSError:
+        stamp = None
+    if _SET_CACHE['set'] is not None and _SET_CACHE['stamp'] == (path, stamp):
+        return _SET_CACHE['set']
+    with _SET_LOCK:
+        if _SET_CACHE['set'] is not None and _SET_CACHE['stamp'] == (path, stamp):
+            return _SET_CACHE['set']
+        model_set = None
+        if stamp is not None:
+            try:
+                model_set = ModelSet.from_file(path)
+            except Exception as e:
+                print(f"Lỗi đọc {path}: {e}")
+                model_set = _SET_CACHE['set']
+        _SET_CACHE['set'] = model_set or ModelSet.default()
+        _SET_CACHE['stamp'] = (path, stamp)
+        return _SET_CACHE['set']
+
+
+# build_X(columns) -> DataFrame feature theo đúng các cột đó, dựng từ chỉ báo đã tính sẵn cho cả lô
+MatrixBuilder = Callable[[List[str]], pd.DataFrame]
+
+
+def matrix_builder(feats: Dict[str, np.ndarray], symbols: List[str], day: np.ndarray) -> MatrixBuilder:
+    """
+    build_X trên chỉ báo panel 2-D `feats` (mỗi dòng một mã, `day` cùng shape) của một lô.
+    Cột fa_* gắn thêm vào `feats` lúc có model cần, dưới khóa riêng của lô: shadow chạy ở
+    thread nền gọi chung build_X với request / live feed mà không đua sửa `feats`.
+    """
+    lock = threading.Lock()
+
+    def build(columns: List[str]) -> pd.DataFrame:
+        with lock:
+            missing = [c for c in columns if c not in feats]
+            if missing:
+                attach_fa_features(feats, symbols, day, missing)
+            # Bar cuối (mới nhất) của input 50 dòng mỗi mã – cùng dòng mà tập train dựng (symbol_features)
+            return pd.DataFrame(feature_matrix(feats, columns)[:, -1, :], columns=columns)
+    return build
+
+
+def score_model(model, build_X: MatrixBuilder) -> Tuple[np.ndarray, Optional[np.ndarray], float]:
+    """predict + prob mua của một model; ms chỉ tính phần chấm (không gồm tính feature)."""
+    X = build_X(model_feature_columns(model))
+    t0 = time.perf_counter()
+    y_pred = np.asarray(model.predict(X))
+    try:
+        prob = np.asarray(model.predict_proba(X))[:, 1]
+    except Exception:
+        prob = None
+    return y_pred, prob, (time.perf_counter() - t0) * 1000
+
+
+class ModelMetrics:
+    """
+    Số liệu theo model: độ trễ chấm (ms mỗi lượt, cửa sổ LATENCY_WINDOW lượt gần nhất) và mức
+    đồng thuận với primary trên cùng input (tỉ lệ cùng nhãn, |Δ prob_buy| trung bình).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data: Dict[str, Dict[str, Any]] = {}
+
+    def _entry(self, name: str) -> Dict[str, Any]:
+        entry = self._data.get(name)
+        if entry is None:
+            entry = self._data[name] = {'calls': 0, 'rows': 0, 'latency': deque(maxlen=LATENCY_WINDOW),
+                                        'compared': 0, 'agree': 0, 'abs_diff': 0.0, 'errors': 0,
+                                        'dropped': 0, 'version': None}
+        return entry
+
+    def record(self, name: str, version: str, latency_ms: float, y_pred: np.ndarray, prob: Optional[np.ndarray],
+               primary_pred: Optional[np.ndarray] = None, primary_prob: Optional[np.ndarray] = None) -> None:
+        with self._lock:
+            e = self._entry(name)
+            if e['version'] != version:
+                # Model đổi file -> số liệu cũ không còn đúng cho version mới
+                e.update(calls=0, rows=0, compared=0, agree=0, abs_diff=0.0, errors=0)
+                e['latency'].clear()
+                e['version'] = version
+            e['calls'] += 1
+            e['rows'] += int(len(y_pred))
+            e['latency'].append(latency_ms)
+            if primary_pred is not None:
+                e['compared'] += int(len(y_pred))
+                e['agree'] += int(np.count_nonzero(y_pred == primary_pred))
+                if prob is not None and primary_prob is not None:
+                    e['abs_diff'] += float(np.abs(prob - primary_prob).sum())
+
+    def error(self, name: str) -> None:
+        with self._lock:
+            self._entry(name)['errors'] += 1
+
+    def dropped(self, name: str) -> None:
+        with self._lock:
+            self._entry(name)['dropped'] += 1
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            out = {}
+            for name, e in self._data.items():
+                lat = np.asarray(e['latency'], dtype=np.float64)
+                out[name] = {
+                    'version': e['version'],
+                    'calls': e['calls'],
+                    'rows': e['rows'],
+                    'latency_ms': {'mean': round(float(lat.mean()), 3), 'p50': round(float(np.percentile(lat, 50)), 3),
+                                   'p95': round(float(np.percentile(lat, 95)), 3)} if len(lat) else None,
+                    'agreement': round(e['agree'] / e['compared'], 4) if e['compared'] else None,
+                    'mean_abs_prob_diff': round(e['abs_diff'] / e['compared'], 6) if e['compared'] else None,
+                    'compared_rows': e['compared'],
+                    'errors': e['errors'],
+                    'dropped': e['dropped'],
+                }
+            return out
+
+
+class ShadowRunner:
+    """Chấm các model shadow trên thread nền (một worker), không bao giờ chặn request."""
+
+    def __init__(self, metrics: ModelMetrics, max_pending: int = SHADOW_MAX_PENDING):
+        self.metrics = metrics
+        self.max_pending = max_pending
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='shadow-model')
+
+    def submit(self, specs: Sequence[ModelSpec], build_X: MatrixBuilder,
+               primary_pred: np.ndarray, primary_prob: Optional[np.ndarray]) -> bool:
+        if not specs:
+            return False
+        with self._lock:
+            if self._pending >= self.max_pending:
+                for s in specs:
+                    self.metrics.dropped(s.name)
+                return False
+            self._pending += 1
+        self._pool.submit(self._run, list(specs), build_X, primary_pred, primary_prob)
+        return True
+
+    def _run(self, specs, build_X, primary_pred, primary_prob) -> None:
+        try:
+            for spec in specs:
+                try:
+                    model, version = spec.load()
+                    y_pred, prob, ms = score_model(model, build_X)
+                    self.metrics.record(spec.name, version, ms, y_pred, prob, primary_pred, primary_prob)
+                except Exception as e:
+                    print(f"Shadow model {spec.name} lỗi: {e}")
+                    self.metrics.error(spec.name)
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def wait(self, timeout: float = 10.0) -> None:
+        """Đợi các lượt shadow đang chờ chạy xong (dùng khi test/benchmark)."""
+        deadline = time.time() + timeout
+        while self._pending and time.time() < deadline:
+            time.sleep(0.01)
+
+
+_METRICS = ModelMetrics()
+_SHADOW = ShadowRunner(_METRICS)
+
+
+def get_model_metrics() -> ModelMetrics:
+    return _METRICS
+
+
+def get_shadow_runner() -> ShadowRunner:
+    return _SHADOW
+
+
+def load_models(specs: Sequence[ModelSpec]) -> List[Tuple[ModelSpec, Any, str]]:
+    out = []
+    for spec in specs:
+        model, version = spec.load()
+        out.append((spec, model, version))
+    return out
+
+
+def score_all(loaded: Sequence[Tuple[ModelSpec, Any, str]], build_X: MatrixBuilder) -> Dict[str, Dict[str, Any]]:
+    """
+    Chấm đồng bộ mọi model trong `loaded` (phần tử đầu là primary) trên cùng bộ chỉ báo, ghi độ
+    trễ + đồng thuận với primary vào metrics. Trả về {tên: {prediction, prob, version, ms}}.
+    """
+    out: Dict[str, Dict[str, Any]] = {}
+    primary = None
+    for spec, model, version in loaded:
+        y_pred, prob, ms = score_model(model, build_X)
+        if primary is None:
+            primary = (y_pred, prob)
+            _METRICS.record(spec.name, version, ms, y_pred, prob)
+        else:
+            _METRICS.record(spec.name, version, ms, y_pred, prob, *primary)
+        out[spec.name] = {'prediction': y_pred, 'prob': prob, 'version': version, 'ms': ms}
+    return out
@@ -0,0 +1,72 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+from service.bars import Bars
+
+
+def bars_digest(bars: Bars) -> str:
+    """Hash nội dung các bar input (ngày + OHLCV): bar mới hoặc bar hôm nay đổi giá -> hash khác."""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(np.ascontiguousarray(bars.day, dtype=np.int64).tobytes())
+    for f in ('open', 'high', 'low', 'close', 'volume'):
+        h.update(np.ascontiguousarray(getattr(bars, f), dtype=np.float64).tobytes())
+    return h.hexdigest()
+
+
+class PredictionMemo:
+    """
+    Cache LRU kết quả dự báo, khóa theo nội dung: (mã, hash input, version model).
+
+    Không cần TTL hay xóa thủ công: có bar mới thì hash input đổi, thay model thì version
+    (sha256 file model) đổi, nên khóa cũ không bao giờ được hỏi lại và tự rơi khỏi LRU.
+    """
+
+    def __init__(self, maxsize: int = 2048):
+        self.maxsize = maxsize
+        self._data: 'OrderedDict[Tuple[str, str, str], Dict[str, Any]]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(symbol: str, bars: Bars, model_version: str) -> Tuple[str, str, str]:
+        return symbol.upper(), bars_digest(bars), model_version
+
+    def get(self, key: Tuple[str, str, str]) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            value = self._data.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Tuple[str, str, str], value: Dict[str, Any]) -> None:
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def discard(self, symbols) -> int:
+        """Xóa mục của các mã (input ngoài bar đổi, vd. kỳ FA mới); trả về số mục đã xóa."""
+        wanted = {s.upper() for s in symbols}
+        with self._lock:
+            stale = [k for k in self._data if k[0] in wanted]
+            for k in stale:
+                del self._data[k]
+            return len(stale)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {'size': len(self._data), 'maxsize': self.maxsize, 'hits': self.hits, 'misses': self.misses,
+                'hit_rate': round(self.hits / total, 4) if total else None}
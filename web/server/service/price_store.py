@@ -0,0 +1,173 @@
+import glob
+import os
+import threading
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Optional
+
+from service.bars import Bars, PRICE_FIELDS, TIME_ALIASES, COLUMN_ALIASES, _find_column
+
+
+def _find_repo_root(start_path: Optional[str] = None) -> str:
+    if start_path is None:
+        start_path = os.path.dirname(__file__)
+    cur = os.path.abspath(start_path)
+    for _ in range(6):
+        if os.path.isdir(os.path.join(cur, 'data')):
+            return cur
+        parent = os.path.dirname(cur)
+        if parent == cur:
+            break
+        cur = parent
+    return os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..'))
+
+
+def default_sources() -> List[str]:
+    """CSV lịch sử local: data/raw/ta/*.csv và các fixture web/server/cache/*.csv."""
+    repo_root = _find_repo_root()
+    server_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    paths = sorted(glob.glob(os.path.join(repo_root, 'data', 'raw', 'ta', '*.csv')))
+    paths += sorted(glob.glob(os.path.join(server_dir, 'cache', 'model_input_*.csv')))
+    paths += sorted(glob.glob(os.path.join(server_dir, 'cache', 'history_*.csv')))
+    return paths
+
+
+def _read_panel(path: str) -> Optional[pd.DataFrame]:
+    """Đọc một CSV và chuẩn hóa về các cột symbol, day, open..volume; None nếu không đúng schema."""
+    try:
+        df = pd.read_csv(path)
+    except Exception as e:
+        print(f"Không đọc được {path}: {e}")
+        return None
+    sym_col = _find_column(df.columns, ['symbol', 'ticker', 'Symbol', 'Ticker'])
+    time_col = _find_column(df.columns, TIME_ALIASES)
+    if sym_col is None or time_col is None or df.empty:
+        return None
+    days = pd.to_datetime(df[time_col], errors='coerce').values.astype('datetime64[D]')
+    ok = ~np.isnat(days)
+    out = pd.DataFrame({
+        'symbol': df[sym_col].astype(str).str.upper().to_numpy()[ok],
+        'day': days[ok].astype(np.int64).astype(np.int32),
+    })
+    for field in PRICE_FIELDS:
+        src = _find_column(df.columns, COLUMN_ALIASES[field])
+        out[field] = pd.to_numeric(df[src], errors='coerce').to_numpy()[ok] if src is not None else np.nan
+    return out
+
+
+class PriceStore:
+    """
+    Kho giá ngày dạng cột (columnar) trong bộ nhớ.
+
+    Tất cả bar được sắp xếp theo (symbol, day) trong các mảng liền kề; mỗi mã là một
+    đoạn [start, end) nên lấy lịch sử một mã / một khoảng ngày chỉ là searchsorted + slice.
+    """
+
+    def __init__(self, symbols: np.ndarray, offsets: np.ndarray, day: np.ndarray,
+                 columns: Dict[str, np.ndarray]):
+        self.symbols = symbols                  # mảng tên mã (đã sort)
+        self.offsets = offsets                  # len = n_symbols + 1
+        self.day = day                          # int32 epoch-day
+        self.columns = columns                  # open/high/low/close/volume float64
+        # chỉ số mã (vị trí trong symbols) cho từng dòng
+        self.codes = np.repeat(np.arange(len(symbols), dtype=np.int32), np.diff(offsets))
+        self._index = {s: i for i, s in enumerate(symbols.tolist())}
+        # Bar bị loại / phiên bị thiếu khi nạp (xem service/validation.py)
+        self.quarantine = pd.DataFrame()
+        self.gaps = pd.DataFrame()
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame) -> 'PriceStore':
+        """df có các cột symbol, day (int epoch-day), open..volume. Trùng (symbol, day) giữ dòng cuối."""
+        if df is None or df.empty:
+            empty = {f: np.empty(0) for f in PRICE_FIELDS}
+            return cls(np.array([], dtype=object), np.zeros(1, dtype=np.int64), np.empty(0, dtype=np.int32), empty)
+        df = df.drop_duplicates(subset=['symbol', 'day'], keep='last')
+        df = df.sort_values(['symbol', 'day'], kind='stable')
+        sym = df['symbol'].to_numpy()
+        symbols, starts = np.unique(sym, return_index=True)
+        offsets = np.append(starts, len(sym)).astype(np.int64)
+        columns = {f: np.ascontiguousarray(df[f].to_numpy(dtype=np.float64)) for f in PRICE_FIELDS}
+        return cls(symbols, offsets, np.ascontiguousarray(df['day'].to_numpy(dtype=np.int32)), columns)
+
+    @classmethod
+    def load(cls, paths: Optional[List[str]] = None) -> 'PriceStore':
+        """Nạp các CSV (file sau ghi đè file trước khi trùng (symbol, day))."""
+        from service.validation import validate_frame
+        if paths is None:
+            paths = default_sources()
+        frames, quarantine, gaps = [], [], []
+        for p in paths:
+            panel = _read_panel(p)
+            if panel is None:
+                continue
+            # Mỗi file kiểm tra trong một lượt; bar sai không vào kho (không bị fill thành giá giả)
+            result = validate_frame(panel)
+            frames.append(result.clean)
+            if len(result.quarantine):
+                quarantine.append(result.quarantine.assign(source=os.path.basename(p)))
+                print(f"{os.path.basename(p)}: loại {len(result.quarantine)} bar không hợp lệ {result.summary()}")
+            if len(result.gaps):
+                gaps.append(result.gaps.assign(source=os.path.basename(p)))
+        if not frames:
+            return cls.from_frame(None)
+        store = cls.from_frame(pd.concat(frames, ignore_index=True))
+        store.quarantine = pd.concat(quarantine, ignore_index=True) if quarantine else pd.DataFrame()
+        store.gaps = pd.concat(gaps, ignore_index=True) if gaps else pd.DataFrame()
+        return store
+
+    def __len__(self) -> int:
+        return int(self.day.shape[0])
+
+    def __contains__(self, symbol: str) -> bool:
+        return str(symbol).upper() in self._index
+
+    def symbol_list(self) -> List[str]:
+        return self.symbols.tolist()
+
+    def span(self, symbol: str):
+        """(start, end) của mã trong các mảng cột; (0, 0) nếu không có."""
+        i = self._index.get(str(symbol).upper())
+        if i is None:
+            return 0, 0
+        return int(self.offsets[i]), int(self.offsets[i + 1])
+
+    def bars(self, symbol: str, start_day: Optional[int] = None, end_day: Optional[int] = None) -> Bars:
+        """Bars của một mã trong [start_day, end_day] (epoch-day, bao gồm hai đầu)."""
+        s, e = self.span(symbol)
+        if s == e:
+            return Bars.empty(symbol)
+        days = self.day[s:e]
+        lo = s + (int(np.searchsorted(days, start_day, side='left')) if start_day is not None else 0)
+        hi = s + (int(np.searchsorted(days, end_day, side='right')) if end_day is not None else e - s)
+        c = self.columns
+        return Bars(symbol, self.day[lo:hi], c['open'][lo:hi], c['high'][lo:hi],
+                    c['low'][lo:hi], c['close'][lo:hi], c['volume'][lo:hi])
+
+    def tail(self, symbol: str, n: int, end_day: Optional[int] = None) -> Bars:
+        """n bar cuối của mã tính tới end_day (bao gồm) – một searchsorted + slice."""
+        s, e = self.span(symbol)
+        if end_day is not None and e > s:
+            e = s + int(np.searchsorted(self.day[s:e], end_day, side='right'))
+        lo = max(s, e - max(int(n), 0))
+        c = self.columns
+        return Bars(symbol, self.day[lo:e], c['open'][lo:e], c['high'][lo:e],
+                    c['low'][lo:e], c['close'][lo:e], c['volume'][lo:e])
+
+    def last_day(self, symbol: str) -> Optional[int]:
+        s, e = self.span(symbol)
+        return int(self.day[e - 1]) if e > s else None
+
+
+_STORE: Optional[PriceStore] = None
+_STORE_LOCK = threading.Lock()
+
+
+def get_price_store() -> PriceStore:
+    """PriceStore dùng chung của process (nạp lười lần đầu gọi)."""
+    global _STORE
+    if _STORE is None:
+        with _STORE_LOCK:
+            if _STORE is None:
+                _STORE = PriceStore.load()
+    return _STORE
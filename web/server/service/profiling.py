@@ -0,0 +1,282 @@
+import contextvars
+import functools
+import inspect
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Set
+
+# Session profile của request hiện tại (None khi không profile -> wrapper chỉ tốn một lần get())
+_SESSION: contextvars.ContextVar = contextvars.ContextVar('profile_session', default=None)
+
+SPEEDSCOPE_SCHEMA = 'https://www.speedscope.app/file-format-schema.json'
+
+
+class SamplingProfiler:
+    """
+    Profiler lấy mẫu: một thread nền chụp stack (sys._current_frames) của các thread đang
+    chạy request mỗi `interval` giây. Không gắn hook vào interpreter nên code được đo chạy
+    gần như nguyên tốc độ (kể cả trong pandas / vnstock / sklearn), khác cProfile.
+    """
+
+    def __init__(self, interval: float = 0.002):
+        self.interval = interval
+        self.threads: Set[int] = set()
+        self.frames: List[Dict[str, Any]] = []
+        self._frame_index: Dict[tuple, int] = {}
+        self.samples: List[List[int]] = []
+        self.weights: List[float] = []
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.started = self.stopped = 0.0
+
+    def _frame_id(self, code) -> int:
+        key = (code.co_filename, code.co_firstlineno, code.co_name)
+        idx = self._frame_index.get(key)
+        if idx is None:
+            idx = self._frame_index[key] = len(self.frames)
+            self.frames.append({'name': code.co_qualname if hasattr(code, 'co_qualname') else code.co_name,
+                                'file': code.co_filename, 'line': code.co_firstlineno})
+        return idx
+
+    def _sample(self, dt: float) -> None:
+        current = sys._current_frames()
+        for tid in list(self.threads):
+            frame = current.get(tid)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(self._frame_id(frame.f_code))
+                frame = frame.f_back
+            stack.reverse()
+            self.samples.append(stack)
+            self.weights.append(dt)
+
+    def _run(self) -> None:
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            now = time.perf_counter()
+            self._sample(now - last)
+            last = now
+
+    def start(self) -> None:
+        self.started = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.stopped = time.perf_counter()
+
+    def speedscope(self, name: str) -> Dict[str, Any]:
+        """Định dạng speedscope (kéo thả file vào https://www.speedscope.app để xem flamegraph)."""
+        return {
+            '$schema': SPEEDSCOPE_SCHEMA,
+            'name': name,
+            'exporter': 'vnstock-server',
+            'activeProfileIndex': 0,
+            'shared': {'frames': self.frames},
+            'profiles': [{
+                'type': 'sampled',
+                'name': name,
+                'unit': 'seconds',
+                'startValue': 0,
+                'endValue': round(sum(self.weights), 6),
+                'samples': self.samples,
+                'weights': [round(w, 6) for w in self.weights],
+            }],
+        }
+
+
+# tracemalloc là trạng thái toàn cục: đếm số request đang cần để chỉ stop khi request cuối xong
+_TRACE_LOCK = threading.Lock()
+_TRACE_USERS = 0
+
+
+def _trace_start() -> bool:
+    global _TRACE_USERS
+    with _TRACE_LOCK:
+        if _TRACE_USERS == 0 and tracemalloc.is_tracing():
+            return False            # người khác bật (vd. PYTHONTRACEMALLOC) -> không đụng vào
+        if _TRACE_USERS == 0:
+            tracemalloc.start(16)
+        _TRACE_USERS += 1
+        tracemalloc.reset_peak()
+        return True
+
+
+def _trace_stop() -> None:
+    global _TRACE_USERS
+    with _TRACE_LOCK:
+        _TRACE_USERS -= 1
+        if _TRACE_USERS == 0:
+            tracemalloc.stop()
+
+
+def allocation_report(before: tracemalloc.Snapshot, after: tracemalloc.Snapshot, top: int = 20) -> List[Dict[str, Any]]:
+    """Các dòng code cấp phát nhiều nhất trong request (chênh lệch giữa hai snapshot)."""
+    stats = after.compare_to(before, 'lineno')
+    out = []
+    for st in stats[:top]:
+        tb = st.traceback[0]
+        out.append({'file': tb.filename, 'line': tb.lineno, 'size_kb': round(st.size_diff / 1024, 1),
+                    'count': st.count_diff})
+    return out
+
+
+class ProfileSession:
+    def __init__(self, name: str, interval: float, allocations: bool):
+        self.id = uuid.uuid4().hex[:12]
+        self.name = name
+        self.profiler = SamplingProfiler(interval)
+        self.allocations = allocations and _trace_start()
+        self._before = tracemalloc.take_snapshot() if self.allocations else None
+        self.alloc: Optional[Dict[str, Any]] = None
+        self.profiler.start()
+
+    def enter_thread(self) -> None:
+        self.profiler.threads.add(threading.get_ident())
+
+    def exit_thread(self) -> None:
+        self.profiler.threads.discard(threading.get_ident())
+
+    def finish(self) -> None:
+        self.profiler.stop()
+        if self.allocations:
+            after = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            self.alloc = {'peak_kb': round(peak / 1024, 1), 'current_kb': round(current / 1024, 1),
+                          'top': allocation_report(self._before, after)}
+            self._before = None
+            _trace_stop()
+
+
+class ProfileStore:
+    """Giữ `keep` profile gần nhất trong bộ nhớ (kèm file .speedscope.json trong `directory` nếu có)."""
+
+    def __init__(self, keep: int = 20, directory: Optional[str] = None):
+        self.keep = keep
+        self.directory = directory
+        self._items: 'OrderedDict[str, Dict[str, Any]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, session: ProfileSession, status: int) -> Dict[str, Any]:
+        p = session.profiler
+        record = {
+            'id': session.id,
+            'name': session.name,
+            'at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'status': status,
+            'duration_ms': round((p.stopped - p.started) * 1000, 2),
+            'samples': len(p.samples),
+            'allocations': session.alloc,
+            'speedscope': p.speedscope(session.name),
+        }
+        if self.directory:
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                path = os.path.join(self.directory, f"{session.id}.speedscope.json")
+                with open(path, 'w', encoding='utf-8') as f:
+                    json.dump(record['speedscope'], f)
+                record['file'] = path
+            except Exception as e:
+                print(f"Không ghi được profile {session.id}: {e}")
+        with self._lock:
+            self._items[session.id] = record
+            while len(self._items) > self.keep:
+                _, old = self._items.popitem(last=False)
+                if old.get('file'):
+                    try:
+                        os.remove(old['file'])
+                    except OSError:
+                        pass
+        return record
+
+    def get(self, profile_id: str) -> Optional[Dict[str, Any]]:
+        return self._items.get(profile_id)
+
+    def list(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            items = list(self._items.values())
+        out = []
+        for r in reversed(items):
+            row = {k: v for k, v in r.items() if k not in ('speedscope', 'allocations')}
+            row['peak_kb'] = (r['allocations'] or {}).get('peak_kb')
+            out.append(row)
+        return out
+
+
+def _wrap_endpoint(call):
+    """Đăng ký thread đang chạy endpoint với session profile (endpoint sync chạy trong threadpool)."""
+    if inspect.iscoroutinefunction(call):
+        @functools.wraps(call)
+        async def wrapper(*args, **kwargs):
+            session = _SESSION.get()
+            if session is None:
+                return await call(*args, **kwargs)
+            session.enter_thread()
+            try:
+                return await call(*args, **kwargs)
+            finally:
+                session.exit_thread()
+    else:
+        @functools.wraps(call)
+        def wrapper(*args, **kwargs):
+            session = _SESSION.get()
+            if session is None:
+                return call(*args, **kwargs)
+            session.enter_thread()
+            try:
+                return call(*args, **kwargs)
+            finally:
+                session.exit_thread()
+    return wrapper
+
+
+def profile_mode(request) -> Optional[str]:
+    """'full' (CPU + cấp phát) | 'cpu' | None, từ ?profile=1|cpu hoặc header X-Profile."""
+    value = request.query_params.get('profile') or request.headers.get('x-profile')
+    if not value or value.lower() in ('0', 'false', 'off', 'no'):
+        return None
+    return 'cpu' if value.lower() == 'cpu' else 'full'
+
+
+def install_profiling(app, token: str, store: ProfileStore, interval: float = 0.002) -> None:
+    """
+    Bật profile theo request cho mọi route HTTP của app (gọi sau khi đã khai báo route).
+    Request có ?profile=1 (hoặc header X-Profile: 1; `cpu` = bỏ đo cấp phát) kèm header
+    X-Admin-Token đúng sẽ được profile; response có header X-Profile-Id để xem ở /admin/profiles.
+    """
+    from fastapi.routing import APIRoute
+
+    for route in app.routes:
+        if isinstance(route, APIRoute):
+            route.dependant.call = _wrap_endpoint(route.dependant.call)
+
+    @app.middleware("http")
+    async def _profile_middleware(request, call_next):
+        mode = profile_mode(request)
+        if mode is None or request.headers.get('x-admin-token') != token:
+            return await call_next(request)
+        name = f"{request.method} {request.url.path}" + (f"?{request.url.query}" if request.url.query else '')
+        session = ProfileSession(name, interval, allocations=(mode == 'full'))
+        reset = _SESSION.set(session)
+        status = 500
+        try:
+            response = await call_next(request)
+            status = response.status_code
+        finally:
+            session.finish()
+            _SESSION.reset(reset)
+            record = store.add(session, status)
+        response.headers['X-Profile-Id'] = record['id']
+        response.headers['X-Profile-Duration-Ms'] = str(record['duration_ms'])
+        return response
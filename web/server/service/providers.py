@@ -0,0 +1,181 @@
+import os
+import random
+import threading
+import time
+from typing import Optional
+
+from service.bars import Bars, iso_to_day
+from service.intraday import IntradayStore, MinuteBars, get_intraday_store, iso_to_minute
+from service.price_store import PriceStore, get_price_store
+from service.trading_calendar import get_trading_calendar
+
+
+class ProviderError(Exception):
+    """Lỗi chung khi lấy dữ liệu từ provider."""
+
+
+class RateLimitError(ProviderError):
+    """Provider từ chối vì vượt rate limit (HTTP 429)."""
+
+
+class HistoryProvider:
+    """Nguồn dữ liệu lịch sử giá; mọi implementation trả về Bars đã chuẩn hóa."""
+    name = 'base'
+
+    def history(self, symbol: str, start_date: str, end_date: str, interval: str = '1D') -> Bars:
+        raise NotImplementedError
+
+    def intraday(self, symbol: str, start_date: str, end_date: str, interval: str = '1m') -> MinuteBars:
+        """Bar trong ngày (mốc theo phút); provider không hỗ trợ -> ProviderError."""
+        raise ProviderError(f'{self.name} không hỗ trợ dữ liệu trong ngày')
+
+
+class VnstockProvider(HistoryProvider):
+    """Provider thật: vnstock Quote (mặc định nguồn VCI)."""
+    name = 'vnstock'
+
+    def __init__(self, source: str = 'VCI'):
+        self.source = source
+
+    def history(self, symbol: str, start_date: str, end_date: str, interval: str = '1D') -> Bars:
+        from vnstock import Quote
+        # Khởi tạo đối tượng Quote như trong tài liệu
+        quote = Quote(symbol=symbol, source=self.source)
+        # Hàm history thường dùng định dạng YYYY-MM-DD
+        df = quote.history(start=start_date, end=end_date, interval=interval)
+        return Bars.from_frame(df, symbol)
+
+    def intraday(self, symbol: str, start_date: str, end_date: str, interval: str = '1m') -> MinuteBars:
+        from vnstock import Quote
+        quote = Quote(symbol=symbol, source=self.source)
+        # vnstock dùng '1H' cho khung giờ
+        df = quote.history(start=start_date, end=end_date, interval='1H' if interval == '1h' else interval)
+        return MinuteBars.from_frame(df, symbol)
+
+
+class ReplayProvider(HistoryProvider):
+    """
+    Phát lại dữ liệu đã ghi (data/raw/ta/*.csv + web/server/cache/*.csv) thay cho provider thật.
+
+    Dữ liệu ghi lại dừng ở một ngày cố định nên nếu align=True và `end` nằm sau ngày cuối
+    của mã, trả về đúng số phiên mà cửa sổ [start, end] chứa (theo lịch giao dịch) tính
+    lùi từ ngày cuối đó; nhờ vậy "N phiên gần nhất" vẫn đủ bar khi load test ở hiện tại.
+    """
+    name = 'replay'
+
+    def __init__(self, store: Optional[PriceStore] = None, align: bool = True,
+                 intraday_store: Optional[IntradayStore] = None):
+        self._store = store
+        self.align = align
+        self._intraday = intraday_store
+
+    @property
+    def store(self) -> PriceStore:
+        return self._store if self._store is not None else get_price_store()
+
+    def history(self, symbol: str, start_date: str, end_date: str, interval: str = '1D') -> Bars:
+        if interval != '1D':
+            raise ProviderError(f'Replay chỉ hỗ trợ interval 1D (nhận {interval})')
+        store = self.store
+        start_day, end_day = iso_to_day(start_date), iso_to_day(end_date)
+        last = store.last_day(symbol)
+        if last is None:
+            return Bars.empty(symbol)
+        if self.align and end_day > last:
+            return store.tail(symbol, get_trading_calendar().count(start_day, end_day))
+        return store.bars(symbol, start_day, end_day)
+
+    def intraday(self, symbol: str, start_date: str, end_date: str, interval: str = '1m') -> MinuteBars:
+        """Phát lại bar phút đã lưu trong kho intraday (data/intraday), không căn theo ngày hiện tại."""
+        store = self._intraday if self._intraday is not None else get_intraday_store()
+        end = iso_to_minute(end_date) + 1439 if len(end_date) <= 10 else iso_to_minute(end_date)
+        return store.read(symbol, interval, iso_to_minute(start_date), end)
+
+
+class FaultInjectingProvider(HistoryProvider):
+    """
+    Bọc một provider khác, thêm độ trễ và lỗi giả lập để load test offline.
+
+    - latency_ms / jitter_ms: trễ cố định + ngẫu nhiên đều trong [0, jitter_ms]
+    - rate_limit_prob: xác suất ném RateLimitError (như HTTP 429)
+    - system_exit_prob: xác suất ném SystemExit (vnstock làm vậy khi bị chặn)
+    """
+
+    def __init__(self, inner: HistoryProvider, latency_ms: float = 0.0, jitter_ms: float = 0.0,
+                 rate_limit_prob: float = 0.0, system_exit_prob: float = 0.0, seed: Optional[int] = None):
+        self.inner = inner
+        self.name = f'{inner.name}+faults'
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.rate_limit_prob = rate_limit_prob
+        self.system_exit_prob = system_exit_prob
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _inject(self, symbol: str) -> None:
+        with self._lock:
+            delay = self.latency_ms + self._rng.uniform(0, self.jitter_ms)
+            roll = self._rng.random()
+        if delay > 0:
+            time.sleep(delay / 1000.0)
+        if roll < self.rate_limit_prob:
+            raise RateLimitError(f'429 Too Many Requests (simulated) for {symbol}')
+        if roll < self.rate_limit_prob + self.system_exit_prob:
+            raise SystemExit(f'Rate limit exceeded (simulated) for {symbol}')
+
+    def history(self, symbol: str, start_date: str, end_date: str, interval: str = '1D') -> Bars:
+        self._inject(symbol)
+        return self.inner.history(symbol, start_date, end_date, interval=interval)
+
+    def intraday(self, symbol: str, start_date: str, end_date: str, interval: str = '1m') -> MinuteBars:
+        self._inject(symbol)
+        return self.inner.intraday(symbol, start_date, end_date, interval=interval)
+
+
+def _env_float(name: str, default: float = 0.0) -> float:
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+def build_provider_from_env() -> HistoryProvider:
+    """
+    Chọn provider theo biến môi trường:
+    - STOCK_PROVIDER: 'vnstock' (mặc định) | 'replay'
+    - PROVIDER_LATENCY_MS, PROVIDER_JITTER_MS: độ trễ giả lập
+    - PROVIDER_429_RATE, PROVIDER_EXIT_RATE: xác suất lỗi 429 / SystemExit
+    - PROVIDER_SEED: seed cho lỗi/độ trễ ngẫu nhiên (tái lập được)
+    """
+    kind = os.environ.get('STOCK_PROVIDER', 'vnstock').strip().lower()
+    if kind in {'replay', 'local', 'csv', 'offline'}:
+        provider: HistoryProvider = ReplayProvider()
+    else:
+        provider = VnstockProvider(source=os.environ.get('VNSTOCK_SOURCE', 'VCI'))
+
+    latency = _env_float('PROVIDER_LATENCY_MS')
+    jitter = _env_float('PROVIDER_JITTER_MS')
+    p429 = _env_float('PROVIDER_429_RATE')
+    pexit = _env_float('PROVIDER_EXIT_RATE')
+    if latency or jitter or p429 or pexit:
+        seed = os.environ.get('PROVIDER_SEED')
+        provider = FaultInjectingProvider(provider, latency_ms=latency, jitter_ms=jitter,
+                                          rate_limit_prob=p429, system_exit_prob=pexit,
+                                          seed=int(seed) if seed else None)
+    return provider
+
+
+_PROVIDER: Optional[HistoryProvider] = None
+
+
+def get_provider() -> HistoryProvider:
+    global _PROVIDER
+    if _PROVIDER is None:
+        _PROVIDER = build_provider_from_env()
+    return _PROVIDER
+
+
+def set_provider(provider: Optional[HistoryProvider]) -> None:
+    """Thay provider dùng chung (None -> đọc lại cấu hình từ môi trường ở lần gọi sau)."""
+    global _PROVIDER
+    _PROVIDER = provider
@@ -0,0 +1,339 @@
+import threading
+import numpy as np
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+from service.bars import Bars, days_to_iso
+from service.price_store import PriceStore, get_price_store
+
+WINDOW = 60                 # số phiên trong cửa sổ tính hiệp phương sai / tương quan
+MIN_PERIODS = 20            # số cặp quan sát tối thiểu để một hệ số có nghĩa
+TRADING_DAYS = 252          # annualize độ biến động
+INDEX_NAME = 'TOP100_EW'    # chỉ số equal-weight (trung bình log return các mã có bar trong ngày)
+
+
+class RollingRisk:
+    """
+    Hiệp phương sai / tương quan log return theo cửa sổ trượt WINDOW phiên cho cả universe, kèm
+    độ biến động từng mã và beta so với chỉ số equal-weight (cột cuối của các ma trận).
+
+    Không giữ lại cả panel: chỉ một ring buffer WINDOW dòng return và các tổng theo cặp
+    (Σx_i·x_j, Σx_i, Σx_i², số quan sát chung – chỉ tính trên những ngày cả hai mã cùng có bar,
+    giống pandas.corr). Mỗi phiên mới là một cập nhật hạng 1 (cộng dòng mới, trừ dòng rơi khỏi
+    cửa sổ): O(n²) thay vì O(WINDOW·n²) tính lại. Bar của phiên hiện tại bị sửa (live) thì trừ
+    dòng cũ, cộng dòng mới. Cứ WINDOW lần cập nhật thì dựng lại tổng từ buffer để sai số làm tròn
+    của cộng/trừ không tích lũy.
+    """
+
+    def __init__(self, symbols: Sequence[str], window: int = WINDOW):
+        self.symbols = [str(s).upper() for s in symbols]
+        self.window = window
+        self._col = {s: i for i, s in enumerate(self.symbols)}
+        n = len(self.symbols)
+        m = n + 1                                   # + cột chỉ số
+        self._R = np.zeros((window, m))
+        self._V = np.zeros((window, m), dtype=bool)
+        self._days = np.full(window, -1, dtype=np.int64)
+        self._head = 0                              # slot sẽ ghi dòng kế tiếp
+        self._count = 0
+        self._S2 = np.zeros((m, m))                 # Σ x_i x_j
+        self._Sx = np.zeros((m, m))                 # Σ x_i   trên các ngày j có dữ liệu
+        self._Sq = np.zeros((m, m))                 # Σ x_i²  trên các ngày j có dữ liệu
+        self._N = np.zeros((m, m))                  # số ngày cả i và j có dữ liệu
+        self._prev = np.full(n, np.nan)             # close gần nhất trước phiên hiện tại
+        self._cur = np.full(n, np.nan)              # close của phiên hiện tại (NaN = chưa có bar)
+        self.last_day: Optional[int] = None
+        self._updates = 0
+        self.version = 0
+        self.store: Optional[PriceStore] = None      # kho giá đã dùng để dựng (nếu có)
+        self._lock = threading.RLock()
+
+    # --- dựng từ kho giá ---
+
+    @classmethod
+    def from_store(cls, store: PriceStore, symbols: Optional[Sequence[str]] = None,
+                   window: int = WINDOW) -> 'RollingRisk':
+        """Dựng từ WINDOW phiên cuối của kho giá (một lần khi khởi động)."""
+        symbols = [s for s in (symbols or store.symbol_list()) if s in store]
+        risk = cls(symbols, window)
+        risk.store = store
+        if not symbols:
+            return risk
+        # Phiên chung của universe: ngày có >= một nửa số mã giao dịch (vd. một mã có file cache mới
+        # hơn phần còn lại thì các ngày chỉ có riêng mã đó không tạo thành phiên)
+        recent = np.concatenate([store.tail(s, 3 * (window + 1)).day for s in symbols])
+        days, counts = np.unique(recent, return_counts=True)
+        days = days[counts >= 0.5 * counts.max()][-(window + 1):]
+        if len(days) < 2:
+            return risk
+        panel = np.full((len(days), len(symbols)), np.nan)
+        for j, s in enumerate(symbols):
+            b = store.bars(s, int(days[0]), int(days[-1]))
+            panel[np.searchsorted(days, b.day), j] = b.close
+            # close gốc của mã chưa có bar ở phiên đầu: bar gần nhất trước đó
+            if not np.isfinite(panel[0, j]):
+                before = store.tail(s, 1, end_day=int(days[0]))
+                if len(before):
+                    panel[0, j] = before.close[-1]
+        risk._cur = panel[0].copy()
+        risk.last_day = int(days[0])
+        cols = np.arange(len(symbols))
+        for t in range(1, len(days)):
+            ok = np.isfinite(panel[t])
+            risk._set(int(days[t]), cols[ok], panel[t, ok])
+        risk._rebuild()
+        return risk
+
+    # --- cập nhật tăng dần ---
+
+    def _apply(self, r: np.ndarray, v: np.ndarray, sign: float) -> None:
+        r0 = np.where(v, r, 0.0)
+        vf = v.astype(np.float64)
+        self._S2 += sign * np.outer(r0, r0)
+        self._Sx += sign * np.outer(r0, vf)
+        self._Sq += sign * np.outer(r0 * r0, vf)
+        self._N += sign * np.outer(vf, vf)
+
+    def _row(self):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            r = np.log(self._cur / self._prev)
+        v = np.isfinite(r)
+        idx = float(r[v].mean()) if v.any() else np.nan
+        return np.append(np.where(v, r, 0.0), idx if v.any() else 0.0), np.append(v, v.any())
+
+    def _set(self, day: int, cols: np.ndarray, closes: np.ndarray) -> bool:
+        if self.last_day is not None and day < self.last_day:
+            return False                            # bar cũ hơn phiên hiện tại -> bỏ qua
+        if self.last_day is None or day > self.last_day:
+            # Phiên mới: close phiên trước thành gốc, dòng cũ nhất rơi khỏi cửa sổ
+            self._prev = np.where(np.isfinite(self._cur), self._cur, self._prev)
+            self._cur = np.full_like(self._cur, np.nan)
+            slot = self._head
+            if self._count == self.window:
+                self._apply(self._R[slot], self._V[slot], -1.0)
+            else:
+                self._count += 1
+            self._head = (self._head + 1) % self.window
+            self._days[slot] = day
+            self.last_day = day
+        else:
+            slot = (self._head - 1) % self.window
+            self._apply(self._R[slot], self._V[slot], -1.0)
+        self._cur[cols] = closes
+        r, v = self._row()
+        self._R[slot], self._V[slot] = r, v
+        self._apply(r, v, 1.0)
+        self._updates += 1
+        if self._updates % self.window == 0:
+            self._rebuild()
+        self.version += 1
+        return True
+
+    def update(self, day: int, closes: Dict[str, float]) -> bool:
+        """
+        Close của phiên `day` cho một số mã (các mã khác của cùng phiên có thể tới sau).
+        Phiên cũ hơn phiên hiện tại bị bỏ qua; mã ngoài universe bị bỏ qua.
+        """
+        items = [(self._col[s.upper()], float(c)) for s, c in closes.items()
+                 if s.upper() in self._col and c is not None and np.isfinite(c) and c > 0]
+        if not items:
+            return False
+        cols = np.array([i for i, _ in items], dtype=np.int64)
+        vals = np.array([c for _, c in items])
+        with self._lock:
+            return self._set(int(day), cols, vals)
+
+    def apply_bars(self, bars: Iterable[Bars]) -> int:
+        """Nạp bar mới (vd. từ live feed): gom theo phiên, cập nhật từng phiên theo thứ tự ngày."""
+        by_day: Dict[int, Dict[str, float]] = {}
+        last = self.last_day
+        for b in bars:
+            if not len(b):
+                continue
+            take = b.day >= last if last is not None else np.arange(len(b)) == len(b) - 1
+            for d, c in zip(b.day[take], b.close[take]):
+                by_day.setdefault(int(d), {})[b.symbol.upper()] = float(c)
+        n = 0
+        for d in sorted(by_day):
+            n += bool(self.update(d, by_day[d]))
+        return n
+
+    def _rebuild(self) -> None:
+        Rz = np.where(self._V, self._R, 0.0)
+        Vf = self._V.astype(np.float64)
+        self._S2 = Rz.T @ Rz
+        self._Sx = Rz.T @ Vf
+        self._Sq = (Rz * Rz).T @ Vf
+        self._N = Vf.T @ Vf
+
+    # --- thống kê ---
+
+    def _stats(self, min_periods: int):
+        """(cov, var_i|j, var_j|i) theo cặp; NaN khi ít hơn min_periods ngày chung."""
+        N = self._N
+        ok = N >= max(min_periods, 2)
+        Nz = np.where(ok, N, 1.0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            cov = (self._S2 - self._Sx * self._Sx.T / Nz) / (Nz - 1)
+            var = (self._Sq - self._Sx * self._Sx / Nz) / (Nz - 1)     # var của i trên ngày chung với j
+        cov[~ok] = np.nan
+        var[~ok] = np.nan
+        return cov, np.maximum(var, 0.0)
+
+    def covariance(self, min_periods: int = MIN_PERIODS) -> np.ndarray:
+        with self._lock:
+            return self._stats(min_periods)[0]
+
+    def correlation(self, min_periods: int = MIN_PERIODS) -> np.ndarray:
+        """Tương quan Pearson theo cặp (ngày chung), gồm cả cột chỉ số ở cuối."""
+        with self._lock:
+            cov, var = self._stats(min_periods)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            corr = cov / np.sqrt(var * var.T)
+        corr = np.clip(corr, -1.0, 1.0)
+        np.fill_diagonal(corr, np.where(np.isfinite(np.diag(cov)) & (np.diag(cov) > 0), 1.0, np.nan))
+        return corr
+
+    def summary(self, min_periods: int = MIN_PERIODS) -> Dict[str, np.ndarray]:
+        """Theo mã: vol (năm hóa), beta và tương quan với chỉ số, số phiên có return."""
+        with self._lock:
+            cov, var = self._stats(min_periods)
+            n_obs = np.diag(self._N).copy()
+        m = cov.shape[0] - 1
+        with np.errstate(invalid='ignore', divide='ignore'):
+            vol = np.sqrt(np.diag(cov)) * np.sqrt(TRADING_DAYS)
+            cov_m = cov[:m, m]
+            var_m_given_i = var[m, :m]              # var chỉ số trên các ngày mã i có bar
+            beta = cov_m / var_m_given_i
+            corr_m = cov_m / np.sqrt(var[:m, m] * var_m_given_i)
+        return {'vol': vol[:m], 'beta': beta, 'corr_index': np.clip(corr_m, -1.0, 1.0),
+                'n_obs': n_obs[:m], 'index_vol': vol[m]}
+
+    def days(self) -> np.ndarray:
+        """Các phiên đang nằm trong cửa sổ (tăng dần)."""
+        with self._lock:
+            order = (np.arange(self._count) + self._head - self._count) % self.window
+            return self._days[order]
+
+    def indices(self, symbols: Optional[Sequence[str]]) -> np.ndarray:
+        if not symbols:
+            return np.arange(len(self.symbols))
+        return np.array([self._col[s.upper()] for s in symbols if s.upper() in self._col], dtype=np.int64)
+
+
+def _distance(corr: np.ndarray) -> np.ndarray:
+    # d = sqrt((1 - ρ) / 2) ∈ [0, 1]; cặp thiếu dữ liệu coi như không tương quan
+    c = np.where(np.isfinite(corr), corr, 0.0)
+    d = np.sqrt(np.clip(0.5 * (1.0 - c), 0.0, 1.0))
+    np.fill_diagonal(d, 0.0)
+    return d
+
+
+def cluster_correlation(risk: RollingRisk, symbols: Optional[Sequence[str]] = None, threshold: float = 0.5,
+                        n_clusters: Optional[int] = None, min_periods: int = MIN_PERIODS) -> Dict[str, Any]:
+    """
+    Gom cụm theo tương quan (hierarchical, average linkage trên d = sqrt((1-ρ)/2)): cắt ở mức
+    tương quan trung bình `threshold` hoặc thành đúng `n_clusters` cụm. `order` là thứ tự lá của
+    dendrogram – xếp ma trận tương quan theo thứ tự này thì các khối tương quan hiện rõ.
+    """
+    from scipy.cluster.hierarchy import fcluster, leaves_list, linkage
+    from scipy.spatial.distance import squareform
+
+    idx = risk.indices(symbols)
+    corr = risk.correlation(min_periods)
+    n_obs = np.diag(risk._N)[idx]
+    idx = idx[(n_obs >= min_periods) & np.isfinite(np.diag(corr)[idx])]
+    names = [risk.symbols[i] for i in idx]
+    sub = corr[np.ix_(idx, idx)]
+    if len(idx) < 2:
+        return {'symbols': names, 'order': names, 'labels': [1] * len(names), 'corr': sub}
+    Z = linkage(squareform(_distance(sub), checks=False), method='average')
+    if n_clusters:
+        labels = fcluster(Z, t=int(n_clusters), criterion='maxclust')
+    else:
+        labels = fcluster(Z, t=float(np.sqrt(0.5 * (1.0 - threshold))), criterion='distance')
+    order = leaves_list(Z)
+    return {'symbols': names, 'order': [names[i] for i in order], 'labels': labels.tolist(), 'corr': sub,
+            'order_index': order}
+
+
+def diversified_top_k(risk: RollingRisk, scores: Dict[str, float], k: int = 10, max_corr: float = 0.7,
+                      labels: Optional[Dict[str, int]] = None, per_cluster: Optional[int] = None,
+                      min_periods: int = MIN_PERIODS) -> Dict[str, Any]:
+    """
+    Chọn tham lam K mã điểm cao nhất sao cho tương quan với mọi mã đã chọn <= max_corr (và tối đa
+    per_cluster mã mỗi cụm nếu có labels). Trả về danh sách chọn + so sánh rủi ro danh mục
+    equal-weight với top-K thuần theo điểm.
+    """
+    corr = risk.correlation(min_periods)
+    summary = risk.summary(min_periods)
+    cand = sorted((s for s, v in scores.items() if v is not None and np.isfinite(v) and s.upper() in risk._col),
+                  key=lambda s: -scores[s])
+    chosen: List[int] = []
+    picked: List[Dict[str, Any]] = []
+    per: Dict[int, int] = {}
+    skipped = {'correlation': 0, 'cluster': 0}
+    for s in cand:
+        if len(chosen) >= k:
+            break
+        i = risk._col[s.upper()]
+        worst = float(np.nanmax(np.abs(corr[i, chosen]))) if chosen and np.isfinite(corr[i, chosen]).any() else 0.0
+        if worst > max_corr:
+            skipped['correlation'] += 1
+            continue
+        lab = labels.get(s.upper()) if labels else None
+        if per_cluster and lab is not None and per.get(lab, 0) >= per_cluster:
+            skipped['cluster'] += 1
+            continue
+        partner = risk.symbols[chosen[int(np.nanargmax(np.abs(corr[i, chosen])))]] if chosen and worst > 0 else None
+        chosen.append(i)
+        if lab is not None:
+            per[lab] = per.get(lab, 0) + 1
+        picked.append({'symbol': risk.symbols[i], 'score': float(scores[s]), 'cluster': lab,
+                       'vol': _num(summary['vol'][i]), 'beta': _num(summary['beta'][i]),
+                       'max_corr_selected': round(worst, 4), 'most_correlated_with': partner})
+    naive = [risk._col[s.upper()] for s in cand[:k]]
+    return {'selected': picked, 'skipped': skipped,
+            'portfolio': portfolio_stats(risk, chosen, min_periods),
+            'naive_top_k': {'symbols': [risk.symbols[i] for i in naive], **portfolio_stats(risk, naive, min_periods)}}
+
+
+def portfolio_stats(risk: RollingRisk, idx: Sequence[int], min_periods: int = MIN_PERIODS) -> Dict[str, Any]:
+    """Vol năm hóa của danh mục equal-weight và tương quan trung bình giữa các cặp."""
+    idx = np.asarray(idx, dtype=np.int64)
+    if not len(idx):
+        return {'vol': None, 'avg_corr': None}
+    cov = risk.covariance(min_periods)[np.ix_(idx, idx)]
+    corr = risk.correlation(min_periods)[np.ix_(idx, idx)]
+    w = np.full(len(idx), 1.0 / len(idx))
+    c = np.where(np.isfinite(cov), cov, 0.0)
+    pairs = corr[np.triu_indices(len(idx), 1)]
+    pairs = pairs[np.isfinite(pairs)]
+    return {'vol': _num(np.sqrt(max(float(w @ c @ w), 0.0) * TRADING_DAYS)),
+            'avg_corr': round(float(pairs.mean()), 4) if len(pairs) else None}
+
+
+def _num(x) -> Optional[float]:
+    x = float(x)
+    return round(x, 6) if np.isfinite(x) else None
+
+
+def window_label(risk: RollingRisk) -> Dict[str, Any]:
+    days = risk.days()
+    return {'window': risk.window, 'sessions': int(len(days)),
+            'start': str(days_to_iso(days[:1])[0]) if len(days) else None,
+            'end': str(days_to_iso(days[-1:])[0]) if len(days) else None}
+
+
+_RISK: Optional[RollingRisk] = None
+_RISK_LOCK = threading.Lock()
+
+
+def get_risk_model() -> RollingRisk:
+    """RollingRisk của kho giá dùng chung (dựng lười lần đầu; dựng lại nếu kho bị thay)."""
+    global _RISK
+    store = get_price_store()
+    if _RISK is None or _RISK.store is not store:
+        with _RISK_LOCK:
+            if _RISK is None or _RISK.store is not store:
+                _RISK = RollingRisk.from_store(store)
+    return _RISK
@@ -0,0 +1,399 @@
+import os
+import re
+import threading
+import numpy as np
+import pandas as pd
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from service.bars import Bars, days_to_iso
+from service.indicators import compute_features
+from service.price_store import PriceStore, _find_repo_root, get_price_store
+
+WINDOW = 50          # cùng cửa sổ với live feed -> chỉ báo khớp message /ws/live
+MAX_EXPR_LEN = 2000
+
+# --- Parser biểu thức lọc (không dùng eval) ---
+#
+#   expr   := and ('OR' and)*
+#   and    := not ('AND' not)*
+#   not    := 'NOT' not | cmp
+#   cmp    := sum (('<' | '<=' | '>' | '>=' | '=' | '==' | '!=') sum)?
+#   sum    := term (('+' | '-') term)*
+#   term   := unary (('*' | '/') unary)*
+#   unary  := '-' unary | atom
+#   atom   := số | tên cột | '(' expr ')'
+#
+# Kết quả là cây tuple (hashable, cache được); evaluate() tính cả cây trên các mảng cột.
+
+_TOKEN = re.compile(r"\s*(?:(\d+(?:\.\d*)?(?:[eE][-+]?\d+)?|\.\d+)|([A-Za-z_][A-Za-z0-9_]*)|(<=|>=|==|!=|&&|\|\||[<>=+\-*/()]))")
+_KEYWORDS = {'and': 'AND', 'or': 'OR', 'not': 'NOT', '&&': 'AND', '||': 'OR'}
+_CMP = {'<', '<=', '>', '>=', '=', '==', '!='}
+
+
+def _tokenize(text: str) -> List[Tuple[str, str]]:
+    tokens, pos, text = [], 0, text.strip()
+    while pos < len(text):
+        m = _TOKEN.match(text, pos)
+        if not m or m.end() == pos:
+            raise ValueError(f"Ký tự không hợp lệ tại vị trí {pos}: {text[pos:pos + 10]!r}")
+        num, name, op = m.groups()
+        if num is not None:
+            tokens.append(('num', num))
+        elif name is not None:
+            kw = _KEYWORDS.get(name.lower())
+            tokens.append(('kw', kw) if kw else ('name', name))
+        else:
+            kw = _KEYWORDS.get(op)
+            tokens.append(('kw', kw) if kw else ('op', op))
+        pos = m.end()
+    return tokens
+
+
+class _Parser:
+    def __init__(self, tokens: List[Tuple[str, str]]):
+        self.tokens = tokens
+        self.i = 0
+        self.depth = 0
+
+    def peek(self) -> Optional[Tuple[str, str]]:
+        return self.tokens[self.i] if self.i < len(self.tokens) else None
+
+    def take(self, kind: str, value: Optional[str] = None) -> bool:
+        tok = self.peek()
+        if tok and tok[0] == kind and (value is None or tok[1] == value):
+            self.i += 1
+            return True
+        return False
+
+    def parse(self):
+        node = self.expr()
+        if self.peek() is not None:
+            raise ValueError(f"Thừa '{self.peek()[1]}' ở cuối biểu thức")
+        return node
+
+    def expr(self):
+        node = self.and_()
+        while self.take('kw', 'OR'):
+            node = ('or', node, self.and_())
+        return node
+
+    def and_(self):
+        node = self.not_()
+        while self.take('kw', 'AND'):
+            node = ('and', node, self.not_())
+        return node
+
+    def not_(self):
+        if self.take('kw', 'NOT'):
+            return ('not', self.not_())
+        return self.cmp()
+
+    def cmp(self):
+        node = self.sum()
+        tok = self.peek()
+        if tok and tok[0] == 'op' and tok[1] in _CMP:
+            self.i += 1
+            op = '==' if tok[1] == '=' else tok[1]
+            node = ('cmp', op, node, self.sum())
+        return node
+
+    def sum(self):
+        node = self.term()
+        while True:
+            tok = self.peek()
+            if tok and tok[0] == 'op' and tok[1] in ('+', '-'):
+                self.i += 1
+                node = ('arith', tok[1], node, self.term())
+            else:
+                return node
+
+    def term(self):
+        node = self.unary()
+        while True:
+            tok = self.peek()
+            if tok and tok[0] == 'op' and tok[1] in ('*', '/'):
+                self.i += 1
+                node = ('arith', tok[1], node, self.unary())
+            else:
+                return node
+
+    def unary(self):
+        if self.take('op', '-'):
+            return ('neg', self.unary())
+        return self.atom()
+
+    def atom(self):
+        tok = self.peek()
+        if tok is None:
+            raise ValueError("Biểu thức kết thúc đột ngột")
+        self.i += 1
+        if tok[0] == 'num':
+            return ('num', float(tok[1]))
+        if tok[0] == 'name':
+            return ('col', tok[1])
+        if tok == ('op', '('):
+            self.depth += 1
+            if self.depth > 32:
+                raise ValueError("Biểu thức lồng quá sâu")
+            node = self.expr()
+            if not self.take('op', ')'):
+                raise ValueError("Thiếu ')'")
+            self.depth -= 1
+            return node
+        raise ValueError(f"Không mong đợi '{tok[1]}'")
+
+
+def _bool_check(node) -> None:
+    """Chặn các biểu thức sai kiểu như 'rsi_14 AND 3' trước khi tính."""
+    kind = node[0]
+    if kind in ('and', 'or'):
+        for child in node[1:]:
+            if child[0] not in ('and', 'or', 'not', 'cmp'):
+                raise ValueError("AND/OR/NOT chỉ dùng giữa các phép so sánh")
+            _bool_check(child)
+    elif kind == 'not':
+        if node[1][0] not in ('and', 'or', 'not', 'cmp'):
+            raise ValueError("AND/OR/NOT chỉ dùng giữa các phép so sánh")
+        _bool_check(node[1])
+    elif kind == 'cmp':
+        for child in node[2:]:
+            if child[0] in ('and', 'or', 'not', 'cmp'):
+                raise ValueError("Không so sánh trực tiếp kết quả của một phép so sánh")
+
+
+@lru_cache(maxsize=256)
+def parse_predicate(text: str):
+    """Chuỗi điều kiện, vd. 'rsi_14<30 AND volume_ratio>2 AND final_score>50' -> cây biểu thức."""
+    if not text or not text.strip():
+        raise ValueError("Điều kiện lọc rỗng")
+    if len(text) > MAX_EXPR_LEN:
+        raise ValueError(f"Điều kiện lọc dài quá {MAX_EXPR_LEN} ký tự")
+    try:
+        node = _Parser(_tokenize(text)).parse()
+    except RecursionError:
+        raise ValueError("Biểu thức lồng quá sâu")
+    if node[0] not in ('and', 'or', 'not', 'cmp'):
+        raise ValueError("Điều kiện lọc phải là phép so sánh, vd. rsi_14 < 30")
+    _bool_check(node)
+    return node
+
+
+def predicate_columns(node) -> List[str]:
+    """Các tên cột dùng trong cây biểu thức (theo thứ tự xuất hiện)."""
+    if node[0] == 'col':
+        return [node[1]]
+    out: List[str] = []
+    for child in node[1:]:
+        if isinstance(child, tuple):
+            out += [c for c in predicate_columns(child) if c not in out]
+    return out
+
+
+def evaluate(node, columns: Dict[str, np.ndarray]) -> np.ndarray:
+    """Tính cây biểu thức trên các mảng cột (vector hóa); so sánh với NaN cho False."""
+    kind = node[0]
+    if kind == 'num':
+        return np.float64(node[1])
+    if kind == 'col':
+        return columns[node[1]]
+    if kind == 'neg':
+        return -evaluate(node[1], columns)
+    if kind == 'not':
+        return ~evaluate(node[1], columns)
+    if kind in ('and', 'or'):
+        a, b = evaluate(node[1], columns), evaluate(node[2], columns)
+        return (a & b) if kind == 'and' else (a | b)
+    op, a, b = node[1], evaluate(node[2], columns), evaluate(node[3], columns)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        if kind == 'arith':
+            return {'+': np.add, '-': np.subtract, '*': np.multiply, '/': np.divide}[op](a, b)
+        return {'<': np.less, '<=': np.less_equal, '>': np.greater, '>=': np.greater_equal,
+                '==': np.equal, '!=': np.not_equal}[op](a, b)
+
+
+# --- Bảng chỉ báo mới nhất ---
+
+def _fa_path() -> str:
+    return os.path.join(_find_repo_root(), 'data', 'raw', 'top_100_stocks.csv')
+
+
+def _read_fa(path: str) -> pd.DataFrame:
+    df = pd.read_csv(path)
+    df['symbol'] = df['symbol'].astype(str).str.strip().str.upper()
+    df = df.drop_duplicates('symbol', keep='last').set_index('symbol')
+    return df.select_dtypes(include=[np.number]).astype(np.float64)
+
+
+class ScreenTable:
+    """
+    Bảng dạng cột: mỗi mã một dòng, mỗi chỉ báo TA (tại bar mới nhất) / điểm FA một mảng float64.
+
+    Dựng một lần từ kho giá local (cả universe tính chỉ báo trong một lượt panel 2-D), sau đó
+    apply() chỉ ghi đè dòng của các mã vừa có bar mới (live feed gọi sau khi đã tính chỉ báo),
+    còn điểm FA được nạp lại khi top_100_stocks.csv đổi mtime. Lọc là vài phép so sánh trên
+    các mảng ~N phần tử, không đọc lại lịch sử.
+    """
+
+    def __init__(self, store: Optional[PriceStore] = None, fa_path: Optional[str] = None, window: int = WINDOW):
+        self.window = window
+        self.fa_path = fa_path or _fa_path()
+        self._fa_mtime = None
+        self._lock = threading.Lock()
+        self.version = 0
+        store = store if store is not None else get_price_store()
+        fa = self._load_fa()
+        symbols = sorted(set(store.symbol_list()) | set(fa.index if fa is not None else ()))
+        self.symbols = np.array(symbols, dtype=object)
+        self._row = {s: i for i, s in enumerate(symbols)}
+        self.day = np.full(len(symbols), -1, dtype=np.int64)
+        self.ta: Dict[str, np.ndarray] = {}
+        self.fa: Dict[str, np.ndarray] = {}
+        self.apply_bars({s: store.tail(s, window) for s in store.symbol_list()})
+        self._set_fa(fa)
+
+    def __len__(self) -> int:
+        return len(self.symbols)
+
+    @property
+    def fields(self) -> List[str]:
+        return [*self.ta, *self.fa]
+
+    def _load_fa(self) -> Optional[pd.DataFrame]:
+        try:
+            mtime = os.path.getmtime(self.fa_path)
+        except OSError:
+            return None
+        self._fa_mtime = mtime
+        return _read_fa(self.fa_path)
+
+    def _set_fa(self, fa: Optional[pd.DataFrame]) -> None:
+        if fa is None:
+            return
+        self._ensure_rows(fa.index)
+        rows = np.array([self._row[s] for s in fa.index], dtype=np.int64)
+        cols = {}
+        for c in fa.columns:
+            arr = np.full(len(self.symbols), np.nan)
+            arr[rows] = fa[c].to_numpy()
+            cols[c] = arr
+        self.fa = cols
+        self.version += 1
+
+    def refresh_fa(self) -> bool:
+        """Nạp lại điểm FA nếu file CSV đã đổi; trả về True khi có nạp lại."""
+        try:
+            mtime = os.path.getmtime(self.fa_path)
+        except OSError:
+            return False
+        if mtime == self._fa_mtime:
+            return False
+        with self._lock:
+            self._set_fa(self._load_fa())
+        return True
+
+    def _ensure_rows(self, symbols: Iterable[str]) -> None:
+        new = [s for s in symbols if s not in self._row]
+        if not new:
+            return
+        n = len(new)
+        self.symbols = np.concatenate([self.symbols, np.array(new, dtype=object)])
+        self._row.update({s: len(self._row) + i for i, s in enumerate(new)})
+        self.day = np.concatenate([self.day, np.full(n, -1, dtype=np.int64)])
+        for d in (self.ta, self.fa):
+            for c in d:
+                d[c] = np.concatenate([d[c], np.full(n, np.nan)])
+
+    def apply(self, symbols: Sequence[str], last: Dict[str, np.ndarray], days: np.ndarray) -> None:
+        """Ghi đè chỉ báo tại bar cuối cho các mã `symbols` (last[c][i] ứng với symbols[i])."""
+        if not len(symbols):
+            return
+        with self._lock:
+            self._ensure_rows(symbols)
+            rows = np.array([self._row[s] for s in symbols], dtype=np.int64)
+            for c, values in last.items():
+                arr = self.ta.get(c)
+                if arr is None:
+                    arr = self.ta[c] = np.full(len(self.symbols), np.nan)
+                arr[rows] = values
+            self.day[rows] = days
+            self.version += 1
+
+    def apply_bars(self, bars: Dict[str, Bars]) -> None:
+        """Tính chỉ báo cho các mã có đủ `window` bar (một lượt panel) rồi apply()."""
+        panel = {s.upper(): b.tail(self.window).filled() for s, b in bars.items() if len(b) >= self.window}
+        if not panel:
+            return
+        syms = list(panel)
+        stack = {f: np.vstack([getattr(panel[s], f) for s in syms]) for f in ('open', 'high', 'low', 'close', 'volume')}
+        feats = compute_features(stack['open'], stack['high'], stack['low'], stack['close'], stack['volume'])
+        self.apply(syms, latest_values(feats), np.array([int(panel[s].day[-1]) for s in syms]))
+
+    def resolve(self, name: str) -> Optional[str]:
+        """Tên cột không phân biệt hoa thường."""
+        if name in self.ta or name in self.fa:
+            return name
+        lower = name.lower()
+        for c in (*self.ta, *self.fa):
+            if c.lower() == lower:
+                return c
+        return None
+
+    def screen(self, where: str, sort: Optional[str] = None, descending: bool = True, limit: Optional[int] = 50,
+               fields: Optional[Sequence[str]] = None) -> Dict[str, object]:
+        self.refresh_fa()
+        node = parse_predicate(where)
+        used = predicate_columns(node)
+        mapping, unknown = {}, []
+        for name in [*used, *(fields or ()), *([sort] if sort else [])]:
+            col = self.resolve(name)
+            if col is None:
+                unknown.append(name)
+            mapping[name] = col
+        if unknown:
+            raise ValueError(f"Không có cột {sorted(set(unknown))}; xem /screen/fields")
+        with self._lock:
+            data = {name: (self.ta.get(col) if col in self.ta else self.fa[col]) for name, col in mapping.items()}
+            symbols, day = self.symbols, self.day
+            mask = np.broadcast_to(np.asarray(evaluate(node, data), dtype=bool), symbols.shape)
+            rows = np.flatnonzero(mask)
+            if sort:
+                key = data[sort][rows]
+                order = np.argsort(np.where(np.isnan(key), -np.inf if descending else np.inf, key), kind='stable')
+                rows = rows[order[::-1] if descending else order]
+            out_cols = list(dict.fromkeys([*used, *(fields or ()), *([sort] if sort else [])]))
+            picked = rows[:limit] if limit else rows
+            dates = days_to_iso(day[picked].clip(min=0))
+            result = []
+            for j, r in enumerate(picked):
+                row = {'symbol': symbols[r], 'date': str(dates[j]) if day[r] >= 0 else None}
+                for c in out_cols:
+                    v = float(data[c][r])
+                    row[mapping[c]] = v if np.isfinite(v) else None
+                result.append(row)
+        return {'where': where, 'total': int(len(rows)), 'count': len(result),
+                'universe': int(len(symbols)), 'version': self.version, 'rows': result}
+
+
+def latest_values(feats: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """Giá trị tại bar cuối của mỗi chỉ báo (panel 2-D) + % thay đổi giá phiên cuối."""
+    last = {k: np.asarray(v, dtype=np.float64)[..., -1] for k, v in feats.items()}
+    close = np.asarray(feats['close'], dtype=np.float64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        last['change_pct'] = (close[..., -1] / close[..., -2] - 1.0) * 100 if close.shape[-1] > 1 \
+            else np.full(close.shape[:-1], np.nan)
+    return last
+
+
+_TABLE: Optional[ScreenTable] = None
+_TABLE_LOCK = threading.Lock()
+
+
+def get_screen_table() -> ScreenTable:
+    """ScreenTable dùng chung của process (dựng lười lần đầu gọi)."""
+    global _TABLE
+    if _TABLE is None:
+        with _TABLE_LOCK:
+            if _TABLE is None:
+                _TABLE = ScreenTable()
+    return _TABLE
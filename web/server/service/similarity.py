@@ -0,0 +1,187 @@
+import threading
+import numpy as np
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from service.bars import days_to_iso
+from service.price_store import PriceStore, get_price_store
+
+WINDOW = 50            # bằng cửa sổ model dùng
+FORWARD = 7            # số phiên sau cửa sổ để báo "sau đó giá đi thế nào"
+SCOPES = ('latest', 'history')
+
+
+def znorm_windows(close: np.ndarray, window: int = WINDOW) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Mọi cửa sổ trượt `window` bar của một chuỗi giá, z-normalize rồi chia thêm sqrt(window)
+    để mỗi vector có độ dài 1: tích vô hướng hai vector = hệ số tương quan Pearson của hai
+    cửa sổ, và khoảng cách Euclid z-normalized = sqrt(2 * window * (1 - r)).
+    Trả về (ma trận float32, mask cửa sổ hợp lệ – đủ dữ liệu và không phẳng).
+    """
+    close = np.asarray(close, dtype=np.float64)
+    if close.shape[0] < window:
+        return np.empty((0, window), dtype=np.float32), np.empty(0, dtype=bool)
+    w = np.lib.stride_tricks.sliding_window_view(close, window)
+    ok = np.isfinite(w).all(axis=1)
+    mu = np.where(ok, np.where(np.isfinite(w), w, 0.0).mean(axis=1), 0.0)
+    z = np.where(ok[:, None], w - mu[:, None], 0.0)
+    sd = np.sqrt((z * z).mean(axis=1))
+    ok &= sd > 1e-9 * np.maximum(np.abs(mu), 1.0)
+    z = np.where(ok[:, None], z / np.where(sd > 0, sd, 1.0)[:, None], 0.0) / np.sqrt(window)
+    return z.astype(np.float32), ok
+
+
+class PatternIndex:
+    """
+    Chỉ mục vector cho tất cả cửa sổ 50 bar của kho giá local (brute force theo khối).
+
+    Các vector nằm liền trong một ma trận float32 (~200 byte/cửa sổ), nên một truy vấn là
+    một phép nhân ma trận–vector theo từng khối `block_rows` dòng + argpartition lấy top-m
+    mỗi khối: vài trăm nghìn cửa sổ vẫn chỉ tốn vài ms, bộ nhớ tạm không phụ thuộc kích
+    thước kho, và kết quả chính xác (không xấp xỉ như ANN).
+    """
+
+    def __init__(self, store: PriceStore, window: int = WINDOW, block_rows: int = 65536):
+        self.store = store
+        self.window = window
+        self.block_rows = block_rows
+        vecs, codes, ends = [], [], []
+        for code, sym in enumerate(store.symbol_list()):
+            s, e = store.span(sym)
+            z, ok = znorm_windows(store.columns['close'][s:e], window)
+            if not ok.any():
+                continue
+            pos = np.flatnonzero(ok)
+            vecs.append(z[pos])
+            codes.append(np.full(len(pos), code, dtype=np.int32))
+            # vị trí (trong mảng cột của store) của bar cuối mỗi cửa sổ
+            ends.append(s + pos + window - 1)
+        self.vectors = np.ascontiguousarray(np.concatenate(vecs)) if vecs else np.empty((0, window), np.float32)
+        self.codes = np.concatenate(codes) if codes else np.empty(0, np.int32)
+        self.ends = np.concatenate(ends).astype(np.int64) if ends else np.empty(0, np.int64)
+        # Cửa sổ mới nhất của mỗi mã (cho scope='latest')
+        last = np.flatnonzero(np.append(self.codes[1:] != self.codes[:-1], True)) if len(self.codes) else []
+        self.latest_rows = np.asarray(last, dtype=np.int64)
+        self._row_of_end = {int(end): i for i, end in enumerate(self.ends)}
+
+    def __len__(self) -> int:
+        return int(self.vectors.shape[0])
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.vectors.nbytes + self.codes.nbytes + self.ends.nbytes)
+
+    def query_vector(self, symbol: str, end_day: Optional[int] = None) -> Tuple[np.ndarray, int]:
+        """(vector, vị trí bar cuối trong store) của cửa sổ mã `symbol` kết thúc tại end_day (mặc định: mới nhất)."""
+        s, e = self.store.span(symbol)
+        if end_day is not None and e > s:
+            e = s + int(np.searchsorted(self.store.day[s:e], end_day, side='right'))
+        if e - s < self.window:
+            raise KeyError(f'{symbol}: không đủ {self.window} phiên')
+        row = self._row_of_end.get(e - 1)
+        if row is not None:
+            return self.vectors[row], e - 1
+        z, ok = znorm_windows(self.store.columns['close'][e - self.window:e], self.window)
+        if not ok[0]:
+            raise KeyError(f'{symbol}: cửa sổ giá phẳng hoặc thiếu dữ liệu')
+        return z[0], e - 1
+
+    def _candidates(self, q: np.ndarray, m: int, rows: Optional[np.ndarray], exclude: Optional[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-m (chỉ số dòng, điểm) theo tương quan, tính theo khối để giới hạn bộ nhớ tạm."""
+        best_idx, best_score = [], []
+        n = len(rows) if rows is not None else len(self)
+        for lo in range(0, n, self.block_rows):
+            hi = min(lo + self.block_rows, n)
+            idx = rows[lo:hi] if rows is not None else np.arange(lo, hi)
+            score = (self.vectors[idx] if rows is not None else self.vectors[lo:hi]) @ q
+            if exclude is not None:
+                score[exclude[idx]] = -np.inf
+            if len(score) > m:
+                part = np.argpartition(-score, m - 1)[:m]
+                idx, score = idx[part], score[part]
+            best_idx.append(idx)
+            best_score.append(score)
+        if not best_idx:
+            return np.empty(0, np.int64), np.empty(0, np.float32)
+        idx, score = np.concatenate(best_idx), np.concatenate(best_score)
+        order = np.argsort(-score, kind='stable')[:m]
+        keep = np.isfinite(score[order])
+        return idx[order][keep], score[order][keep]
+
+    def search(self, symbol: str, k: int = 10, scope: str = 'latest', end_day: Optional[int] = None,
+               symbols: Optional[Sequence[str]] = None, forward: int = FORWARD) -> Dict[str, object]:
+        """
+        scope='latest': mã nào có 50 phiên gần nhất giống cửa sổ truy vấn nhất (mỗi mã một kết quả).
+        scope='history': các đoạn trong quá khứ (mọi mã, hoặc chỉ `symbols`) giống nhất; các cửa sổ
+        chồng lên cửa sổ truy vấn hoặc chồng quá nửa lên một kết quả tốt hơn của cùng mã bị bỏ.
+        """
+        symbol = symbol.upper()
+        q, q_end = self.query_vector(symbol, end_day)
+        q_code = self.store._index[symbol]
+        w = self.window
+
+        allowed = None
+        if symbols:
+            codes = [self.store._index[s] for s in (x.upper() for x in symbols) if s in self.store._index]
+            allowed = np.isin(self.codes, codes)
+
+        if scope == 'latest':
+            rows = self.latest_rows if allowed is None else self.latest_rows[allowed[self.latest_rows]]
+            rows = rows[self.codes[rows] != q_code]
+            idx, score = self._candidates(q, k, rows, None)
+        elif scope == 'history':
+            rows = None if allowed is None else np.flatnonzero(allowed)
+            exclude = (self.codes == q_code) & (np.abs(self.ends - q_end) < w)
+            # Mỗi kết quả nhận được loại tối đa 2*(w//2) cửa sổ lân cận của cùng mã -> lấy dư đủ
+            sep = max(w // 2, 1)
+            idx, score = self._candidates(q, k * (2 * sep + 1), rows, exclude)
+            taken: Dict[int, List[int]] = {}
+            keep = []
+            for j, (i, c, end) in enumerate(zip(idx, self.codes[idx], self.ends[idx])):
+                if any(abs(int(end) - t) < sep for t in taken.get(int(c), ())):
+                    continue
+                taken.setdefault(int(c), []).append(int(end))
+                keep.append(j)
+                if len(keep) == k:
+                    break
+            idx, score = idx[keep], score[keep]
+        else:
+            raise ValueError(f"scope phải là một trong {SCOPES}")
+
+        close, day = self.store.columns['close'], self.store.day
+        out_end = self.store.offsets[self.codes[idx] + 1]
+        matches = []
+        for i, r, end, stop in zip(idx, score, self.ends[idx], out_end):
+            ahead = int(end) + forward
+            nxt = float(close[ahead] / close[end] - 1.0) if forward and ahead < stop and close[end] else None
+            r = float(min(max(r, -1.0), 1.0))
+            matches.append({
+                'symbol': self.store.symbols[self.codes[i]],
+                'start': str(days_to_iso(day[end - w + 1:end - w + 2])[0]),
+                'end': str(days_to_iso(day[end:end + 1])[0]),
+                'corr': round(r, 4),
+                'distance': round(float(np.sqrt(max(2.0 * w * (1.0 - r), 0.0))), 4),
+                f'return_next_{forward}': None if nxt is None or not np.isfinite(nxt) else round(nxt, 4),
+            })
+        return {
+            'symbol': symbol,
+            'window': w,
+            'scope': scope,
+            'query': {'start': str(days_to_iso(day[q_end - w + 1:q_end - w + 2])[0]),
+                      'end': str(days_to_iso(day[q_end:q_end + 1])[0])},
+            'matches': matches,
+        }
+
+
+_INDEX: Optional[PatternIndex] = None
+_INDEX_LOCK = threading.Lock()
+
+
+def get_pattern_index() -> PatternIndex:
+    """PatternIndex của kho giá dùng chung (dựng lười lần đầu; dựng lại nếu kho bị thay)."""
+    global _INDEX
+    store = get_price_store()
+    if _INDEX is None or _INDEX.store is not store:
+        with _INDEX_LOCK:
+            if _INDEX is None or _INDEX.store is not store:
+                _INDEX = PatternIndex(store)
+    return _INDEX
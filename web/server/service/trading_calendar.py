@@ -0,0 +1,111 @@
+import threading
+import numpy as np
+from datetime import datetime
+from typing import Optional, Tuple
+
+from service.bars import days_to_iso, iso_to_day
+from service.price_store import PriceStore, get_price_store
+
+
+def _as_date(day: int) -> np.datetime64:
+    return np.datetime64(int(day), 'D')
+
+
+def _today() -> int:
+    return iso_to_day(datetime.now().strftime('%Y-%m-%d'))
+
+
+class TradingCalendar:
+    """
+    Lịch phiên giao dịch suy ra từ ngày có bar thực tế trong kho giá.
+
+    - Trong khoảng đã quan sát: phiên = ngày có bar, nên "N phiên gần nhất" là chính xác
+      (bỏ qua cuối tuần, nghỉ lễ).
+    - Sau ngày cuối đã quan sát (dữ liệu chưa cập nhật tới hôm nay): ước lượng bằng
+      ngày làm việc thứ 2–6, và được thay bằng ngày thật khi observe() thấy bar mới.
+    """
+
+    def __init__(self, days: np.ndarray):
+        self.days = np.unique(np.asarray(days, dtype=np.int32))
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_store(cls, store: PriceStore, min_share: float = 0.5) -> 'TradingCalendar':
+        """
+        Ngày giao dịch = ngày có ít nhất min_share * (số mã trung vị mỗi ngày) mã có bar,
+        để loại các bar lạc (một mã có dữ liệu vào ngày nghỉ).
+        """
+        if len(store) == 0:
+            return cls(np.empty(0, dtype=np.int32))
+        days, counts = np.unique(store.day, return_counts=True)
+        keep = counts >= max(1.0, min_share * float(np.median(counts)))
+        return cls(days[keep])
+
+    def __len__(self) -> int:
+        return int(self.days.shape[0])
+
+    @property
+    def last_observed(self) -> Optional[int]:
+        return int(self.days[-1]) if len(self) else None
+
+    def observe(self, days: np.ndarray) -> None:
+        """Bổ sung các ngày mới thấy từ provider (chỉ ngày sau ngày cuối đã biết)."""
+        days = np.asarray(days, dtype=np.int32)
+        last = self.last_observed
+        new = days if last is None else days[days > last]
+        if new.size:
+            with self._lock:
+                self.days = np.union1d(self.days, new).astype(np.int32)
+
+    def _weekdays_after_last(self, end_day: int) -> int:
+        """Số ngày thứ 2–6 trong (ngày cuối đã quan sát, end_day]."""
+        last = self.last_observed
+        if last is None or end_day <= last:
+            return 0
+        return int(np.busday_count(_as_date(last + 1), _as_date(end_day + 1)))
+
+    def count(self, start_day: int, end_day: int) -> int:
+        """Số phiên trong [start_day, end_day]."""
+        if end_day < start_day:
+            return 0
+        last = self.last_observed
+        if last is None:
+            return int(np.busday_count(_as_date(start_day), _as_date(end_day + 1)))
+        days = self.days
+        n = int(np.searchsorted(days, end_day, side='right') - np.searchsorted(days, start_day, side='left'))
+        if end_day > last:
+            n += int(np.busday_count(_as_date(max(start_day, last + 1)), _as_date(end_day + 1)))
+        return n
+
+    def window(self, n: int, end_day: Optional[int] = None) -> Tuple[int, int]:
+        """(start_day, end_day) bao đúng n phiên gần nhất kết thúc tại/trước end_day (mặc định hôm nay)."""
+        if end_day is None:
+            end_day = _today()
+        n = max(int(n), 1)
+        days = self.days
+        extra = self._weekdays_after_last(end_day)
+        if len(self) == 0 or extra >= n:
+            start = np.busday_offset(_as_date(end_day), -(n - 1), roll='backward')
+            return int(start.astype(np.int64)), end_day
+        hi = int(np.searchsorted(days, end_day, side='right'))
+        need = n - extra
+        return int(days[max(hi - need, 0)]), end_day
+
+    def window_iso(self, n: int, end_day: Optional[int] = None) -> Tuple[str, str]:
+        start, end = self.window(n, end_day)
+        return str(days_to_iso([start])[0]), str(days_to_iso([end])[0])
+
+
+_CALENDAR: Optional[TradingCalendar] = None
+_CALENDAR_LOCK = threading.Lock()
+
+
+def get_trading_calendar() -> TradingCalendar:
+    """Lịch phiên dùng chung của process, dựng từ kho giá local lần đầu gọi."""
+    global _CALENDAR
+    if _CALENDAR is None:
+        with _CALENDAR_LOCK:
+            if _CALENDAR is None:
+                _CALENDAR = TradingCalendar.from_store(get_price_store())
+    return _CALENDAR
+
@@ -0,0 +1,393 @@
+import hashlib
+import json
+import math
+import os
+import time
+import numpy as np
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from service.fundamentals import attach_fa_features
+from service.indicators import MODEL_WINDOW, feature_matrix, window_features, FEATURE_COLUMNS
+from service.price_store import PriceStore, get_price_store
+
+# Nhãn giống notebooks/modelling.ipynb: 1 nếu lợi nhuận sau 7 phiên > 2%
+TARGET_HORIZON = 7
+TARGET_THRESHOLD = 0.02
+GAP_DAYS = 7
+SEED = 42
+
+
+# ---------------------------------------------------------------------------
+# Dữ liệu
+# ---------------------------------------------------------------------------
+
+class Dataset:
+    """Ma trận feature (float32) + nhãn + ngày của toàn bộ mã, sắp theo (mã, ngày)."""
+
+    def __init__(self, X: np.ndarray, y: np.ndarray, day: np.ndarray, codes: np.ndarray, symbols: List[str],
+                 columns: Sequence[str] = FEATURE_COLUMNS):
+        self.X = X
+        self.y = y
+        self.day = day
+        self.codes = codes
+        self.symbols = symbols
+        self.columns = list(columns)
+
+    def __len__(self) -> int:
+        return int(self.y.shape[0])
+
+    def fingerprint(self) -> str:
+        h = hashlib.sha1()
+        for arr in (self.X, self.y, self.day):
+            h.update(np.ascontiguousarray(arr).tobytes())
+        h.update(','.join(self.columns).encode('utf-8'))
+        return h.hexdigest()[:16]
+
+
+def symbol_features(bars, columns: Sequence[str] = FEATURE_COLUMNS, horizon: int = TARGET_HORIZON,
+                    threshold: float = TARGET_THRESHOLD) -> Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """
+    (X float32, nhãn int8, ngày) của một mã. Mỗi dòng là feature của bar cuối trong cửa sổ
+    MODEL_WINDOW bar kết thúc ở ngày đó – đúng dòng server chấm lúc dự báo – nên bỏ
+    MODEL_WINDOW - 1 bar đầu và các dòng cuối chưa có giá sau `horizon` phiên.
+    """
+    bars = bars.filled()
+    if len(bars) < MODEL_WINDOW + horizon:
+        return None
+    f = window_features(bars.open, bars.high, bars.low, bars.close, bars.volume, MODEL_WINDOW)
+    day = bars.day[MODEL_WINDOW - 1:]
+    attach_fa_features(f, bars.symbol, day, columns)
+    X = feature_matrix(f, list(columns))
+    close = bars.close[MODEL_WINDOW - 1:]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ret = (close[horizon:] - close[:-horizon]) / close[:-horizon]
+    ok = np.isfinite(ret)
+    n = len(ret)
+    return X[:n][ok].astype(np.float32), (ret[ok] > threshold).astype(np.int8), day[:n][ok]
+
+
+def build_dataset(store: Optional[PriceStore] = None, symbols: Optional[Sequence[str]] = None,
+                  horizon: int = TARGET_HORIZON, threshold: float = TARGET_THRESHOLD,
+                  columns: Sequence[str] = FEATURE_COLUMNS) -> Dataset:
+    """
+    Feature tính bằng đúng compute_features trên cửa sổ MODEL_WINDOW bar như server dùng lúc dự
+    báo (không đọc lại CSV chỉ báo đã xử lý), nhãn = close sau `horizon` phiên tăng hơn `threshold`.
+    """
+    if store is None:
+        store = get_price_store()
+    if symbols is None:
+        symbols = store.symbol_list()
+    mats, ys, days, codes, kept = [], [], [], [], []
+    for sym in symbols:
+        part = symbol_features(store.bars(sym), columns, horizon, threshold)
+        if part is None:
+            continue
+        mats.append(part[0])
+        ys.append(part[1])
+        days.append(part[2])
+        codes.append(np.full(len(part[1]), len(kept), dtype=np.int32))
+        kept.append(sym)
+    if not mats:
+        raise ValueError('Không có dữ liệu để train')
+    return Dataset(np.ascontiguousarray(np.concatenate(mats)), np.concatenate(ys),
+                   np.concatenate(days).astype(np.int32), np.concatenate(codes), kept, list(columns))
+
+
+def split_by_time(day: np.ndarray, train_ratio: float = 0.7, val_ratio: float = 0.15,
+                  gap_days: int = GAP_DAYS) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Chia TRAIN --gap-- VALIDATION --gap-- TEST theo lịch (như time_series_split_with_gap
+    trong notebook) để nhãn 7 phiên không rò rỉ qua ranh giới. Trả về 3 mask.
+    """
+    lo, hi = int(day.min()), int(day.max())
+    total = hi - lo
+    val_start = lo + int(total * train_ratio)
+    test_start = lo + int(total * (train_ratio + val_ratio))
+    train = day <= val_start - gap_days
+    val = (day >= val_start) & (day <= test_start - gap_days)
+    test = day >= test_start
+    return train, val, test
+
+
+def time_folds(day: np.ndarray, n_splits: int = 3, gap_days: int = GAP_DAYS) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """
+    TimeSeriesSplit theo ngày (không theo dòng, vì nhiều mã cùng ngày): chia các ngày thành
+    n_splits + 1 khúc, fold k train trên các ngày trước khúc k (trừ gap), test trên khúc k.
+    """
+    uniq = np.unique(day)
+    bounds = np.linspace(0, len(uniq), n_splits + 2).astype(int)
+    folds = []
+    for k in range(1, n_splits + 1):
+        test_lo, test_hi = uniq[bounds[k]], uniq[bounds[k + 1] - 1]
+        tr = np.flatnonzero(day <= test_lo - gap_days)
+        te = np.flatnonzero((day >= test_lo) & (day <= test_hi))
+        if len(tr) and len(te):
+            folds.append((tr, te))
+    return folds
+
+
+# ---------------------------------------------------------------------------
+# Cache ma trận từng fold trên đĩa
+# ---------------------------------------------------------------------------
+
+class FoldCache:
+    """
+    Ma trận train/test của từng fold (kèm bản đã chuẩn hóa bằng StandardScaler fit trên
+    train của fold) lưu .npy dưới thư mục theo fingerprint dữ liệu + cách chia.
+
+    Mọi ứng viên dùng chung các file này qua np.load(mmap_mode='r'): scaler chỉ fit một lần
+    mỗi fold, các worker song song đọc cùng trang bộ nhớ thay vì mỗi process giữ một bản.
+    """
+
+    def __init__(self, root: str, key: str):
+        self.dir = os.path.join(root, key)
+
+    @staticmethod
+    def key_for(data: Dataset, mask: np.ndarray, n_splits: int, gap_days: int) -> str:
+        h = hashlib.sha1(f'{data.fingerprint()}:{n_splits}:{gap_days}:'.encode('utf-8'))
+        h.update(np.packbits(mask).tobytes())
+        return h.hexdigest()[:16]
+
+    def _path(self, fold: int, name: str) -> str:
+        return os.path.join(self.dir, f'fold{fold}_{name}.npy')
+
+    def exists(self, n_folds: int) -> bool:
+        return os.path.exists(os.path.join(self.dir, 'meta.json')) and all(
+            os.path.exists(self._path(k, 'Xte_std')) for k in range(n_folds))
+
+    def build(self, X: np.ndarray, y: np.ndarray, folds) -> None:
+        os.makedirs(self.dir, exist_ok=True)
+        for k, (tr, te) in enumerate(folds):
+            Xtr, Xte = X[tr], X[te]
+            mean = Xtr.mean(axis=0, dtype=np.float64)
+            std = Xtr.std(axis=0, dtype=np.float64)
+            std[std == 0] = 1.0
+            arrays = {
+                'Xtr': Xtr, 'ytr': y[tr], 'Xte': Xte, 'yte': y[te],
+                'Xtr_std': ((Xtr - mean) / std).astype(np.float32),
+                'Xte_std': ((Xte - mean) / std).astype(np.float32),
+            }
+            for name, arr in arrays.items():
+                tmp = self._path(k, name) + '.tmp.npy'
+                np.save(tmp, np.ascontiguousarray(arr))
+                os.replace(tmp, self._path(k, name))
+        with open(os.path.join(self.dir, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump({'folds': len(folds), 'sizes': [[len(tr), len(te)] for tr, te in folds]}, f)
+
+    def load(self, fold: int, scaled: bool = False) -> Dict[str, np.ndarray]:
+        suffix = '_std' if scaled else ''
+        return {
+            'Xtr': np.load(self._path(fold, 'Xtr' + suffix), mmap_mode='r'),
+            'ytr': np.load(self._path(fold, 'ytr'), mmap_mode='r'),
+            'Xte': np.load(self._path(fold, 'Xte' + suffix), mmap_mode='r'),
+            'yte': np.load(self._path(fold, 'yte'), mmap_mode='r'),
+        }
+
+    def train_rows(self, fold: int) -> int:
+        return int(np.load(self._path(fold, 'ytr'), mmap_mode='r').shape[0])
+
+
+# ---------------------------------------------------------------------------
+# Các họ model (LightGBM / XGBoost chỉ dùng khi đã cài)
+# ---------------------------------------------------------------------------
+
+def _has(module: str) -> bool:
+    try:
+        __import__(module)
+        return True
+    except ImportError:
+        return False
+
+
+def _make_lr(params):
+    from sklearn.linear_model import LogisticRegression
+    return LogisticRegression(class_weight='balanced', max_iter=1000, solver='lbfgs', random_state=SEED, **params)
+
+
+def _make_rf(params):
+    from sklearn.ensemble import RandomForestClassifier
+    return RandomForestClassifier(class_weight='balanced', random_state=SEED, n_jobs=1, **params)
+
+
+def _make_lgbm(params):
+    import lightgbm as lgb
+    return lgb.LGBMClassifier(n_estimators=1000, max_depth=6, class_weight='balanced', random_state=SEED,
+                              n_jobs=1, verbose=-1, **params)
+
+
+def _make_xgb(params):
+    import xgboost as xgb
+    return xgb.XGBClassifier(n_estimators=1000, max_depth=6, random_state=SEED, n_jobs=1,
+                             eval_metric='auc', verbosity=0, **params)
+
+
+FAMILIES: Dict[str, Dict[str, Any]] = {
+    'lr': {'label': 'Logistic Regression', 'scaled': True, 'make': _make_lr,
+           'grid': {'C': [0.01, 0.1, 1.0, 10.0]}},
+    'rf': {'label': 'Random Forest', 'scaled': False, 'make': _make_rf,
+           'grid': {'n_estimators': [100], 'max_depth': [6, 8, 10], 'min_samples_leaf': [20, 50],
+                    'max_features': ['sqrt', 'log2']}},
+    'lgbm': {'label': 'LightGBM', 'scaled': False, 'make': _make_lgbm, 'boosting': True, 'module': 'lightgbm',
+             'grid': {'learning_rate': [0.03, 0.1], 'num_leaves': [15, 31], 'min_child_samples': [20, 50]}},
+    'xgb': {'label': 'XGBoost', 'scaled': False, 'make': _make_xgb, 'boosting': True, 'module': 'xgboost',
+            'grid': {'learning_rate': [0.03, 0.1], 'min_child_weight': [1, 10]}},
+}
+
+EARLY_STOPPING_ROUNDS = 30
+
+
+def available_families() -> List[str]:
+    return [k for k, fam in FAMILIES.items() if 'module' not in fam or _has(fam['module'])]
+
+
+def expand_grid(families: Sequence[str]) -> List[Tuple[str, Dict[str, Any]]]:
+    from sklearn.model_selection import ParameterGrid
+    out = []
+    for fam in families:
+        for params in ParameterGrid(FAMILIES[fam]['grid']):
+            out.append((fam, dict(params)))
+    return out
+
+
+def _fit(fam: str, est, X: np.ndarray, y: np.ndarray):
+    """
+    Fit một ứng viên. Họ boosting dừng sớm trên 10% dòng cuối (theo thời gian) của tập
+    train, nên số vòng không phải dò bằng grid; trả về số vòng tốt nhất (hoặc None).
+    """
+    if not FAMILIES[fam].get('boosting'):
+        est.fit(X, y)
+        return est, None
+    cut = int(len(y) * 0.9)
+    X_fit, y_fit, X_es, y_es = X[:cut], y[:cut], X[cut:], y[cut:]
+    if fam == 'lgbm':
+        import lightgbm as lgb
+        est.fit(X_fit, y_fit, eval_set=[(X_es, y_es)], eval_metric='auc',
+                callbacks=[lgb.early_stopping(EARLY_STOPPING_ROUNDS, verbose=False)])
+        return est, int(est.best_iteration_ or est.n_estimators)
+    pos = max(int(y_fit.sum()), 1)
+    est.set_params(scale_pos_weight=(len(y_fit) - pos) / pos, early_stopping_rounds=EARLY_STOPPING_ROUNDS)
+    est.fit(X_fit, y_fit, eval_set=[(X_es, y_es)], verbose=False)
+    return est, int(est.best_iteration + 1)
+
+
+def _rows_for_fold(data: Dict[str, np.ndarray], n_rows: Optional[int]) -> Tuple[np.ndarray, np.ndarray]:
+    # Resource của successive halving = số dòng train gần nhất (đuôi của fold)
+    X, y = data['Xtr'], data['ytr']
+    if n_rows is not None and n_rows < len(y):
+        X, y = X[-n_rows:], y[-n_rows:]
+    return X, y
+
+
+def evaluate_candidate(cache_dir: str, fold: int, fam: str, params: Dict[str, Any],
+                       n_rows: Optional[int]) -> Dict[str, Any]:
+    """Một task (ứng viên, fold, số dòng): chạy trong worker, đọc ma trận từ cache qua mmap."""
+    from sklearn.metrics import roc_auc_score
+    cache = FoldCache.__new__(FoldCache)
+    cache.dir = cache_dir
+    data = cache.load(fold, scaled=FAMILIES[fam]['scaled'])
+    X, y = _rows_for_fold(data, n_rows)
+    t0 = time.perf_counter()
+    est, best_iter = _fit(fam, FAMILIES[fam]['make'](params), X, y)
+    fit_s = time.perf_counter() - t0
+    yte = np.asarray(data['yte'])
+    prob = est.predict_proba(data['Xte'])[:, 1]
+    auc = float(roc_auc_score(yte, prob)) if 0 < yte.sum() < len(yte) else float('nan')
+    return {'fold': fold, 'auc': auc, 'fit_s': fit_s, 'best_iter': best_iter}
+
+
+# ---------------------------------------------------------------------------
+# Successive halving song song có giới hạn bộ nhớ
+# ---------------------------------------------------------------------------
+
+def parse_bytes(value) -> int:
+    """'2G' / '512M' / số byte -> byte."""
+    if isinstance(value, (int, float)):
+        return int(value)
+    s = str(value).strip().upper().rstrip('B')
+    mult = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30}.get(s[-1:], 1)
+    return int(float(s[:-1] if s[-1:] in 'KMG' else s) * mult)
+
+
+def _task_memory(n_rows: int, n_features: int, fam: str) -> int:
+    """Ước lượng bộ nhớ riêng của một task: bản sao X khi fit + cấu trúc model + overhead process."""
+    x_bytes = n_rows * n_features * 4
+    model = 8 * n_rows * 16 if fam == 'rf' else 4 * x_bytes if FAMILIES[fam].get('boosting') else x_bytes
+    return 2 * x_bytes + model + (80 << 20)
+
+
+def effective_jobs(n_jobs: int, memory_cap: int, n_rows: int, n_features: int, families: Sequence[str]) -> int:
+    cpus = os.cpu_count() or 1
+    want = cpus if n_jobs is None or n_jobs < 1 else min(n_jobs, cpus)
+    per_task = max(_task_memory(n_rows, n_features, f) for f in families)
+    return max(1, min(want, memory_cap // per_task))
+
+
+def successive_halving(cache: FoldCache, n_folds: int, candidates: List[Tuple[str, Dict[str, Any]]],
+                       factor: int = 3, min_rows: int = 1000, n_jobs: int = -1,
+                       memory_cap: int = 2 << 30, n_features: int = len(FEATURE_COLUMNS),
+                       log: Callable[[str], None] = print) -> List[Dict[str, Any]]:
+    """
+    Vòng i đánh giá các ứng viên còn lại trên mọi fold với 1/factor^(số vòng còn lại) số dòng
+    train gần nhất của fold;
+    giữ 1/factor ứng viên tốt nhất (AUC trung bình) cho vòng sau, vòng cuối dùng đủ dữ liệu.
+    Các task (ứng viên × fold) chạy song song bằng joblib, số worker bị giới hạn bởi memory_cap.
+    """
+    from joblib import Parallel, delayed
+    fold_rows = [cache.train_rows(k) for k in range(n_folds)]
+    # Số vòng: đủ để còn ~1 ứng viên, nhưng fold nhỏ nhất ở vòng đầu vẫn có >= min_rows dòng
+    rounds = max(1, math.ceil(math.log(max(len(candidates), 1), factor)))
+    rounds = min(rounds, max(1, int(math.log(max(min(fold_rows) / min_rows, 1), factor)) + 1))
+    alive = list(range(len(candidates)))
+    history: List[Dict[str, Any]] = []
+    for r in range(rounds):
+        last = r == rounds - 1
+        frac = 1.0 / factor ** (rounds - 1 - r)
+        n_rows = [None if last else int(n * frac) for n in fold_rows]
+        rows_used = int(sum(fold_rows) * frac)
+        families = sorted({candidates[i][0] for i in alive})
+        jobs = effective_jobs(n_jobs, memory_cap, int(max(fold_rows) * frac), n_features, families)
+        t0 = time.perf_counter()
+        tasks = [(i, k) for i in alive for k in range(n_folds)]
+        results = Parallel(n_jobs=jobs, backend='loky' if jobs > 1 else 'sequential')(
+            delayed(evaluate_candidate)(cache.dir, k, candidates[i][0], candidates[i][1], n_rows[k])
+            for i, k in tasks)
+        scores: Dict[int, List[Dict[str, Any]]] = {}
+        for (i, _), res in zip(tasks, results):
+            scores.setdefault(i, []).append(res)
+        ranked = []
+        for i in alive:
+            aucs = [s['auc'] for s in scores[i]]
+            iters = [s['best_iter'] for s in scores[i] if s['best_iter']]
+            entry = {
+                'round': r, 'rows': rows_used, 'family': candidates[i][0], 'params': candidates[i][1],
+                'mean_auc': float(np.nanmean(aucs)) if np.isfinite(aucs).any() else float('nan'),
+                'std_auc': float(np.nanstd(aucs)) if np.isfinite(aucs).any() else float('nan'),
+                'fit_s': float(sum(s['fit_s'] for s in scores[i])),
+                'best_iter': int(np.median(iters)) if iters else None,
+                'index': i,
+            }
+            ranked.append(entry)
+            history.append(entry)
+        ranked.sort(key=lambda e: -np.nan_to_num(e['mean_auc'], nan=-1.0))
+        log(f"  Vòng {r + 1}/{rounds}: {len(alive)} ứng viên × {n_folds} fold, {rows_used:,} dòng train, "
+            f"{jobs} worker, {time.perf_counter() - t0:.1f}s – tốt nhất AUC {ranked[0]['mean_auc']:.4f} "
+            f"({FAMILIES[ranked[0]['family']]['label']} {ranked[0]['params']})")
+        if not last:
+            keep = max(1, math.ceil(len(alive) / factor))
+            alive = [e['index'] for e in ranked[:keep]]
+    return history
+
+
+def final_estimator(fam: str, params: Dict[str, Any], best_iter: Optional[int] = None):
+    """Model cuối cùng để lưu: LR bọc StandardScaler trong Pipeline; RF dùng mọi core khi dự báo."""
+    params = dict(params)
+    if FAMILIES[fam].get('boosting') and best_iter:
+        params['n_estimators'] = best_iter
+    est = FAMILIES[fam]['make'](params)
+    if fam == 'lr':
+        from sklearn.pipeline import make_pipeline
+        from sklearn.preprocessing import StandardScaler
+        return make_pipeline(StandardScaler(), est)
+    if fam == 'rf':
+        est.set_params(n_jobs=-1)
+    return est
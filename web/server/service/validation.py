@@ -0,0 +1,211 @@
+import threading
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Optional, Sequence
+
+from service.bars import Bars, COLUMN_ALIASES, PRICE_FIELDS, TIME_ALIASES, _find_column, days_to_iso
+
+# Lý do loại bar (bitmask – một bar có thể sai nhiều kiểu)
+REASONS = {
+    'missing_field': 1,       # thiếu/NaN/inf ở open..volume (trước đây bị fill None/0)
+    'non_positive_price': 2,
+    'high_lt_low': 4,
+    'ohlc_out_of_range': 8,   # open/close nằm ngoài [low, high]
+    'negative_volume': 16,
+    'duplicate': 32,          # trùng (symbol, ngày) với giá khác -> giữ bản cuối
+    'outlier': 64,            # nhảy giá rồi quay về ngay (bad tick)
+}
+
+PRICE_TOLERANCE = 1e-3        # sai số tương đối cho kiểm tra open/close trong [low, high]
+OUTLIER_FLOOR = 0.2           # |log return| tối thiểu để xét bad tick (biên độ sàn VN <= 15%)
+OUTLIER_MADS = 10.0
+
+
+def reason_names(mask: int) -> str:
+    return ','.join(name for name, bit in REASONS.items() if mask & bit)
+
+
+class ValidationResult:
+    """Kết quả kiểm tra một lô: clean (bar hợp lệ), quarantine (bar bị loại + lý do), gaps."""
+
+    def __init__(self, clean: pd.DataFrame, quarantine: pd.DataFrame, gaps: pd.DataFrame):
+        self.clean = clean
+        self.quarantine = quarantine
+        self.gaps = gaps
+
+    def summary(self) -> Dict[str, int]:
+        out = {'rows': int(len(self.clean) + len(self.quarantine)), 'clean': int(len(self.clean)),
+               'quarantined': int(len(self.quarantine)), 'gaps': int(len(self.gaps)),
+               'missing_sessions': int(self.gaps['missing_sessions'].sum()) if len(self.gaps) else 0}
+        if len(self.quarantine):
+            masks = self.quarantine['reason_mask'].to_numpy()
+            for name, bit in REASONS.items():
+                n = int(np.count_nonzero(masks & bit))
+                if n:
+                    out[name] = n
+        return out
+
+
+def _standardize(df: pd.DataFrame) -> pd.DataFrame:
+    """Cột symbol, day (epoch-day int), open..volume từ DataFrame có tên cột bất kỳ trong các alias."""
+    if 'day' in df.columns and 'symbol' in df.columns:
+        day = df['day'].to_numpy(dtype=np.int64)
+        ok = np.ones(len(df), dtype=bool)
+    else:
+        time_col = _find_column(df.columns, TIME_ALIASES)
+        if time_col is None:
+            raise ValueError('Thiếu cột thời gian')
+        days = pd.to_datetime(df[time_col], errors='coerce').values.astype('datetime64[D]')
+        ok = ~np.isnat(days)
+        day = np.where(ok, days.astype(np.int64), -1)
+    sym_col = _find_column(df.columns, ['symbol', 'ticker', 'Symbol', 'Ticker'])
+    out = pd.DataFrame({'symbol': df[sym_col].astype(str).str.strip().str.upper().to_numpy() if sym_col else '',
+                        'day': day})
+    for field in PRICE_FIELDS:
+        src = field if field in df.columns else _find_column(df.columns, COLUMN_ALIASES[field])
+        out[field] = pd.to_numeric(df[src], errors='coerce').to_numpy(dtype=np.float64) if src is not None else np.nan
+    return out[ok].reset_index(drop=True)
+
+
+def validate_frame(df: pd.DataFrame, sessions: Optional[np.ndarray] = None) -> ValidationResult:
+    """
+    Kiểm tra cả lô bar của nhiều mã trong một lượt vector hóa (các kiểm tra của ta_eda.ipynb
+    + phát hiện thiếu phiên và bad tick). Không fill gì cả: bar sai bị tách sang quarantine,
+    nên chỉ báo (MA, RSI, ...) tính trên phần còn lại không bị kéo bởi giá trị bịa.
+
+    sessions: các ngày giao dịch (epoch-day, đã sort) để tính số phiên thiếu giữa hai bar
+    liên tiếp; không có thì suy ra từ chính lô (ngày có >= 50% số mã giao dịch) khi lô đủ lớn.
+    """
+    data = _standardize(df)
+    empty = pd.DataFrame(columns=['symbol', 'after', 'before', 'missing_sessions'])
+    if data.empty:
+        return ValidationResult(data, data.assign(reason_mask=np.int64(0), reasons=''), empty)
+    data = data.sort_values(['symbol', 'day'], kind='stable').reset_index(drop=True)
+    sym = data['symbol'].to_numpy()
+    day = data['day'].to_numpy(dtype=np.int64)
+    o, h, l, c, v = (data[f].to_numpy(dtype=np.float64) for f in PRICE_FIELDS)
+    mask = np.zeros(len(data), dtype=np.int64)
+
+    with np.errstate(invalid='ignore'):
+        finite = np.isfinite(o) & np.isfinite(h) & np.isfinite(l) & np.isfinite(c) & np.isfinite(v)
+        mask |= np.where(~finite, REASONS['missing_field'], 0)
+        mask |= np.where((o <= 0) | (h <= 0) | (l <= 0) | (c <= 0), REASONS['non_positive_price'], 0)
+        mask |= np.where(h < l, REASONS['high_lt_low'], 0)
+        lo, hi = l * (1 - PRICE_TOLERANCE), h * (1 + PRICE_TOLERANCE)
+        out = (o < lo) | (o > hi) | (c < lo) | (c > hi)
+        mask |= np.where(out & (h >= l), REASONS['ohlc_out_of_range'], 0)
+        mask |= np.where(v < 0, REASONS['negative_volume'], 0)
+
+    # Trùng (symbol, ngày): bản cuối thắng (như drop_duplicates keep='last'); bản trước giống hệt thì bỏ lặng lẽ
+    same_key = np.zeros(len(data), dtype=bool)
+    same_key[:-1] = (sym[1:] == sym[:-1]) & (day[1:] == day[:-1])
+    if same_key.any():
+        vals = np.column_stack([o, h, l, c, v])
+        nxt = np.roll(vals, -1, axis=0)
+        identical = same_key & np.all((vals == nxt) | (np.isnan(vals) & np.isnan(nxt)), axis=1)
+        mask |= np.where(same_key & ~identical, REASONS['duplicate'], 0)
+        drop_silent = identical
+    else:
+        drop_silent = same_key
+
+    # Bad tick: trên các bar còn lại, log return nhảy > ngưỡng rồi quay về ở bar kế tiếp
+    keep = (mask == 0) & ~drop_silent
+    idx = np.flatnonzero(keep)
+    if len(idx) > 2:
+        ks, kc = sym[idx], c[idx]
+        r = np.full(len(idx), np.nan)
+        cont = ks[1:] == ks[:-1]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            r[1:] = np.where(cont, np.log(kc[1:] / kc[:-1]), np.nan)
+        # Ngưỡng theo từng mã: max(OUTLIER_FLOOR, OUTLIER_MADS * độ lệch robust của log return)
+        mad = pd.Series(np.abs(r)).groupby(ks).transform('median').to_numpy() * 1.4826
+        thr = np.maximum(OUTLIER_FLOOR, OUTLIER_MADS * np.nan_to_num(mad))
+        r_next = np.append(r[1:], np.nan)
+        with np.errstate(invalid='ignore'):
+            spike = (np.abs(r) > thr) & (np.abs(r_next) > thr) & (np.sign(r) != np.sign(r_next)) \
+                & (np.abs(r + r_next) < 0.5 * np.minimum(np.abs(r), np.abs(r_next)))
+        mask[idx[spike]] |= REASONS['outlier']
+        keep = (mask == 0) & ~drop_silent
+
+    clean = data[keep].reset_index(drop=True)
+    bad = mask != 0
+    quarantine = data[bad].assign(reason_mask=mask[bad], reasons=[reason_names(m) for m in mask[bad]])
+    quarantine.insert(1, 'time', days_to_iso(day[bad]))
+
+    # Thiếu phiên giữa hai bar hợp lệ liên tiếp của cùng mã
+    if sessions is None and clean['symbol'].nunique() >= 5:
+        counts = clean.groupby('day')['symbol'].nunique()
+        sessions = counts.index.to_numpy()[counts.to_numpy() >= 0.5 * clean['symbol'].nunique()]
+    gaps = empty
+    if sessions is not None and len(clean) > 1:
+        sessions = np.asarray(sessions, dtype=np.int64)
+        cs, cd = clean['symbol'].to_numpy(), clean['day'].to_numpy(dtype=np.int64)
+        pos = np.searchsorted(sessions, cd, side='left')
+        missing = pos[1:] - pos[:-1] - np.isin(cd[:-1], sessions)
+        cont = cs[1:] == cs[:-1]
+        g = np.flatnonzero(cont & (missing > 0))
+        if len(g):
+            gaps = pd.DataFrame({'symbol': cs[g], 'after': days_to_iso(cd[g]), 'before': days_to_iso(cd[g + 1]),
+                                 'missing_sessions': missing[g].astype(np.int64)})
+    return ValidationResult(clean, quarantine.reset_index(drop=True), gaps)
+
+
+def validate_bars(bars: Bars, sessions: Optional[np.ndarray] = None) -> ValidationResult:
+    """validate_frame cho Bars của một mã (đường provider)."""
+    df = pd.DataFrame({'symbol': bars.symbol, 'day': bars.day.astype(np.int64),
+                       **{f: getattr(bars, f) for f in PRICE_FIELDS}})
+    return validate_frame(df, sessions)
+
+
+def clean_bars(result: ValidationResult, symbol: str) -> Bars:
+    df = result.clean
+    return Bars(symbol, df['day'].to_numpy(dtype=np.int32), *(df[f].to_numpy(dtype=np.float64) for f in PRICE_FIELDS))
+
+
+def clean_ta_frame(result: ValidationResult) -> pd.DataFrame:
+    """Phần hợp lệ theo schema CSV TA (time, open, high, low, close, volume, symbol)."""
+    df = result.clean
+    out = pd.DataFrame({'time': pd.to_datetime(days_to_iso(df['day'].to_numpy(dtype=np.int64))),
+                        **{f: df[f].to_numpy() for f in PRICE_FIELDS}, 'symbol': df['symbol'].to_numpy()})
+    volume = out['volume'].to_numpy()
+    if len(volume) and np.all(volume == np.floor(volume)):
+        out['volume'] = volume.astype(np.int64)
+    return out
+
+
+class QuarantineLog:
+    """
+    Bar bị loại gần nhất theo mã (trong bộ nhớ): mỗi lần kiểm tra lại một mã thì thay phần của
+    mã đó, nên không phình theo số lần gọi provider. Dùng cho /data-quality.
+    """
+
+    def __init__(self):
+        self._rows: Dict[str, pd.DataFrame] = {}
+        self._lock = threading.Lock()
+
+    def record(self, result: ValidationResult, symbols: Optional[Sequence[str]] = None) -> None:
+        q = result.quarantine
+        with self._lock:
+            for s in (symbols if symbols is not None else q['symbol'].unique()):
+                part = q[q['symbol'] == s]
+                if len(part):
+                    self._rows[s] = part
+                else:
+                    self._rows.pop(s, None)
+
+    def frame(self, symbols: Optional[Sequence[str]] = None) -> pd.DataFrame:
+        with self._lock:
+            parts = [df for s, df in self._rows.items() if symbols is None or s in symbols]
+        return pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(
+            columns=['symbol', 'time', 'day', *PRICE_FIELDS, 'reason_mask', 'reasons'])
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            return {s: int(len(df)) for s, df in self._rows.items()}
+
+
+_LOG = QuarantineLog()
+
+
+def get_quarantine_log() -> QuarantineLog:
+    return _LOG
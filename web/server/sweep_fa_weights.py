@@ -0,0 +1,67 @@
+import os
+import sys
+import json
+import argparse
+
+# Ensure UTF-8 output on Windows
+if sys.platform == 'win32':
+    os.environ['PYTHONIOENCODING'] = 'utf-8'
+    if hasattr(sys.stdout, 'reconfigure'):
+        sys.stdout.reconfigure(encoding='utf-8')
+    if hasattr(sys.stderr, 'reconfigure'):
+        sys.stderr.reconfigure(encoding='utf-8')
+
+from service.fa_ranking import (BASELINE_WEIGHTS, COMPONENTS, RECENT_PERIODS, FAComponents, chunk_size,
+                                default_ranking_source, run_sweep)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Quét độ nhạy của xếp hạng FA (fa_ranking.ipynb) theo 7 trọng số thành phần')
+    parser.add_argument('--n', type=int, default=10000, help='Số bộ trọng số (dòng đầu là trọng số gốc)')
+    parser.add_argument('--k', type=int, default=100, help='Top-k cần đo độ ổn định')
+    parser.add_argument('--concentration', type=float, default=50.0,
+                        help='Dirichlet quanh trọng số gốc; càng lớn càng sát, 0 = đều trên simplex')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--periods', type=int, default=RECENT_PERIODS, help='Số kỳ gần nhất dùng tính chỉ số')
+    parser.add_argument('--memory-mb', type=int, default=None, help='Bộ nhớ tạm cho mỗi khúc trọng số')
+    parser.add_argument('--source', type=str, default=None, help=f'CSV báo cáo FA (mặc định {default_ranking_source()})')
+    parser.add_argument('--out', type=str, default='fa_weight_sweep.csv', help='CSV kết quả theo mã')
+    args = parser.parse_args()
+
+    components = FAComponents.load(args.source, periods=args.periods)
+    print(f"✓ {len(components)} mã từ {components.source}")
+    if components.missing:
+        print(f"  Chỉ số không có trong nguồn (coi là trung tính): {', '.join(components.missing)}")
+    chunk = chunk_size(len(components), args.memory_mb) if args.memory_mb else None
+    table, summary = run_sweep(components, n=args.n, k=args.k, concentration=args.concentration,
+                               seed=args.seed, chunk=chunk)
+    print(f"✓ {summary['n_weights']:,} bộ trọng số × {summary['n_symbols']} mã, "
+          f"khúc {summary['chunk']} ({summary['took_s']:.2f}s)")
+    print("\nTrọng số gốc: " + ', '.join(f"{c} {w:.0%}" for c, w in zip(COMPONENTS, BASELINE_WEIGHTS)))
+
+    k = summary['k']
+    ov, rho = summary['topk_overlap'], summary['spearman']
+    print(f"\nTop {k} trùng với top {k} gốc: trung bình {ov['mean']:.1%}, p5 {ov['p05']:.1%}, thấp nhất {ov['min']:.1%}")
+    print(f"Spearman với xếp hạng gốc: trung bình {rho['mean']:.4f}, p5 {rho['p05']:.4f}")
+    print(f"Luôn trong top {k} (>=99%): {summary['always_in']} mã; chập chờn (5-95%): {summary['borderline']} mã")
+    print(f"Top {k} gốc nhưng vào < 50% lần: {summary['baseline_at_risk']}; "
+          f"ngoài top {k} gốc nhưng vào >= 50% lần: {summary['outside_often_in']}")
+    print("Tương quan trọng số ~ độ trùng top-k (âm = tăng trọng số này làm top-k đổi nhiều):")
+    for c, v in summary['weight_overlap_corr'].items():
+        print(f"  {c:>17} {v:+.3f}" if v is not None else f"  {c:>17}   n/a")
+
+    border = table[(table['inclusion'] > 0.05) & (table['inclusion'] < 0.95)]
+    if len(border):
+        print(f"\nMã chập chờn quanh ngưỡng top {k}:")
+        for r in border.head(20).itertuples():
+            print(f"  {r.symbol:<6} gốc #{r.baseline_rank:<4} vào {r.inclusion:6.1%}  "
+                  f"hạng {r.mean_rank:6.1f} ± {r.std_rank:5.1f} (p5 {r.p05_rank}, p95 {r.p95_rank})")
+
+    table.to_csv(args.out, index=False)
+    with open(os.path.splitext(args.out)[0] + '.json', 'w', encoding='utf-8') as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+    print(f"\n✓ Đã ghi {args.out} và {os.path.splitext(args.out)[0]}.json")
+
+
+if __name__ == '__main__':
+    main()
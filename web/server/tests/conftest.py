@@ -0,0 +1,7 @@
+import os
+import sys
+
+# Test chạy từ web/server hoặc gốc repo đều import được service.*
+_server_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _server_dir not in sys.path:
+    sys.path.insert(0, _server_dir)
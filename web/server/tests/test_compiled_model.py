@@ -0,0 +1,122 @@
+import os
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.ensemble import ExtraTreesClassifier, RandomForestClassifier
+from sklearn.linear_model import LogisticRegression
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import MinMaxScaler, StandardScaler
+
+from service.compiled_model import COMPILED_MAX_ROWS, CompiledModel, compile_model, export_compiled, load_model
+
+TOL = 1e-12
+MODEL_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'model')
+
+
+def _data(n=3000, p=12, seed=0):
+    rng = np.random.default_rng(seed)
+    X = rng.normal(size=(n, p)) * rng.uniform(0.1, 1e4, size=p)
+    y = (X[:, 0] / X[:, 0].std() + np.sin(X[:, 1] / X[:, 1].std()) + rng.normal(scale=0.5, size=n) > 0).astype(int)
+    return pd.DataFrame(X, columns=[f'f{i}' for i in range(p)]), y
+
+
+def _parity(model, X):
+    compiled = CompiledModel(compile_model(model))
+    ref = model.predict_proba(X)
+    got = compiled.predict_proba(X)
+    assert got.shape == ref.shape
+    assert np.max(np.abs(ref - got)) <= TOL
+    # Nhãn chỉ so ở dòng không hòa: xác suất bằng nhau (vd. 0.5/0.5) thì argmax phụ thuộc sai số 1e-16
+    decided = np.abs(ref[:, 1] - ref[:, 0]) > 2 * TOL
+    np.testing.assert_array_equal(model.predict(X)[decided], compiled.predict(X)[decided])
+    return compiled
+
+
+@pytest.mark.parametrize('model', [
+    RandomForestClassifier(n_estimators=25, max_depth=8, random_state=0),
+    RandomForestClassifier(n_estimators=10, min_samples_leaf=3, random_state=1),     # cây sâu, không giới hạn
+    ExtraTreesClassifier(n_estimators=15, max_depth=6, random_state=0),
+    Pipeline([('scale', StandardScaler()), ('rf', RandomForestClassifier(n_estimators=10, max_depth=6, random_state=0))]),
+    Pipeline([('scale', MinMaxScaler()), ('lr', LogisticRegression(max_iter=2000))]),
+    Pipeline([('scale', StandardScaler()), ('lr', LogisticRegression(max_iter=2000))]),
+])
+def test_predict_proba_matches_sklearn_on_random_rows(model):
+    X, y = _data()
+    model.fit(X, y)
+    X_new, _ = _data(n=2000, seed=1)
+    _parity(model, X_new)
+
+
+def test_thresholds_hit_exactly_on_float32_boundaries():
+    # Giá trị đúng bằng ngưỡng / sát ngưỡng là chỗ so sánh float32 của sklearn dễ lệch nhất
+    X, y = _data(n=1500, p=5)
+    model = RandomForestClassifier(n_estimators=10, random_state=0).fit(X, y)
+    thr = np.concatenate([t.tree_.threshold[t.tree_.children_left >= 0] for t in model.estimators_])
+    rng = np.random.default_rng(2)
+    rows = np.repeat(X.to_numpy()[:1], len(thr), axis=0)
+    col = rng.integers(0, X.shape[1], size=len(thr))
+    rows[np.arange(len(thr)), col] = np.nextafter(thr, rng.choice([-np.inf, np.inf], size=len(thr)))
+    _parity(model, pd.DataFrame(rows, columns=X.columns))
+
+
+def test_column_order_follows_feature_names():
+    X, y = _data(n=1000, p=6)
+    model = RandomForestClassifier(n_estimators=5, random_state=0).fit(X, y)
+    compiled = CompiledModel(compile_model(model))
+    shuffled = X[X.columns[::-1]]
+    np.testing.assert_allclose(compiled.predict_proba(shuffled), model.predict_proba(X), rtol=0, atol=TOL)
+
+
+def test_shipped_model_matches_pickle_on_real_features():
+    pkl, npz = os.path.join(MODEL_DIR, 'best_model.pkl'), os.path.join(MODEL_DIR, 'best_model.npz')
+    if not (os.path.exists(pkl) and os.path.exists(npz)):
+        pytest.skip('Chưa có best_model.pkl/.npz')
+    import joblib
+    from service.indicators import model_feature_columns
+    from service.price_store import get_price_store
+    from service.training import build_dataset
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        model = joblib.load(pkl)
+    compiled = CompiledModel.load(npz)
+    columns = model_feature_columns(model)
+    store = get_price_store()
+    data = build_dataset(store, store.symbol_list()[:10], columns=columns)
+    X = pd.DataFrame(data.X, columns=columns)
+    assert np.max(np.abs(model.predict_proba(X) - compiled.predict_proba(X))) <= TOL
+
+
+def _best_ms(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best * 1000
+
+
+def test_benchmark_compiled_not_slower_than_sklearn(tmp_path):
+    # Cỡ model như best_model (RF 100 cây sâu 8, 30 feature); biên rộng để không phụ thuộc máy
+    import joblib
+    X, y = _data(n=4000, p=30)
+    model = RandomForestClassifier(n_estimators=100, max_depth=8, random_state=0).fit(X, y)
+    pkl = str(tmp_path / 'rf.pkl')
+    joblib.dump(model, pkl)
+    export_compiled(model, str(tmp_path / 'rf.npz'), source_path=pkl)
+    compiled = load_model(pkl)
+    assert isinstance(compiled, CompiledModel) and compiled.source_path == pkl
+
+    small, _ = _data(n=100, seed=3, p=30)
+    t_sk, t_c = _best_ms(lambda: model.predict_proba(small), 5), _best_ms(lambda: compiled.predict_proba(small), 5)
+    assert t_c < 0.5 * t_sk, (t_c, t_sk)
+
+    # Lô lớn (quét cả Top 100) đi qua sklearn: không được chậm hơn bản gốc
+    big, _ = _data(n=max(4 * COMPILED_MAX_ROWS, 10_000), seed=4, p=30)
+    compiled.predict_proba(big[:COMPILED_MAX_ROWS])              # nạp pickle một lần
+    t_sk, t_c = _best_ms(lambda: model.predict_proba(big), 3), _best_ms(lambda: compiled.predict_proba(big), 3)
+    assert t_c < 1.25 * t_sk, (t_c, t_sk)
+    np.testing.assert_allclose(compiled.predict_proba(big), model.predict_proba(big), rtol=0, atol=TOL)
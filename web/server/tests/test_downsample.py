@@ -0,0 +1,40 @@
+import numpy as np
+
+from service.bars import Bars
+from service.downsample import DownsampleCache, downsample, resample_ohlc
+
+
+def _bars(n, first_day=10_000, symbol='AAA'):
+    day = first_day + np.arange(n, dtype=np.int32)
+    c = 10_000.0 + 100.0 * np.sin(np.arange(n) / 20.0)
+    return Bars(symbol, day, c, c + 50, c - 50, c, np.full(n, 1_000.0))
+
+
+def test_resample_keeps_ohlc_per_week():
+    bars = _bars(14, first_day=10_007)          # 10_007 là thứ Hai -> đúng 2 tuần
+    week = resample_ohlc(bars, 'W')
+    assert len(week) == 2
+    assert week.open[0] == bars.open[0] and week.close[0] == bars.close[6]
+    assert week.high[1] == bars.high[7:].max() and week.low[1] == bars.low[7:].min()
+    assert week.volume[0] == 7_000.0
+
+
+def test_weekly_and_monthly_never_exceed_max_points():
+    bars = _bars(3_000)                          # ~430 tuần, ~99 tháng
+    for res in ('W', 'M', 'auto'):
+        small, used = downsample(bars, 50, res)
+        assert len(small) <= 50
+        assert used.endswith('+lttb')
+        assert small.day[0] == bars.day[0]
+    small, used = downsample(bars, 500, 'W')
+    assert used == 'W' and len(small) <= 500
+
+
+def test_short_window_is_returned_as_is_and_cached_by_last_bar():
+    cache = DownsampleCache()
+    bars = _bars(40)
+    assert downsample(bars, 100, 'M')[0] is bars
+    long = _bars(1_000)
+    first = cache.get(long, 60, 'W')
+    assert cache.get(long, 60, 'W') is first
+    assert cache.get(_bars(1_001), 60, 'W') is not first
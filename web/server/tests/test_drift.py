@@ -0,0 +1,136 @@
+import numpy as np
+import pytest
+
+import service.drift as drift
+from service.bars import Bars
+from service.drift import (PSI_MAJOR, PSI_MODERATE, DriftMonitor, DriftReference, HistogramSketch,
+                           iter_feature_chunks, ks, load_or_build_reference, psi, quantile_edges,
+                           reference_path_for)
+from service.indicators import FEATURE_COLUMNS, MODEL_WINDOW, compute_features, feature_matrix
+
+
+def _bars(n, seed, symbol='AAA'):
+    rng = np.random.default_rng(seed)
+    close = 20_000 * np.exp(np.cumsum(rng.normal(0, 0.02, n)))
+    open_ = close * (1 + rng.normal(0, 0.005, n))
+    high = np.maximum(open_, close) * (1 + rng.uniform(0, 0.01, n))
+    low = np.minimum(open_, close) * (1 - rng.uniform(0, 0.01, n))
+    volume = rng.integers(100_000, 2_000_000, n).astype(np.float64)
+    return Bars(symbol, 19_000 + np.arange(n, dtype=np.int32), open_, high, low, close, volume)
+
+
+class _Store:
+    """Đủ giao diện PriceStore mà iter_feature_chunks dùng."""
+
+    def __init__(self, bars):
+        self._bars = {b.symbol: b for b in bars}
+
+    def symbol_list(self):
+        return list(self._bars)
+
+    def bars(self, symbol):
+        return self._bars[symbol]
+
+
+def _served(bars, ends, row=-1):
+    """Feature server chấm cho các input MODEL_WINDOW bar kết thúc ở `ends` (panel 2-D như _feature_builder)."""
+    idx = np.asarray(ends)[:, None] + np.arange(-MODEL_WINDOW + 1, 1)
+    f = compute_features(bars.open[idx], bars.high[idx], bars.low[idx], bars.close[idx], bars.volume[idx])
+    return feature_matrix(f, FEATURE_COLUMNS)[:, row, :]
+
+
+def test_sketch_counts_match_brute_force():
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(5_000, 3))
+    X[::97, 1] = np.nan
+    X[:, 2] = rng.integers(0, 2, len(X))                        # feature rời rạc 0/1
+    sketch = HistogramSketch(quantile_edges(X, bins=8)).update(X)
+    for j in range(X.shape[1]):
+        col = X[:, j][np.isfinite(X[:, j])]
+        want = np.bincount(np.searchsorted(sketch.edges[j], col, side='right'), minlength=sketch.bins)
+        np.testing.assert_array_equal(sketch.counts[j], want)
+    assert sketch.nan[1] == np.isnan(X[:, 1]).sum() and sketch.rows == len(X)
+
+
+def test_sketch_merge_is_additive():
+    rng = np.random.default_rng(1)
+    X = rng.normal(size=(3_000, 4))
+    edges = quantile_edges(X)
+    whole = HistogramSketch(edges).update(X)
+    parts = HistogramSketch(edges).update(X[:1_000]).merge(HistogramSketch(edges).update(X[1_000:]))
+    np.testing.assert_array_equal(whole.counts, parts.counts)
+    assert whole.rows == parts.rows
+    with pytest.raises(ValueError):
+        whole.merge(HistogramSketch(edges + 1.0))
+
+
+def test_reference_save_load_roundtrip(tmp_path):
+    X = np.random.default_rng(2).normal(size=(2_000, 2))
+    ref = DriftReference.from_matrix(X, ['a', 'b'], bins=16, meta={'source': 'test'})
+    back = DriftReference.load(ref.save(str(tmp_path / 'ref.npz')))
+    assert back.columns == ['a', 'b'] and back.meta['source'] == 'test'
+    np.testing.assert_array_equal(back.sketch.counts, ref.sketch.counts)
+    np.testing.assert_array_equal(back.sketch.edges, ref.sketch.edges)
+
+
+def test_psi_and_ks():
+    p = np.array([[0.25, 0.25, 0.25, 0.25]])
+    assert psi(p, p)[0] == 0.0 and ks(p, p)[0] == 0.0
+    q = np.array([[0.7, 0.1, 0.1, 0.1]])
+    want = sum((a - e) * np.log(a / e) for e, a in zip(p[0], q[0]))
+    assert psi(p, q)[0] == pytest.approx(want)
+    assert ks(p, q)[0] == pytest.approx(0.45)
+
+
+def _replay():
+    """
+    Tham chiếu từ dòng train (iter_feature_chunks) của 30 mã; live phát lại lịch sử của chính các
+    mã đó qua đường phục vụ (input MODEL_WINDOW bar, mỗi 3 phiên một lần).
+    """
+    bars = [_bars(400, seed, f'S{seed}') for seed in range(30)]
+    ref = DriftReference.from_chunks(lambda: iter_feature_chunks(FEATURE_COLUMNS, _Store(bars)), FEATURE_COLUMNS)
+    ends = np.arange(MODEL_WINDOW - 1, 400, 3)
+    return ref, bars, ends
+
+
+def test_in_distribution_replay_is_stable():
+    ref, live, ends = _replay()
+    monitor = DriftMonitor(ref, 'v')
+    for bars in live:
+        monitor.observe(_served(bars, ends))
+    report = monitor.report()
+    assert report['live_rows'] >= drift.DRIFT_MIN_ROWS
+    worst = max(report['features'], key=lambda f: f['psi'])
+    assert worst['psi'] < PSI_MODERATE, worst
+    assert report['summary']['moderate'] == report['summary']['major'] == 0
+
+
+def test_cold_start_row_is_flagged():
+    # Dòng đầu của cửa sổ (chỉ báo chưa đủ lịch sử) khác hẳn dòng train -> phải bị báo drift
+    ref, live, ends = _replay()
+    monitor = DriftMonitor(ref, 'v')
+    for bars in live:
+        monitor.observe(_served(bars, ends, row=0))
+    assert monitor.report()['max_psi'] >= PSI_MAJOR
+
+
+def test_runtime_reference_goes_to_cache_dir(tmp_path, monkeypatch):
+    model_dir, cache_dir = tmp_path / 'model', tmp_path / 'cache'
+    model_dir.mkdir()
+    model_path = str(model_dir / 'best_model.pkl')
+    monkeypatch.setattr(drift, 'DRIFT_CACHE_DIR', str(cache_dir))
+    built = []
+    X = np.random.default_rng(3).normal(size=(500, 2))
+
+    def fake_build(columns, store=None, symbols=None):
+        built.append(columns)
+        return DriftReference.from_matrix(X, columns)
+    monkeypatch.setattr(drift, 'build_reference', fake_build)
+
+    ref = load_or_build_reference(model_path, ['a', 'b'])
+    assert list(model_dir.iterdir()) == [] and len(list(cache_dir.iterdir())) == 1
+    again = load_or_build_reference(model_path, ['a', 'b'])
+    assert len(built) == 1 and again.sketch.rows == ref.sketch.rows
+    # Sketch do retrain/export ghi cạnh model được ưu tiên
+    DriftReference.from_matrix(X[:100], ['a', 'b'], meta={'source': 'retrain'}).save(reference_path_for(model_path))
+    assert load_or_build_reference(model_path, ['a', 'b']).meta['source'] == 'retrain'
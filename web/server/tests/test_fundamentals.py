@@ -0,0 +1,77 @@
+import numpy as np
+import pandas as pd
+
+import service.fundamentals as fundamentals
+from service.fundamentals import FA_FIELDS, FAIndex, period_end_day, refresh_fa_index
+
+
+def _reports(rows):
+    """rows: (mã, năm, quý, roe) – các chỉ số khác NaN."""
+    df = pd.DataFrame(rows, columns=['symbol', 'year', 'quarter', 'roe'])
+    for f in FA_FIELDS:
+        if f not in df:
+            df[f] = np.nan
+    return df[['symbol', 'year', 'quarter', *FA_FIELDS]]
+
+
+def _roe(index, symbol, day):
+    day = np.asarray(day)
+    symbols = np.full(day.shape, symbol, dtype=object) if isinstance(symbol, str) else symbol
+    values, _ = index.join(symbols, day)
+    return values[:, FA_FIELDS.index('roe')]
+
+
+def test_as_of_join_matches_merge_asof():
+    rng = np.random.default_rng(0)
+    rows = [(s, y, q, float(rng.normal())) for s in ('AAA', 'BBB', 'CCC') for y in (2023, 2024) for q in (1, 2, 3, 4)]
+    index = FAIndex(_reports(rows))
+    day = np.arange(19_300, 20_200, 7)
+    bars = pd.DataFrame({'symbol': np.repeat(['AAA', 'BBB', 'CCC', 'ZZZ'], len(day)), 'day': np.tile(day, 4)})
+    got = _roe(index, bars['symbol'].to_numpy(dtype=object), bars['day'].to_numpy())
+
+    rep = _reports(rows)
+    rep['day'] = period_end_day(rep['year'].to_numpy(), rep['quarter'].to_numpy()) + index.lag_days
+    want = pd.merge_asof(bars.sort_values('day'), rep.sort_values('day')[['symbol', 'day', 'roe']],
+                         on='day', by='symbol', direction='backward').sort_values(['symbol', 'day'])
+    np.testing.assert_array_equal(np.isnan(got), want['roe'].isna().to_numpy())
+    np.testing.assert_allclose(got[~np.isnan(got)], want['roe'].dropna().to_numpy())
+
+
+def test_report_not_visible_before_publication():
+    index = FAIndex(_reports([('AAA', 2024, 1, 0.1)]))
+    available = int(period_end_day(np.array([2024]), np.array([1]))[0]) + index.lag_days
+    roe = _roe(index, 'AAA', [available - 1, available])
+    assert np.isnan(roe[0]) and roe[1] == 0.1
+
+
+def test_refresh_reports_only_changed_symbols():
+    base = [('AAA', 2024, 1, 0.1), ('BBB', 2024, 1, 0.2)]
+    index, changed = refresh_fa_index(None, _reports(base))
+    same, changed = refresh_fa_index(index, _reports(base))
+    assert same is index and changed == []
+    newer, changed = refresh_fa_index(index, _reports(base + [('BBB', 2024, 2, 0.3)]))
+    assert changed == ['BBB'] and newer is not index
+    late = int(period_end_day(np.array([2024]), np.array([2]))[0]) + newer.lag_days
+    assert _roe(newer, 'BBB', [late])[0] == 0.3
+
+
+def test_get_fa_index_reloads_when_sources_change(tmp_path, monkeypatch):
+    src = tmp_path / 'fa.csv'
+    monkeypatch.setattr(fundamentals, 'default_fa_sources', lambda: [str(src)])
+    monkeypatch.setattr(fundamentals, 'load_fa_reports', lambda paths=None: pd.read_csv(src))
+    monkeypatch.setattr(fundamentals, 'FA_REFRESH_SECONDS', 0.0)
+    monkeypatch.setattr(fundamentals, '_INDEX', None)
+    monkeypatch.setattr(fundamentals, '_LISTENERS', [])
+    seen = []
+    fundamentals.on_fa_update(seen.append)
+
+    _reports([('AAA', 2024, 1, 0.1)]).to_csv(src, index=False)
+    first = fundamentals.get_fa_index()
+    assert fundamentals.get_fa_index() is first and seen == []
+
+    _reports([('AAA', 2024, 1, 0.1), ('AAA', 2024, 2, 0.5)]).to_csv(src, index=False)
+    import os
+    st = os.stat(src)
+    os.utime(src, ns=(st.st_atime_ns, st.st_mtime_ns + 10_000_000))
+    second = fundamentals.get_fa_index()
+    assert second is not first and len(second) == 2 and seen == [['AAA']]
@@ -0,0 +1,57 @@
+import numpy as np
+
+from service.bars import Bars, iso_to_day
+from service.history_index import FULL, HistoryIndex, parse_since
+
+
+def _bars(first_day, n, close=None, symbol='AAA'):
+    day = first_day + np.arange(n, dtype=np.int32)
+    c = np.asarray(close, dtype=np.float64) if close is not None else 10_000.0 + np.arange(n)
+    return Bars(symbol, day, c, c + 50, c - 50, c, np.full(n, 1_000.0))
+
+
+def test_parse_since_cursor_date_and_garbage():
+    index = HistoryIndex()
+    index.update('AAA', _bars(20_000, 5))
+    assert parse_since(None, index) == (None, None)
+    assert parse_since('', index) == (None, None)
+    assert parse_since(index.cursor(), index) == ('cursor', index.seq)
+    # Ngày: client đã có tới hết ngày đó -> cần từ ngày hôm sau
+    assert parse_since('2025-03-04', index) == ('date', iso_to_day('2025-03-04') + 1)
+    assert parse_since('hôm qua', index) == (None, None)
+
+
+def test_parse_since_rejects_foreign_or_future_cursor():
+    index = HistoryIndex()
+    index.update('AAA', _bars(20_000, 5))
+    other = HistoryIndex()
+    other.epoch = index.epoch + 'x'
+    assert parse_since(other.cursor(), index) == (None, None)   # process khác (server đã restart)
+    assert parse_since(f'{index.epoch}.{index.seq + 1}', index) == (None, None)
+    assert parse_since(f'{index.epoch}.abc', index) == (None, None)
+
+
+def test_changed_since_tracks_new_and_revised_bars():
+    index = HistoryIndex()
+    index.update('AAA', _bars(20_000, 5))
+    seq = index.seq
+    index.update('aaa', _bars(20_000, 5))                       # không đổi -> không tăng seq
+    assert index.seq == seq and index.changed_since('AAA', seq) is None
+    index.update('AAA', _bars(20_000, 7))                       # 2 bar mới, bar cuối cũ giữ nguyên
+    assert index.changed_since('AAA', seq) == 20_005
+    seq = index.seq
+    revised = _bars(20_000, 7)
+    revised.close[-1] += 100                                    # bar hôm nay đổi giá
+    index.update('AAA', revised)
+    assert index.changed_since('AAA', seq) == 20_006
+    assert index.changed_since('BBB', 0) is None
+
+
+def test_changed_since_full_when_history_truncated():
+    index = HistoryIndex(keep=3)
+    index.update('AAA', _bars(20_000, 5))
+    seq = index.seq
+    for n in range(6, 11):
+        index.update('AAA', _bars(20_000, n))
+    assert index.changed_since('AAA', seq) == FULL
+    assert index.changed_since('AAA', index.seq - 1) == 20_009
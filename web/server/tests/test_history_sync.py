@@ -0,0 +1,108 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+from service.bars import Bars
+from service.providers import HistoryProvider, set_provider
+
+
+class _Provider(HistoryProvider):
+    """Provider trong bộ nhớ: trả mọi bar đang có của mã (bỏ qua khoảng ngày)."""
+    name = 'memory'
+
+    def __init__(self):
+        self.bars = {}
+
+    def add(self, symbol, n=15, first_day=20_000):
+        day = first_day + np.arange(n, dtype=np.int32)
+        close = 10_000.0 + np.arange(n)
+        self.bars[symbol] = Bars(symbol, day, close, close + 50, close - 50, close, np.full(n, 1_000.0))
+
+    def extend(self, symbol):
+        b = self.bars[symbol]
+        d, c = int(b.day[-1]) + 1, float(b.close[-1]) + 10
+        self.bars[symbol] = b.merge(Bars(symbol, np.array([d], dtype=np.int32), np.array([c]), np.array([c + 50]),
+                                         np.array([c - 50]), np.array([c]), np.array([1_000.0])))
+
+    def history(self, symbol, start_date, end_date, interval='1D'):
+        return self.bars.get(symbol.upper(), Bars.empty(symbol))
+
+
+@pytest.fixture
+def app(monkeypatch, tmp_path):
+    import main
+    provider = _Provider()
+    monkeypatch.setattr(main, '_cache_dir', lambda: str(tmp_path))
+    set_provider(provider)
+    monkeypatch.setitem(main.CACHE, "symbol_history", {})
+    monkeypatch.setitem(main.CACHE, "top100_history", {})
+    yield main, TestClient(main.app), provider
+    set_provider(None)
+
+
+def test_stock_delta_sees_bar_fetched_by_another_path(app):
+    main, client, provider = app
+    provider.add('TSTA')
+    first = client.get('/stock/TSTA', params={'days': 60}).json()
+    assert len(first['data']) == 15
+    # Đường khác (input /predict, job, live feed) hỏi provider và thấy bar mới; cache /stock còn hạn
+    provider.extend('TSTA')
+    main.get_stock_history('TSTA', '2024-01-01', '2030-01-01')
+    delta = client.get('/stock/TSTA', params={'days': 60, 'since': first['cursor']}).json()
+    assert delta['delta'] and [r['close'] for r in delta['data']] == [10_024.0]
+    again = client.get('/stock/TSTA', params={'days': 60, 'since': delta['cursor']})
+    assert again.status_code == 304
+
+
+def test_top100_delta_sees_bar_fetched_by_another_path(app, monkeypatch):
+    main, client, provider = app
+    for sym in ('TSTA', 'TSTB'):
+        provider.add(sym)
+    monkeypatch.setattr(main, 'get_top100_symbols', lambda: ['TSTA', 'TSTB'])
+    first = client.get('/top100-history', params={'days': 61})
+    for _ in range(100):
+        if first.status_code == 200:
+            break
+        main.JOBS.get(first.json()['id']).wait(5)
+        first = client.get('/top100-history', params={'days': 61})
+    cursor = first.json()['cursor']
+    provider.extend('TSTB')
+    main.get_stock_history('TSTB', '2024-01-01', '2030-01-01')
+    delta = client.get('/top100-history', params={'days': 61, 'since': cursor}).json()
+    assert list(delta['data']) == ['TSTB'] and delta['data']['TSTB'][-1]['close'] == 10_024.0
+
+
+def test_downsampled_update_is_marked_as_replacement(app, monkeypatch):
+    main, client, provider = app
+    provider.add('TSTA', n=40)
+    first = client.get('/stock/TSTA', params={'days': 90, 'max_points': 10}).json()
+    provider.extend('TSTA')
+    main.get_stock_history('TSTA', '2024-01-01', '2030-01-01')
+    update = client.get('/stock/TSTA', params={'days': 90, 'max_points': 10, 'since': first['cursor']}).json()
+    assert update['delta'] is False and update['from'] is None and len(update['data']) <= 10
+    assert update['data'][-1]['close'] == 10_049.0
+
+
+def test_slow_history_job_returns_202_without_holding_the_request(app, monkeypatch):
+    main, client, provider = app
+    provider.add('TSTA')
+    release = threading.Event()
+
+    def symbols():
+        release.wait(30)
+        return ['TSTA']
+
+    monkeypatch.setattr(main, 'get_top100_symbols', symbols)
+    monkeypatch.setattr(main, 'JOB_WAIT_SECONDS', 0.2)
+    t0 = time.monotonic()
+    resp = client.get('/top100-history', params={'days': 62})
+    assert resp.status_code == 202 and time.monotonic() - t0 < 5
+    job_id = resp.json()['id']
+    assert resp.headers['location'] == f'/jobs/{job_id}' and 'retry-after' in resp.headers
+    release.set()
+    main.JOBS.get(job_id).wait(30)
+    assert client.get(f'/jobs/{job_id}').json()['status'] == 'done'
+    assert list(client.get('/top100-history', params={'days': 62}).json()['data']) == ['TSTA']
@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+from service.bars import Bars
+from service.indicators import FEATURE_COLUMNS, MODEL_WINDOW, compute_features, feature_matrix, window_features
+from service.training import TARGET_HORIZON, symbol_features
+
+
+def _bars(n=180, seed=0, symbol='AAA'):
+    rng = np.random.default_rng(seed)
+    close = 20_000 * np.exp(np.cumsum(rng.normal(0, 0.02, n)))
+    open_ = close * (1 + rng.normal(0, 0.005, n))
+    high = np.maximum(open_, close) * (1 + rng.uniform(0, 0.01, n))
+    low = np.minimum(open_, close) * (1 - rng.uniform(0, 0.01, n))
+    volume = rng.integers(0, 2_000_000, n).astype(np.float64)
+    volume[rng.random(n) < 0.05] = 0.0                         # phiên không khớp lệnh
+    if n > 64:
+        close[60:64] = close[59]                                # giá đứng yên vài phiên
+    day = 19_000 + np.arange(n, dtype=np.int32)
+    return Bars(symbol, day, open_, high, low, close, volume)
+
+
+def _served_row(bars: Bars, t: int) -> np.ndarray:
+    """Dòng server chấm cho input MODEL_WINDOW bar kết thúc ở bar t (như _feature_builder, 1 mã)."""
+    sl = slice(t - MODEL_WINDOW + 1, t + 1)
+    f = compute_features(bars.open[None, sl], bars.high[None, sl], bars.low[None, sl],
+                         bars.close[None, sl], bars.volume[None, sl])
+    return feature_matrix(f, FEATURE_COLUMNS)[0, -1]
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_window_features_match_scoring_each_window(seed):
+    bars = _bars(seed=seed)
+    got = feature_matrix(window_features(bars.open, bars.high, bars.low, bars.close, bars.volume), FEATURE_COLUMNS)
+    assert got.shape == (len(bars) - MODEL_WINDOW + 1, len(FEATURE_COLUMNS))
+    for i, t in enumerate(range(MODEL_WINDOW - 1, len(bars))):
+        np.testing.assert_allclose(got[i], _served_row(bars, t), rtol=1e-12, atol=1e-9,
+                                   err_msg=f'bar {t}')
+
+
+def test_window_features_short_history():
+    bars = _bars(n=MODEL_WINDOW - 1)
+    assert window_features(bars.open, bars.high, bars.low, bars.close, bars.volume) == {}
+
+
+def test_training_rows_are_served_rows():
+    bars = _bars(n=200, seed=3)
+    X, y, day = symbol_features(bars)
+    assert len(X) == len(bars) - MODEL_WINDOW + 1 - TARGET_HORIZON
+    assert day[0] == bars.day[MODEL_WINDOW - 1]
+    for t in (MODEL_WINDOW - 1, 120, len(bars) - TARGET_HORIZON - 1):
+        i = int(np.searchsorted(day, bars.day[t]))
+        np.testing.assert_allclose(X[i], _served_row(bars, t).astype(np.float32), rtol=1e-6)
+        assert y[i] == int(bars.close[t + TARGET_HORIZON] / bars.close[t] - 1 > 0.02)
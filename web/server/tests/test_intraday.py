@@ -0,0 +1,82 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from service.intraday import IntradayStore, MinuteBars, iso_to_minute, normalize_interval, resample
+
+
+def _minutes(days=('2025-01-30', '2025-01-31', '2025-02-03'), seed=0):
+    """Bar phút của vài phiên qua ranh giới tháng: 9:00-11:29, 13:00-14:44, thiếu ngẫu nhiên vài phút."""
+    rng = np.random.default_rng(seed)
+    ts = np.concatenate([iso_to_minute(f'{d} 09:00') + np.r_[np.arange(150), np.arange(240, 345)] for d in days])
+    ts = ts[rng.random(len(ts)) > 0.1]
+    close = 25_000 + np.cumsum(rng.normal(0, 20, len(ts)))
+    open_ = close + rng.normal(0, 10, len(ts))
+    high = np.maximum(open_, close) + rng.uniform(0, 15, len(ts))
+    low = np.minimum(open_, close) - rng.uniform(0, 15, len(ts))
+    high[::37] = np.nan                                         # provider thiếu high/low vài bar
+    low[::41] = np.nan
+    volume = rng.integers(0, 50_000, len(ts)).astype(np.float64)
+    return MinuteBars('aaa', ts, open_, high, low, close, volume)
+
+
+def _pandas_resample(bars: MinuteBars, rule: str) -> pd.DataFrame:
+    df = pd.DataFrame({f: getattr(bars, f) for f in ('open', 'high', 'low', 'close', 'volume')},
+                      index=pd.to_datetime(bars.ts.astype('datetime64[m]')))
+    out = df.resample(rule, label='left', closed='left').agg(
+        {'open': 'first', 'high': 'max', 'low': 'min', 'close': 'last', 'volume': 'sum'})
+    return out[df['close'].resample(rule).count() > 0]
+
+
+@pytest.mark.parametrize('interval,rule', [('5m', '5min'), ('15m', '15min'), ('30m', '30min'),
+                                           ('1h', '60min'), ('1D', '1D')])
+def test_resample_matches_pandas(interval, rule):
+    bars = _minutes()
+    got = resample(bars, interval)
+    want = _pandas_resample(bars, rule)
+    np.testing.assert_array_equal(got.ts.astype('datetime64[m]'), want.index.values.astype('datetime64[m]'))
+    for f in ('open', 'high', 'low', 'close', 'volume'):
+        np.testing.assert_allclose(getattr(got, f), want[f].to_numpy(), err_msg=f)
+
+
+def test_to_daily_and_aliases():
+    bars = _minutes()
+    daily = bars.to_daily()
+    assert daily.day.tolist() == (resample(bars, '1D').ts // 1440).tolist()
+    assert normalize_interval('5min') == '5m' and normalize_interval('D') == '1D'
+    with pytest.raises(ValueError):
+        normalize_interval('7m')
+
+
+def test_merge_overwrites_forming_bar():
+    bars = _minutes()
+    head, last = bars[:len(bars) - 1], bars[len(bars) - 1:]
+    forming = MinuteBars('AAA', last.ts, last.open, last.high, last.low, last.close * 0.99, last.volume / 2)
+    merged = head.merge(forming).merge(last)
+    assert len(merged) == len(bars)
+    np.testing.assert_array_equal(merged.close, bars.close)
+
+
+def test_store_partitions_by_month_and_reads_back(tmp_path):
+    bars = _minutes()
+    store = IntradayStore(str(tmp_path))
+    # Ghi làm hai lượt chồng lên nhau như ingest tăng dần
+    mid = len(bars) // 2
+    assert store.write(bars[:mid + 10]) == 1
+    assert store.write(bars[mid:]) == 2
+    assert store.write(bars[mid:]) == 0                        # không có gì mới
+    assert len(store.months('AAA')) == 2
+    for interval in ('1m', '5m', '1h'):
+        got = store.read('AAA', interval)
+        want = resample(bars, interval)
+        np.testing.assert_array_equal(got.ts, want.ts)
+        np.testing.assert_allclose(got.close, want.close)
+    daily = store.daily('AAA')
+    np.testing.assert_allclose(daily.high, bars.to_daily().high)
+    # Đọc một khoảng: khung chứa `start` tính từ đầu khung
+    start = iso_to_minute('2025-01-31 10:07')
+    got = store.read('AAA', '15m', start, iso_to_minute('2025-01-31 23:59'))
+    assert got.ts[0] == iso_to_minute('2025-01-31 10:00')
+    hits = store.stats['hits']
+    store.read('AAA', '5m')                                     # khung gộp lấy từ cache theo partition
+    assert store.stats['hits'] == hits + 2
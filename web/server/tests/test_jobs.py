@@ -0,0 +1,92 @@
+import threading
+
+import pytest
+
+from service.jobs import DONE, FAILED, QUEUED, JobManager, JobQueueFull, job_key, job_params
+
+
+def _blocking(gate: threading.Event, started: threading.Event = None):
+    def fn(params, progress):
+        if started is not None:
+            started.set()
+        for i in range(3):
+            progress(i + 1, 3, f'step {i + 1}')
+        assert gate.wait(5)
+        return {'echo': params}
+    return fn
+
+
+def test_job_key_ignores_param_order():
+    assert job_key('k', {'a': 1, 'b': 2}) == job_key('k', {'b': 2, 'a': 1})
+    assert job_key('k', {'a': 1}) != job_key('k', {'a': 2}) != job_key('other', {'a': 2})
+
+
+def test_job_params_defaults_and_rejections():
+    defaults = {'predict-top100': {'days': 60, 'limit': None, 'save_csv': False}, 'top100-history': {'days': 30}}
+    assert job_params(defaults, 'predict-top100', {'days': '20'}) == {'days': 20, 'limit': None, 'save_csv': False}
+    assert job_params(defaults, 'top100-history', {}) == {'days': 30}
+    for kind, params, msg in [('nope', {}, 'kind'), ('top100-history', {'limit': 5}, 'không hỗ trợ'),
+                              ('top100-history', {'days': 'abc'}, 'days'), ('top100-history', {'days': None}, 'days')]:
+        with pytest.raises(ValueError, match=msg):
+            job_params(defaults, kind, params)
+
+
+def test_same_params_share_one_job():
+    gate, started = threading.Event(), threading.Event()
+    jobs = JobManager(workers=1, db_path=None)
+    jobs.register('slow', _blocking(gate, started))
+    first = jobs.submit('slow', {'days': 60, 'limit': None})
+    assert started.wait(5)
+    again = jobs.submit('slow', {'limit': None, 'days': 60})
+    other = jobs.submit('slow', {'days': 30, 'limit': None})
+    assert again is first and first.subscribers == 2 and other is not first
+    gate.set()
+    assert first.wait(5) and other.wait(5)
+    assert first.status == DONE and first.result == {'echo': {'days': 60, 'limit': None}}
+    assert first.to_dict()['progress'] == {'done': 3, 'total': 3, 'percent': 100.0, 'message': 'step 3'}
+    assert jobs.stats['submitted'] == 2 and jobs.stats['deduplicated'] == 1
+    # Job đã xong không còn nhận submit mới: cùng tham số -> chạy lượt mới
+    assert jobs.submit('slow', {'days': 60, 'limit': None}) is not first
+
+
+def test_queue_limit_and_unknown_kind():
+    gate, started = threading.Event(), threading.Event()
+    jobs = JobManager(workers=1, max_queue=1, db_path=None)
+    jobs.register('slow', _blocking(gate, started))
+    running = jobs.submit('slow', {'n': 1})
+    assert started.wait(5)
+    queued = jobs.submit('slow', {'n': 2})
+    assert queued.status == QUEUED
+    with pytest.raises(JobQueueFull):
+        jobs.submit('slow', {'n': 3})
+    assert jobs.submit('slow', {'n': 2}) is queued              # dedup không tính vào giới hạn
+    with pytest.raises(KeyError):
+        jobs.submit('missing', {})
+    gate.set()
+    assert running.wait(5) and queued.wait(5)
+    assert jobs.stats['rejected'] == 1
+
+
+def test_failure_is_reported():
+    def boom(params, progress):
+        raise RuntimeError('Không có kết quả dự báo')
+    jobs = JobManager(workers=1, db_path=None)
+    jobs.register('boom', boom)
+    job = jobs.submit('boom', {})
+    assert job.wait(5)
+    assert job.status == FAILED and job.error == 'Không có kết quả dự báo'
+    assert 'result' not in job.to_dict(result=True)
+
+
+def test_results_survive_restart_with_sqlite(tmp_path):
+    db = str(tmp_path / 'jobs.sqlite')
+    gate = threading.Event()
+    gate.set()
+    jobs = JobManager(workers=1, db_path=db)
+    jobs.register('slow', _blocking(gate))
+    job = jobs.submit('slow', {'days': 5})
+    assert job.wait(5)
+    restarted = JobManager(workers=1, db_path=db)
+    loaded = restarted.get(job.id)
+    assert loaded.status == DONE and loaded.result == {'echo': {'days': 5}} and loaded.wait(0)
+    assert restarted.get('nope') is None
@@ -0,0 +1,30 @@
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.linear_model import LogisticRegression
+
+import service.model_service_wrapper as wrapper
+from service.bars import Bars, days_to_iso
+from service.indicators import FEATURE_COLUMNS
+
+
+def _bars(symbol, n=80, first_day=20_000):
+    rng = np.random.default_rng(0)
+    c = 20_000.0 + np.cumsum(rng.normal(scale=100.0, size=n))
+    day = first_day + np.arange(n, dtype=np.int32)
+    return Bars(symbol, day, c, c + 80, c - 80, c, rng.uniform(1e5, 1e6, size=n))
+
+
+def test_predict_for_symbol_reports_bar_day_for_feature_models(tmp_path, monkeypatch):
+    # Model train trên feature tính sẵn (như model 30 feature đang ship) -> nhánh needs_features
+    X = pd.DataFrame(np.random.default_rng(1).normal(size=(200, len(FEATURE_COLUMNS))), columns=FEATURE_COLUMNS)
+    y = (X.iloc[:, 0] > 0).astype(int)
+    path = str(tmp_path / 'model.pkl')
+    joblib.dump(LogisticRegression(max_iter=200).fit(X, y), path)
+    bars = _bars('AAA')
+    monkeypatch.setattr(wrapper._model, 'build_model_bars', lambda symbol, **kw: bars)
+
+    out = wrapper.predict_for_symbol('aaa', model_path=path)
+    assert out['status'] == 'ok'
+    assert out['date'] == days_to_iso(bars.day[-1:])[0]
+    assert out['prediction'] in (0, 1)
@@ -0,0 +1,78 @@
+import numpy as np
+import pandas as pd
+
+from service.risk import RollingRisk, diversified_top_k
+
+WINDOW = 30
+
+
+def _closes(days=100, n=6, seed=0):
+    rng = np.random.default_rng(seed)
+    common = rng.normal(0, 0.01, (days, 1))
+    closes = 10_000 * np.exp(np.cumsum(common + rng.normal(0, 0.015, (days, n)), axis=0))
+    closes[rng.random(closes.shape) < 0.1] = np.nan             # phiên mã không có bar
+    closes[:40, n - 1] = np.nan                                 # mã niêm yết muộn
+    return pd.DataFrame(closes, index=19_000 + np.arange(days), columns=[f'S{i}' for i in range(n)])
+
+
+def _expected(closes: pd.DataFrame, window: int) -> pd.DataFrame:
+    """Log return so với close gần nhất trước đó + cột chỉ số equal-weight, cửa sổ cuối `window` phiên."""
+    ret = np.log(closes / closes.ffill().shift(1))
+    ret['INDEX'] = ret.mean(axis=1)
+    return ret.iloc[1:].tail(window)
+
+
+def _feed(closes: pd.DataFrame, window: int) -> RollingRisk:
+    risk = RollingRisk(list(closes.columns), window)
+    for day, row in closes.iterrows():
+        risk.update(int(day), row.dropna().to_dict())
+    return risk
+
+
+def test_rank_one_updates_match_pandas_corr():
+    closes = _closes()
+    risk = _feed(closes, WINDOW)
+    want = _expected(closes, WINDOW)
+    np.testing.assert_array_equal(risk.days(), want.index.to_numpy())
+    np.testing.assert_allclose(risk.correlation(min_periods=10), want.corr(min_periods=10).to_numpy(),
+                               rtol=1e-9, atol=1e-12, equal_nan=True)
+    np.testing.assert_allclose(risk.covariance(min_periods=10), want.cov(min_periods=10).to_numpy(),
+                               rtol=1e-9, atol=1e-15, equal_nan=True)
+
+
+def test_revised_bar_replaces_session_row():
+    closes = _closes(seed=1)
+    risk = _feed(closes.iloc[:-1], WINDOW)
+    last_day, last = int(closes.index[-1]), closes.iloc[-1].dropna()
+    # Bar phiên hiện tại tới từng phần rồi bị sửa giá (live) -> kết quả như nhận một lần bar cuối
+    risk.update(last_day, (last * 0.9).iloc[:3].to_dict())
+    risk.update(last_day, (last * 1.1).to_dict())
+    risk.update(last_day, last.to_dict())
+    want = _expected(closes, WINDOW)
+    np.testing.assert_allclose(risk.correlation(min_periods=10), want.corr(min_periods=10).to_numpy(),
+                               rtol=1e-9, atol=1e-12, equal_nan=True)
+    assert not risk.update(last_day - 5, last.to_dict())       # phiên cũ bị bỏ qua
+
+
+def test_summary_beta_matches_regression():
+    closes = _closes(seed=2)
+    risk = _feed(closes, WINDOW)
+    want = _expected(closes, WINDOW)
+    beta = risk.summary(min_periods=10)['beta']
+    for j, sym in enumerate(closes.columns):
+        pair = want[[sym, 'INDEX']].dropna()
+        np.testing.assert_allclose(beta[j], pair.cov().iloc[0, 1] / pair['INDEX'].var(), rtol=1e-9)
+
+
+def test_diversified_top_k_respects_max_corr():
+    closes = _closes(days=120, n=8, seed=3)
+    closes['S7'] = closes['S0'] * 1.0001                        # gần như trùng S0
+    risk = _feed(closes, WINDOW)
+    scores = {s: 1.0 - i / 10 for i, s in enumerate(closes.columns)}
+    scores['S7'] = 0.95
+    out = diversified_top_k(risk, scores, k=4, max_corr=0.7, min_periods=10)
+    picks = [p['symbol'] for p in out['selected']]
+    assert picks[0] == 'S0' and 'S7' not in picks and 'S7' in out['naive_top_k']['symbols']
+    idx = risk.indices(picks)
+    corr = risk.correlation(min_periods=10)[np.ix_(idx, idx)]
+    assert np.nanmax(np.abs(corr - np.eye(len(idx)))) <= 0.7
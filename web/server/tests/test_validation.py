@@ -0,0 +1,98 @@
+import numpy as np
+import pandas as pd
+
+from service.bars import Bars, iso_to_day
+from service.validation import REASONS, QuarantineLog, clean_bars, validate_bars, validate_frame
+
+DAY0 = iso_to_day('2025-03-03')
+
+
+def _frame(n=30, symbol='AAA', seed=0):
+    rng = np.random.default_rng(seed)
+    close = 20_000 * np.exp(np.cumsum(rng.normal(0, 0.01, n)))
+    return pd.DataFrame({'symbol': symbol, 'day': DAY0 + np.arange(n), 'open': close, 'high': close * 1.01,
+                         'low': close * 0.99, 'close': close, 'volume': 1_000.0})
+
+
+def _reasons(result, day):
+    q = result.quarantine
+    return set(q.loc[q['day'] == day, 'reasons'].iloc[0].split(','))
+
+
+def test_clean_frame_passes_untouched():
+    df = _frame()
+    result = validate_frame(df)
+    assert len(result.clean) == len(df) and result.quarantine.empty
+    np.testing.assert_allclose(result.clean['close'], df['close'])
+
+
+def test_each_rule_flags_its_bar():
+    df = _frame()
+    df.loc[2, 'volume'] = np.nan
+    df.loc[4, ['open', 'low']] = [-1.0, -1.0]
+    df.loc[6, ['high', 'low']] = df.loc[6, ['low', 'high']].to_numpy()
+    df.loc[8, 'close'] = df.loc[8, 'high'] * 1.05
+    df.loc[10, 'volume'] = -5.0
+    result = validate_frame(df)
+    assert _reasons(result, DAY0 + 2) == {'missing_field'}
+    assert 'non_positive_price' in _reasons(result, DAY0 + 4)
+    assert _reasons(result, DAY0 + 6) == {'high_lt_low'}
+    assert _reasons(result, DAY0 + 8) == {'ohlc_out_of_range'}
+    assert _reasons(result, DAY0 + 10) == {'negative_volume'}
+    assert len(result.clean) == len(df) - 5
+    summary = result.summary()
+    assert summary['quarantined'] == 5 and summary['high_lt_low'] == 1
+
+
+def test_close_within_tolerance_is_kept():
+    df = _frame()
+    df.loc[3, 'close'] = df.loc[3, 'high'] * 1.0005              # làm tròn giá của provider
+    assert validate_frame(df).quarantine.empty
+
+
+def test_duplicates_keep_last():
+    df = _frame(n=10)
+    same = df.iloc[[3]]
+    revised = df.iloc[[5]].assign(close=df.loc[5, 'close'] * 1.002)
+    result = validate_frame(pd.concat([df, same, revised], ignore_index=True))
+    assert len(result.clean) == 10 and result.clean['day'].is_unique
+    assert result.clean.loc[result.clean['day'] == DAY0 + 5, 'close'].iloc[0] == revised['close'].iloc[0]
+    assert result.quarantine['reasons'].tolist() == ['duplicate']
+
+
+def test_bad_tick_flagged_but_real_jump_kept():
+    df = _frame(n=40)
+    df.loc[20, ['open', 'high', 'low', 'close']] *= 3.0           # nhảy rồi quay về ngay
+    df.loc[30:, ['open', 'high', 'low', 'close']] *= 1.5          # tăng thật và giữ mức
+    result = validate_frame(df)
+    assert result.quarantine['day'].tolist() == [DAY0 + 20]
+    assert _reasons(result, DAY0 + 20) == {'outlier'}
+
+
+def test_gaps_counted_against_sessions():
+    df = _frame(n=20).drop(index=[7, 8, 15]).reset_index(drop=True)
+    result = validate_frame(df, sessions=DAY0 + np.arange(20))
+    assert result.gaps['missing_sessions'].tolist() == [2, 1]
+    assert result.gaps['after'].tolist()[0] == str(np.datetime64(int(DAY0 + 6), 'D'))
+
+
+def test_alias_columns_and_bars_roundtrip():
+    df = _frame(n=5)
+    raw = pd.DataFrame({'Date': pd.to_datetime(df['day'], unit='D'), 'Open': df['open'], 'High': df['high'],
+                        'Low': df['low'], 'Close': df['close'], 'Volume': df['volume'], 'ticker': ' aaa '})
+    result = validate_frame(raw)
+    assert result.clean['symbol'].unique().tolist() == ['AAA']
+    assert result.clean['day'].tolist() == df['day'].tolist()
+    bars = Bars('AAA', df['day'].to_numpy(dtype=np.int32), *(df[f].to_numpy() for f in ('open', 'high', 'low', 'close', 'volume')))
+    np.testing.assert_array_equal(clean_bars(validate_bars(bars), 'AAA').close, bars.close)
+
+
+def test_quarantine_log_replaces_per_symbol():
+    log = QuarantineLog()
+    bad = pd.concat([_frame(n=5, symbol='AAA'), _frame(n=5, symbol='BBB')], ignore_index=True)
+    bad.loc[[1, 6], 'volume'] = -1.0
+    log.record(validate_frame(bad))
+    assert sorted(log.frame()['symbol']) == ['AAA', 'BBB']
+    log.record(validate_frame(_frame(n=5, symbol='AAA')), symbols=['AAA'])
+    assert log.frame()['symbol'].tolist() == ['BBB']
+    assert (log.frame(['BBB'])['reason_mask'] & REASONS['negative_volume']).all()